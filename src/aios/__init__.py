@@ -13,13 +13,19 @@ from .agent.agent_memory import AgentMemory
 from .agent.workspace import AgentWorkspace
 from .agent.llm_context import LLMProcessContext,GlobaToolsLibrary,SimpleLLMContext
 from .agent.llm_process import BaseLLMProcess,LLMAgentBaseProcess
+from .agent.inner_func_call import InnerFuncCall
 from .agent.llm_process_loader import LLMProcessLoader
 
-from .frame.compute_kernel import ComputeKernel,ComputeTask,ComputeTaskResult,ComputeTaskState,ComputeTaskType
-from .frame.compute_node import ComputeNode,LocalComputeNode
+from .frame.compute_kernel import ComputeKernel,ComputeTask,ComputeTaskResult,ComputeTaskState,ComputeTaskType,LLMCompletionStream
+from .frame.compute_node import ComputeNode,LocalComputeNode,ComputeNodeStats
+from .frame.schedule_policy import SchedulePolicy,WeightedRandomPolicy,LeastOutstandingPolicy,EWMALatencyPolicy
 from .frame.bus import AIBus
-from .frame.tunnel import AgentTunnel
+from .frame.tunnel import AgentTunnel,StreamingReply
 from .frame.contact_manager import ContactManager,Contact
+from .frame.compute_task_queue import ComputeTaskQueue
+from .frame.embedding_batcher import EmbeddingBatcher
+from .frame.embedding_cache import EmbeddingCache
+from .frame.completion_cache import CompletionCache
 from .frame.queue_compute_node import Queue_ComputeNode
 
 from .environment.environment import BaseEnvironment,SimpleEnvironment,CompositeEnvironment
@@ -30,6 +36,7 @@ from .environment.workspace_env import WorkspaceEnvironment
 
 from .storage.storage import ResourceLocation,AIStorage,UserConfig,UserConfigItem
 from .storage.objfs import ObjFS
+from .storage.sqlite_db import SQLiteDB
 
 from .net import *
 from .knowledge import *
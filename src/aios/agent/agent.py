@@ -26,6 +26,7 @@ from .chatsession import *
 from ..environment.workspace_env import WorkspaceEnvironment, TodoListType
 from ..environment.environment import *
 from ..storage.storage import AIStorage
+from ..frame.bus import AIBus
 from ..knowledge import *
 from ..proto.compute_task import LLMPrompt,LLMResult
 
@@ -185,6 +186,10 @@ class AIAgent(BaseAIAgent):
             "msg":msg,
             "context_info":context_info
         }
+        # the sender shows the reply while it's generated, the listener is on the bus the msg came in on
+        on_stream = AIBus.get_current_bus().get_stream_listener(msg.msg_id)
+        if on_stream is not None:
+            input_parms["on_token"] = on_stream
         msg_process = self.behaviors.get("on_message")
         llm_result : LLMResult = await msg_process.process(input_parms)
         if llm_result.state == LLMResultStates.ERROR:
@@ -2,19 +2,18 @@
 from datetime import datetime,timedelta
 import json
 import os
-import threading
 from typing import Dict, List
-import sqlite3
 
 import aiofiles
 
 from ..storage.storage import AIStorage
+from ..storage.sqlite_db import SQLiteDB
 from ..knowledge.knowledge_base import BaseKnowledgeGraph,ObjFSKnowledgeGrpah
 from ..frame.compute_kernel import ComputeKernel
 from ..frame.contact_manager import ContactManager
 from ..frame.contact import Contact
 from ..proto.ai_function import ParameterDefine, SimpleAIFunction
-from ..proto.agent_msg import AgentMsg, AgentMsgType
+from ..proto.agent_msg import AgentMsg
 from ..proto.agent_task import AgentWorkLog
 
 from .llm_context import GlobaToolsLibrary
@@ -47,6 +46,7 @@ class AgentMemory:
         #AIStorage.get_instance().ensure_directory_exists(f"{self.agent_memory_base_dir}/summary")
 
         self.memory_db:str = f"{self.agent_memory_base_dir}/memory.db"
+        self.db : SQLiteDB = None
         
         self.threshold_hours = 72
         self.last_think_time : float = 0.0
@@ -70,34 +70,15 @@ The Knowledgegraph is used to store important information obtained by Agent in t
         self.load_memory_meta()
 
 
-    def _get_conn(self):
-        """ get db connection """
-        local = threading.local()
-        if not hasattr(local, 'conn'):
-            local.conn = self._create_connection(self.memory_db)
-        return local.conn
-    
-    def _create_connection(self, db_file):
-        """ create a database connection to a SQLite database """
-        conn = None
-        try:
-            conn = sqlite3.connect(db_file)
-        except Error as e:
-            logging.error("Error occurred while connecting to database: %s", e)
-            return None
-
-        if conn:
-            self._create_table(conn)
-
-        return conn
+    def _get_db(self) -> SQLiteDB:
+        """ get the shared db of memory.db """
+        if self.db is None:
+            self.db = SQLiteDB.open(self.memory_db)
+            self.db.init_schema("AgentMemory", self._create_table)
+        return self.db
     
     def get_session_from_msg(self,msg:AgentMsg) -> AIChatSession:
-        if msg.msg_type == AgentMsgType.TYPE_GROUPMSG:
-            session_topic = msg.target + "#" + msg.topic
-            chatsession = AIChatSession.get_session(self.agent_id,session_topic,self.memory_db)
-        else:
-            session_topic = msg.get_sender() + "#" + msg.topic
-            chatsession = AIChatSession.get_session(self.agent_id,session_topic,self.memory_db)
+        chatsession = AIChatSession.get_session(self.agent_id,msg.get_session_topic(),self.memory_db)
         return chatsession
     
     # return last record time
@@ -114,15 +95,17 @@ The Knowledgegraph is used to store important information obtained by Agent in t
         # Must load n (n> = 2), and hope to load the M
         # The information in the # M is gradually added, knowing that it is less than 72 hours from the current time, and consumes enough tokens
 
-        messages_n = chatsession.read_history() # read
         histroy_str = ""
         read_count = 0
         is_all = True
-        for msg in messages_n:
+        # newest first, stop reading the db when the token budget is used up
+        async for msg in chatsession.iter_history(page_size=16):
             dt = datetime.fromtimestamp(float(msg.create_time))
             formatted_time = dt.strftime('%y-%m-%d %H:%M:%S')
-            record_str = f"{msg.sender},[{formatted_time}]\n{msg.body}\n"
-            token_limit -= ComputeKernel.llm_num_tokens_from_text(record_str)
+            record_head = f"{msg.sender},[{formatted_time}]\n"
+            record_str = f"{record_head}{msg.body}\n"
+            # the body token count is kept by the session tail cache, only the short head is counted again
+            token_limit -= ComputeKernel.llm_num_tokens_from_text(record_head) + chatsession.get_token_count(msg)
             if token_limit <= 32:
                 is_all = False
                 break
@@ -149,9 +132,6 @@ The Knowledgegraph is used to store important information obtained by Agent in t
     #     return "OK"
 
     async def load_worklogs(self,operator_id:str,owner_id:str=None, work_types:List[str]=None,token_limit=800):
-        conn = self._get_conn()
-        c = conn.cursor()
-        
         query = 'SELECT * FROM worklog WHERE 1=1'  
         params = []
 
@@ -169,8 +149,7 @@ The Knowledgegraph is used to store important information obtained by Agent in t
         
         query += ' ORDER BY timestamp DESC LIMIT 8'
 
-        c.execute(query, tuple(params))
-        rows = c.fetchall()
+        rows = await self._get_db().afetchall(query, tuple(params))
 
 
         return [self.worklog_from_db_row(row) for row in rows]
@@ -201,16 +180,12 @@ The Knowledgegraph is used to store important information obtained by Agent in t
         return log
     
     async def append_worklog(self,log:AgentWorkLog)->str:
-        conn = self._get_conn()
-        c = conn.cursor()
         # 将meta字典转换为JSON字符串
         meta_str = json.dumps(log.meta,ensure_ascii=False) if log.meta else None
-        c.execute('''
+        await self._get_db().aexecute('''
             INSERT INTO worklog (logid, owner_id, work_type, timestamp, content, result, meta, operator)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (log.logid, log.owner_id, log.work_type, log.timestamp, log.content, log.result, meta_str, log.operator))
-        conn.commit()
-        #conn.close()
 
     def memory_meta_to_dict(self) -> Dict:
         return {
@@ -1,47 +1,47 @@
 # pylint:disable=E0402
-import sqlite3 # Because sqlite3 IO operation is small, so we can use sqlite3 directly.(so we don't need to use async sqlite3 now)
 from sqlite3 import Error
 import logging
-import threading
 import datetime
 import uuid
 import json
-from typing import List
+from typing import List, AsyncIterator, Optional, Tuple
 
 from ..proto.agent_msg import AgentMsgType, AgentMsg, AgentMsgStatus
+from ..proto.tokenizer import num_tokens_from_text
+from .session_tail_cache import SessionTailCache, SessionTail
+from .session_registry import SessionRegistry
+from ..storage.sqlite_db import SQLiteDB
 
 class ChatSessionDB:
+    # version 1: indexes for history loads, WAL journal
+    SCHEMA_VERSION = 1
+
     def __init__(self, db_file):
         """ initialize db connection """
         self.db_file = db_file
-        self._get_conn()
-
-    def _get_conn(self):
-        """ get db connection """
-        local = threading.local()
-        if not hasattr(local, 'conn'):
-            local.conn = self._create_connection(self.db_file)
-        return local.conn
-
-    def _create_connection(self, db_file):
-        """ create a database connection to a SQLite database """
-        conn = None
-        try:
-            conn = sqlite3.connect(db_file)
-        except Error as e:
-            logging.error("Error occurred while connecting to database: %s", e)
-            return None
+        self.db : SQLiteDB = None
+        self._get_db()
+
+    def _get_db(self) -> SQLiteDB:
+        """ get the shared db of the file, reopened if the handle was closed """
+        if self.db is None:
+            self.db = SQLiteDB.open(self.db_file)
+            self.db.init_schema("ChatSessionDB", self._init_schema)
+        return self.db
 
-        if conn:
-            self._create_table(conn)
+    def _init_schema(self, conn):
+        self._create_table(conn)
+        self._migrate(conn)
 
-        return conn
+    def group_commit(self, func, *args):
+        """ run func(*args) as one transaction, the writes of the store in it are committed together """
+        return self._get_db().batch(lambda conn: func(*args))
 
     def close(self):
-        local = threading.local()
-        if not hasattr(local, 'conn'):
+        if self.db is None:
             return
-        local.conn.close()
+        self.db.close()
+        self.db = None
 
     def _create_table(self, conn):
         """ create table """
@@ -93,59 +93,89 @@ class ChatSessionDB:
         except Error as e:
             logging.error("Error occurred while creating tables: %s", e)
 
+    def _migrate(self, conn):
+        """ upgrade the schema of databases created by older versions """
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= ChatSessionDB.SCHEMA_VERSION:
+                return
+
+            if version < 1:
+                logging.info(f"migrate chatsession db {self.db_file} to version 1, create indexes")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_time ON Messages(SessionID, Timestamp)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender_time ON Messages(SenderID, Timestamp)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_receiver_time ON Messages(ReceiverID, Timestamp)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_chatsessions_owner_topic ON ChatSessions(SessionOwner, SessionTopic)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_chatsessions_owner_start ON ChatSessions(SessionOwner, StartTime)")
+
+            conn.execute(f"PRAGMA user_version = {ChatSessionDB.SCHEMA_VERSION}")
+            conn.commit()
+        except Error as e:
+            logging.error("Error occurred while migrating chatsession db: %s", e)
+
     def insert_chatsession(self, session_id, session_owner,session_topic, start_time,thread_id = ""):
         """ insert a new session into the ChatSessions table """
         try:
-            conn = self._get_conn()
-            conn.execute("""
+            self._get_db().execute("""
                 INSERT INTO ChatSessions (SessionID, SessionOwner,SessionTopic, StartTime,SummarizePos,Summary,ThreadID)
                 VALUES (?,?, ?, ?,0,"",?)
             """, (session_id, session_owner,session_topic, start_time,thread_id))
-            conn.commit()
             return 0  # return 0 if successful
         except Error as e:
             logging.error("Error occurred while inserting session: %s", e)
             return -1  # return -1 if an error occurs
 
+    @staticmethod
+    def _message_row(msg:AgentMsg,tags:List[str] = None) -> tuple:
+        action_name = None
+        action_params = None
+        action_result = None
+        mentions = None
+        if msg.mentions:
+            mentions = json.dumps(msg.mentions,ensure_ascii=False)
+
+        match msg.msg_type:
+            case AgentMsgType.TYPE_MSG:
+                pass
+            case AgentMsgType.TYPE_ACTION:# THIS Action is not AIAction
+                action_name = msg.func_name
+                action_params = json.dumps(msg.args,ensure_ascii=False)
+                action_result = msg.result_str
+            case AgentMsgType.TYPE_INTERNAL_CALL:
+                action_name = msg.func_name
+                action_params = json.dumps(msg.args,ensure_ascii=False)
+                action_result = msg.result_str
+            case AgentMsgType.TYPE_EVENT:
+                action_name = msg.event_name
+                action_params = json.dumps(msg.event_args,ensure_ascii=False)
+        if tags is None:
+            tags = []
+
+        str_tags = ','.join(tags)
+        return (msg.msg_id, msg.session_id, msg.msg_type.value, msg.prev_msg_id, msg.sender, msg.target, msg.create_time, msg.topic,mentions,msg.body_mime,msg.body,action_name,action_params,action_result,msg.done_time,msg.status.value,str_tags)
+
+    @staticmethod
+    def _append_message_rows(rows:list,msg:AgentMsg,tags:List[str] = None):
+        rows.append(ChatSessionDB._message_row(msg,tags))
+        if msg.inner_call_chain:
+            for inner_call in msg.inner_call_chain:
+                ChatSessionDB._append_message_rows(rows,inner_call)
+
     def insert_message(self, msg:AgentMsg,tags:List[str] = None):
-        """ insert a new message into the Messages table """
+        """ insert a new message (and its inner calls) into the Messages table """
+        return self.insert_messages([msg],tags)
+
+    def insert_messages(self, msgs:List[AgentMsg],tags:List[str] = None):
+        """ insert messages and all their inner calls in one transaction """
         try:
-            action_name = None
-            action_params = None
-            action_result = None
-            mentions = None
-            if msg.mentions:
-                mentions = json.dumps(msg.mentions,ensure_ascii=False)
-
-            match msg.msg_type:
-                case AgentMsgType.TYPE_MSG:
-                    pass
-                case AgentMsgType.TYPE_ACTION:# THIS Action is not AIAction
-                    action_name = msg.func_name
-                    action_params = json.dumps(msg.args,ensure_ascii=False)
-                    action_result = msg.result_str
-                case AgentMsgType.TYPE_INTERNAL_CALL:
-                    action_name = msg.func_name
-                    action_params = json.dumps(msg.args,ensure_ascii=False)
-                    action_result = msg.result_str
-                case AgentMsgType.TYPE_EVENT:
-                    action_name = msg.event_name
-                    action_params = json.dumps(msg.event_args,ensure_ascii=False)
-            if tags is None:
-                tags = []
-
-            str_tags = ','.join(tags)
-            conn = self._get_conn()
-            conn.execute("""
+            rows = []
+            for msg in msgs:
+                ChatSessionDB._append_message_rows(rows,msg,tags)
+
+            self._get_db().executemany("""
                 INSERT INTO Messages (MessageID, SessionID, MsgType, PrevMsgID, SenderID, ReceiverID, Timestamp, Topic,Mentions,ContentMIME,Content,ActionName,ActionParams,ActionResult,DoneTime,Status,Tags)
                 VALUES (?, ?, ?, ?, ?, ?, ?,?, ?, ?, ?, ?, ?, ?, ?, ?,?)
-            """, (msg.msg_id, msg.session_id, msg.msg_type.value, msg.prev_msg_id, msg.sender, msg.target, msg.create_time, msg.topic,mentions,msg.body_mime,msg.body,action_name,action_params,action_result,msg.done_time,msg.status.value,str_tags))
-            conn.commit()
-
-            if msg.inner_call_chain:
-                for inner_call in msg.inner_call_chain:
-                    self.insert_message(inner_call)
-
+            """, rows)
             return 0  # return 0 if successful
         except Error as e:
             logging.error("Error occurred while inserting message: %s", e)
@@ -153,32 +183,23 @@ class ChatSessionDB:
 
     def get_chatsession_by_id(self, session_id):
         """Get a message by its ID"""
-        conn = self._get_conn()
-        c = conn.cursor()
-        c.execute("SELECT * FROM ChatSessions WHERE SessionID = ?", (session_id,))
-        chatsession = c.fetchone()
+        chatsession = self._get_db().fetchone("SELECT * FROM ChatSessions WHERE SessionID = ?", (session_id,))
         return chatsession
 
     def get_chatsession_by_owner_topic(self, owner_id, topic):
         """Get a chatsession by its owner and topic"""
-        conn = self._get_conn()
-        c = conn.cursor()
-        c.execute("SELECT * FROM ChatSessions WHERE SessionOwner = ? AND SessionTopic = ?", (owner_id,topic))
-        chatsession = c.fetchone()
+        chatsession = self._get_db().fetchone("SELECT * FROM ChatSessions WHERE SessionOwner = ? AND SessionTopic = ?", (owner_id,topic))
         return chatsession
 
     def list_chatsessions(self, owner_id, limit, offset):
         """ retrieve sessions with pagination """
         try:
-            conn = self._get_conn()
-            cursor = conn.cursor()
-            cursor.execute("""
+            results = self._get_db().fetchall("""
                 SELECT SessionID FROM ChatSessions
                 WHERE SessionOwner = ?           
                 ORDER BY StartTime DESC
                 LIMIT ? OFFSET ? 
             """, (owner_id,limit, offset))
-            results = cursor.fetchall()
             #self.close()
             return results  # return 0 and the result if successful
         except Error as e:
@@ -187,27 +208,21 @@ class ChatSessionDB:
 
     def get_message_by_id(self, message_id):
         """Get a message by its ID"""
-        conn =self._get_conn()
-        c = conn.cursor()
-        c.execute("SELECT MessageID, SessionID, MsgType, PrevMsgID, SenderID, ReceiverID, Timestamp, Topic,Mentions,ContentMIME,Content,ActionName,ActionParams,ActionResult,DoneTime,Status FROM Messages WHERE MessageID = ?", (message_id,))
-        message = c.fetchone()
+        message = self._get_db().fetchone("SELECT MessageID, SessionID, MsgType, PrevMsgID, SenderID, ReceiverID, Timestamp, Topic,Mentions,ContentMIME,Content,ActionName,ActionParams,ActionResult,DoneTime,Status FROM Messages WHERE MessageID = ?", (message_id,))
         return message
 
     # read message from begin->now
     def read_message(self,session_id,limit,offset):
         try:
-            conn = self._get_conn()
-            cursor = conn.cursor()
             if limit == 0:
                 limit = 1024
 
-            cursor.execute("""
+            results = self._get_db().fetchall("""
                 SELECT MessageID, SessionID, MsgType, PrevMsgID, SenderID, ReceiverID, Timestamp, Topic,Mentions,ContentMIME,Content,ActionName,ActionParams,ActionResult,DoneTime,Status FROM Messages
                 WHERE SessionID = ?
-                ORDER BY Timestamp 
+                ORDER BY Timestamp, rowid
                 LIMIT ? OFFSET ?
             """, (session_id, limit, offset))
-            results = cursor.fetchall()
             #self.close()
             return results  # return 0 and the result if successful
         except Error as e:
@@ -216,15 +231,12 @@ class ChatSessionDB:
         
     def load_message_by_agentid(self,agent_id,limit,start_time="1970-01-01 00:00:00"):
         try:
-            conn = self._get_conn()
-            cursor = conn.cursor()
-            cursor.execute("""
+            results = self._get_db().fetchall("""
                 SELECT MessageID, SessionID, MsgType, PrevMsgID, SenderID, ReceiverID, Timestamp, Topic,Mentions,ContentMIME,Content,ActionName,ActionParams,ActionResult,DoneTime,Status FROM Messages
-                WHERE SenderID = ? or ReceiverID =? AND Timestamp > ?
+                WHERE (SenderID = ? OR ReceiverID = ?) AND Timestamp > ?
                 ORDER BY Timestamp 
                 LIMIT ? 
             """, (agent_id, agent_id, start_time,limit))
-            results = cursor.fetchall()
             #self.close()
             return results  # return 0 and the result if successful
         except Error as e:
@@ -235,33 +247,62 @@ class ChatSessionDB:
     def get_messages(self, session_id, limit, offset):
         """ retrieve messages of a session with pagination """
         try:
-            conn = self._get_conn()
-            cursor = conn.cursor()
             if limit == 0:
                 limit = 1024
-            cursor.execute("""
+            results = self._get_db().fetchall("""
                 SELECT MessageID, SessionID, MsgType, PrevMsgID, SenderID, ReceiverID, Timestamp, Topic,Mentions,ContentMIME,Content,ActionName,ActionParams,ActionResult,DoneTime,Status FROM Messages
                 WHERE SessionID = ?
-                ORDER BY Timestamp DESC
+                ORDER BY Timestamp DESC, rowid DESC
                 LIMIT ? OFFSET ?
             """, (session_id, limit, offset))
-            results = cursor.fetchall()
             #self.close()
             return results  # return 0 and the result if successful
         except Error as e:
             logging.error("Error occurred while getting messages: %s", e)
             return -1, None  # return -1 and None if an error occurs
 
+    def read_messages_by_key(self, session_id, limit, after_key:Optional[Tuple] = None, reverse = True, offset = 0):
+        """ keyset pagination: read messages after the (Timestamp, rowid) key of the last message of the previous page.
+            rowid keeps messages with the same Timestamp in insert order, and idx_messages_session_time covers it """
+        try:
+            direction = "DESC" if reverse else "ASC"
+            params = [session_id]
+            key_filter = ""
+            if after_key is not None:
+                key_filter = "AND (Timestamp, rowid) < (?, ?)" if reverse else "AND (Timestamp, rowid) > (?, ?)"
+                params.extend(after_key)
+            params.extend([limit, offset])
+
+            return self._get_db().fetchall(f"""
+                SELECT MessageID, SessionID, MsgType, PrevMsgID, SenderID, ReceiverID, Timestamp, Topic,Mentions,ContentMIME,Content,ActionName,ActionParams,ActionResult,DoneTime,Status,rowid FROM Messages
+                WHERE SessionID = ? {key_filter}
+                ORDER BY Timestamp {direction}, rowid {direction}
+                LIMIT ? OFFSET ?
+            """, params)
+        except Error as e:
+            logging.error("Error occurred while getting messages: %s", e)
+            return []
+
+    def get_message_keys(self, msg_ids:List[str]) -> dict:
+        """ msg_id -> the (Timestamp, rowid) key read_messages_by_key pages by """
+        if not msg_ids:
+            return {}
+        placeholders = ",".join("?" * len(msg_ids))
+        rows = self._get_db().fetchall(f"SELECT MessageID, Timestamp, rowid FROM Messages WHERE MessageID IN ({placeholders})", msg_ids)
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    async def aread_messages_by_key(self, session_id, limit, after_key:Optional[Tuple] = None, reverse = True, offset = 0):
+        """ read_messages_by_key on the db thread, without blocking the event loop """
+        return await self._get_db().run(lambda conn: self.read_messages_by_key(session_id, limit, after_key, reverse, offset))
+
     def update_message_status(self, message_id, status):
         """ update the status of a message """
         try:
-            conn = self._get_conn()
-            conn.execute("""
+            self._get_db().execute("""
                 UPDATE Messages
                 SET Status = ?
                 WHERE MessageID = ?
             """, (status, message_id))
-            conn.commit()
             return 0  # return 0 if successful
         except Error as e:
             logging.error("Error occurred while updating message status: %s", e)
@@ -270,13 +311,11 @@ class ChatSessionDB:
     def update_session_summary(self, session_id, summarize_pos, summary):
         """ update the summary of a session """
         try:
-            conn = self._get_conn()
-            conn.execute("""
+            self._get_db().execute("""
                 UPDATE ChatSessions
                 SET SummarizePos = ?, Summary = ?
                 WHERE SessionID = ?
             """, (summarize_pos, summary, session_id))
-            conn.commit()
             return 0  # return 0 if successful
         except Error as e:
             logging.error("Error occurred while updating session summary: %s", e)
@@ -285,13 +324,11 @@ class ChatSessionDB:
     def update_session_thread_id(self, session_id, thread_id):
         """ update the threadid of a session """
         try:
-            conn = self._get_conn()
-            conn.execute("""
+            self._get_db().execute("""
                 UPDATE ChatSessions
                 SET ThreadID = ?
                 WHERE SessionID = ?
             """, (thread_id, session_id))
-            conn.commit()
             return 0  # return 0 if successful
         except Error as e:
             logging.error("Error occurred while updating session threadid: %s", e)
@@ -300,8 +337,10 @@ class ChatSessionDB:
 # chat session store the chat history between owner and agent
 # chat session might be large, so can read / write at stream mode.
 class AIChatSession:
-    _dbs = {}
-    _sessions = {}
+    # last messages of recently used sessions, shared by all sessions of the process
+    _tail_cache = SessionTailCache()
+    # live sessions and db handles, evicted sessions also leave the tail cache
+    _registry = SessionRegistry(on_evict=lambda session: AIChatSession._tail_cache.remove(session.session_id))
     #@classmethod
     #async def get_session_by_id(cls,session_id:str,db_path:str):
     #    db = cls._dbs.get(db_path)
@@ -310,50 +349,59 @@ class AIChatSession:
     #        cls._dbs[db_path] = db
     #    db.get_chatsession_by_id(session_id)
     #    #result = AIChatSession()
+    @staticmethod
+    def _msg_from_row(msg) -> AgentMsg:
+        agent_msg = AgentMsg()
+        agent_msg.msg_id = msg[0]
+        agent_msg.session_id = msg[1]
+        agent_msg.msg_type = AgentMsgType(msg[2])
+        agent_msg.prev_msg_id = msg[3]
+        agent_msg.sender = msg[4]
+        agent_msg.target = msg[5]
+        agent_msg.create_time = msg[6]
+        agent_msg.topic = msg[7]
+        if msg[8] is not None:
+            agent_msg.mentions = json.loads(msg[8])
+        agent_msg.body_mime = msg[9]
+        agent_msg.body = msg[10]
+        agent_msg.func_name = msg[11]
+        if msg[12] is not None:
+            agent_msg.args = json.loads(msg[12])
+        agent_msg.result_str = msg[13]
+        agent_msg.done_time = msg[14]
+        agent_msg.status = AgentMsgStatus(msg[15])
+        return agent_msg
+
+    @classmethod
+    def set_session_registry(cls,max_sessions:int = 4096,idle_timeout:float = 3600) -> None:
+        cls._registry.max_sessions = max_sessions
+        cls._registry.idle_timeout = idle_timeout
+        cls._registry.evict()
+
+    @classmethod
+    def get_registry_metrics(cls) -> dict:
+        return cls._registry.get_metrics()
+
+    @classmethod
+    def _get_db(cls,db_path:str) -> ChatSessionDB:
+        return cls._registry.get_db(db_path,ChatSessionDB)
+
     @classmethod
     # start_time is a string like "2021-01-01 00:00:00"
     def load_message_records_by_agentid(cls,agent_id:str,start_time:str,limit:int,db_path:str)->List[AgentMsg]:
-        db = cls._dbs.get(db_path)
-        if db is None:
-            db = ChatSessionDB(db_path)
-            cls._dbs[db_path] = db
-        msgs = db.load_message_by_agentid(agent_id,start_time,limit)
+        db = cls._get_db(db_path)
+        msgs = db.load_message_by_agentid(agent_id,limit,start_time)
         result = []
         for msg in msgs:
-            agent_msg = AgentMsg()
-            agent_msg.msg_id = msg[0]
-            agent_msg.session_id = msg[1]
-            agent_msg.msg_type = AgentMsgType(msg[2])
-            agent_msg.prev_msg_id = msg[3]
-            agent_msg.sender = msg[4]
-            agent_msg.target = msg[5]
-            agent_msg.create_time = msg[6]
-            agent_msg.topic = msg[7]
-            if msg[8] is not None:
-                agent_msg.mentions = json.loads(msg[8])
-            agent_msg.body_mime = msg[9]
-            agent_msg.body = msg[10]
-            agent_msg.func_name = msg[11]
-            if msg[12] is not None:
-                agent_msg.args = json.loads(msg[12])
-            agent_msg.result_str = msg[13]
-            agent_msg.done_time = msg[14]
-            agent_msg.status = AgentMsgStatus(msg[15])
-
-            result.append(agent_msg)
+            result.append(AIChatSession._msg_from_row(msg))
         return result
 
     @classmethod
     def get_session(cls,owner_id:str,session_topic:str,db_path:str,auto_create = True) -> 'AIChatSession':
-        db = cls._dbs.get(db_path)
-        if db is None:
-            db = ChatSessionDB(db_path)
-            cls._dbs[db_path] = db
-
-        result = None
-        for session in cls._sessions.values():
-            if session.owner_id == owner_id and session.topic == session_topic:
-                return session
+        db = cls._get_db(db_path)
+        result = cls._registry.find(db_path,owner_id,session_topic)
+        if result is not None:
+            return result
             
         session = db.get_chatsession_by_owner_topic(owner_id,session_topic)
         if session is None:
@@ -361,28 +409,24 @@ class AIChatSession:
                 session_id = "CS#" + uuid.uuid4().hex
                 db.insert_chatsession(session_id,owner_id,session_topic,datetime.datetime.now())
                 result = AIChatSession(owner_id,session_id,db)
-                cls._sessions[session_id] = result
+                result.topic = session_topic
+                cls._registry.add(result)
         else:
             result = AIChatSession(owner_id,session[0],db)
             result.topic = session_topic
             result.summarize_pos = session[4]
             result.summary = session[5]
             result.openai_thread_id = session[6]
-            cls._sessions[result.session_id] = result
+            cls._registry.add(result)
 
         return result
     
     @classmethod
     def get_session_by_id(cls,session_id:str,db_path:str)->'AIChatSession':
-        db = cls._dbs.get(db_path)
-        if db is None:
-            db = ChatSessionDB(db_path)
-            cls._dbs[db_path] = db
-
-        result = None
-        session = cls._sessions.get(session_id)
-        if session:
-            return session
+        db = cls._get_db(db_path)
+        result = cls._registry.get(session_id)
+        if result is not None:
+            return result
         
         session = db.get_chatsession_by_id(session_id)
         if session is None:
@@ -393,17 +437,13 @@ class AIChatSession:
             result.summarize_pos = session[4]
             result.summary = session[5]
             result.openai_thread_id = session[6]
-            cls._sessions[session_id] = result
+            cls._registry.add(result)
 
         return result        
 
     @classmethod
     def list_session(cls,owner_id:str,db_path:str) -> list[str]:
-        db = cls._dbs.get(db_path)
-        if db is None:
-            db = ChatSessionDB(db_path)
-            cls._dbs[db_path] = db
-
+        db = cls._get_db(db_path)
         result = db.list_chatsessions(owner_id,16,0)
         result_ids = []
         for r in result:
@@ -425,40 +465,112 @@ class AIChatSession:
     def get_owner_id(self) -> str:
         return self.owner_id
 
+    @classmethod
+    def set_tail_cache(cls,tail_len:int = 64,max_size:int = 32 * 1024 * 1024) -> None:
+        cls._tail_cache = SessionTailCache(tail_len,max_size)
+
+    @classmethod
+    def get_tail_cache_metrics(cls) -> dict:
+        return cls._tail_cache.get_metrics()
+
+    def _get_tail(self) -> SessionTail:
+        tail = AIChatSession._tail_cache.get(self.session_id)
+        if tail is None:
+            # cold start: one db read, append keeps the tail up to date after that
+            tail_len = AIChatSession._tail_cache.tail_len
+            rows = list(reversed(self.db.read_messages_by_key(self.session_id, tail_len)))
+            msgs = [AIChatSession._msg_from_row(row) for row in rows]
+            keys = [(row[6], row[16]) for row in rows]
+            tail = AIChatSession._tail_cache.put(self.session_id, msgs, keys, len(rows) < tail_len)
+        return tail
+
+    def _read_tail(self, number:int, offset:int) -> Optional[List[AgentMsg]]:
+        # newest first, None if the tail doesn't cover the requested range
+        if offset + number > AIChatSession._tail_cache.tail_len and number > 0:
+            return None
+        tail = self._get_tail()
+        if number == 0 or offset + number > len(tail.msgs):
+            if not tail.is_all:
+                return None
+        end = len(tail.msgs) - offset
+        if end <= 0:
+            return []
+        start = 0 if number == 0 else max(end - number, 0)
+        return list(reversed(tail.msgs[start:end]))
+
     def read_history(self, number:int=0,offset=0,order="revers") -> [AgentMsg]:
+        """ the returned messages may be shared with the tail cache, don't modify them """
         if order == "revers":
+            result = self._read_tail(number, offset)
+            if result is not None:
+                return result
             msgs = self.db.get_messages(self.session_id, number, offset)
         else:
             msgs = self.db.read_message(self.session_id, number, offset)
             
         result = []
         for msg in msgs:
-            agent_msg = AgentMsg()
-            agent_msg.msg_id = msg[0]
-            agent_msg.session_id = msg[1]
-            agent_msg.msg_type = AgentMsgType(msg[2])
-            agent_msg.prev_msg_id = msg[3]
-            agent_msg.sender = msg[4]
-            agent_msg.target = msg[5]
-            agent_msg.create_time = msg[6]
-            agent_msg.topic = msg[7]
-            if msg[8] is not None:
-                agent_msg.mentions = json.loads(msg[8])
-            agent_msg.body_mime = msg[9]
-            agent_msg.body = msg[10]
-            agent_msg.func_name = msg[11]
-            if msg[12] is not None:
-                agent_msg.args = json.loads(msg[12])
-            agent_msg.result_str = msg[13]
-            agent_msg.done_time = msg[14]
-            agent_msg.status = AgentMsgStatus(msg[15])
-
-            result.append(agent_msg)
+            result.append(AIChatSession._msg_from_row(msg))
         return result
 
+    async def iter_history(self, order="revers", offset=0, page_size=32) -> AsyncIterator[AgentMsg]:
+        """ iterate the messages of the session page by page, stop iterating to stop reading the db.
+            order is "revers" (newest first) or "natural", offset skips the first messages (e.g. summarize_pos) """
+        reverse = order == "revers"
+        after_key = None
+        if reverse:
+            # the newest messages come from the tail cache, the db is read on from the key of the oldest one,
+            # so messages appended meanwhile don't shift the pages
+            tail = self._get_tail()
+            cached_msgs = list(reversed(tail.msgs))
+            cached_keys = list(tail.keys)
+            for msg in cached_msgs[offset:]:
+                yield msg
+            if tail.is_all:
+                return
+            if cached_keys:
+                after_key = cached_keys[0]
+                offset = max(offset - len(cached_keys), 0)
+
+        while True:
+            rows = await self.db.aread_messages_by_key(self.session_id, page_size, after_key, reverse, offset)
+            offset = 0
+            for row in rows:
+                yield AIChatSession._msg_from_row(row)
+            if len(rows) < page_size:
+                return
+            # (Timestamp, rowid) of the last row
+            after_key = (rows[-1][6], rows[-1][16])
+
+    def get_token_count(self, msg:AgentMsg, model_name:str = None) -> int:
+        """ token count of the body of msg, counted once while msg is in the tail cache """
+        tail = AIChatSession._tail_cache.peek(self.session_id)
+        if tail is not None:
+            return tail.get_token_count(msg, model_name)
+        return num_tokens_from_text(msg.body or "", model_name)
+
+    def _append_to_tail(self, msg:AgentMsg, keys:dict) -> None:
+        key = keys.get(msg.msg_id)
+        if msg.session_id == self.session_id and key is not None:
+            AIChatSession._tail_cache.append(self.session_id, msg, key)
+        if msg.inner_call_chain:
+            for inner_call in msg.inner_call_chain:
+                self._append_to_tail(inner_call, keys)
+
+    @staticmethod
+    def _collect_msg_ids(msg:AgentMsg, msg_ids:List[str]) -> List[str]:
+        msg_ids.append(msg.msg_id)
+        if msg.inner_call_chain:
+            for inner_call in msg.inner_call_chain:
+                AIChatSession._collect_msg_ids(inner_call, msg_ids)
+        return msg_ids
+
     def append(self,msg:AgentMsg,tags:List[str] = None) -> None:
         msg.session_id = self.session_id
-        self.db.insert_message(msg,tags)
+        if self.db.insert_message(msg,tags) == 0:
+            # write through, a failed insert must not show up in the tail
+            if AIChatSession._tail_cache.peek(self.session_id) is not None:
+                self._append_to_tail(msg, self.db.get_message_keys(AIChatSession._collect_msg_ids(msg, [])))
 
 
     def update_summary(self,new_summary:str) -> None:
@@ -472,5 +584,3 @@ class AIChatSession:
     #def attach_event_handler(self,handler) -> None:
     #    """chat session changed event handler"""
     #    pass
-
-    #TODO : add iterator interface for read chat history
@@ -0,0 +1,100 @@
+# pylint:disable=E0402
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from ..proto.ai_function import AIFunction
+
+logger = logging.getLogger(__name__)
+
+# A model turn may ask for several functions at once (tool_calls). The parallel safe (read only) calls
+# of a turn don't affect each other and run at the same time, the other calls run alone, in the order
+# the model gave them. The results go back to the prompt in the order of the calls, whichever finishes first.
+
+# seconds a single call may take, AIFunction.get_timeout() overrides it
+INNER_FUNC_TIMEOUT = 300
+
+class InnerFuncCall:
+    def __init__(self,name:str,arguments:str,call_id:str = None) -> None:
+        self.name = name
+        # the json string the llm wrote
+        self.arguments = arguments
+        # only tool_calls have an id, the result message refers to it
+        self.call_id = call_id
+        # set by the caller before execute_inner_func_calls
+        self.func_node : AIFunction = None
+        self.result_str : str = None
+        self.exec_time = 0
+
+    @classmethod
+    def from_message(cls,result_message:dict) -> List['InnerFuncCall']:
+        """ the calls in a llm result message, tool_calls or the older single function_call """
+        if not result_message:
+            return []
+        tool_calls = result_message.get("tool_calls")
+        if tool_calls:
+            return [cls(tool_call["function"].get("name"),tool_call["function"].get("arguments"),tool_call.get("id"))
+                    for tool_call in tool_calls if tool_call.get("function")]
+        function_call = result_message.get("function_call")
+        if function_call:
+            return [cls(function_call.get("name"),function_call.get("arguments"))]
+        return []
+
+    @classmethod
+    def get_call_message(cls,result_message:dict) -> dict:
+        """ the llm result message as it goes back into the prompt, before the results of its calls """
+        call_message = {}
+        for k,v in result_message.items():
+            if v is not None:
+                call_message[k] = v
+        if call_message.get("tool_calls"):
+            # llama-cpp-python fills in both
+            call_message.pop("function_call",None)
+        call_message["content"] = result_message.get("content")
+        return call_message
+
+    def is_parallel_safe(self) -> bool:
+        return self.func_node is not None and self.func_node.is_parallel_safe()
+
+    def to_result_message(self) -> dict:
+        if self.call_id:
+            return {"role":"tool","tool_call_id":self.call_id,"content":self.result_str}
+        return {"role":"function","content":self.result_str,"name":self.name}
+
+
+async def execute_inner_func_calls(calls:List[InnerFuncCall],run_func:Callable[[InnerFuncCall,Dict],Awaitable[str]],timeout:float = INNER_FUNC_TIMEOUT):
+    """ set result_str of every call, run_func(call,arguments) runs call.func_node """
+    async def _execute(call:InnerFuncCall):
+        begin = time.monotonic()
+        func_timeout = timeout
+        try:
+            if call.func_node is None:
+                call.result_str = f"execute {call.name} error,function not found"
+                return
+            if call.func_node.get_timeout() is not None:
+                func_timeout = call.func_node.get_timeout()
+            arguments = json.loads(call.arguments) if call.arguments else {}
+            call.result_str = str(await asyncio.wait_for(run_func(call,arguments),func_timeout))
+        except asyncio.TimeoutError:
+            call.result_str = f"execute {call.name} error:timeout after {func_timeout}s"
+            logger.error(f"execute inner func:{call.name} timeout after {func_timeout}s")
+        except Exception as e:
+            call.result_str = f"execute {call.name} error:{str(e)}"
+            logger.error(f"execute inner func:{call.name} error:\n\t{e}")
+        finally:
+            call.exec_time = time.monotonic() - begin
+
+    batch = []
+    for call in calls:
+        if call.is_parallel_safe():
+            batch.append(call)
+            continue
+        # a call which may change something waits for the calls before it, and the calls after it wait for it
+        if batch:
+            await asyncio.gather(*[_execute(batch_call) for batch_call in batch])
+            batch = []
+        await _execute(call)
+    if batch:
+        await asyncio.gather(*[_execute(batch_call) for batch_call in batch])
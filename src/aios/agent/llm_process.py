@@ -5,13 +5,14 @@ import os.path
 from .chatsession import AIChatSession
 from ..utils import video_utils,image_utils
 
-from ..proto.compute_task import LLMPrompt,LLMResult,ComputeTaskResult,ComputeTaskResultCode
+from ..proto.compute_task import LLMPrompt,LLMResult,ComputeTaskResult,ComputeTaskResultCode,ComputeTaskPriority
 from ..proto.ai_function import AIFunction,AIAction,ActionNode
 from ..proto.agent_msg import AgentMsg,AgentMsgType
 
 from .agent_memory import AgentMemory
 from .workspace import AgentWorkspace
 from .llm_context import LLMProcessContext,GlobaToolsLibrary, SimpleLLMContext
+from .inner_func_call import InnerFuncCall,execute_inner_func_calls,INNER_FUNC_TIMEOUT
 
 from ..frame.compute_kernel import ComputeKernel
 from ..knowledge.knowledge_base import BaseKnowledgeGraph
@@ -44,6 +45,11 @@ class BaseLLMProcess(ABC):
         self.max_prompt_token = 2000 # not include input prompt
         self.chat_summary_token_len = 500
         self.timeout = 1800 # 30 min
+        self.inner_func_timeout = INNER_FUNC_TIMEOUT
+        # chat replies are INTERACTIVE, most behaviors run in background
+        self.priority = ComputeTaskPriority.AGENT_BACKGROUND
+        # only idempotent behaviors (triage, extraction...) should turn this on
+        self.enable_completion_cache = False
 
         self.llm_context:LLMProcessContext = None
 
@@ -84,6 +90,12 @@ class BaseLLMProcess(ABC):
             self.max_token = config.get("max_token")
         if config.get("timeout"):
             self.timeout = config.get("timeout")
+        if config.get("inner_func_timeout"):
+            self.inner_func_timeout = config.get("inner_func_timeout")
+        if config.get("priority"):
+            self.priority = ComputeTaskPriority.from_str(config.get("priority"))
+        if config.get("enable_completion_cache"):
+            self.enable_completion_cache = config.get("enable_completion_cache") == "true"
 
 
         return True
@@ -96,27 +108,21 @@ class BaseLLMProcess(ABC):
         return content.format_map(env)
 
 
-    async def _execute_inner_func(self,inner_func_call_node:Dict,prompt: LLMPrompt,stack_limit = 1) -> ComputeTaskResult:
-        arguments = None
+    async def _execute_inner_func(self,inner_func_calls:List[InnerFuncCall],prompt: LLMPrompt,stack_limit = 1,on_token = None) -> ComputeTaskResult:
         stack_limit = stack_limit - 1
-        try:
-            func_name = inner_func_call_node.get("name")
-            arguments = json.loads(inner_func_call_node.get("arguments"))
-            logger.info(f"LLMProcess execute inner func:{func_name} :({json.dumps(arguments,ensure_ascii=False)})")
+        for call in inner_func_calls:
+            call.func_node = await self.get_inner_function_for_exec(call.name)
 
-            func_node : AIFunction = await self.get_inner_function_for_exec(func_name)
-            if func_node is None:
-                result_str:str = f"execute {func_name} error,function not found"
-            else:
-                self.prepare_inner_function_context_for_exec(func_name,arguments)
-                result_str:str = await func_node.execute(arguments)
-        except Exception as e:
-            result_str = f"execute {func_name} error:{str(e)}"
-            logger.error(f"LLMProcess execute inner func:{func_name} error:\n\t{e}")
+        async def run_func(call:InnerFuncCall,arguments:Dict) -> str:
+            logger.info(f"LLMProcess execute inner func:{call.name} :({json.dumps(arguments,ensure_ascii=False)})")
+            self.prepare_inner_function_context_for_exec(call.name,arguments)
+            return await call.func_node.execute(arguments)
 
-        logger.info("LLMProcess execute inner func result:" + result_str)
+        await execute_inner_func_calls(inner_func_calls,run_func,self.inner_func_timeout)
+        for call in inner_func_calls:
+            logger.info(f"LLMProcess execute inner func:{call.name} result ({call.exec_time:.2f}s):" + call.result_str)
+            prompt.messages.append(call.to_result_message())
 
-        prompt.messages.append({"role":"function","content":result_str,"name":func_name})
         if self.enable_json_resp:
             resp_mode = "json"
         else:
@@ -134,6 +140,9 @@ class BaseLLMProcess(ABC):
         else:
             inner_functions = None
 
+        if on_token is not None and resp_mode == "text":
+            # the text streamed so far came with the function calls, the listener drops it and the reply starts over
+            await on_token(None)
 
         task_result: ComputeTaskResult = await (ComputeKernel.get_instance().do_llm_completion(
             prompt,
@@ -141,25 +150,20 @@ class BaseLLMProcess(ABC):
             mode_name=self.get_llm_model_name(),
             max_token=max_result_token,
             inner_functions=inner_functions, #NOTICE: inner_function in prompt can be a subset of get_inner_function
-            timeout=self.timeout))
+            timeout=self.timeout,
+            priority=self.priority,
+            use_cache=self.enable_completion_cache,
+            on_token=on_token if resp_mode == "text" else None))
 
         if task_result.result_code != ComputeTaskResultCode.OK:
             logger.error(f"llm compute error:{task_result.error_str}")
             return task_result
 
-        inner_func_call_node = None
-
         result_message : dict = task_result.result.get("message")
-        if result_message:
-            inner_func_call_node = result_message.get("function_call")
-            if inner_func_call_node:
-                func_msg = copy.deepcopy(result_message)
-                del func_msg["tool_calls"]#TODO: support tool_calls?
-                prompt.messages.append(func_msg)
-
-
-        if inner_func_call_node:
-            return await self._execute_inner_func(inner_func_call_node,prompt,stack_limit-1)
+        inner_func_calls = InnerFuncCall.from_message(result_message)
+        if inner_func_calls:
+            prompt.messages.append(InnerFuncCall.get_call_message(copy.deepcopy(result_message)))
+            return await self._execute_inner_func(inner_func_calls,prompt,stack_limit-1,on_token)
         else:
             return task_result
 
@@ -179,13 +183,18 @@ class BaseLLMProcess(ABC):
         #if max_result_token < MIN_PREDICT_TOKEN_LEN:
         #    return LLMResult.from_error_str(f"prompt too long,can not predict")
 
+        # the caller wants the text as it's generated (a tunnel showing the reply), json resps aren't streamed
+        on_token = input.get("on_token") if resp_mode == "text" else None
         task_result: ComputeTaskResult = await (ComputeKernel.get_instance().do_llm_completion(
                 prompt,
                 resp_mode=resp_mode,
                 mode_name=self.get_llm_model_name(),
                 max_token=max_result_token,
                 inner_functions=prompt.inner_functions, #NOTICE: inner_function in prompt can be a subset of get_inner_function
-                timeout=self.timeout))
+                timeout=self.timeout,
+                priority=self.priority,
+                use_cache=self.enable_completion_cache,
+                on_token=on_token))
 
         if task_result.result_code != ComputeTaskResultCode.OK:
             err_str = f"do_llm_completion error:{task_result.error_str}"
@@ -193,16 +202,11 @@ class BaseLLMProcess(ABC):
             return LLMResult.from_error_str(err_str)
 
         result_message = task_result.result.get("message")
-        inner_func_call_node = None
-        if result_message:
-            inner_func_call_node = result_message.get("function_call")
-
-        if inner_func_call_node:
+        inner_func_calls = InnerFuncCall.from_message(result_message)
+        if inner_func_calls:
             call_prompt : LLMPrompt = copy.deepcopy(prompt)
-            func_msg = copy.deepcopy(result_message)
-            del func_msg["tool_calls"]
-            call_prompt.messages.append(func_msg)
-            task_result = await self._execute_inner_func(inner_func_call_node,call_prompt)
+            call_prompt.messages.append(InnerFuncCall.get_call_message(copy.deepcopy(result_message)))
+            task_result = await self._execute_inner_func(inner_func_calls,call_prompt,on_token=on_token)
 
         # parse task_result to LLM Result
         if self.enable_json_resp:
@@ -355,6 +359,7 @@ class LLMAgentBaseProcess(BaseLLMProcess):
 class AgentMessageProcess(LLMAgentBaseProcess):
     def __init__(self) -> None:
         super().__init__()
+        self.priority = ComputeTaskPriority.INTERACTIVE
         self.mutil_model = None
         self.enable_media2text = False
         self.is_mutil_model = False
@@ -583,9 +588,8 @@ class AgentSelfThinking(LLMAgentBaseProcess):
             if token_limit > 8:
                 # load session chat history
                 cur_pos = chatsession.summarize_pos
-                messages = chatsession.read_history(0,cur_pos,"natural") # read
                 history_str = ""
-                for msg in messages:
+                async for msg in chatsession.iter_history("natural",cur_pos):
                     read_history_msg += 1
                     total_read_msg += 1
                     cur_pos += 1
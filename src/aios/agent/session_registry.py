@@ -0,0 +1,131 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Registry of the live AIChatSession objects and the ChatSessionDB handles they use.
+# Sessions are indexed by id and by (db path, owner, topic), so get_session doesn't scan every session.
+# A session is dropped when it has been idle for idle_timeout seconds or when there are more than max_sessions,
+# a db handle is closed when no registered session uses it and it has been idle for idle_timeout seconds.
+# Dropped objects are only unregistered, callers which still hold a session keep using it.
+
+class SessionRegistry:
+    def __init__(self, max_sessions: int = 4096, idle_timeout: float = 3600,
+                 on_evict: Callable = None, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict
+        self.clock = clock
+
+        # session_id -> (session, last_access), least recently used first
+        self._sessions : OrderedDict = OrderedDict()
+        # (db_path, owner_id, topic) -> session_id
+        self._topic_index = {}
+        # db_path -> [db, last_access, session count], least recently used first
+        self._dbs : OrderedDict = OrderedDict()
+
+        self.hit_count = 0
+        self.miss_count = 0
+        self.evicted_sessions = 0
+        self.evicted_dbs = 0
+
+    @staticmethod
+    def _topic_key(session) -> tuple:
+        return (session.db.db_file, session.owner_id, session.topic)
+
+    def get_db(self, db_path: str, factory: Callable):
+        now = self.clock()
+        entry = self._dbs.get(db_path)
+        if entry is None:
+            entry = [factory(db_path), now, 0]
+            self._dbs[db_path] = entry
+        else:
+            entry[1] = now
+            self._dbs.move_to_end(db_path)
+        self.evict(now)
+        return entry[0]
+
+    def _touch(self, session_id: str):
+        now = self.clock()
+        session = self._sessions[session_id][0]
+        self._sessions[session_id] = (session, now)
+        self._sessions.move_to_end(session_id)
+        db_entry = self._dbs.get(session.db.db_file)
+        if db_entry is not None:
+            db_entry[1] = now
+            self._dbs.move_to_end(session.db.db_file)
+        self.evict(now)
+        return session
+
+    def get(self, session_id: str):
+        if session_id not in self._sessions:
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        return self._touch(session_id)
+
+    def find(self, db_path: str, owner_id: str, topic: str):
+        session_id = self._topic_index.get((db_path, owner_id, topic))
+        if session_id is None:
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        return self._touch(session_id)
+
+    def add(self, session):
+        old_entry = self._sessions.get(session.session_id)
+        if old_entry is not None:
+            self._remove(session.session_id)
+        self._sessions[session.session_id] = (session, self.clock())
+        if session.topic is not None:
+            self._topic_index[SessionRegistry._topic_key(session)] = session.session_id
+        db_entry = self._dbs.get(session.db.db_file)
+        if db_entry is not None:
+            db_entry[2] += 1
+        self._touch(session.session_id)
+
+    def _remove(self, session_id: str):
+        session, _ = self._sessions.pop(session_id)
+        topic_key = SessionRegistry._topic_key(session)
+        if self._topic_index.get(topic_key) == session_id:
+            del self._topic_index[topic_key]
+        db_entry = self._dbs.get(session.db.db_file)
+        if db_entry is not None:
+            db_entry[2] -= 1
+        return session
+
+    def evict(self, now: Optional[float] = None):
+        if now is None:
+            now = self.clock()
+
+        while self._sessions:
+            session_id, (session, last_access) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - last_access < self.idle_timeout:
+                break
+            self._remove(session_id)
+            self.evicted_sessions += 1
+            logger.debug(f"session registry evict session {session_id}")
+            if self.on_evict:
+                self.on_evict(session)
+
+        while self._dbs:
+            db_path, (db, last_access, session_count) = next(iter(self._dbs.items()))
+            # a db is used at least as recently as its sessions, so an idle db has no idle sessions left
+            if session_count > 0 or now - last_access < self.idle_timeout:
+                break
+            del self._dbs[db_path]
+            db.close()
+            self.evicted_dbs += 1
+            logger.info(f"session registry close idle db {db_path}")
+
+    def get_metrics(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "dbs": len(self._dbs),
+            "hit": self.hit_count,
+            "miss": self.miss_count,
+            "evicted_sessions": self.evicted_sessions,
+            "evicted_dbs": self.evicted_dbs,
+        }
@@ -0,0 +1,127 @@
+import bisect
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from ..proto.agent_msg import AgentMsg
+from ..proto.tokenizer import num_tokens_from_text
+
+logger = logging.getLogger(__name__)
+
+# Write-through cache of the last messages of hot chat sessions.
+# Prompt builders read the same recent messages of a session again and again (every reply, every workflow role turn),
+# the tail is loaded from the db once and then kept up to date by AIChatSession.append.
+# All tails share one memory budget, the least recently used sessions are dropped first.
+# A tail is sorted by the (Timestamp, rowid) key the db pages by, so reads go on into the db from the key of its oldest message.
+
+class SessionTail:
+    def __init__(self, msgs: List[AgentMsg], keys: List[Tuple], is_all: bool) -> None:
+        # oldest -> newest
+        self.msgs : List[AgentMsg] = msgs
+        # the (Timestamp, rowid) of each message in the db
+        self.keys : List[Tuple] = keys
+        # True if the tail holds every message of the session
+        self.is_all = is_all
+        # msg_id -> {model_name: token count of the body}
+        self.token_counts : Dict[str, Dict[str, int]] = {}
+        self.size = sum(SessionTail.estimate_size(msg) for msg in msgs)
+
+    @staticmethod
+    def estimate_size(msg: AgentMsg) -> int:
+        size = 256
+        if msg.body:
+            size += len(msg.body)
+        if msg.result_str:
+            size += len(msg.result_str)
+        return size
+
+    def add(self, msg: AgentMsg, key: Tuple, max_len: int) -> int:
+        # keep the order of the db, messages usually arrive in order so this is an append
+        pos = bisect.bisect_right(self.keys, key)
+        self.msgs.insert(pos, msg)
+        self.keys.insert(pos, key)
+        added_size = SessionTail.estimate_size(msg)
+        self.size += added_size
+        while len(self.msgs) > max_len:
+            removed = self.msgs.pop(0)
+            self.keys.pop(0)
+            self.token_counts.pop(removed.msg_id, None)
+            self.size -= SessionTail.estimate_size(removed)
+            added_size -= SessionTail.estimate_size(removed)
+            self.is_all = False
+        return added_size
+
+    def get_token_count(self, msg: AgentMsg, model_name: str = None) -> int:
+        counts = self.token_counts.setdefault(msg.msg_id, {})
+        count = counts.get(model_name)
+        if count is None:
+            count = num_tokens_from_text(msg.body or "", model_name)
+            counts[model_name] = count
+        return count
+
+
+class SessionTailCache:
+    def __init__(self, tail_len: int = 64, max_size: int = 32 * 1024 * 1024) -> None:
+        self.tail_len = tail_len
+        self.max_size = max_size
+        self.total_size = 0
+        # session_id -> SessionTail, in LRU order
+        self._tails : OrderedDict = OrderedDict()
+
+        self.hit_count = 0
+        self.miss_count = 0
+        self.evict_count = 0
+
+    def get(self, session_id: str) -> Optional[SessionTail]:
+        tail = self._tails.get(session_id)
+        if tail is None:
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        self._tails.move_to_end(session_id)
+        return tail
+
+    def peek(self, session_id: str) -> Optional[SessionTail]:
+        # no metrics and no LRU update, for lookups which follow a get
+        return self._tails.get(session_id)
+
+    def put(self, session_id: str, msgs: List[AgentMsg], keys: List[Tuple], is_all: bool) -> SessionTail:
+        """ msgs oldest -> newest in the order of their (Timestamp, rowid) keys """
+        old_tail = self._tails.pop(session_id, None)
+        if old_tail is not None:
+            self.total_size -= old_tail.size
+        tail = SessionTail(msgs[-self.tail_len:], keys[-self.tail_len:], is_all and len(msgs) <= self.tail_len)
+        self._tails[session_id] = tail
+        self.total_size += tail.size
+        self._evict()
+        return tail
+
+    def append(self, session_id: str, msg: AgentMsg, key: Tuple):
+        # only sessions which are cached are updated, a cold session is loaded on its next read
+        tail = self._tails.get(session_id)
+        if tail is None:
+            return
+        self.total_size += tail.add(msg, key, self.tail_len)
+        self._tails.move_to_end(session_id)
+        self._evict()
+
+    def remove(self, session_id: str):
+        tail = self._tails.pop(session_id, None)
+        if tail is not None:
+            self.total_size -= tail.size
+
+    def _evict(self):
+        while self.total_size > self.max_size and len(self._tails) > 1:
+            session_id, tail = self._tails.popitem(last=False)
+            self.total_size -= tail.size
+            self.evict_count += 1
+            logger.debug(f"session tail cache evict {session_id}")
+
+    def get_metrics(self) -> dict:
+        return {
+            "sessions": len(self._tails),
+            "size": self.total_size,
+            "hit": self.hit_count,
+            "miss": self.miss_count,
+            "evicted": self.evict_count,
+        }
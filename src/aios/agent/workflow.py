@@ -15,6 +15,7 @@ from ..proto.ai_function import *
 from .agent_base import *
 from .chatsession import AIChatSession
 from .role import AIRole,AIRoleGroup
+from .inner_func_call import InnerFuncCall,execute_inner_func_calls,INNER_FUNC_TIMEOUT
 
 from ..frame.compute_kernel import ComputeKernel
 from ..frame.bus import AIBus
@@ -59,6 +60,7 @@ class Workflow:
         self.db_file = None
         self.env_db_file = None
         self.workflow_env:WorkflowEnvironment = None
+        self.inner_func_timeout = INNER_FUNC_TIMEOUT
 
         self.is_start = False
         self.msg_queue = Queue()
@@ -82,6 +84,9 @@ class Workflow:
         else:
             self.workflow_id = self.owner_workflow.workflow_id + "." + self.workflow_name
             self.db_file = self.owner_workflow.db_file
+            self.inner_func_timeout = self.owner_workflow.inner_func_timeout
+        if config.get("inner_func_timeout"):
+            self.inner_func_timeout = config.get("inner_func_timeout")
 
         if config.get("prompt") is not None:
             self.rule_prompt = LLMPrompt()
@@ -327,43 +332,43 @@ class Workflow:
             return result_func
         return None
 
-    async def _role_execute_func(self,the_role:AIRole,inenr_func_call_node:dict,prompt:LLMPrompt,org_msg:AgentMsg,stack_limit = 5) -> [str,int]:
-
-        func_name = inenr_func_call_node.get("name")
-        arguments = json.loads(inenr_func_call_node.get("arguments"))
-        ineternal_call_record = AgentMsg.create_internal_call_msg(func_name,arguments,org_msg.get_msg_id(),org_msg.target)
-        func_node : AIFunction = self.workflow_env.get_ai_function(func_name)
-        result_str : str = ""
-        if func_node is None:
-            result_str = f"execute {func_name} failed,function not found"
-        else:
-            try:
-                result_str = await func_node.execute(**arguments)
-            except Exception as e:
-                result_str = f"execute {func_name} error:{str(e)}"
-                logger.error(f"llm execute inner func:{func_name} error:{e}")
-                logger.exception(e)
-
+    async def _role_execute_func(self,the_role:AIRole,inner_func_calls:List[InnerFuncCall],prompt:LLMPrompt,org_msg:AgentMsg,stack_limit = 5) -> [str,int]:
+        # every call is recorded, one which fails before it runs (bad argument json, no such function) with the llm's arguments
+        ineternal_call_records = {}
+        for call in inner_func_calls:
+            call.func_node = self.workflow_env.get_ai_function(call.name)
+            ineternal_call_records[call] = AgentMsg.create_internal_call_msg(call.name,call.arguments,org_msg.get_msg_id(),org_msg.target)
+
+        async def run_func(call:InnerFuncCall,arguments:dict) -> str:
+            ineternal_call_record = ineternal_call_records[call]
+            ineternal_call_record.args = arguments
+            ineternal_call_record.create_time = time.time()
+            return await call.func_node.execute(arguments)
+
+        await execute_inner_func_calls(inner_func_calls,run_func,self.inner_func_timeout)
+        for call in inner_func_calls:
+            ineternal_call_record = ineternal_call_records[call]
+            ineternal_call_record.result_str = call.result_str
+            ineternal_call_record.done_time = ineternal_call_record.create_time + call.exec_time
+            org_msg.inner_call_chain.append(ineternal_call_record)
+            prompt.messages.append(call.to_result_message())
 
         inner_functions = self._get_inner_functions(the_role)
-        prompt.messages.append({"role":"function","content":result_str,"name":func_name})
         task_result:ComputeTaskResult = await ComputeKernel.get_instance().do_llm_completion(prompt,
-                                                                                the_role.agent.llm_model_name,the_role.agent.max_token_size,
-                                                                                inner_functions)
+                                                                                mode_name=the_role.agent.llm_model_name,max_token=the_role.agent.max_token_size,
+                                                                                inner_functions=inner_functions)
         if task_result.result_code != ComputeTaskResultCode.OK:
             logger.error(f"llm compute error:{task_result.error_str}")
             return task_result.error_str,1
 
-        ineternal_call_record.result_str = task_result.result_str
-        ineternal_call_record.done_time = time.time()
-        org_msg.inner_call_chain.append(ineternal_call_record)
+        inner_func_calls = []
         if stack_limit > 0:
             result_message = task_result.result.get("message")
-            if result_message:
-                inner_func_call_node = result_message.get("function_call")
+            inner_func_calls = InnerFuncCall.from_message(result_message)
 
-        if inner_func_call_node:
-            return await self._role_execute_func(the_role,inner_func_call_node,prompt,org_msg,stack_limit-1)
+        if inner_func_calls:
+            prompt.messages.append(InnerFuncCall.get_call_message(result_message))
+            return await self._role_execute_func(the_role,inner_func_calls,prompt,org_msg,stack_limit-1)
         else:
             return task_result.result_str,0
 
@@ -402,12 +407,12 @@ class Workflow:
             logger.info(f"{the_role.role_id} process {msg.sender}:{msg.body},llm str is :{result_str}")
 
             result_message = task_result.result.get("message")
-            if result_message:
-                inner_func_call_node = result_message.get("function_call")
+            inner_func_calls = InnerFuncCall.from_message(result_message)
 
-            if inner_func_call_node:
+            if inner_func_calls:
                 #TODO to save more token ,can i use msg_prompt?
-                result_str,r_code = await self._role_execute_func(the_role,inner_func_call_node,prompt,msg)
+                prompt.messages.append(InnerFuncCall.get_call_message(result_message))
+                result_str,r_code = await self._role_execute_func(the_role,inner_func_calls,prompt,msg)
                 if r_code != 0:
                     error_resp = msg.create_error_resp(result_str)
                     return error_resp
@@ -599,7 +599,7 @@ class AgentWorkspace:
                 return "no task"
         list_task_ai_function = SimpleAIFunction("agent.workspace.list_task",
                                               "list all tasks in json format",
-                                               list_task,{})
+                                               list_task,{},read_only=True)
         GlobaToolsLibrary.get_instance().register_tool_function(list_task_ai_function)
         
         async def update_task(parameters):
@@ -746,7 +746,7 @@ class AgentWorkspace:
         })
         read_task_file_ai_function = SimpleAIFunction("agent.workspace.read_file",
                                               "read file for task",
-                                               read_task_file,parameters)
+                                               read_task_file,parameters,read_only=True)
         GlobaToolsLibrary.get_instance().register_tool_function(read_task_file_ai_function)
 
         # list dir
@@ -763,7 +763,7 @@ class AgentWorkspace:
         })
         list_task_dir_ai_function = SimpleAIFunction("agent.workspace.list_dir",
                                               "list dir in task workspace",
-                                               list_task_dir,parameters)
+                                               list_task_dir,parameters,read_only=True)
         GlobaToolsLibrary.get_instance().register_tool_function(list_task_dir_ai_function)
 
         # remove file
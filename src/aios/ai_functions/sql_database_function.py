@@ -61,7 +61,7 @@ class GetTableInfosFunction(AIFunction):
         return True
 
     def is_ready_only(self) -> bool:
-        return False
+        return True
 
 
 class ExecuteSqlFunction(AIFunction):
@@ -2,9 +2,7 @@
 from datetime import datetime
 import asyncio
 import json
-import sqlite3 # Because sqlite3 IO operation is small, so we can use sqlite3 directly.(so we don't need to use async sqlite3 now)
 from sqlite3 import Error
-import threading
 import logging
 from typing import Optional
 import aiosqlite
@@ -15,6 +13,7 @@ from ..proto.ai_function import *
 from ..frame.compute_kernel import ComputeKernel
 from ..frame.contact_manager import ContactManager,Contact
 from ..storage.storage import AIStorage
+from ..storage.sqlite_db import SQLiteDB
 
 from .environment import SimpleEnvironment, CompositeEnvironment
 from ..ai_functions.script_to_speech_function import ScriptToSpeechFunction
@@ -41,7 +40,7 @@ class CalenderEnvironment(SimpleEnvironment):
 
         gl.register_tool_function(SimpleAIFunction("system.now",
                                         "get current time",
-                                        self._get_now))
+                                        self._get_now,read_only=True))
         
         get_param = ParameterDefine.create_parameters({
             "start_time": "start time (UTC) of event",
@@ -49,7 +48,7 @@ class CalenderEnvironment(SimpleEnvironment):
         })
         gl.register_tool_function(SimpleAIFunction("system.calender.get_events",
                                               "get events in calender by time range",
-                                              self._get_events_by_time_range,get_param))
+                                              self._get_events_by_time_range,get_param,read_only=True))
 
         add_param = ParameterDefine.create_parameters({
             "title": "title of event",
@@ -322,36 +321,24 @@ class WorkflowEnvironment(CompositeEnvironment):
     def __init__(self, env_id: str,db_file:str) -> None:
         super().__init__(env_id)
         self.db_file = db_file
-        self.local = threading.local()
+        self.db : SQLiteDB = None
         self.table_name = "WorkflowEnv_" + env_id
         # self.add_ai_function(ScriptToSpeechFunction())
         # self.add_ai_function(Image2TextFunction())
 
 
-    def _get_conn(self):
-        """ get db connection """
-        if not hasattr(self.local, 'conn'):
-            self.local.conn = self._create_connection()
-        return self.local.conn
-
-    def _create_connection(self):
-        """ create a database connection to a SQLite database """
-        conn = None
-        try:
-            conn = sqlite3.connect(self.db_file)
-        except Error as e:
-            logging.error("Error occurred while connecting to database: %s", e)
-            return None
-
-        if conn:
-            self._create_table(conn)
-
-        return conn
+    def _get_db(self) -> SQLiteDB:
+        """ get the shared db of the file, the table of each env is created once """
+        if self.db is None:
+            self.db = SQLiteDB.open(self.db_file)
+            self.db.init_schema(self.table_name, self._create_table)
+        return self.db
 
     def close(self):
-        if not hasattr(self.local, 'conn'):
+        if self.db is None:
             return
-        self.local.conn.close()
+        self.db.close()
+        self.db = None
 
     def _create_table(self, conn):
         """ create table """
@@ -370,10 +357,7 @@ class WorkflowEnvironment(CompositeEnvironment):
 
     def _do_get_value(self, key: str) -> str | None:
         try:
-            conn = self._get_conn()
-            c = conn.cursor()
-            c.execute("SELECT EnvValue FROM " + self.table_name +" WHERE EnvKey = ?", (key,))
-            value = c.fetchone()
+            value = self._get_db().fetchone("SELECT EnvValue FROM " + self.table_name +" WHERE EnvKey = ?", (key,))
             if value is None:
                 return None
             return value[0]
@@ -387,12 +371,10 @@ class WorkflowEnvironment(CompositeEnvironment):
             return
 
         try:
-            conn = self._get_conn()
-            conn.execute("""
+            self._get_db().execute("""
                 INSERT OR REPLACE INTO """ + self.table_name+ """ (EnvKey, EnvValue, UpdateTime)
                 VALUES (?, ?, ?) 
             """, (key, str_value, datetime.now()))
-            conn.commit()
             return 0  # return 0 if successful
         except Error as e:
             logging.error(f"Error occurred while update env{self.env_id}.{key} ,error:{e}")
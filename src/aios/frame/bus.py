@@ -1,6 +1,9 @@
-from typing import Coroutine,Dict,Any
+from typing import Awaitable,Callable,Coroutine,Dict,Any,Optional
+import time
 import asyncio
+import contextvars
 from asyncio import Queue
+from collections import deque
 import logging
 
 from ..proto.agent_msg import *
@@ -8,20 +11,180 @@ from ..agent.agent_base import *
 
 logger = logging.getLogger(__name__)
 
+# send_message waits for the reply on a future registered under the msg_id on the sender's handler,
+# post_message resolves it when a msg with that rely_msg_id arrives. A reply nobody waits for
+# (the sender timed out or never asked) is dropped instead of piling up.
+SEND_MESSAGE_TIMEOUT = 240
+# A handler works on the msgs of different sessions (AgentMsg.get_session_topic) at the same time,
+# up to max_concurrency of them, and on the msgs of one session in order. So a long llm turn
+# in one chat doesn't hold up the other chats of the same agent.
+HANDLER_MAX_CONCURRENCY = 4
+# At most max_queue msgs of a handler wait to be handled. When it's full post_message waits for room
+# (up to post_timeout), except for the msg types with an overflow policy: those are dropped, or merged
+# into a waiting msg of the same kind in the same session (a newer event replaces the older one).
+HANDLER_MAX_QUEUE = 256
+POST_MESSAGE_TIMEOUT = 60
+OVERFLOW_WAIT = "wait"
+OVERFLOW_DROP = "drop"
+OVERFLOW_MERGE = "merge"
+# the bus which delivers the msg a handler is working on, a process may run several buses
+_delivering_bus = contextvars.ContextVar("delivering_bus",default=None)
+DEFAULT_OVERFLOW_POLICIES = {
+    AgentMsgType.TYPE_EVENT: OVERFLOW_MERGE,
+}
+
 class AIBusHandler:
-    def __init__(self,handler:Coroutine,owner_bus,enable_defualt_proc=True) -> None:
+    def __init__(self,handler:Coroutine,owner_bus,enable_defualt_proc=True,max_concurrency:int=HANDLER_MAX_CONCURRENCY,
+                 max_queue:int=HANDLER_MAX_QUEUE,overflow_policies:dict=None) -> None:
         self.handler = handler
-        self.working_task = None
-        self.results = {} # recv resps
-        self.queue:Queue = Queue()
+        self.pending_resps : Dict[str,asyncio.Future] = {} # msg_id -> future of the resp
+        self.queue:Queue = Queue() # msgs of a handler without a handler func, its owner reads them
         self.enable_defualt_proc = enable_defualt_proc
         self.owner_bus = owner_bus
 
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # session topic -> (post time, msg) of the session, the first one is being handled
+        self.sessions : Dict[str,deque] = {}
+        self.session_tasks = set()
+        self.max_queue = max_queue
+        self.overflow_policies = DEFAULT_OVERFLOW_POLICIES if overflow_policies is None else overflow_policies
+        self.space = asyncio.Condition()
+        self.waiting_count = 0
+        self.blocked_count = 0
+        self.dropped_count = 0
+        self.merged_count = 0
+        self.total_block_time = 0.0
+        self.max_block_time = 0.0
+        self.running_count = 0
+        self.handled_count = 0
+        self.failed_count = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+
+    @staticmethod
+    def _merge_key(msg:AgentMsg) -> tuple:
+        return (msg.msg_type,msg.sender,msg.event_name,msg.func_name)
+
+    def _merge(self,msg:AgentMsg) -> bool:
+        session = self.sessions.get(msg.get_session_topic())
+        if not session:
+            return False
+        merge_key = AIBusHandler._merge_key(msg)
+        # the first msg of a session may be running already
+        for i in range(len(session) - 1,0,-1):
+            post_time,waiting_msg = session[i]
+            if AIBusHandler._merge_key(waiting_msg) == merge_key:
+                session[i] = (post_time,msg)
+                return True
+        return False
+
+    async def put(self,msg:AgentMsg,timeout:float) -> bool:
+        if self.handler is None:
+            self.queue.put_nowait(msg)
+            return True
+
+        if self.waiting_count >= self.max_queue:
+            policy = self.overflow_policies.get(msg.msg_type,OVERFLOW_WAIT)
+            if policy == OVERFLOW_MERGE and self._merge(msg):
+                self.merged_count += 1
+                return True
+            if policy != OVERFLOW_WAIT:
+                self.dropped_count += 1
+                logger.warning(f"queue is full, drop msg {msg.msg_id} from {msg.sender}")
+                return False
+
+            begin = time.monotonic()
+            self.blocked_count += 1
+            try:
+                async with self.space:
+                    await asyncio.wait_for(self.space.wait_for(lambda: self.waiting_count < self.max_queue),timeout)
+                    self.waiting_count += 1
+            except asyncio.TimeoutError:
+                self.dropped_count += 1
+                logger.warning(f"queue is full for {timeout}s, drop msg {msg.msg_id} from {msg.sender}")
+                return False
+            finally:
+                block_time = time.monotonic() - begin
+                self.total_block_time += block_time
+                self.max_block_time = max(self.max_block_time,block_time)
+        else:
+            self.waiting_count += 1
+
+        self.dispatch(time.monotonic(),msg)
+        return True
+
+    async def _release(self):
+        self.waiting_count -= 1
+        async with self.space:
+            self.space.notify()
+
+    def dispatch(self,post_time:float,msg:AgentMsg):
+        session_topic = msg.get_session_topic()
+        session = self.sessions.get(session_topic)
+        if session is not None:
+            session.append((post_time,msg))
+            return
+
+        self.sessions[session_topic] = deque([(post_time,msg)])
+        task = asyncio.create_task(self.process_session(session_topic))
+        self.session_tasks.add(task)
+        task.add_done_callback(self.session_tasks.discard)
+
+    async def process_session(self,session_topic:str):
+        session = self.sessions[session_topic]
+        try:
+            while session:
+                post_time,msg = session[0]
+                async with self.semaphore:
+                    await self._release()
+                    lag = time.monotonic() - post_time
+                    self.last_lag = lag
+                    self.max_lag = max(self.max_lag,lag)
+                    self.total_lag += lag
+                    self.running_count += 1
+                    try:
+                        await self.handle_message(msg)
+                    except Exception as e:
+                        self.failed_count += 1
+                        logger.error(f"handle message {msg.msg_id} failed! {e}")
+                        logger.exception(e)
+                    finally:
+                        self.running_count -= 1
+                        self.handled_count += 1
+                session.popleft()
+        finally:
+            del self.sessions[session_topic]
+
+    def get_metrics(self) -> dict:
+        return {
+            "waiting": self.waiting_count,
+            "max_queue": self.max_queue,
+            "blocked": self.blocked_count,
+            "dropped": self.dropped_count,
+            "merged": self.merged_count,
+            "avg_block_time": self.total_block_time / self.blocked_count if self.blocked_count > 0 else 0.0,
+            "max_block_time": self.max_block_time,
+            "running": self.running_count,
+            "sessions": len(self.sessions),
+            "max_concurrency": self.max_concurrency,
+            "handled": self.handled_count,
+            "failed": self.failed_count,
+            "avg_lag": self.total_lag / self.handled_count if self.handled_count > 0 else 0.0,
+            "max_lag": self.max_lag,
+            "last_lag": self.last_lag,
+        }
+
     async def handle_message(self,msg:AgentMsg) -> Any:
         if self.handler is None:
             return None
 
-        resp_msg = await self.handler(msg)
+        bus_token = _delivering_bus.set(self.owner_bus)
+        try:
+            resp_msg = await self.handler(msg)
+        finally:
+            _delivering_bus.reset(bus_token)
         if self.enable_defualt_proc:
             if resp_msg is not None:
                 if resp_msg.msg_type == AgentMsgType.TYPE_GROUPMSG:
@@ -39,12 +202,26 @@ class AIBus:
             cls._instance = AIBus()
         return cls._instance
 
-    def __init__(self) -> None:
+    @classmethod
+    def get_current_bus(cls) -> 'AIBus':
+        """ the bus which delivered the msg the calling handler works on, the default bus outside of a handler """
+        bus = _delivering_bus.get()
+        if bus is None:
+            return cls.get_default_bus()
+        return bus
+
+    def __init__(self,send_timeout:float=SEND_MESSAGE_TIMEOUT,post_timeout:float=POST_MESSAGE_TIMEOUT) -> None:
         self.handlers:Dict[AIBusHandler] = {}
         self.unhandle_handler:Coroutine = None
+        self.send_timeout = send_timeout
+        self.post_timeout = post_timeout
+        self.orphan_resp_count = 0
+        # msg_id -> the sender's callback for the resp tokens, while the resp is generated.
+        # a None token means the text so far wasn't the resp (a step of a tool calling turn), the resp starts over
+        self.stream_listeners : Dict[str,Callable[[str],Awaitable]] = {}
 
 
-    async def post_message(self,msg:AgentMsg,target_id = None,use_unhandle=True) -> bool:
+    async def post_message(self,msg:AgentMsg,target_id = None,use_unhandle=True,timeout:float=None) -> bool:
         if target_id is None:
             target_id =msg.target
 
@@ -53,26 +230,36 @@ class AIBus:
         handler = self.handlers.get(target_id)
         if handler:
             if msg.rely_msg_id is not None:
-                handler.results[msg.rely_msg_id] = msg
+                resp_future = handler.pending_resps.pop(msg.rely_msg_id,None)
+                if resp_future is None or resp_future.done():
+                    self.orphan_resp_count += 1
+                    logger.warning(f"drop resp {msg.msg_id} to {target_id}, no one is waiting for {msg.rely_msg_id}")
+                    return None
+                resp_future.set_result(msg)
                 return None
 
-            handler.queue.put_nowait(msg)
-            self.start_process(target_id)
-            return True
+            if timeout is None:
+                timeout = self.post_timeout
+            return await handler.put(msg,timeout)
 
         if use_unhandle:
             if self.unhandle_handler is not None:
                 if await self.unhandle_handler(self,target_id):
-                    return await self.post_message(msg,target_id,False)
+                    return await self.post_message(msg,target_id,False,timeout)
 
-        logger.warn(f"post message to {msg.target} failed!,target not found")
+        logger.warning(f"post message to {msg.target} failed!,target not found")
         return False
 
     async def resp_message(self,org_msg_id:str,resp:AgentMsg) -> None:
         assert resp.rely_msg_id == org_msg_id
         return await self.post_message(resp)
 
-    async def send_message(self,msg:AgentMsg,target_id = None, real_sender=None) -> AgentMsg:
+    def get_stream_listener(self,msg_id:str) -> Optional[Callable[[str],Awaitable]]:
+        """ the callback which wants the tokens of the resp of msg_id as they are generated, None if no one does """
+        return self.stream_listeners.get(msg_id)
+
+    async def send_message(self,msg:AgentMsg,target_id = None, real_sender=None, timeout:float=None,
+                           on_stream:Callable[[str],Awaitable] = None) -> AgentMsg:
         if real_sender is None:
             sender_id = msg.sender.split(".")[0]
         else:
@@ -80,70 +267,51 @@ class AIBus:
             
         sender_handler = self.handlers.get(sender_id) # sender already register on bus
         if sender_handler is None:
-            logger.warn(f"sender {sender_id} not register on AI_BUS!")
+            logger.warning(f"sender {sender_id} not register on AI_BUS!")
             return None
 
-        post_result = await self.post_message(msg,target_id)
-        if post_result is False:
-            return None
+        # wait before post, the resp may arrive before post_message returns
+        resp_future = asyncio.get_running_loop().create_future()
+        sender_handler.pending_resps[msg.msg_id] = resp_future
+        if on_stream is not None:
+            self.stream_listeners[msg.msg_id] = on_stream
+        try:
+            post_result = await self.post_message(msg,target_id)
+            if post_result is False:
+                return None
 
-        retry_times = 0
-        while True:
-            resp : AgentMsg = sender_handler.results.get(msg.msg_id)
-            if resp is not None:
-                msg.resp_msg = resp
-                msg.status = AgentMsgStatus.RESPONSED
-                del sender_handler.results[msg.msg_id]
-                return resp
-
-            await asyncio.sleep(0.2)
-            retry_times += 1
-            if retry_times > 5*240: # default timeout is 240 sec
+            if timeout is None:
+                timeout = self.send_timeout
+            try:
+                resp : AgentMsg = await asyncio.wait_for(resp_future,timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"wait resp of {msg.msg_id} timeout after {timeout}s")
                 msg.status = AgentMsgStatus.ERROR
                 return None
 
-        return None
+            msg.resp_msg = resp
+            msg.status = AgentMsgStatus.RESPONSED
+            return resp
+        finally:
+            if sender_handler.pending_resps.get(msg.msg_id) is resp_future:
+                del sender_handler.pending_resps[msg.msg_id]
+            self.stream_listeners.pop(msg.msg_id,None)
 
     def register_unhandle_message_handler(self,handler:Any) -> Queue:
         self.unhandle_handler = handler
 
     # means sub
-    def register_message_handler(self,handler_name:str,handler:Any) -> Queue:
-        handler_node =  AIBusHandler(handler,self)
-        if self.handlers.get(handler_name) is not None:
-            logger.warn(f"handler {handler_name} already register on AI_BUS!")
+    def register_message_handler(self,handler_name:str,handler:Any,max_concurrency:int=HANDLER_MAX_CONCURRENCY,
+                                 max_queue:int=HANDLER_MAX_QUEUE,overflow_policies:dict=None) -> Queue:
+        handler_node =  AIBusHandler(handler,self,max_concurrency=max_concurrency,max_queue=max_queue,overflow_policies=overflow_policies)
+        old_handler = self.handlers.get(handler_name)
+        if old_handler is not None:
+            logger.warning(f"handler {handler_name} already register on AI_BUS!")
+            # tunnels register again for every msg, the resps their earlier msgs wait for go to the new handler
+            handler_node.pending_resps = old_handler.pending_resps
                         
         self.handlers[handler_name] = handler_node
         return handler_node.queue
 
-    async def process_queue(self, handler:AIBusHandler):
-        while True:
-            # Wait for a message
-            message = await handler.queue.get()
-
-            try:
-                # Try to handle the message
-                await handler.handle_message(message)
-            except Exception as e:
-                # If an error occurs, put the message back into the queue
-                logger.error(f"handle message {message.msg_id} failed! {e}")
-                logger.exception(e)
-                raise e
-                #self.queues[name].put_nowait(message)
-
-        return
-
-    def start_process(self,target_name):
-        handler = self.handlers.get(target_name)
-        if handler is None:
-            logger.error(f"handler {target_name} not found!")
-            return
-
-        if handler.handler is None:
-            return
-
-        if handler.working_task is not None:
-            logger.warn(f"handler {target_name} is already working!")
-            return
-
-        handler.working_task = asyncio.create_task(self.process_queue(handler))
+    def get_metrics(self) -> dict:
+        return {name:handler.get_metrics() for name,handler in self.handlers.items()}
@@ -0,0 +1,72 @@
+import copy
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from ..proto.compute_task import ComputeTaskResult, LLMPrompt
+
+logger = logging.getLogger(__name__)
+
+# Cache of llm completion results for idempotent prompts (triage, knowledge pipeline retries...).
+# The key is a canonical hash of everything which changes the answer: prompt messages, inner functions, model, max_token and resp_mode.
+# Entries expire after ttl seconds, and the least recently used ones are dropped when there are more than max_entries.
+# Only callers which pass use_cache=True to do_llm_completion read or fill it.
+
+class CompletionCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (expire_time, result, latency)
+        self._entries = OrderedDict()
+
+        self.hit_count = 0
+        self.miss_count = 0
+        self.saved_time = 0.0
+
+    @staticmethod
+    def make_key(prompt: LLMPrompt, resp_mode: str, model_name: Optional[str], max_token: int, inner_functions) -> str:
+        canonical = json.dumps({
+            "messages": prompt.to_message_list(),
+            "functions": inner_functions or [],
+            "model": model_name,
+            "max_token": max_token,
+            "resp_mode": resp_mode,
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[ComputeTaskResult]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.miss_count += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hit_count += 1
+        self.saved_time += entry[2]
+        # callers append the returned message to their prompt, never hand out the cached object
+        return copy.deepcopy(entry[1])
+
+    def put(self, key: str, result: ComputeTaskResult, latency: float):
+        self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(result), latency)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_metrics(self) -> dict:
+        total = self.hit_count + self.miss_count
+        return {
+            "hit": self.hit_count,
+            "miss": self.miss_count,
+            "hit_rate": self.hit_count / total if total > 0 else 0,
+            "saved_time": self.saved_time,
+            "entries": len(self._entries),
+        }
@@ -1,16 +1,20 @@
 from abc import ABC, abstractmethod
-import random
-from typing import Optional
+from typing import AsyncIterator, Awaitable, Callable, Optional, List, Union
 import logging
 import asyncio
-import tiktoken
-from asyncio import Queue
+import time
 
 from ..proto.compute_task import *
+from ..proto.tokenizer import num_tokens_from_text
 from ..knowledge import ObjectID
 from ..storage.storage import AIStorage
 
 from .compute_node import ComputeNode
+from .compute_task_queue import ComputeTaskQueue
+from .schedule_policy import SchedulePolicy, EWMALatencyPolicy
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import EmbeddingCache
+from .completion_cache import CompletionCache
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +22,28 @@ logger = logging.getLogger(__name__)
 # to suitable computing nodes, achieving a balance of speed, cost, and power consumption,
 # is the CORE GOAL of the entire computing task schedule system (aios_kernel).
 
+class LLMCompletionStream:
+    # a streamed llm completion: async for the tokens as they are generated, then await result() for the whole result
+    def __init__(self, kernel: 'ComputeKernel', task: ComputeTask, timeout: float) -> None:
+        self.kernel = kernel
+        self.task = task
+        self.timeout = timeout
+        self.begin = time.monotonic()
+        self.first_token_time : Optional[float] = None
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async for token in self.task.iter_tokens(self._remain()):
+            if self.first_token_time is None:
+                self.first_token_time = time.monotonic() - self.begin
+            yield token
+
+    def _remain(self) -> float:
+        return max(self.timeout - (time.monotonic() - self.begin), 0)
+
+    async def result(self) -> ComputeTaskResult:
+        return await self.kernel._wait_task(self.task, self._remain())
+
+
 class ComputeKernel:
     _instance = None
     @classmethod
@@ -28,9 +54,26 @@ class ComputeKernel:
 
     def __init__(self) -> None:
         self.is_start = False
-        self.task_queue = Queue()
+        self.task_queue = ComputeTaskQueue()
         self.is_start = False
         self.compute_nodes = {}
+        self.schedule_policy : SchedulePolicy = EWMALatencyPolicy()
+        # (task_type, model_name, is_batch) -> nodes support it, rebuilt when nodes are added
+        self._support_nodes_index = {}
+        self.embedding_batcher = EmbeddingBatcher(self)
+        self.embedding_cache : EmbeddingCache = None
+        self.completion_cache = CompletionCache()
+
+    def set_schedule_policy(self, policy: SchedulePolicy):
+        self.schedule_policy = policy
+
+    def set_embedding_cache(self, cache: Optional[EmbeddingCache]):
+        self.embedding_cache = cache
+
+    def set_embedding_batch(self, window: float, max_batch_size: int):
+        # window <= 0 sends each do_text_embedding as its own task
+        self.embedding_batcher.window = window
+        self.embedding_batcher.max_batch_size = max_batch_size
 
     def run(self, task: ComputeTask) -> None:
         # check there is compute node can support this task
@@ -51,41 +94,36 @@ class ComputeKernel:
         async def _run_task_loop():
             while True:
                 task = await self.task_queue.get()
+                if task.is_cancelled:
+                    continue
                 logger.info(f"compute_kernel get task: {task.display()}")
                 c_node: ComputeNode = self._schedule(task)
                 if c_node:
-                    await c_node.push_task(task)
+                    await c_node.push_task(task, task.priority.value)
 
             logger.warn("compute_kernel is stoped!")
 
         asyncio.create_task(_run_task_loop())
 
-    def _schedule(self, task) -> ComputeNode:
-        # find all the node which supports this task
-        support_nodes = []
-        total_weights = 0
+    def _get_support_nodes(self, task: ComputeTask) -> List[ComputeNode]:
+        is_batch = isinstance(task.params.get("input"), list)
+        index_key = (task.task_type, task.params.get("model_name"), is_batch)
+        support_nodes = self._support_nodes_index.get(index_key)
+        if support_nodes is None:
+            support_nodes = [node for node in self.compute_nodes.values()
+                             if node.is_support(task) and (not is_batch or node.is_support_batch(task))]
+            self._support_nodes_index[index_key] = support_nodes
 
-        for node in self.compute_nodes.values():
-            if node.is_support(task) is True:
-                support_nodes.append({
-                    "pos": total_weights,
-                    "node": node
-                })
-                total_weights += node.weight()
+        return [node for node in support_nodes if node.enable]
 
+    def _schedule(self, task) -> ComputeNode:
+        # find all the node which supports this task
+        support_nodes = self._get_support_nodes(task)
         if len(support_nodes) < 1:
             logger.warning(f"task {task.display()} is not support by any compute node")
             return None
 
-        # hit a random node with weight
-        hit_pos = random.randint(0, total_weights - 1)
-        for i in range(min(len(support_nodes) - 1, hit_pos), -1, -1):
-            if support_nodes[i]["pos"] <= hit_pos:
-                return support_nodes[i]["node"]
-
-        logger.warning(
-            f"task {task.display()} is not support by any compute node")
-        return None
+        return self.schedule_policy.select(task, support_nodes)
 
     def add_compute_node(self, node: ComputeNode):
         if self.compute_nodes.get(node.node_id) is not None:
@@ -93,6 +131,7 @@ class ComputeKernel:
                 f"compute_node {node.display()} already in compute_kernel")
             return
         self.compute_nodes[node.node_id] = node
+        self._support_nodes_index = {}
         logger.info(f"add compute_node {node.display()} to compute_kernel")
 
     def disable_compute_node(self, node_id: str):
@@ -105,75 +144,112 @@ class ComputeKernel:
     def is_task_support(self, task: ComputeTask) -> bool:
         return True
 
-    @staticmethod
-    def llm_num_tokens_from_text(text:str,model:str = None) -> int:
-        if model is None:
-            model = "gpt-4-turbo-preview"
+    def is_batch_embedding_support(self, model_name: Optional[str] = None) -> bool:
+        task = ComputeTask()
+        task.set_text_embedding_params([], model_name)
+        return len(self._get_support_nodes(task)) > 0
 
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            logger.debug("Warning: model not found. Using cl100k_base encoding.")
-            encoding = tiktoken.get_encoding("cl100k_base")
+    def get_queue_depths(self) -> dict:
+        result = {"kernel": self.task_queue.get_depths()}
+        for node in self.compute_nodes.values():
+            result[node.node_id] = node.get_capacity().get("queue_depths")
+        return result
 
-        token_count = len(encoding.encode(text))
-        return token_count
+    @staticmethod
+    def llm_num_tokens_from_text(text:str,model:str = None) -> int:
+        return num_tokens_from_text(text,model)
 
     @staticmethod
     def llm_num_tokens(prompt: LLMPrompt, model_name: str = None) -> int:
-        return ComputeKernel.llm_num_tokens_from_text(prompt.as_str(), model_name)
+        return prompt.get_token_count(model_name)
 
 
     # friendly interface for use:
-    def llm_completion(self, prompt: LLMPrompt, resp_mode:str="text",model_name: Optional[str] = None, max_token: int = 0,inner_functions = None):
+    def llm_completion(self, prompt: LLMPrompt, resp_mode:str="text",model_name: Optional[str] = None, max_token: int = 0,inner_functions = None,
+                       priority: ComputeTaskPriority = ComputeTaskPriority.INTERACTIVE, stream: bool = False):
         # craete a llm_work_task ,push on queue's end
         # then task_schedule would run this task.(might schedule some work_task to another host)
         task_req = ComputeTask()
         task_req.set_llm_params(prompt,resp_mode,model_name, max_token,inner_functions)
+        task_req.priority = priority
+        if stream:
+            task_req.enable_stream()
         self.run(task_req)
         return task_req
 
-    async def _wait_task(self,task_req:ComputeTask, timeout=60)->ComputeTaskResult:
-        async def check_timer():
-            check_times = 0
-            while True:
-                if task_req.state == ComputeTaskState.DONE:
-                    break
-
-                if task_req.state == ComputeTaskState.ERROR:
-                    break
-
-                if timeout is not None and check_times >= timeout*2:
-                    task_req.state = ComputeTaskState.ERROR
-                    break
+    def llm_completion_stream(self, prompt: LLMPrompt, resp_mode:str="text", mode_name: Optional[str]=None, max_token:int=0, inner_functions=None, timeout=60,
+                              priority: ComputeTaskPriority = ComputeTaskPriority.INTERACTIVE) -> LLMCompletionStream:
+        task_req = self.llm_completion(prompt, resp_mode, mode_name, max_token, inner_functions, priority, stream=True)
+        return LLMCompletionStream(self, task_req, timeout)
 
-                await asyncio.sleep(0.5)
-                check_times += 1
-
-        await asyncio.create_task(check_timer())
-        if task_req.result:
+    async def _wait_task(self,task_req:ComputeTask, timeout=60)->ComputeTaskResult:
+        # compute nodes resolve the task's done future, so we return as soon as the node finishes
+        is_done = await task_req.wait_done(timeout)
+        if not is_done:
+            logger.warning(f"wait task {task_req.display()} timeout, cancel it")
+            task_req.cancel("timeout")
+        elif task_req.result:
             return task_req.result
-        else:
-            time_out_result = ComputeTaskResult()
-            time_out_result.result_code = ComputeTaskResultCode.TIMEOUT
-            time_out_result.set_from_task(task_req)
-            task_req.result = time_out_result
-            return time_out_result
 
+        time_out_result = ComputeTaskResult()
+        time_out_result.result_code = ComputeTaskResultCode.TIMEOUT
+        time_out_result.set_from_task(task_req)
+        task_req.result = time_out_result
+        return time_out_result
+
+
+    async def do_llm_completion(self, prompt: LLMPrompt,resp_mode:str="text", mode_name: Optional[str]=None, max_token:int=0, inner_functions=None, timeout=60,
+                                priority: ComputeTaskPriority = ComputeTaskPriority.INTERACTIVE, use_cache: bool = False,
+                                on_token: Callable[[str], Awaitable] = None) -> str:
+        # use_cache is for idempotent prompts only, a chat reply must not be served from the cache
+        if on_token is not None:
+            # on_token gets the tokens as they are generated, the result is the same as without it
+            stream = self.llm_completion_stream(prompt, resp_mode, mode_name, max_token, inner_functions, timeout, priority)
+            async for token in stream:
+                await on_token(token)
+            return await stream.result()
+
+        if not use_cache or self.completion_cache is None:
+            task_req = self.llm_completion(prompt, resp_mode,mode_name, max_token,inner_functions,priority)
+            return await self._wait_task(task_req, timeout)
+
+        cache_key = CompletionCache.make_key(prompt,resp_mode,mode_name,max_token,inner_functions)
+        task_result = self.completion_cache.get(cache_key)
+        if task_result is not None:
+            return task_result
 
-    async def do_llm_completion(self, prompt: LLMPrompt,resp_mode:str="text", mode_name: Optional[str]=None, max_token:int=0, inner_functions=None, timeout=60) -> str:
-        task_req = self.llm_completion(prompt, resp_mode,mode_name, max_token,inner_functions)
-        return await self._wait_task(task_req, timeout)
+        begin = time.monotonic()
+        task_req = self.llm_completion(prompt, resp_mode,mode_name, max_token,inner_functions,priority)
+        task_result = await self._wait_task(task_req, timeout)
+        if task_result.result_code == ComputeTaskResultCode.OK:
+            self.completion_cache.put(cache_key,task_result,time.monotonic() - begin)
+        return task_result
 
 
-    def text_embedding(self,input:str,model_name:Optional[str] = None):
+    def text_embedding(self,input:Union[str,List[str]],model_name:Optional[str] = None,priority: ComputeTaskPriority = ComputeTaskPriority.INTERACTIVE):
         task_req = ComputeTask()
         task_req.set_text_embedding_params(input,model_name)
+        task_req.priority = priority
         self.run(task_req)
         return task_req
 
-    async def do_text_embedding(self,input:str,model_name:Optional[str] = None) -> [float]:
-        task_req = self.text_embedding(input,model_name)
+    async def do_text_embedding(self,input:str,model_name:Optional[str] = None,priority: ComputeTaskPriority = ComputeTaskPriority.INTERACTIVE) -> [float]:
+        if self.embedding_cache is None:
+            return await self._compute_text_embedding(input,model_name,priority)
+
+        vector = await self.embedding_cache.get(model_name,input)
+        if vector is not None:
+            return vector
+        vector = await self._compute_text_embedding(input,model_name,priority)
+        if vector is not None:
+            await self.embedding_cache.put(model_name,input,vector)
+        return vector
+
+    async def _compute_text_embedding(self,input:str,model_name:Optional[str],priority: ComputeTaskPriority) -> [float]:
+        if self.embedding_batcher.window > 0:
+            return await self.embedding_batcher.embed(input,model_name,priority)
+
+        task_req = self.text_embedding(input,model_name,priority)
         task_result = await self._wait_task(task_req)
 
         if task_req.state == ComputeTaskState.DONE:
@@ -182,14 +258,15 @@ class ComputeKernel:
             logging.warning(f"do_text_embedding error: {task_req.error_str},input: {input}")
         return None
 
-    def image_embedding(self,input:ObjectID,model_name:Optional[str] = None):
+    def image_embedding(self,input:ObjectID,model_name:Optional[str] = None,priority: ComputeTaskPriority = ComputeTaskPriority.INTERACTIVE):
         task_req = ComputeTask()
         task_req.set_image_embedding_params(input,model_name)
+        task_req.priority = priority
         self.run(task_req)
         return task_req
 
-    async def do_image_embedding(self,input:ObjectID,model_name:Optional[str] = None) -> [float]:
-        task_req = self.image_embedding(input,model_name)
+    async def do_image_embedding(self,input:ObjectID,model_name:Optional[str] = None,priority: ComputeTaskPriority = ComputeTaskPriority.INTERACTIVE) -> [float]:
+        task_req = self.image_embedding(input,model_name,priority)
         task_result = await self._wait_task(task_req)
 
         if task_req.state == ComputeTaskState.DONE:
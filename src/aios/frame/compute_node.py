@@ -1,14 +1,67 @@
 from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import time
 
-from ..proto.compute_task import ComputeTask, ComputeTaskType
+from ..proto.compute_task import ComputeTask, ComputeTaskType, ComputeTaskState
+
+logger = logging.getLogger(__name__)
+
+class ComputeNodeStats:
+    # smoothing factor of the latency moving average, bigger value follows recent tasks faster
+    EWMA_ALPHA = 0.3
+
+    def __init__(self) -> None:
+        self.total_tasks = 0
+        self.error_tasks = 0
+        self.ewma_latency : float = None
+        self.model_ewma_latency = {}
+
+    def on_task_done(self, model_name: str, latency: float, is_error: bool):
+        self.total_tasks += 1
+        if is_error:
+            self.error_tasks += 1
+        self.ewma_latency = self._update_ewma(self.ewma_latency, latency)
+        self.model_ewma_latency[model_name] = self._update_ewma(self.model_ewma_latency.get(model_name), latency)
+
+    def get_latency(self, model_name: str = None) -> float:
+        # None means there is no sample yet
+        latency = self.model_ewma_latency.get(model_name)
+        if latency is None:
+            return self.ewma_latency
+        return latency
+
+    @classmethod
+    def _update_ewma(cls, current: float, sample: float) -> float:
+        if current is None:
+            return sample
+        return cls.EWMA_ALPHA * sample + (1 - cls.EWMA_ALPHA) * current
 
 class ComputeNode(ABC):
     def __init__(self) -> None:
         self.node_id = "default"
         self.enable = True
 
+        # how many tasks this node runs at the same time, and the limit for some models
+        self.max_workers = 1
+        self.model_max_workers = {}
+        self.in_flight = 0
+        self.model_in_flight = {}
+        self._model_semaphores = {}
+        self.stats = ComputeNodeStats()
+
+    def set_parallelism(self, max_workers: int, model_max_workers: dict = None):
+        # must be called before start(), workers are created when the node starts
+        self.max_workers = max(1, int(max_workers))
+        self.model_max_workers = {}
+        self._model_semaphores = {}
+        if model_max_workers:
+            for model_name, limit in model_max_workers.items():
+                self.model_max_workers[model_name] = max(1, int(limit))
+
     @abstractmethod
-    async def push_task(self, task: ComputeTask, proiority: int = 0):
+    async def push_task(self, task: ComputeTask, proiority: int = None):
         pass
 
     @abstractmethod
@@ -23,14 +76,35 @@ class ComputeNode(ABC):
     def display(self) -> str:
         pass
 
-    @abstractmethod
-    def get_capacity(self):
-        pass
+    def get_capacity(self) -> dict:
+        capacity = {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "pending": self.get_pending_count(),
+            "models": dict(self.model_in_flight),
+        }
+        task_queue = getattr(self, "task_queue", None)
+        if hasattr(task_queue, "get_depths"):
+            capacity["queue_depths"] = task_queue.get_depths()
+        return capacity
+
+    def get_outstanding_count(self) -> int:
+        return self.in_flight + self.get_pending_count()
+
+    def get_pending_count(self) -> int:
+        task_queue = getattr(self, "task_queue", None)
+        if task_queue is None:
+            return 0
+        return task_queue.qsize()
 
     @abstractmethod
     def is_support(self, task: ComputeTask) -> bool:
         pass
 
+    def is_support_batch(self, task: ComputeTask) -> bool:
+        # True if the node can run a TEXT_EMBEDDING task whose input is a list of strings
+        return False
+
     @abstractmethod
     def is_local(self) -> bool:
         pass
@@ -45,6 +119,49 @@ class ComputeNode(ABC):
     def get_fee_type(self) -> str:
         return "free"
 
+    @asynccontextmanager
+    async def task_slot(self, task: ComputeTask):
+        # hold one worker slot of the task's model while the task is running
+        model_name = task.params.get("model_name")
+        semaphore = self._model_semaphores.get(model_name)
+        if semaphore is None and model_name in self.model_max_workers:
+            semaphore = asyncio.Semaphore(self.model_max_workers[model_name])
+            self._model_semaphores[model_name] = semaphore
+
+        if semaphore is not None:
+            await semaphore.acquire()
+        self.in_flight += 1
+        self.model_in_flight[model_name] = self.model_in_flight.get(model_name, 0) + 1
+        begin_time = time.monotonic()
+        # tasks cancelled while waiting for the slot never run, they say nothing about the latency
+        is_skipped = task.is_cancelled
+        try:
+            yield
+        finally:
+            if not is_skipped:
+                self.stats.on_task_done(model_name, time.monotonic() - begin_time, task.state == ComputeTaskState.ERROR)
+            self.in_flight -= 1
+            self.model_in_flight[model_name] -= 1
+            if self.model_in_flight[model_name] == 0:
+                del self.model_in_flight[model_name]
+            if semaphore is not None:
+                semaphore.release()
+
+    async def run_cancellable(self, task: ComputeTask, coro):
+        # run coro as the runner of task, so ComputeTask.cancel() can stop it on timeout.
+        # return None if the task was cancelled, exceptions raised by coro are re-raised.
+        runner = asyncio.create_task(coro)
+        task.bind_runner(runner)
+        try:
+            await asyncio.wait([runner])
+        finally:
+            task.bind_runner(None)
+
+        if runner.cancelled():
+            logger.info(f"{self.display()} task {task.task_id} cancelled")
+            return None
+        return runner.result()
+
 class LocalComputeNode(ComputeNode):
     def display(self) -> str:
         return super().display()
@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+import time
+import logging
+
+from ..proto.compute_task import ComputeTask, ComputeTaskPriority
+
+logger = logging.getLogger(__name__)
+
+# Drop-in replacement of asyncio.Queue for ComputeTask: get() returns the task with the highest priority.
+# To avoid starvation, a lower priority task which has waited longer than its max wait goes first.
+
+class ComputeTaskQueue(asyncio.Queue):
+    DEFAULT_MAX_WAIT = {
+        ComputeTaskPriority.INTERACTIVE: None,
+        ComputeTaskPriority.AGENT_BACKGROUND: 20,
+        ComputeTaskPriority.BATCH_INGEST: 60,
+    }
+
+    def __init__(self, maxsize: int = 0, max_wait: dict = None) -> None:
+        self.max_wait = dict(ComputeTaskQueue.DEFAULT_MAX_WAIT)
+        if max_wait:
+            self.max_wait.update(max_wait)
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._queues = {}
+        self.put_count = {}
+        self.get_count = {}
+        self.promote_count = {}
+        for priority in ComputeTaskPriority:
+            self._queues[priority] = deque()
+            self.put_count[priority] = 0
+            self.get_count[priority] = 0
+            self.promote_count[priority] = 0
+
+    def _put(self, task: ComputeTask):
+        self._queues[task.priority].append((time.monotonic(), task))
+        self.put_count[task.priority] += 1
+
+    def _get(self) -> ComputeTask:
+        now = time.monotonic()
+        selected = None
+        for priority in ComputeTaskPriority:
+            queue = self._queues[priority]
+            if len(queue) < 1:
+                continue
+            if selected is None:
+                selected = priority
+                continue
+
+            max_wait = self.max_wait.get(priority)
+            enqueue_time, _ = queue[0]
+            if max_wait is not None and now - enqueue_time >= max_wait:
+                logger.info(f"compute task of {priority} waited {now - enqueue_time:.1f}s, promote it")
+                self.promote_count[priority] += 1
+                selected = priority
+                break
+
+        _, task = self._queues[selected].popleft()
+        self.get_count[selected] += 1
+        return task
+
+    def qsize(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def push(self, task: ComputeTask, priority: int = None):
+        if priority is not None:
+            task.priority = ComputeTaskPriority(priority)
+        self.put_nowait(task)
+
+    def get_depths(self) -> dict:
+        now = time.monotonic()
+        result = {}
+        for priority, queue in self._queues.items():
+            oldest_wait = 0
+            if len(queue) > 0:
+                oldest_wait = now - queue[0][0]
+            result[priority.name.lower()] = {
+                "depth": len(queue),
+                "oldest_wait": oldest_wait,
+                "put": self.put_count[priority],
+                "get": self.get_count[priority],
+                "promoted": self.promote_count[priority],
+            }
+        return result
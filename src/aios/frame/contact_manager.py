@@ -28,7 +28,7 @@ class ContactManager:
         get_parameters = ParameterDefine.create_parameters({"name":"contact name name"})
         gl.register_tool_function(SimpleAIFunction("system.contacts.get",
                                         "get contact info",
-                                        self._get_contact,get_parameters))
+                                        self._get_contact,get_parameters,read_only=True))
 
         # todo: use json to save contact info
         update_parameters = ParameterDefine.create_parameters({"name":"name","contact_info":"A json to descrpit contact"})
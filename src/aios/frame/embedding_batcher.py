@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from ..proto.compute_task import ComputeTaskPriority, ComputeTaskState
+
+logger = logging.getLogger(__name__)
+
+# Gathers text embedding requests of the same model for a short window (or until the batch is full),
+# sends them to the compute node as one multi-input task and fans the vectors back out to each waiter.
+# Identical inputs which are already queued or in flight share one result.
+# Nodes which can't take a list of inputs (ComputeNode.is_support_batch) get one task per input.
+
+class EmbeddingBatcher:
+    def __init__(self, kernel, window: float = 0.01, max_batch_size: int = 64, timeout: float = 60) -> None:
+        self.kernel = kernel
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+
+        # (model_name, priority) -> inputs waiting for the next batch
+        self._pending = {}
+        self._flush_handles = {}
+        # (model_name, input) -> future of the vector, shared by identical requests
+        self._inflight = {}
+
+        self.request_count = 0
+        self.dedup_count = 0
+        self.batch_count = 0
+        self.batched_input_count = 0
+
+    async def embed(self, input: str, model_name: Optional[str] = None,
+                    priority: ComputeTaskPriority = ComputeTaskPriority.INTERACTIVE) -> Optional[List[float]]:
+        self.request_count += 1
+        inflight_key = (model_name, input)
+        future = self._inflight.get(inflight_key)
+        if future is not None:
+            self.dedup_count += 1
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[inflight_key] = future
+
+        group = (model_name, priority)
+        pending = self._pending.setdefault(group, [])
+        pending.append(input)
+        if len(pending) >= self.max_batch_size:
+            self._flush(group)
+        elif len(pending) == 1:
+            self._flush_handles[group] = loop.call_later(self.window, self._flush, group)
+
+        # a cancelled waiter must not cancel the result shared with other waiters
+        return await asyncio.shield(future)
+
+    def _flush(self, group):
+        handle = self._flush_handles.pop(group, None)
+        if handle is not None:
+            handle.cancel()
+        inputs = self._pending.pop(group, None)
+        if inputs:
+            asyncio.create_task(self._run_batch(group, inputs))
+
+    async def _run_batch(self, group, inputs: List[str]):
+        model_name, priority = group
+        try:
+            vectors = await self._embed_inputs(inputs, model_name, priority)
+        except Exception as e:
+            logger.error(f"embedding batch of {len(inputs)} inputs failed: {e}")
+            vectors = [None] * len(inputs)
+
+        for input, vector in zip(inputs, vectors):
+            future = self._inflight.pop((model_name, input), None)
+            if future is not None and not future.done():
+                future.set_result(vector)
+
+    async def _embed_inputs(self, inputs: List[str], model_name: Optional[str], priority: ComputeTaskPriority) -> list:
+        if len(inputs) > 1 and self.kernel.is_batch_embedding_support(model_name):
+            self.batch_count += 1
+            self.batched_input_count += len(inputs)
+            task_req = self.kernel.text_embedding(inputs, model_name, priority)
+            task_result = await self.kernel._wait_task(task_req, self.timeout)
+            if task_req.state == ComputeTaskState.DONE:
+                vectors = task_result.result.get("content")
+                if vectors is not None and len(vectors) == len(inputs):
+                    return vectors
+            logger.warning(f"embedding batch error: {task_req.error_str}, inputs: {len(inputs)}")
+            return [None] * len(inputs)
+
+        return await asyncio.gather(*[self._embed_one(input, model_name, priority) for input in inputs])
+
+    async def _embed_one(self, input: str, model_name: Optional[str], priority: ComputeTaskPriority):
+        task_req = self.kernel.text_embedding(input, model_name, priority)
+        task_result = await self.kernel._wait_task(task_req, self.timeout)
+        if task_req.state == ComputeTaskState.DONE:
+            return task_result.result.get("content")
+        logger.warning(f"do_text_embedding error: {task_req.error_str},input: {input}")
+        return None
+
+    def get_metrics(self) -> dict:
+        return {
+            "requests": self.request_count,
+            "deduped": self.dedup_count,
+            "batches": self.batch_count,
+            "batched_inputs": self.batched_input_count,
+            "pending": sum(len(inputs) for inputs in self._pending.values()),
+            "in_flight": len(self._inflight),
+        }
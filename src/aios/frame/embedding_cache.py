@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+from array import array
+from typing import List, Optional
+
+from ..knowledge.object.hash import HashValue
+from ..storage.sqlite_db import SQLiteDB
+
+logger = logging.getLogger(__name__)
+
+# Disk backed cache of text embeddings, keyed by (model name, sha256 of the utf-8 text).
+# The hash is the same one ChunkID.hash_data uses, so a chunk which is ingested again hits the cache.
+# Vectors are stored as float32 blobs, the least recently used ones are evicted when the cache grows over max_size bytes.
+# A hit doesn't write, its last_access is kept in memory and written with the next put, or every TOUCH_FLUSH_COUNT hits.
+
+TOUCH_FLUSH_COUNT = 256
+
+class EmbeddingCache:
+    def __init__(self, db_file: str, max_size: int = 256 * 1024 * 1024) -> None:
+        db_dir = os.path.dirname(db_file)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        logger.info(f"will init embedding cache, db={db_file}")
+
+        self.db_file = db_file
+        self.max_size = max_size
+        self.hit_count = 0
+        self.miss_count = 0
+        self.evict_count = 0
+        # (model, hash) -> last access time, not written yet
+        self.touches = {}
+
+        self.db = SQLiteDB.open(db_file)
+        self.db.init_schema("EmbeddingCache", self._create_table)
+        self.total_size = self.db.fetchone("SELECT COALESCE(SUM(size), 0) FROM embeddings")[0]
+
+    @staticmethod
+    def _create_table(conn):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY(model, hash)
+            )
+        """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        conn.commit()
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return HashValue.hash_data(text.encode("utf-8")).to_base58()
+
+    async def get(self, model_name: Optional[str], text: str) -> Optional[List[float]]:
+        key = (model_name or "", EmbeddingCache.content_hash(text))
+        row = await self.db.afetchone("SELECT vector FROM embeddings WHERE model = ? AND hash = ?", key)
+        if row is None:
+            self.miss_count += 1
+            return None
+
+        self.hit_count += 1
+        self.touches[key] = time.time()
+        if len(self.touches) >= TOUCH_FLUSH_COUNT:
+            await self.db.run(self._write, None, self._take_touches())
+        return array("f", row[0]).tolist()
+
+    async def put(self, model_name: Optional[str], text: str, vector: List[float]):
+        blob = array("f", vector).tobytes()
+        row = (model_name or "", EmbeddingCache.content_hash(text), blob, len(blob), time.time())
+        # the touches go first, the eviction sees the recent hits
+        await self.db.run(self._write, row, self._take_touches())
+
+    def _take_touches(self) -> list:
+        touches = [(last_access, model, content_hash) for (model, content_hash), last_access in self.touches.items()]
+        self.touches = {}
+        return touches
+
+    def _write(self, conn, row: Optional[tuple], touches: list):
+        # runs on the db thread, one transaction
+        try:
+            if touches:
+                conn.executemany("UPDATE embeddings SET last_access = ? WHERE model = ? AND hash = ?", touches)
+            if row is not None:
+                old_row = conn.execute("SELECT size FROM embeddings WHERE model = ? AND hash = ?", row[:2]).fetchone()
+                conn.execute("INSERT OR REPLACE INTO embeddings (model, hash, vector, size, last_access) VALUES (?, ?, ?, ?, ?)", row)
+                if old_row is not None:
+                    self.total_size -= old_row[0]
+                self.total_size += row[3]
+                if self.total_size > self.max_size:
+                    self._evict(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _evict(self, conn):
+        # drop the least recently used vectors until the cache is back under 90% of max_size
+        target_size = self.max_size * 0.9
+        cursor = conn.execute("SELECT model, hash, size FROM embeddings ORDER BY last_access")
+        evicted = []
+        for model, content_hash, size in cursor:
+            if self.total_size <= target_size:
+                break
+            evicted.append((model, content_hash))
+            self.total_size -= size
+        cursor.close()
+
+        conn.executemany("DELETE FROM embeddings WHERE model = ? AND hash = ?", evicted)
+        self.evict_count += len(evicted)
+        logger.info(f"embedding cache evicted {len(evicted)} vectors, size {self.total_size}")
+
+    def get_metrics(self) -> dict:
+        return {
+            "hit": self.hit_count,
+            "miss": self.miss_count,
+            "evicted": self.evict_count,
+            "size": self.total_size,
+            "max_size": self.max_size,
+        }
+
+    def close(self):
+        if self.touches:
+            self.db.call(self._write, None, self._take_touches())
+        self.db.close()
@@ -1,26 +1,27 @@
 
 import asyncio
-from asyncio import Queue
 import logging
 from abc import abstractmethod
 
 from aios import ComputeTask, ComputeNode,ComputeTaskResult, ComputeTaskResultCode, ComputeTaskState, ComputeTaskType
+from .compute_task_queue import ComputeTaskQueue
 
 logger = logging.getLogger(__name__)
 
 class Queue_ComputeNode(ComputeNode):
-    def __init__(self):
+    def __init__(self, max_workers: int = 1, model_max_workers: dict = None):
         super().__init__()
-        self.task_queue = Queue()
+        self.task_queue = ComputeTaskQueue()
         self.is_start = False
+        self.set_parallelism(max_workers, model_max_workers)
 
     @abstractmethod
     async def execute_task(self, task: ComputeTask)->ComputeTaskResult:
         pass
 
-    async def push_task(self, task: ComputeTask, proiority: int = 0):
+    async def push_task(self, task: ComputeTask, proiority: int = None):
         logger.info(f"{self.display()} push task: {task.display()}")
-        self.task_queue.put_nowait(task)
+        self.task_queue.push(task, proiority)
 
     async def remove_task(self, task_id: str):
         pass
@@ -53,10 +54,16 @@ class Queue_ComputeNode(ComputeNode):
         async def _run_task_loop():
             while True:
                 task = await self.task_queue.get()
-                logger.info(f"openai_node get task: {task.display()}")
-                await self._run_task(task)
-
-        asyncio.create_task(_run_task_loop())
+                if task.is_cancelled:
+                    continue
+                logger.info(f"{self.display()} get task: {task.display()}")
+                async with self.task_slot(task):
+                    if task.is_cancelled:
+                        continue
+                    await self.run_cancellable(task, self._run_task(task))
+
+        for _ in range(self.max_workers):
+            asyncio.create_task(_run_task_loop())
 
 
     def get_task_state(self, task_id: str):
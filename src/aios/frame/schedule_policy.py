@@ -0,0 +1,71 @@
+from abc import ABC, abstractmethod
+import random
+from typing import List, Optional
+import logging
+
+from ..proto.compute_task import ComputeTask
+from .compute_node import ComputeNode
+
+logger = logging.getLogger(__name__)
+
+# A schedule policy picks one node from the nodes which support the task.
+# Nodes report their load through get_capacity() and their latency through ComputeNode.stats,
+# the policies below only read them, so a policy can be changed at any time.
+
+class SchedulePolicy(ABC):
+    @abstractmethod
+    def select(self, task: ComputeTask, nodes: List[ComputeNode]) -> Optional[ComputeNode]:
+        pass
+
+    @staticmethod
+    def _cost_order(node: ComputeNode):
+        # on the same load, local nodes first, then free nodes
+        return (0 if node.is_local() else 1, 0 if node.get_fee_type() == "free" else 1)
+
+    @staticmethod
+    def _load(node: ComputeNode) -> float:
+        return node.get_outstanding_count() / max(1, node.max_workers)
+
+
+class WeightedRandomPolicy(SchedulePolicy):
+    # hit a random node with ComputeNode.weight(), ignore the load of nodes
+    def select(self, task: ComputeTask, nodes: List[ComputeNode]) -> Optional[ComputeNode]:
+        if len(nodes) < 1:
+            return None
+
+        weights = [node.weight() for node in nodes]
+        return random.choices(nodes, weights=weights)[0]
+
+
+class LeastOutstandingPolicy(SchedulePolicy):
+    # pick the node with the least queued and running tasks for each worker
+    def select(self, task: ComputeTask, nodes: List[ComputeNode]) -> Optional[ComputeNode]:
+        if len(nodes) < 1:
+            return None
+
+        return min(nodes, key=lambda node: (self._load(node), self._cost_order(node), -node.weight()))
+
+
+class EWMALatencyPolicy(SchedulePolicy):
+    # pick the node which is expected to finish the task first:
+    # (outstanding tasks + this task) / workers * moving average of the task latency.
+    # nodes without latency samples are expected to be as fast as the fastest known node,
+    # so new nodes get traffic until they report their own latency.
+    def select(self, task: ComputeTask, nodes: List[ComputeNode]) -> Optional[ComputeNode]:
+        if len(nodes) < 1:
+            return None
+
+        model_name = task.params.get("model_name")
+        latencies = {}
+        for node in nodes:
+            latencies[node] = node.stats.get_latency(model_name)
+        known_latencies = [latency for latency in latencies.values() if latency is not None]
+        default_latency = min(known_latencies) if len(known_latencies) > 0 else 1.0
+
+        def expected_latency(node: ComputeNode) -> float:
+            latency = latencies[node]
+            if latency is None:
+                latency = default_latency
+            return (node.get_outstanding_count() + 1) / max(1, node.max_workers) * latency
+
+        return min(nodes, key=lambda node: (expected_latency(node), self._cost_order(node), -node.weight()))
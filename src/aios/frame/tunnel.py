@@ -1,12 +1,87 @@
 from abc import ABC, abstractmethod
 import logging
-from typing import Coroutine
+import time
+from typing import Any, Awaitable, Callable, Coroutine, Optional
 
 from ..proto.agent_msg import AgentMsg
 from .bus import AIBus
 
 logger = logging.getLogger(__name__)
 
+# chat apps rate limit message edits, a streamed reply is edited at most once in this many seconds
+STREAM_EDIT_INTERVAL = 1.0
+
+class StreamingReply:
+    # A reply which the user sees while the llm generates it: sent with the first tokens, then edited
+    # with the text so far (throttled), and edited to the final text by finish().
+    # send_func(text) sends a message and returns its handle, edit_func(handle,text) changes it,
+    # delete_func(handle) removes it when the tunnel sends the reply another way.
+    def __init__(self, send_func:Callable[[str],Awaitable[Any]], edit_func:Callable[[Any,str],Awaitable],
+                 delete_func:Callable[[Any],Awaitable] = None, edit_interval:float = STREAM_EDIT_INTERVAL) -> None:
+        self.send_func = send_func
+        self.edit_func = edit_func
+        self.delete_func = delete_func
+        self.edit_interval = edit_interval
+        self.text = ""
+        self.shown_text = ""
+        self.handle = None
+        self.last_edit_time = 0
+        self.is_failed = False
+
+    async def on_stream(self, token:Optional[str]):
+        if token is None:
+            # the next completion of the turn replaces the text shown so far
+            self.text = ""
+            return
+        self.text += token
+        if self.is_failed or not self.text.strip():
+            return
+        now = time.monotonic()
+        if self.handle is not None and now - self.last_edit_time < self.edit_interval:
+            return
+        await self._show(self.text)
+        self.last_edit_time = now
+
+    async def _show(self, text:str):
+        try:
+            if self.handle is None:
+                self.handle = await self.send_func(text)
+            elif text != self.shown_text:
+                await self.edit_func(self.handle, text)
+            self.shown_text = text
+        except Exception as e:
+            # the final reply is still sent by the tunnel
+            logger.warning(f"show streamed reply failed: {e}")
+            self.is_failed = True
+
+    async def finish(self, text:str) -> bool:
+        """ show the final text, False if the tunnel should send the reply itself (the streamed message is removed then) """
+        if self.handle is None:
+            return False
+        if not text:
+            text = self.text
+        self.is_failed = False
+        await self._show(text)
+        if not self.is_failed:
+            return True
+        # e.g. the edit was rejected, the tunnel sends the reply as a new message instead of a second copy
+        await self.discard()
+        return False
+
+    async def discard(self):
+        """ remove the streamed message when the tunnel sends the reply itself, e.g. a reply which isn't text """
+        if self.handle is None:
+            return
+        handle = self.handle
+        self.handle = None
+        self.shown_text = ""
+        if self.delete_func is None:
+            return
+        try:
+            await self.delete_func(handle)
+        except Exception as e:
+            logger.warning(f"delete streamed reply failed: {e}")
+
 class AgentTunnel(ABC):
     _all_loader = {}
     _all_tunnels = {}
@@ -1,5 +1,5 @@
 from .object import *
-#from .vector import *
+from .vector import *
 from .data import *
 from .store import KnowledgeStore
 from .core_object import *
@@ -1,7 +1,7 @@
 import os
 import hashlib
 import re
-import tiktoken
+from ...proto.tokenizer import get_encoding
 import logging
 from typing import Callable, Iterable, Optional, Tuple, List
 from .chunk_store import ChunkStore
@@ -186,16 +186,22 @@ class ChunkListWriter:
         chunk_overlap: int = 200,
         separators: str = ["\n\n", "\n", " ", ""]
     ) -> ChunkList:
-        enc = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        enc = get_encoding("gpt-3.5-turbo")
+        # split_text and _merge_splits measure the same splits again and again
+        lengths = {}
 
         def length_function(text: str) -> int:
-            return len(
-                enc.encode(
-                    text,
-                    allowed_special=set(),
-                    disallowed_special="all",
+            length = lengths.get(text)
+            if length is None:
+                length = len(
+                    enc.encode(
+                        text,
+                        allowed_special=set(),
+                        disallowed_special="all",
+                    )
                 )
-            )
+                lengths[text] = length
+            return length
 
         text_list = split_text(text, separators, chunk_size, chunk_overlap, length_function)
         chunk_list = []
@@ -1,9 +1,12 @@
 from abc import ABC, abstractmethod
+import asyncio
 import json
 import os
 import uuid
 from typing import List
 
+import numpy as np
+
 from ..proto.ai_function import ParameterDefine, SimpleAIAction, SimpleAIFunction
 from ..agent.llm_context import GlobaToolsLibrary
 from ..storage.objfs import ObjFS
@@ -12,6 +15,19 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# hybrid search reranks limit * SEARCH_CANDIDATE_FACTOR full text matches
+SEARCH_CANDIDATE_FACTOR = 4
+SEARCH_EMBEDDING_MAX_CHARS = 2048
+RRF_K = 60
+
+
+def cosine_similarities(query_vector:List[float],vectors:np.ndarray) -> np.ndarray:
+    """ the cosine of query_vector with every row of vectors, 0 for a zero vector """
+    query_vector = np.asarray(query_vector,dtype=np.float32)
+    norms = np.linalg.norm(vectors,axis=1) * np.linalg.norm(query_vector)
+    dots = vectors @ query_vector
+    return np.divide(dots,norms,out=np.zeros_like(dots),where=norms > 0)
+
 class BaseKnowledgeGraph(ABC):
     _all_knowledge_bases = {}
     _default_kb = None
@@ -48,8 +64,9 @@ class BaseKnowledgeGraph(ABC):
         return self.kb_desc
 
     # 读接口： 查询，浏览
+    # query_type is "text" (full text) or "hybrid" (full text reranked by embedding similarity)
     @abstractmethod
-    async def serach(self,  query: str,query_type:str):
+    async def serach(self,  query: str,query_type:str,limit:int = 8) -> List[dict]:
         pass
 
     @abstractmethod
@@ -109,7 +126,8 @@ All Knowledge Graph APIs return are json format string."""
         async def knowledge_graph_access(parameters):
             kb_id = parameters['kb_id']
             op_name = parameters['op']
-            param = parameters['param']
+            # the function declares op_param, older callers pass param
+            param = parameters.get('op_param', parameters.get('param'))
             
             
             if op_name is None:
@@ -158,21 +176,28 @@ All Knowledge Graph APIs return are json format string."""
                     return "Error! Object ID is not specified"
                 return json.dumps(await kb.get_obj_by_id(obj_id), ensure_ascii=False)
             
+            if op_name == "search":
+                query = param.get("query")
+                if query is None:
+                    logger.error("Query is not specified")
+                    return "Error! Query is not specified"
+                query_type = param.get("type") or "hybrid"
+                limit = int(param.get("limit") or 8)
+                return json.dumps(await kb.serach(query,query_type,limit), ensure_ascii=False)
                
             return "Error! Operation type is not supported"
         
-        # search is not supported currently
-        func_desc = "Read knowledge graph, op_param format is as follows: list:{'path':$path}, read:{'path':$path}, get_obj:{'obj_id':$obj_id}, tree:{'path':$path,'depth':$depth}"
+        func_desc = "Read knowledge graph, op_param format is as follows: list:{'path':$path}, read:{'path':$path}, get_obj:{'obj_id':$obj_id}, tree:{'path':$path,'depth':$depth}, search:{'query':$keywords,'limit':$top_k}. search returns the best matching objects with their paths and a snippet, use it before walking the tree"
         parameters = ParameterDefine.create_parameters({
             "kb_id": "Knowledge Base ID",
-            "op": "Operation Type,could be [list, read, get_obj]",
+            "op": "Operation Type,could be [list, read, get_obj, tree, search]",
             "op_param": "Operation Param, must be a json string"
         })
 
         knowledge_graph_access_func = SimpleAIFunction("knowledge_base.knowledge_graph_read",
                                                         func_desc,
                                                         knowledge_graph_access,
-                                                        parameters)
+                                                        parameters,read_only=True)
         GlobaToolsLibrary.get_instance().register_tool_function(knowledge_graph_access_func)
 
         async def knwoledge_graph_update(parameters):
@@ -208,7 +233,7 @@ All Knowledge Graph APIs return are json format string."""
                     result["result"] = "Error! Object content is not specified"
                     return json.dumps(result, ensure_ascii=False)
                 
-                objid = uuid.uuid4()
+                objid = str(uuid.uuid4())
                 objname = os.path.basename(write_path)
                 paths = []
                 paths.append(write_path)
@@ -325,8 +350,44 @@ class ObjFSKnowledgeGrpah(BaseKnowledgeGraph):
         self.db_path = db_path
         self.obj_storage : ObjFS = ObjFS(db_path)
     
-    async def serach(self,  query: str,query_type:str):
-        pass
+    async def serach(self,  query: str,query_type:str = "hybrid",limit:int = 8) -> List[dict]:
+        if query_type != "hybrid":
+            return self.obj_storage.search(query,limit)
+
+        # rerank a larger full text candidate set by embedding similarity, the two rankings are fused by RRF
+        candidates = self.obj_storage.search(query,limit * SEARCH_CANDIDATE_FACTOR)
+        if len(candidates) <= 1:
+            return candidates
+        # compute_kernel imports the knowledge package, import it here to avoid the cycle
+        from ..frame.compute_kernel import ComputeKernel
+        kernel = ComputeKernel.get_instance()
+        contents = self.obj_storage.get_contents([candidate["obj_id"] for candidate in candidates])
+        texts = [f"{candidate['name']}\n{contents.get(candidate['obj_id']) or ''}"[:SEARCH_EMBEDDING_MAX_CHARS] for candidate in candidates]
+        # the query and every candidate at once, the kernel batches them into as few node requests as it can
+        vectors = await asyncio.gather(*[kernel.do_text_embedding(text) for text in [query] + texts])
+        query_vector = vectors[0]
+        if query_vector is None:
+            return candidates[:limit]
+
+        similarities = np.full(len(candidates),-1.0,dtype=np.float32)
+        embedded = [i for i,vector in enumerate(vectors[1:]) if vector is not None and len(vector) == len(query_vector)]
+        if embedded:
+            similarities[embedded] = cosine_similarities(query_vector,np.array([vectors[i + 1] for i in embedded],dtype=np.float32))
+
+        semantic_ranks = np.argsort(-similarities,kind="stable").tolist()
+        fused = [0.0] * len(candidates)
+        for rank,index in enumerate(semantic_ranks):
+            fused[index] += 1.0 / (RRF_K + rank + 1)
+        for rank in range(len(candidates)):
+            fused[rank] += 1.0 / (RRF_K + rank + 1)
+
+        order = sorted(range(len(candidates)),key=lambda i: fused[i],reverse=True)
+        result = []
+        for index in order[:limit]:
+            candidate = dict(candidates[index])
+            candidate["score"] = fused[index]
+            result.append(candidate)
+        return result
 
     def list_source(self):
         pass
@@ -344,7 +405,7 @@ class ObjFSKnowledgeGrpah(BaseKnowledgeGraph):
         return self.obj_storage.tree(base_path,depth)
     
     async def add_obj(self,obj_id,obj_name,obj_content,paths)->bool:
-        self.obj_storage.add_obj(obj_id,obj_name,obj_content,paths)
+        return self.obj_storage.add_obj(obj_id,obj_name,obj_content,paths)
 
     #todo 更新默认是做dict的merge
     async def update_obj(self, obj_id, new_content)->bool:
@@ -1,10 +1,12 @@
 import os
 import json
 import logging
+from typing import Optional
 
 from .object import ObjectStore, ObjectRelationStore, ObjectID, ObjectType, KnowledgeObject
 from .core_object import DocumentObject, ImageObject, VideoObject, RichTextObject, EmailObject
 from .data import ChunkStore, ChunkTracker, ChunkListWriter, ChunkReader
+from .vector import VectorIndex
 from ..storage.storage import AIStorage
 
 # KnowledgeStore class, which aggregates ChunkStore, ChunkTracker, and ObjectStore, and is a global singleton that makes it easy to use these three built-in store examples
@@ -41,6 +43,10 @@ class KnowledgeStore:
         self.chunk_list_writer = ChunkListWriter(self.chunk_store, self.chunk_tracker)
         self.chunk_reader = ChunkReader(self.chunk_store, self.chunk_tracker)
 
+        # one vector index per embedding model, their vectors don't compare with each other
+        self.vector_dir = os.path.join(root_dir, "vector")
+        self.vector_indexes = {}
+
     
     def get_relation_store(self) -> ObjectRelationStore:
         return self.relation_store
@@ -59,6 +65,35 @@ class KnowledgeStore:
     
     def get_chunk_reader(self) -> ChunkReader:
         return self.chunk_reader
+
+    def get_vector_index(self, model_name: str) -> VectorIndex:
+        index = self.vector_indexes.get(model_name)
+        if index is None:
+            index = VectorIndex.open(os.path.join(self.vector_dir, model_name.replace("/", "_")))
+            self.vector_indexes[model_name] = index
+        return index
+
+    async def add_text_embedding(self, id, text: str, model_name: str = None, meta: dict = None) -> Optional[VectorIndex]:
+        """ embed text and add it to the index of the model, None if no embedding could be computed """
+        # imported here, the compute kernel imports the knowledge package
+        from ..frame.compute_kernel import ComputeKernel
+        vector = await ComputeKernel.get_instance().do_text_embedding(text, model_name)
+        if vector is None:
+            logging.warning(f"add text embedding of {id} failed, no embedding from model {model_name or 'default'}")
+            return None
+        index = self.get_vector_index(model_name or "default")
+        index.add([id], [vector], [meta])
+        return index
+
+    async def add_image_embedding(self, id, image_id: ObjectID, model_name: str = None, meta: dict = None) -> Optional[VectorIndex]:
+        from ..frame.compute_kernel import ComputeKernel
+        vector = await ComputeKernel.get_instance().do_image_embedding(image_id, model_name)
+        if vector is None:
+            logging.warning(f"add image embedding of {id} failed, no embedding from model {model_name or 'default'}")
+            return None
+        index = self.get_vector_index(model_name or "default")
+        index.add([id], [vector], [meta])
+        return index
     
     async def insert_object(self, object: KnowledgeObject):
         self.object_store.put_object(object.calculate_id(), object.encode())
@@ -0,0 +1 @@
+from .vector_index import VectorIndex, VectorSearchResult
@@ -0,0 +1,494 @@
+import os
+import json
+import math
+import logging
+import threading
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from ..object import ObjectID
+from ...storage.sqlite_db import SQLiteDB
+
+logger = logging.getLogger(__name__)
+
+# Local vector index of text/image embeddings, keyed by ObjectID/ChunkID (or any string id).
+# Vectors live in a memory-mapped float32 matrix (vectors.f32), ids and metadata in a sqlite db next to it.
+# Search is exact (a numpy scan of the whole matrix) for small collections and IVF for large ones:
+# a k-means coarse quantizer splits the vectors into nlist cells, a query only scans the nprobe cells nearest to it.
+# Deleted rows are masked out until compact() rewrites the files.
+# Training the quantizer takes seconds on large collections, so it runs on a background thread started by the
+# write or query which finds the index stale. Queries keep using the exact scan (or the old cells) until it is done.
+
+VECTOR_CHUNK_ROWS = 65536
+
+
+class VectorSearchResult:
+    def __init__(self, id: str, score: float, meta: Optional[dict]) -> None:
+        self.id = id
+        self.score = score
+        self.meta = meta
+
+    def __repr__(self) -> str:
+        return f"VectorSearchResult({self.id}, {self.score:.4f})"
+
+
+class VectorIndex:
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, root_dir: str, **kwargs) -> 'VectorIndex':
+        """ get the shared index of root_dir, every open needs a close """
+        index_key = os.path.abspath(root_dir)
+        with cls._indexes_lock:
+            index = cls._indexes.get(index_key)
+            if index is None:
+                index = VectorIndex(root_dir, **kwargs)
+                cls._indexes[index_key] = index
+            index.ref_count += 1
+            return index
+
+    def __init__(self, root_dir: str, dim: Optional[int] = None, metric: str = "cosine",
+                 ivf_threshold: int = 50000, nprobe: int = 16) -> None:
+        if not os.path.exists(root_dir):
+            os.makedirs(root_dir)
+        logger.info(f"will init vector index, root_dir={root_dir}")
+
+        self.root_dir = root_dir
+        self.ref_count = 0
+        # collections smaller than ivf_threshold are always scanned exactly
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+
+        self.db = SQLiteDB.open(os.path.join(root_dir, "vector_meta.db"))
+        self.db.init_schema("VectorIndex", VectorIndex._create_tables)
+        info = dict(self.db.fetchall("SELECT key, value FROM vector_info"))
+        self.dim : Optional[int] = int(info["dim"]) if "dim" in info else dim
+        self.metric = info.get("metric", metric)
+        self.trained_count = int(info.get("trained_count", 0))
+
+        self.count = 0
+        self._vectors : Optional[np.memmap] = None
+        self._assign : Optional[np.memmap] = None
+        self._ids : List[Optional[str]] = []
+        self._rows : Dict[str, int] = {}
+        self._metas : List[Optional[dict]] = []
+        self._deleted = np.zeros(0, dtype=np.bool_)
+        # meta key -> value -> rows, for filters
+        self._meta_index : Dict[str, Dict] = {}
+
+        self._centroids : Optional[np.ndarray] = None
+        self._list_rows : Optional[np.ndarray] = None
+        self._list_offsets : Optional[np.ndarray] = None
+        # rows assigned to a cell after the lists were built, always scanned
+        self._pending_rows : List[int] = []
+
+        # guards the rows and files, k-means runs outside of it
+        self._lock = threading.RLock()
+        # one training at a time, build_index() waits for a background one
+        self._train_lock = threading.Lock()
+        self._train_thread : Optional[threading.Thread] = None
+        # rows written while a training runs, they are assigned again with its centroids
+        self._changed_rows : Optional[set] = None
+        # bumped by compact(), a training of the old rows is dropped
+        self._generation = 0
+
+        self._load()
+
+    @staticmethod
+    def _create_tables(conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS vector_info (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS vectors (row INTEGER PRIMARY KEY, id TEXT NOT NULL, deleted INTEGER NOT NULL, meta TEXT)")
+        conn.commit()
+
+    def _load(self):
+        rows = self.db.fetchall("SELECT row, id, deleted, meta FROM vectors ORDER BY row")
+        self.count = len(rows)
+        self._deleted = np.zeros(self.count, dtype=np.bool_)
+        for row, id, deleted, meta_str in rows:
+            meta = json.loads(meta_str) if meta_str else None
+            self._ids.append(id)
+            self._metas.append(meta)
+            if deleted:
+                self._deleted[row] = True
+            else:
+                self._rows[id] = row
+                self._index_meta(row, meta)
+
+        if self.dim is not None:
+            self._open_files(self.count)
+        centroids_file = os.path.join(self.root_dir, "centroids.npy")
+        if self.trained_count > 0 and os.path.exists(centroids_file):
+            self._centroids = np.load(centroids_file)
+            self._build_lists()
+
+    def _open_files(self, min_rows: int):
+        # the files grow by doubling, the memmaps are reopened when they do
+        vectors_file = os.path.join(self.root_dir, "vectors.f32")
+        assign_file = os.path.join(self.root_dir, "ivf_assign.i32")
+        row_size = self.dim * 4
+        capacity = os.path.getsize(vectors_file) // row_size if os.path.exists(vectors_file) else 0
+        if capacity < max(min_rows, 1):
+            capacity = max(min_rows, capacity * 2, 1024)
+            for file_name, size in ((vectors_file, capacity * row_size), (assign_file, capacity * 4)):
+                with open(file_name, "ab") as f:
+                    f.truncate(size)
+
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._assign.flush()
+        self._vectors = np.memmap(vectors_file, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._assign = np.memmap(assign_file, dtype=np.int32, mode="r+", shape=(capacity,))
+
+    def _set_info(self, key: str, value):
+        self.db.execute("INSERT OR REPLACE INTO vector_info (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _index_meta(self, row: int, meta: Optional[dict]):
+        if not meta:
+            return
+        for key, value in meta.items():
+            if isinstance(value, (str, int, float, bool)):
+                self._meta_index.setdefault(key, {}).setdefault(value, set()).add(row)
+
+    def _unindex_meta(self, row: int, meta: Optional[dict]):
+        if not meta:
+            return
+        for key, value in meta.items():
+            if isinstance(value, (str, int, float, bool)):
+                self._meta_index.get(key, {}).get(value, set()).discard(row)
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        if self.metric != "cosine":
+            return vectors
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, ids: List[Union[str, ObjectID]], vectors, metas: Optional[List[Optional[dict]]] = None):
+        """ add or replace vectors, metas are dicts of json values used by search filters """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if len(ids) != len(vectors):
+            raise ValueError(f"{len(ids)} ids for {len(vectors)} vectors")
+        if metas is None:
+            metas = [None] * len(ids)
+
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._set_info("dim", self.dim)
+            self._set_info("metric", self.metric)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"vector dimension {vectors.shape[1]} doesn't match the index dimension {self.dim}")
+        vectors = self._normalize(vectors)
+
+        with self._lock:
+            rows = []
+            db_rows = []
+            for id, meta in zip(ids, metas):
+                id = str(id)
+                row = self._rows.get(id)
+                if row is None:
+                    row = self.count
+                    self.count += 1
+                    self._ids.append(id)
+                    self._metas.append(meta)
+                    self._rows[id] = row
+                else:
+                    # replace in place
+                    self._unindex_meta(row, self._metas[row])
+                    self._metas[row] = meta
+                self._index_meta(row, meta)
+                rows.append(row)
+                db_rows.append((row, id, json.dumps(meta, ensure_ascii=False) if meta else None))
+
+            if len(self._deleted) < self.count:
+                self._deleted = np.concatenate([self._deleted, np.zeros(self.count - len(self._deleted), dtype=np.bool_)])
+            if self._vectors is None or len(self._vectors) < self.count:
+                self._open_files(self.count)
+
+            rows = np.asarray(rows, dtype=np.int64)
+            self._vectors[rows] = vectors
+            self._vectors.flush()
+            if self._centroids is not None:
+                self._assign[rows] = self._nearest_centroids(vectors)
+                self._assign.flush()
+                self._pending_rows.extend(rows.tolist())
+            if self._changed_rows is not None:
+                self._changed_rows.update(rows.tolist())
+
+            self.db.executemany("INSERT OR REPLACE INTO vectors (row, id, deleted, meta) VALUES (?, ?, 0, ?)", db_rows)
+        self._start_training()
+
+    def delete(self, ids: List[Union[str, ObjectID]]) -> int:
+        deleted_rows = []
+        with self._lock:
+            for id in ids:
+                row = self._rows.pop(str(id), None)
+                if row is None:
+                    continue
+                self._deleted[row] = True
+                self._unindex_meta(row, self._metas[row])
+                deleted_rows.append((row,))
+            self.db.executemany("UPDATE vectors SET deleted = 1 WHERE row = ?", deleted_rows)
+        return len(deleted_rows)
+
+    def get(self, id: Union[str, ObjectID]) -> Optional[np.ndarray]:
+        row = self._rows.get(str(id))
+        if row is None:
+            return None
+        return np.array(self._vectors[row])
+
+    def get_meta(self, id: Union[str, ObjectID]) -> Optional[dict]:
+        row = self._rows.get(str(id))
+        if row is None:
+            return None
+        return self._metas[row]
+
+    def _filter_mask(self, filters: Optional[dict]) -> np.ndarray:
+        # rows which are alive and match every filter, a list value matches any of its items
+        mask = ~self._deleted[:self.count]
+        if not filters:
+            return mask
+        for key, value in filters.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            key_mask = np.zeros(self.count, dtype=np.bool_)
+            for item in values:
+                matched_rows = self._meta_index.get(key, {}).get(item)
+                if matched_rows:
+                    key_mask[np.fromiter(matched_rows, dtype=np.int64, count=len(matched_rows))] = True
+            mask &= key_mask
+        return mask
+
+    @staticmethod
+    def _top_k(rows: np.ndarray, scores: np.ndarray, k: int):
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    def _make_results(self, rows: np.ndarray, scores: np.ndarray) -> List[VectorSearchResult]:
+        return [VectorSearchResult(self._ids[row], float(score), self._metas[row]) for row, score in zip(rows.tolist(), scores.tolist())]
+
+    def search(self, vector, k: int = 10, filters: Optional[dict] = None,
+               exact: Optional[bool] = None, nprobe: Optional[int] = None) -> List[VectorSearchResult]:
+        """ the k vectors most similar to vector, best first. exact=None lets the index pick IVF for large collections """
+        if exact is None:
+            exact = len(self._rows) < self.ivf_threshold
+            if not exact:
+                # an index opened from disk may be stale, the query doesn't wait for the training
+                self._start_training()
+        with self._lock:
+            if self.count == 0 or len(self._rows) == 0:
+                return []
+            query = self._normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+            mask = self._filter_mask(filters)
+            if exact or self._centroids is None:
+                return self._search_exact(query, k, mask)
+            return self._search_ivf(query, k, mask, nprobe or self.nprobe)
+
+    def _search_exact(self, query: np.ndarray, k: int, mask: np.ndarray) -> List[VectorSearchResult]:
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for begin in range(0, self.count, VECTOR_CHUNK_ROWS):
+            end = min(begin + VECTOR_CHUNK_ROWS, self.count)
+            chunk_rows = np.flatnonzero(mask[begin:end]) + begin
+            if len(chunk_rows) == 0:
+                continue
+            if len(chunk_rows) == end - begin:
+                scores = self._vectors[begin:end] @ query
+            else:
+                scores = self._vectors[chunk_rows] @ query
+            rows, scores = VectorIndex._top_k(chunk_rows, scores, k)
+            best_rows, best_scores = VectorIndex._top_k(np.concatenate([best_rows, rows]),
+                                                        np.concatenate([best_scores, scores]), k)
+        return self._make_results(best_rows, best_scores)
+
+    def _search_ivf(self, query: np.ndarray, k: int, mask: np.ndarray, nprobe: int) -> List[VectorSearchResult]:
+        cell_scores = self._centroids @ query
+        nprobe = min(nprobe, len(self._centroids))
+        probe_cells = np.argpartition(-cell_scores, nprobe - 1)[:nprobe]
+        candidates = [self._list_rows[self._list_offsets[cell]:self._list_offsets[cell + 1]] for cell in probe_cells]
+        if self._pending_rows:
+            pending = np.asarray(self._pending_rows, dtype=np.int64)
+            candidates.append(pending[np.isin(self._assign[pending], probe_cells)])
+        rows = np.unique(np.concatenate(candidates))
+        rows = rows[mask[rows]]
+        if len(rows) == 0:
+            return []
+        rows, scores = VectorIndex._top_k(rows, self._vectors[rows] @ query, k)
+        return self._make_results(rows, scores)
+
+    def _needs_training(self) -> bool:
+        # (re)train when the collection has grown 4x since the last training
+        return self._centroids is None or len(self._rows) > self.trained_count * 4
+
+    def _nearest_centroids(self, vectors: np.ndarray) -> np.ndarray:
+        return VectorIndex._nearest(vectors, self._centroids)
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        result = np.empty(len(vectors), dtype=np.int32)
+        for begin in range(0, len(vectors), VECTOR_CHUNK_ROWS):
+            chunk = vectors[begin:begin + VECTOR_CHUNK_ROWS]
+            result[begin:begin + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return result
+
+    def _start_training(self):
+        if len(self._rows) < self.ivf_threshold or not self._needs_training():
+            return
+        if self._train_thread is not None and self._train_thread.is_alive():
+            return
+        self._train_thread = threading.Thread(target=self._train_in_background, daemon=True,
+                                              name=f"vector-train-{os.path.basename(self.root_dir)}")
+        self._train_thread.start()
+
+    def _train_in_background(self):
+        try:
+            with self._train_lock:
+                # build_index() may have trained it meanwhile
+                if self._needs_training():
+                    self._train()
+        except Exception as e:
+            logger.error(f"vector index {self.root_dir}: train failed: {e}")
+
+    def build_index(self, nlist: Optional[int] = None, iterations: int = 10, sample_size: int = 65536):
+        """ train the IVF quantizer (spherical k-means on a sample) and assign every vector to its cell """
+        with self._train_lock:
+            self._train(nlist, iterations, sample_size)
+
+    def _train(self, nlist: Optional[int] = None, iterations: int = 10, sample_size: int = 65536):
+        with self._lock:
+            alive_rows = np.flatnonzero(~self._deleted[:self.count])
+            if len(alive_rows) == 0:
+                return
+            if nlist is None:
+                nlist = max(1, int(4 * math.sqrt(len(alive_rows))))
+            nlist = min(nlist, len(alive_rows))
+            logger.info(f"vector index {self.root_dir}: train {nlist} cells on {len(alive_rows)} vectors")
+
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(alive_rows, min(sample_size, len(alive_rows)), replace=False))
+            sample = np.array(self._vectors[sample_rows])
+            # the rows up to count are assigned below without the lock, the ones written meanwhile are recorded
+            train_count = self.count
+            vectors = self._vectors
+            generation = self._generation
+            self._changed_rows = set()
+
+        try:
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+            for i in range(iterations):
+                assign = VectorIndex._nearest(sample, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, sample)
+                counts = np.bincount(assign, minlength=nlist)
+                # an empty cell keeps its old centroid
+                filled = counts > 0
+                sums[filled] /= counts[filled, None]
+                sums[~filled] = centroids[~filled]
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                norms[norms == 0] = 1
+                centroids = (sums / norms).astype(np.float32)
+
+            assign = np.empty(train_count, dtype=np.int32)
+            for begin in range(0, train_count, VECTOR_CHUNK_ROWS):
+                end = min(begin + VECTOR_CHUNK_ROWS, train_count)
+                assign[begin:end] = VectorIndex._nearest(np.asarray(vectors[begin:end]), centroids)
+
+            with self._lock:
+                if generation != self._generation:
+                    logger.info(f"vector index {self.root_dir}: compacted while training, the training is dropped")
+                    return
+                self._assign[:train_count] = assign
+                changed_rows = np.asarray(sorted(self._changed_rows | set(range(train_count, self.count))), dtype=np.int64)
+                if len(changed_rows) > 0:
+                    self._assign[changed_rows] = VectorIndex._nearest(np.asarray(self._vectors[changed_rows]), centroids)
+                self._assign.flush()
+                self._centroids = centroids
+                np.save(os.path.join(self.root_dir, "centroids.npy"), self._centroids)
+                self.trained_count = len(alive_rows)
+                self._set_info("trained_count", self.trained_count)
+                self._build_lists()
+        finally:
+            self._changed_rows = None
+
+    def _build_lists(self):
+        # rows grouped by cell: the rows of cell c are list_rows[list_offsets[c]:list_offsets[c + 1]]
+        assign = np.asarray(self._assign[:self.count])
+        self._list_rows = np.argsort(assign, kind="stable").astype(np.int64)
+        self._list_offsets = np.searchsorted(assign[self._list_rows], np.arange(len(self._centroids) + 1))
+        self._pending_rows = []
+
+    def compact(self):
+        """ drop deleted rows from the files """
+        with self._lock:
+            alive_rows = np.flatnonzero(~self._deleted[:self.count])
+            if len(alive_rows) == self.count:
+                return
+            self._generation += 1
+            vectors = np.array(self._vectors[alive_rows])
+            assign = np.array(self._assign[alive_rows])
+            ids = [self._ids[row] for row in alive_rows.tolist()]
+            metas = [self._metas[row] for row in alive_rows.tolist()]
+
+            self._vectors.flush()
+            self._vectors = None
+            self._assign = None
+            for file_name in ("vectors.f32", "ivf_assign.i32"):
+                os.remove(os.path.join(self.root_dir, file_name))
+            def _rewrite_rows(conn):
+                conn.execute("DELETE FROM vectors")
+                conn.executemany("INSERT INTO vectors (row, id, deleted, meta) VALUES (?, ?, 0, ?)",
+                                 [(row, id, json.dumps(meta, ensure_ascii=False) if meta else None)
+                                  for row, (id, meta) in enumerate(zip(ids, metas))])
+            self.db.batch(_rewrite_rows)
+
+            self.count = len(ids)
+            self._ids = ids
+            self._metas = metas
+            self._rows = {id: row for row, id in enumerate(ids)}
+            self._deleted = np.zeros(self.count, dtype=np.bool_)
+            self._meta_index = {}
+            for row, meta in enumerate(metas):
+                self._index_meta(row, meta)
+            self._open_files(self.count)
+            self._vectors[:self.count] = vectors
+            self._assign[:self.count] = assign
+            self._vectors.flush()
+            self._assign.flush()
+            if self._centroids is not None:
+                self._build_lists()
+
+    def get_metrics(self) -> dict:
+        return {
+            "vectors": len(self._rows),
+            "deleted": int(self._deleted[:self.count].sum()),
+            "dim": self.dim,
+            "cells": 0 if self._centroids is None else len(self._centroids),
+            "pending": len(self._pending_rows),
+        }
+
+    def close(self):
+        """ release this handle, the files are closed with the last one """
+        with VectorIndex._indexes_lock:
+            self.ref_count -= 1
+            if self.ref_count > 0:
+                return
+            index_key = os.path.abspath(self.root_dir)
+            if VectorIndex._indexes.get(index_key) is self:
+                del VectorIndex._indexes[index_key]
+
+        if self._train_thread is not None:
+            self._train_thread.join()
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._assign.flush()
+        self._vectors = None
+        self._assign = None
+        self.db.close()
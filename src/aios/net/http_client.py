@@ -0,0 +1,117 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Shared async http client for compute nodes which talk to http services (local llama, stable diffusion webui, openai rest api).
+# All nodes share one connection pool with keep-alive, so one slow service never blocks the event loop.
+
+class HttpResponse:
+    # the subset of requests.Response used by compute nodes
+    def __init__(self, status_code: int, headers: dict, content: bytes) -> None:
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpStreamResponse:
+    # a response whose body is read as it arrives
+    def __init__(self, resp: aiohttp.ClientResponse) -> None:
+        self.status_code = resp.status
+        self.headers = dict(resp.headers)
+        self._resp = resp
+
+    async def read(self) -> HttpResponse:
+        return HttpResponse(self.status_code, self.headers, await self._resp.read())
+
+    async def iter_lines(self) -> AsyncIterator[str]:
+        async for line in self._resp.content:
+            yield line.decode("utf-8", errors="replace").rstrip("\r\n")
+
+    async def iter_sse_data(self) -> AsyncIterator[str]:
+        # the data of server-sent events, as openai compatible servers stream completions
+        async for line in self.iter_lines():
+            if line.startswith("data:"):
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                yield data
+
+
+class AsyncHttpClient:
+    _instance = None
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = AsyncHttpClient()
+        return cls._instance
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 32, keepalive_timeout: float = 60, timeout: float = 600) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+
+        self._session : aiohttp.ClientSession = None
+        self._session_loop = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        # a session can only be used in the event loop which created it
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.limit,
+                                             limit_per_host=self.limit_per_host,
+                                             keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._session_loop = loop
+        return self._session
+
+    async def request(self, method: str, url: str, json_body=None, headers: dict = None,
+                      timeout: Optional[float] = None, verify_ssl: bool = True) -> HttpResponse:
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        if not verify_ssl:
+            kwargs["ssl"] = False
+
+        async with self.get_session().request(method, url, json=json_body, headers=headers, **kwargs) as resp:
+            content = await resp.read()
+            return HttpResponse(resp.status, dict(resp.headers), content)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, json_body=None, headers: dict = None,
+                     timeout: Optional[float] = None, verify_ssl: bool = True) -> AsyncIterator[HttpStreamResponse]:
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        if not verify_ssl:
+            kwargs["ssl"] = False
+
+        async with self.get_session().request(method, url, json=json_body, headers=headers, **kwargs) as resp:
+            yield HttpStreamResponse(resp)
+
+    async def post(self, url: str, json_body=None, headers: dict = None,
+                   timeout: Optional[float] = None, verify_ssl: bool = True) -> HttpResponse:
+        return await self.request("POST", url, json_body, headers, timeout, verify_ssl)
+
+    async def get(self, url: str, headers: dict = None, timeout: Optional[float] = None, verify_ssl: bool = True) -> HttpResponse:
+        return await self.request("GET", url, None, headers, timeout, verify_ssl)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
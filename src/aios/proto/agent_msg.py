@@ -188,6 +188,9 @@ class AgentMsg:
         if topic:
             self.topic = topic
 
+    def is_text_msg(self) -> bool:
+        return not (self.is_image_msg() or self.is_video_msg() or self.is_audio_msg())
+
     def is_image_msg(self) -> bool:
         if self.body_mime is None:
             return False
@@ -257,6 +260,12 @@ class AgentMsg:
     def get_target(self) -> str:
         return self.target
 
+    def get_session_topic(self) -> str:
+        # a group msg belongs to the session of the group, others to the session of the sender
+        if self.msg_type == AgentMsgType.TYPE_GROUPMSG:
+            return f"{self.target}#{self.topic}"
+        return f"{self.get_sender()}#{self.topic}"
+
     def get_prev_msg_id(self) -> str:
         return self.prev_msg_id
 
@@ -182,6 +182,18 @@ class AIFunction:
     def is_ready_only(self) -> bool:
         pass
 
+    def is_parallel_safe(self) -> bool:
+        """
+        can this function run at the same time as the other calls of one llm turn?
+        """
+        return self.is_ready_only()
+
+    def get_timeout(self) -> float:
+        """
+        seconds one call may take, None for the caller's default
+        """
+        return None
+
 #TODO need to be upgrade
 class ActionNode:
     def __init__(self,name:str,args:List[str]) -> None:
@@ -211,11 +223,14 @@ class ActionNode:
     
 
 class SimpleAIFunction(AIFunction):
-    def __init__(self,func_id:str,description:str,func_handler:Coroutine,parameters:Dict[str,ParameterDefine] = None) -> None:
+    def __init__(self,func_id:str,description:str,func_handler:Coroutine,parameters:Dict[str,ParameterDefine] = None,
+                 read_only:bool = False,timeout:float = None) -> None:
         self.func_id = func_id
         self.description = description
         self.func_handler = func_handler
         self.parameters:Dict[str,ParameterDefine] = parameters
+        self.read_only = read_only
+        self.timeout = timeout
 
     def get_id(self) -> str: 
         return self.func_id
@@ -242,7 +257,10 @@ class SimpleAIFunction(AIFunction):
         return True
     
     def is_ready_only(self) -> bool:
-        return False
+        return self.read_only
+
+    def get_timeout(self) -> float:
+        return self.timeout
 
 class AIAction:
     @abstractmethod
@@ -1,13 +1,15 @@
 # pylint:disable=E0402
+import asyncio
 import copy
 from enum import Enum
 import json
 import shlex
 import uuid
 import time
-from typing import List, Union,Dict
+from typing import AsyncIterator, List, Union,Dict
 from .ai_function import AIFunction,ActionNode
 from .agent_msg import AgentMsg
+from .tokenizer import get_encoding
 from ..knowledge import ObjectID
 from ..storage.storage import AIStorage
 
@@ -30,6 +32,19 @@ class ComputeTaskState(Enum):
     ERROR = 3
     PENDING = 4
 
+class ComputeTaskPriority(Enum):
+    INTERACTIVE = 0 # user is waiting for the result, e.g. reply a chat message
+    AGENT_BACKGROUND = 1 # agent's self thinking, triage / do / check tasks
+    BATCH_INGEST = 2 # knowledge pipeline, embedding of documents
+
+    @classmethod
+    def from_str(cls, priority_str: str) -> 'ComputeTaskPriority':
+        try:
+            return cls[priority_str.upper()]
+        except KeyError:
+            logger.warning(f"unknown compute task priority {priority_str}, use AGENT_BACKGROUND")
+            return cls.AGENT_BACKGROUND
+
 class ComputeTaskType(Enum):
     NONE = "None"
     LLM_COMPLETION = "llm_completion"
@@ -76,6 +91,8 @@ class LLMPrompt:
             self.messages.append({"role":"user","content":prompt_str})
         self.system_message : Dict = None
         self.inner_functions : List[Dict] = []
+        # (encoding name, json of a message) -> token count, so appending a message only encodes the new one
+        self._token_counts : Dict[tuple,int] = {}
 
     def append_system_message(self,content:str):
         if content is None:
@@ -103,6 +120,33 @@ class LLMPrompt:
 
         return result_str
 
+    def get_token_count(self, model_name: str = None) -> int:
+        # the sum of the token counts of each message in as_str(), messages are encoded once and remembered.
+        # messages are plain dicts which callers change in place, so the json of a message is the cache key.
+        encoding = get_encoding(model_name)
+        parts = []
+        if self.system_message:
+            parts.append(self.system_message)
+        if self.messages:
+            parts.extend(self.messages)
+        if self.inner_functions:
+            parts.extend(self.inner_functions)
+
+        total = 0
+        token_counts = {}
+        for part in parts:
+            key = (encoding.name, json.dumps(part, ensure_ascii=False))
+            count = token_counts.get(key)
+            if count is None:
+                count = self._token_counts.get(key)
+            if count is None:
+                count = len(encoding.encode(key[1]))
+            token_counts[key] = count
+            total += count
+        # drop the counts of messages which are no longer in the prompt
+        self._token_counts = token_counts
+        return total
+
     def to_message_list(self):
         result = []
         if self.system_message:
@@ -275,11 +319,102 @@ class ComputeTask:
         self.params: dict = {}
         self.refers: dict = None
         self.pading_data: bytearray = None
+        self.priority = ComputeTaskPriority.INTERACTIVE
 
-        self.state = ComputeTaskState.INIT
+        self._state = ComputeTaskState.INIT
         self.result = None
         self.error_str = None
 
+        # resolved when the task reaches DONE or ERROR, created lazily by the first waiter
+        self._done_future : asyncio.Future = None
+        # the coroutine running this task on a compute node, cancelled by cancel()
+        self._runner : asyncio.Task = None
+        self.is_cancelled = False
+        # tokens of a streamed llm completion, pushed by the compute node, None marks the end
+        self._tokens : asyncio.Queue = None
+        self._token_pushed = False
+
+    @property
+    def state(self) -> ComputeTaskState:
+        return self._state
+
+    @state.setter
+    def state(self, new_state: ComputeTaskState):
+        self._state = new_state
+        if self.is_finished():
+            self._notify_done()
+
+    def is_finished(self) -> bool:
+        return self._state == ComputeTaskState.DONE or self._state == ComputeTaskState.ERROR
+
+    def _notify_done(self):
+        # compute nodes set result fields right after the state without awaiting,
+        # so waiters woken by this future always see the final result.
+        if self._done_future is not None and not self._done_future.done():
+            self._done_future.set_result(self._state)
+        if self._tokens is not None:
+            self._tokens.put_nowait(None)
+
+    async def wait_done(self, timeout: float = None) -> bool:
+        if self.is_finished():
+            return True
+
+        if self._done_future is None:
+            self._done_future = asyncio.get_running_loop().create_future()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(self._done_future), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def enable_stream(self):
+        self.params["stream"] = True
+        self._tokens = asyncio.Queue()
+
+    def is_stream(self) -> bool:
+        return self._tokens is not None
+
+    def push_token(self, token: str):
+        if self._tokens is None or not token or self.is_finished():
+            return
+        self._token_pushed = True
+        self._tokens.put_nowait(token)
+
+    async def iter_tokens(self, timeout: float = None) -> AsyncIterator[str]:
+        # the tokens as the node generates them, until the task is finished or timeout
+        if self._tokens is None:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remain = None if deadline is None else deadline - time.monotonic()
+            if remain is not None and remain <= 0:
+                return
+            try:
+                token = await asyncio.wait_for(self._tokens.get(), remain)
+            except asyncio.TimeoutError:
+                return
+            if token is None:
+                break
+            yield token
+
+        # a node which can't stream gives the whole text at the end
+        if not self._token_pushed and self._state == ComputeTaskState.DONE and self.result is not None and self.result.result_str:
+            yield self.result.result_str
+
+    def bind_runner(self, runner: asyncio.Task):
+        self._runner = runner
+
+    def cancel(self, error_str: str = "cancelled"):
+        if self.is_finished():
+            return
+
+        self.is_cancelled = True
+        self.error_str = error_str
+        if self._runner is not None and not self._runner.done():
+            self._runner.cancel()
+        self.state = ComputeTaskState.ERROR
+
     def set_llm_params(self, prompts, resp_mode,model_name, max_token_size, inner_functions = None, callchain_id=None):
         self.task_type = ComputeTaskType.LLM_COMPLETION
         self.create_time = time.time()
@@ -298,7 +433,7 @@ class ComputeTask:
         if inner_functions is not None:
             self.params["inner_functions"] = inner_functions
 
-    def set_text_embedding_params(self, input: str, model_name=None, callchain_id = None):
+    def set_text_embedding_params(self, input: Union[str, List[str]], model_name=None, callchain_id = None):
         self.task_type = ComputeTaskType.TEXT_EMBEDDING
         self.create_time = time.time()
         self.task_id = uuid.uuid4().hex
@@ -0,0 +1,27 @@
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# tiktoken.encoding_for_model looks the model up and builds the encoder every time it is called,
+# token counting runs several times for each message, so the encoders are memoised here.
+
+DEFAULT_TOKENIZER_MODEL = "gpt-4-turbo-preview"
+
+
+@lru_cache(maxsize=64)
+def get_encoding(model_name: str = None) -> tiktoken.Encoding:
+    if model_name is None:
+        model_name = DEFAULT_TOKENIZER_MODEL
+
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        logger.debug(f"Warning: model {model_name} not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def num_tokens_from_text(text: str, model_name: str = None) -> int:
+    return len(get_encoding(model_name).encode(text))
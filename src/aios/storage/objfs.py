@@ -1,12 +1,13 @@
 from abc import ABC, abstractmethod
-import sqlite3
 from sqlite3 import Error
 from typing import List
 
-import threading
 import time
 import uuid
 import logging
+import re
+
+from .sqlite_db import SQLiteDB
 
 logger = logging.getLogger(__name__)
 
@@ -29,29 +30,17 @@ class ObjFS(ObjFSReader):
     def __init__(self, db_file):
         """ initialize db connection """
         self.db_file = db_file
-        self._get_conn()
-
-    def _get_conn(self):
-        """ get db connection """
-        local = threading.local()
-        if not hasattr(local, 'conn'):
-            local.conn = self._create_connection(self.db_file)
-        return local.conn
-
-    def _create_connection(self, db_file):
-        """ create a database connection to a SQLite database """
-        conn = None
-        try:
-            conn = sqlite3.connect(db_file)
-
-        except Error as e:
-            logger.error("Error occurred while connecting to database: %s", e)
-            return None
-
-        if conn:
-            self._create_table(conn)
-
-        return conn
+        self.db : SQLiteDB = None
+        self.fts_enabled = False
+        self._get_db()
+
+    def _get_db(self) -> SQLiteDB:
+        """ get the shared db of the file """
+        if self.db is None:
+            self.db = SQLiteDB.open(self.db_file)
+            self.db.init_schema("ObjFS", self._create_table)
+            self.fts_enabled = self.db.fetchone("SELECT name FROM sqlite_master WHERE name = 'objects_fts'") is not None
+        return self.db
     
     def _create_table(self, conn):
         try:
@@ -60,19 +49,34 @@ class ObjFS(ObjFSReader):
 
             conn.execute('''CREATE TABLE IF NOT EXISTS paths
                         (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE, obj_id TEXT, FOREIGN KEY(obj_id) REFERENCES objects(id))''')
-
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_paths_obj_id ON paths(obj_id)")
+            conn.commit()
         except Error as e:
             logger.error("Error occurred while creating tables: %s", e)
 
+        self._create_fts_table(conn)
+
+    def _create_fts_table(self, conn):
+        # full text index of name and content, kept in sync by add_obj/update_obj/remove_obj
+        try:
+            is_new = conn.execute("SELECT name FROM sqlite_master WHERE name = 'objects_fts'").fetchone() is None
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS objects_fts USING fts5(obj_id UNINDEXED, name, content)")
+            if is_new:
+                # objects written by older versions
+                conn.execute("INSERT INTO objects_fts (obj_id, name, content) SELECT id, name, content FROM objects")
+            conn.commit()
+        except Error as e:
+            # sqlite built without fts5, search falls back to LIKE
+            logger.warning("Error occurred while creating full text index: %s", e)
+
     def close(self):
-        local = threading.local()
-        if not hasattr(local, 'conn'):
+        if self.db is None:
             return
-        local.conn.close()
+        self.db.close()
+        self.db = None
         
     def add_obj(self,obj_uuid, name, content, paths) -> bool:
-        conn = self._get_conn()
-        c = conn.cursor()
+        db = self._get_db()
         #obj id是guid,由外部生成
 
         # 获取当前时间戳
@@ -81,14 +85,15 @@ class ObjFS(ObjFSReader):
         # 计算内容大小
         content_size = len(content.encode('utf-8'))
         try:
-            # 插入对象
-            c.execute("INSERT INTO objects (id, name, content, created_at, modified_at, size) VALUES (?, ?, ?, ?, ?, ?)", (obj_uuid, name, content, current_time, current_time, content_size))
-
-            # 插入路径
-            for path in paths:
-                c.execute("INSERT OR IGNORE INTO paths (path, obj_id) VALUES (?, ?)", (path, obj_uuid))
-
-            conn.commit()
+            def _add_obj(conn):
+                # 插入对象
+                conn.execute("INSERT INTO objects (id, name, content, created_at, modified_at, size) VALUES (?, ?, ?, ?, ?, ?)", (obj_uuid, name, content, current_time, current_time, content_size))
+                if self.fts_enabled:
+                    conn.execute("INSERT INTO objects_fts (obj_id, name, content) VALUES (?, ?, ?)", (obj_uuid, name, content))
+
+                # 插入路径
+                conn.executemany("INSERT OR IGNORE INTO paths (path, obj_id) VALUES (?, ?)", [(path, obj_uuid) for path in paths])
+            db.batch(_add_obj)
         except Error as e:
             logger.warning("Error occurred while adding object: %s", e)
             return False
@@ -105,8 +110,6 @@ class ObjFS(ObjFSReader):
         #WHERE id = 1;
         
         try:
-            conn = self._get_conn()
-            c = conn.cursor()
             # 获取当前时间戳
             current_time = time.time()
 
@@ -114,8 +117,12 @@ class ObjFS(ObjFSReader):
 
             new_content_size = len(new_content.encode('utf-8'))
 
-            c.execute("UPDATE objects SET content = ?, modified_at = ?, size = ? WHERE id = ?", (new_content, current_time, new_content_size, obj_id))
-            conn.commit()
+            db = self._get_db()
+            def _update_obj(conn):
+                conn.execute("UPDATE objects SET content = ?, modified_at = ?, size = ? WHERE id = ?", (new_content, current_time, new_content_size, obj_id))
+                if self.fts_enabled:
+                    conn.execute("UPDATE objects_fts SET content = ? WHERE obj_id = ?", (new_content, obj_id))
+            db.batch(_update_obj)
             return True
         except Error as e:
             logger.warning("Error occurred while updating object: %s", e)
@@ -123,10 +130,7 @@ class ObjFS(ObjFSReader):
 
     def add_path(self,obj_id, new_path) -> bool:
         try:
-            conn = self._get_conn()
-            c = conn.cursor()        
-            c.execute("INSERT OR IGNORE INTO paths (path, obj_id) VALUES (?, ?)", (new_path, obj_id))
-            conn.commit()
+            self._get_db().execute("INSERT OR IGNORE INTO paths (path, obj_id) VALUES (?, ?)", (new_path, obj_id))
             return True
         except Error as e:
             logger.warning("Error occurred while adding path: %s", e)
@@ -134,11 +138,8 @@ class ObjFS(ObjFSReader):
 
     def remove_path(self,path) -> bool:
         try:
-            conn = self._get_conn()
-            c = conn.cursor()    
             #TODO     
-            c.execute("DELETE FROM paths WHERE path = ?", (path,))
-            conn.commit()
+            self._get_db().execute("DELETE FROM paths WHERE path = ?", (path,))
             return True
         except Error as e:
             logger.warning("Error occurred while removing path: %s", e)
@@ -146,13 +147,15 @@ class ObjFS(ObjFSReader):
 
     def remove_obj(self,obj_id) -> bool:
         try:
-            conn = self._get_conn()
-            c = conn.cursor()
-            c.execute("DELETE FROM objects WHERE id = ?", (obj_id,))
-
-            # 删除所有与该对象相关的路径
-            c.execute("DELETE FROM paths WHERE obj_id = ?", (obj_id,))
-            conn.commit()
+            db = self._get_db()
+            def _remove_obj(conn):
+                conn.execute("DELETE FROM objects WHERE id = ?", (obj_id,))
+                if self.fts_enabled:
+                    conn.execute("DELETE FROM objects_fts WHERE obj_id = ?", (obj_id,))
+
+                # 删除所有与该对象相关的路径
+                conn.execute("DELETE FROM paths WHERE obj_id = ?", (obj_id,))
+            db.batch(_remove_obj)
             return True
         except Error as e:
             logger.warning("Error occurred while removing object: %s", e)
@@ -160,10 +163,7 @@ class ObjFS(ObjFSReader):
 
     def get_obj_by_path(self,path) -> str:
         try:
-            conn = self._get_conn()
-            c = conn.cursor()        
-            c.execute("SELECT objects.id, objects.name, objects.content FROM objects JOIN paths ON objects.id = paths.obj_id WHERE paths.path = ?", (path,))
-            obj_row = c.fetchone()
+            obj_row = self._get_db().fetchone("SELECT objects.id, objects.name, objects.content FROM objects JOIN paths ON objects.id = paths.obj_id WHERE paths.path = ?", (path,))
             if obj_row:
                 return obj_row[2]
             return None
@@ -174,10 +174,7 @@ class ObjFS(ObjFSReader):
 
     def get_obj_by_id(self,obj_id) -> str:
         try:
-            conn = self._get_conn()
-            c = conn.cursor()        
-            c.execute("SELECT id, name, content FROM objects WHERE id = ?", (obj_id,))
-            obj_row =  c.fetchone()
+            obj_row = self._get_db().fetchone("SELECT id, name, content FROM objects WHERE id = ?", (obj_id,))
             if obj_row:
                 return obj_row[2]
             return None
@@ -185,22 +182,29 @@ class ObjFS(ObjFSReader):
             logger.warning("Error occurred while getting object by id: %s", e)
             return None
 
+    def get_contents(self,obj_ids:List[str]) -> dict:
+        """ {obj_id: content} of the objects which exist, in one query """
+        if not obj_ids:
+            return {}
+        try:
+            rows = self._get_db().fetchall("SELECT id, content FROM objects WHERE id IN ({})".format(",".join("?" * len(obj_ids))), list(obj_ids))
+            return dict(rows)
+        except Error as e:
+            logger.warning("Error occurred while getting objects by id: %s", e)
+            return {}
+
     def list_paths(self,base_path)->List[str]:
         try:
-            conn = self._get_conn()
-            c = conn.cursor()        
-            c.execute("SELECT path FROM paths WHERE path LIKE ? ESCAPE '/'", (base_path + "/%",))
-            return [row[0] for row in c.fetchall()]
+            rows = self._get_db().fetchall("SELECT path FROM paths WHERE path LIKE ? ESCAPE '/'", (base_path + "/%",))
+            return [row[0] for row in rows]
         except Error as e:
             logger.warning("Error occurred while listing paths: %s", e)
             return None
         
     def tree(self, base_path,max_depth=3):
         try:
-            conn = self._get_conn()
-            c = conn.cursor()        
-            c.execute("SELECT path FROM paths WHERE path LIKE ? ESCAPE '/'", (base_path + "/%",))
-            paths = [row[0] for row in c.fetchall()]
+            rows = self._get_db().fetchall("SELECT path FROM paths WHERE path LIKE ? ESCAPE '/'", (base_path + "/%",))
+            paths = [row[0] for row in rows]
             tree = {}
             for path in paths:
                 parts = path.split("/")
@@ -215,3 +219,43 @@ class ObjFS(ObjFSReader):
             return None
 
 
+
+    @staticmethod
+    def _fts_query(query:str) -> str:
+        # any word may match, bm25 ranks objects matching more (and rarer) words first.
+        # quoting keeps punctuation in the query (LLM generated) from being parsed as fts5 syntax
+        words = re.findall(r"\w+", query)
+        return " OR ".join(f'"{word}"' for word in words)
+
+    def search(self,query:str,limit:int = 8) -> List[dict]:
+        """ full text search of name and content, best matches first.
+            every result is {"obj_id","name","paths","snippet","score"} """
+        try:
+            db = self._get_db()
+            if self.fts_enabled:
+                fts_query = ObjFS._fts_query(query)
+                if not fts_query:
+                    return []
+                rows = db.fetchall("""
+                    SELECT obj_id, name, snippet(objects_fts, 2, '[', ']', '...', 16), bm25(objects_fts) AS score
+                    FROM objects_fts WHERE objects_fts MATCH ?
+                    ORDER BY score LIMIT ?
+                """, (fts_query, limit))
+            else:
+                rows = db.fetchall("SELECT id, name, substr(content, 1, 128), 0 FROM objects WHERE name LIKE ? OR content LIKE ? LIMIT ?",
+                                   (f"%{query}%", f"%{query}%", limit))
+            if not rows:
+                return []
+
+            obj_ids = [row[0] for row in rows]
+            paths = {}
+            path_rows = db.fetchall("SELECT obj_id, path FROM paths WHERE obj_id IN ({})".format(",".join("?" * len(obj_ids))), obj_ids)
+            for obj_id, path in path_rows:
+                paths.setdefault(obj_id, []).append(path)
+
+            # bm25 is lower for better matches, flip it so a higher score is better
+            return [{"obj_id": row[0], "name": row[1], "paths": paths.get(row[0], []), "snippet": row[2], "score": -row[3]}
+                    for row in rows]
+        except Error as e:
+            logger.warning("Error occurred while searching objects: %s", e)
+            return []
@@ -0,0 +1,177 @@
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Shared access layer for the sqlite stores (chat sessions, agent memory, objfs, knowledge dbs, workflow env).
+# Each database file gets one SQLiteDB: a dedicated thread which owns one persistent connection,
+# so the schema is created once, statements stay in the connection's statement cache,
+# and stores which live in the same file (memory.db) share it.
+# Sync methods run the statement on the db thread and wait for it, async methods (a*) await it without blocking the event loop.
+# Outside of batch() every write is committed at once. batch(func) runs func on the db thread as one job
+# and one transaction, so the writes of other stores on the file can't get into it, they wait for it.
+
+class SQLiteDB:
+    _dbs = {}
+    _dbs_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, db_file: str) -> 'SQLiteDB':
+        """ get the shared db of db_file, every open needs a close """
+        db_key = os.path.abspath(db_file)
+        with cls._dbs_lock:
+            db = cls._dbs.get(db_key)
+            if db is None:
+                db = SQLiteDB(db_file)
+                cls._dbs[db_key] = db
+            db.ref_count += 1
+            return db
+
+    def __init__(self, db_file: str) -> None:
+        self.db_file = db_file
+        self.ref_count = 0
+        self.conn : sqlite3.Connection = None
+        self._thread_id = None
+        self._schemas = set()
+        # only set on the db thread while a batch func runs
+        self._in_batch = False
+
+        self.query_count = 0
+        self.async_query_count = 0
+        self.query_time = 0.0
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{os.path.basename(db_file)}",
+                                           initializer=self._init_thread)
+        # create the connection now, so a bad path fails here and not at the first query
+        self.executor.submit(lambda: None).result()
+
+    def _init_thread(self):
+        self._thread_id = threading.get_ident()
+        self.conn = sqlite3.connect(self.db_file, cached_statements=256)
+        # WAL lets readers in other processes run while we write, NORMAL only fsyncs at checkpoints
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def _run(self, func: Callable, args: tuple):
+        begin = time.perf_counter()
+        try:
+            return func(self.conn, *args)
+        finally:
+            self.query_count += 1
+            self.query_time += time.perf_counter() - begin
+
+    def call(self, func: Callable, *args):
+        """ run func(conn, *args) on the db thread and return its result """
+        if threading.get_ident() == self._thread_id:
+            return self._run(func, args)
+        return self.executor.submit(self._run, func, args).result()
+
+    async def run(self, func: Callable, *args):
+        """ run func(conn, *args) on the db thread, the event loop keeps running meanwhile """
+        self.async_query_count += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._run, func, args)
+
+    def init_schema(self, name: str, create_func: Callable):
+        """ create_func(conn) runs once per db file, however many stores are opened on it """
+        if name in self._schemas:
+            return
+        self.call(create_func)
+        self._schemas.add(name)
+
+    def _commit(self, conn: sqlite3.Connection):
+        if not self._in_batch:
+            conn.commit()
+
+    def _execute(self, conn: sqlite3.Connection, sql: str, params) -> int:
+        cursor = conn.execute(sql, params)
+        self._commit(conn)
+        return cursor.rowcount
+
+    def _executemany(self, conn: sqlite3.Connection, sql: str, seq_of_params) -> int:
+        cursor = conn.executemany(sql, seq_of_params)
+        self._commit(conn)
+        return cursor.rowcount
+
+    @staticmethod
+    def _fetchone(conn: sqlite3.Connection, sql: str, params):
+        return conn.execute(sql, params).fetchone()
+
+    @staticmethod
+    def _fetchall(conn: sqlite3.Connection, sql: str, params) -> list:
+        return conn.execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params: Iterable = ()) -> int:
+        """ execute a write, return the number of changed rows """
+        return self.call(self._execute, sql, params)
+
+    def executemany(self, sql: str, seq_of_params: Iterable) -> int:
+        return self.call(self._executemany, sql, list(seq_of_params))
+
+    def fetchone(self, sql: str, params: Iterable = ()) -> Optional[tuple]:
+        return self.call(SQLiteDB._fetchone, sql, params)
+
+    def fetchall(self, sql: str, params: Iterable = ()) -> list:
+        return self.call(SQLiteDB._fetchall, sql, params)
+
+    async def aexecute(self, sql: str, params: Iterable = ()) -> int:
+        return await self.run(self._execute, sql, params)
+
+    async def aexecutemany(self, sql: str, seq_of_params: Iterable) -> int:
+        return await self.run(self._executemany, sql, list(seq_of_params))
+
+    async def afetchone(self, sql: str, params: Iterable = ()) -> Optional[tuple]:
+        return await self.run(SQLiteDB._fetchone, sql, params)
+
+    async def afetchall(self, sql: str, params: Iterable = ()) -> list:
+        return await self.run(SQLiteDB._fetchall, sql, params)
+
+    def _batch(self, conn: sqlite3.Connection, func: Callable, args: tuple):
+        if self._in_batch:
+            # a batch inside a batch is part of the outer one
+            return func(conn, *args)
+        self._in_batch = True
+        try:
+            result = func(conn, *args)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._in_batch = False
+
+    def batch(self, func: Callable, *args):
+        """ run func(conn, *args) on the db thread in one transaction, rolled back if it raises.
+        the db methods called from func are part of the transaction """
+        return self.call(self._batch, func, args)
+
+    async def abatch(self, func: Callable, *args):
+        return await self.run(self._batch, func, args)
+
+    def close(self):
+        """ release this handle, the connection is closed with the last one """
+        with SQLiteDB._dbs_lock:
+            self.ref_count -= 1
+            if self.ref_count > 0:
+                return
+            db_key = os.path.abspath(self.db_file)
+            if SQLiteDB._dbs.get(db_key) is self:
+                del SQLiteDB._dbs[db_key]
+
+        self.executor.submit(lambda: self.conn.close()).result()
+        self.executor.shutdown(wait=True)
+        logger.info(f"sqlite db {self.db_file} closed")
+
+    def get_metrics(self) -> dict:
+        return {
+            "queries": self.query_count,
+            "async_queries": self.async_query_count,
+            "query_time": self.query_time,
+        }
@@ -0,0 +1,276 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from aios import SQLiteDB
+from . import document_parser
+
+logger = logging.getLogger(__name__)
+
+# Incremental, parallel ingestion of a local document folder.
+# DocumentJournal remembers the size and mtime of every ingested file (document_journal in kb.db, loaded into memory once),
+# so a rescan only stats the files and skips the unchanged ones without a query.
+# Changed files are parsed (hash, pdf text, markdown toc) in a process pool, small files in batches so the
+# round trip to the pool doesn't cost more than the parse. At most max_inflight batches are submitted,
+# results are handed out in the order they finish and the file is journaled when the consumer commits it.
+
+PARSE_BATCH_FILES = 16
+PARSE_BATCH_BYTES = 1024 * 1024
+
+class ScannedFile:
+    def __init__(self, path: str, size: int, mtime: float) -> None:
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+
+
+class ParsedDocument(ScannedFile):
+    def __init__(self, path: str, size: int, mtime: float, doc_hash: Optional[str] = None, meta: Optional[dict] = None) -> None:
+        super().__init__(path, size, mtime)
+        self.doc_hash = doc_hash
+        self.meta = meta
+
+
+class DocumentJournal:
+    def __init__(self, db: SQLiteDB) -> None:
+        self.db = db
+        self.db.init_schema("DocumentJournal", DocumentJournal._create_tables)
+        # path -> (size, mtime)
+        self._files : Dict[str, tuple] = {}
+        for path, size, mtime in self.db.fetchall("SELECT doc_path, length, mtime FROM document_journal"):
+            self._files[path] = (size, mtime)
+
+    @staticmethod
+    def _create_tables(conn):
+        is_new = conn.execute("SELECT name FROM sqlite_master WHERE name = 'document_journal'").fetchone() is None
+        conn.execute("CREATE TABLE IF NOT EXISTS document_journal (doc_path TEXT PRIMARY KEY, length INTEGER, mtime REAL)")
+        has_documents = conn.execute("SELECT name FROM sqlite_master WHERE name = 'documents'").fetchone() is not None
+        if is_new and has_documents:
+            # files ingested before the journal existed, documents.last_modify is their st_mtime
+            conn.execute("""
+                INSERT OR IGNORE INTO document_journal (doc_path, length, mtime)
+                SELECT doc_path, length, CAST(last_modify AS REAL) FROM documents
+            """)
+        conn.commit()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def is_changed(self, path: str, size: int, mtime: float) -> bool:
+        return self._files.get(path) != (size, mtime)
+
+    def mark(self, path: str, size: int, mtime: float):
+        self.db.execute("INSERT OR REPLACE INTO document_journal (doc_path, length, mtime) VALUES (?, ?, ?)", (path, size, mtime))
+        self._files[path] = (size, mtime)
+
+    def remove(self, path: str):
+        if self._files.pop(path, None) is not None:
+            self.db.execute("DELETE FROM document_journal WHERE doc_path = ?", (path,))
+
+
+class DocumentIngestor:
+    _ingestors = {}
+    _ingestors_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, db_path: str, **kwargs) -> 'DocumentIngestor':
+        """ get the shared ingestor of the knowledge db, every open needs a close """
+        ingestor_key = os.path.abspath(db_path)
+        with cls._ingestors_lock:
+            ingestor = cls._ingestors.get(ingestor_key)
+            if ingestor is None:
+                ingestor = DocumentIngestor(db_path, **kwargs)
+                cls._ingestors[ingestor_key] = ingestor
+            ingestor.ref_count += 1
+            return ingestor
+
+    def __init__(self, db_path: str, max_workers: Optional[int] = None, max_inflight: Optional[int] = None,
+                 batch_files: int = PARSE_BATCH_FILES, parse_func: Callable = document_parser.parse_documents) -> None:
+        self.db_path = db_path
+        self.ref_count = 0
+        self.db = SQLiteDB.open(db_path)
+        self.journal = DocumentJournal(self.db)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_inflight = max_inflight or self.max_workers * 2
+        self.batch_files = batch_files
+        self.parse_func = parse_func
+        self.executor : Optional[ProcessPoolExecutor] = None
+        # parsed by ingest(), waiting for the consumer to take them
+        self._parsed : Dict[str, ParsedDocument] = {}
+
+        self.scanned_count = 0
+        self.skipped_count = 0
+        self.changed_count = 0
+        self.inflight_count = 0
+        self.parsed_count = 0
+        self.parsed_bytes = 0
+        self.failed_count = 0
+        self.scan_time = 0.0
+        self.parse_time = 0.0
+        self.round_begin = None
+        self.round_end = None
+        self.round_parsed = 0
+        self.round_bytes = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    def scan(self, root: str, support_func: Callable[[str], bool]) -> List[ScannedFile]:
+        """ the supported files under root which are new or changed since they were committed """
+        begin = time.perf_counter()
+        changed = []
+        scanned = 0
+        dirs = [root]
+        while dirs:
+            dir_path = dirs.pop()
+            try:
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.path)
+                            continue
+                        if not support_func(entry.name):
+                            continue
+                        scanned += 1
+                        stat = entry.stat()
+                        path = os.path.normpath(entry.path)
+                        if self.journal.is_changed(path, stat.st_size, stat.st_mtime):
+                            changed.append(ScannedFile(path, stat.st_size, stat.st_mtime))
+            except OSError as e:
+                logger.warning(f"scan {dir_path} failed: {e}")
+
+        self.scan_time = time.perf_counter() - begin
+        self.scanned_count += scanned
+        self.skipped_count += scanned - len(changed)
+        self.changed_count += len(changed)
+        logger.info(f"scan {root}: {len(changed)} of {scanned} files changed, {self.scan_time:.2f}s")
+        return changed
+
+    async def parse_files(self, files: List[ScannedFile]) -> List[Optional[ParsedDocument]]:
+        """ hash and parse the files in one task of the process pool, None for a file which can't be read """
+        to_parse = [file for file in files if file.size >= 1]
+        results = {}
+        if to_parse:
+            loop = asyncio.get_running_loop()
+            begin = time.perf_counter()
+            self.inflight_count += len(to_parse)
+            try:
+                parsed = await loop.run_in_executor(self._get_executor(), self.parse_func, [file.path for file in to_parse])
+            except Exception as e:
+                parsed = [(None, str(e))] * len(to_parse)
+            finally:
+                self.inflight_count -= len(to_parse)
+            self.parse_time += time.perf_counter() - begin
+            for file, (doc_hash, meta) in zip(to_parse, parsed):
+                results[file.path] = (doc_hash, meta)
+
+        docs = []
+        for file in files:
+            if file.size < 1:
+                # nothing to parse
+                docs.append(ParsedDocument(file.path, file.size, file.mtime))
+                continue
+            doc_hash, meta = results[file.path]
+            if doc_hash is None:
+                self.failed_count += 1
+                logger.warning(f"parse document {file.path} failed: {meta}")
+                docs.append(None)
+                continue
+            self.parsed_count += 1
+            self.parsed_bytes += file.size
+            self.round_parsed += 1
+            self.round_bytes += file.size
+            docs.append(ParsedDocument(file.path, file.size, file.mtime, doc_hash, meta))
+        return docs
+
+    async def parse_file(self, file: ScannedFile) -> Optional[ParsedDocument]:
+        return (await self.parse_files([file]))[0]
+
+    def _next_batch(self, files) -> List[ScannedFile]:
+        batch = []
+        batch_bytes = 0
+        while len(batch) < self.batch_files and batch_bytes < PARSE_BATCH_BYTES:
+            file = next(files, None)
+            if file is None:
+                break
+            batch.append(file)
+            batch_bytes += file.size
+        return batch
+
+    async def ingest(self, root: str, support_func: Callable[[str], bool]) -> AsyncIterator[ParsedDocument]:
+        """ scan root and parse the changed files, max_inflight batches at a time, yield them as they finish.
+            the yielded documents wait in take() for their consumer """
+        self.round_begin = time.perf_counter()
+        self.round_end = None
+        self.round_parsed = 0
+        self.round_bytes = 0
+        files = iter(await asyncio.to_thread(self.scan, root, support_func))
+        pending = set()
+        try:
+            while True:
+                while len(pending) < self.max_inflight:
+                    batch = self._next_batch(files)
+                    if not batch:
+                        break
+                    pending.add(asyncio.ensure_future(self.parse_files(batch)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for doc in task.result():
+                        if doc is None:
+                            continue
+                        self._parsed[doc.path] = doc
+                        yield doc
+        finally:
+            for task in pending:
+                task.cancel()
+            self.round_end = time.perf_counter()
+
+    def take(self, path: str) -> Optional[ParsedDocument]:
+        return self._parsed.pop(path, None)
+
+    def commit(self, doc: ScannedFile):
+        """ the file is ingested, skip it until it changes """
+        self.journal.mark(doc.path, doc.size, doc.mtime)
+
+    def get_metrics(self) -> dict:
+        round_time = 0.0
+        if self.round_begin is not None:
+            round_time = (self.round_end or time.perf_counter()) - self.round_begin
+        return {
+            "journal_files": len(self.journal),
+            "scanned": self.scanned_count,
+            "skipped": self.skipped_count,
+            "changed": self.changed_count,
+            "inflight": self.inflight_count,
+            "parsed": self.parsed_count,
+            "parsed_bytes": self.parsed_bytes,
+            "failed": self.failed_count,
+            "waiting": len(self._parsed),
+            "scan_time": self.scan_time,
+            "parse_time": self.parse_time,
+            "files_per_sec": self.round_parsed / round_time if round_time > 0 else 0.0,
+            "bytes_per_sec": self.round_bytes / round_time if round_time > 0 else 0.0,
+        }
+
+    def close(self):
+        """ release this handle, the pool is shut down with the last one """
+        with DocumentIngestor._ingestors_lock:
+            self.ref_count -= 1
+            if self.ref_count > 0:
+                return
+            ingestor_key = os.path.abspath(self.db_path)
+            if DocumentIngestor._ingestors.get(ingestor_key) is self:
+                del DocumentIngestor._ingestors[ingestor_key]
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.db.close()
@@ -0,0 +1,121 @@
+import os
+import re
+import json
+import hashlib
+import logging
+
+import chardet
+import PyPDF2
+from markdown import Markdown
+
+from .pdf_text import PdfText
+
+logger = logging.getLogger(__name__)
+
+# Parsing of local documents: content hash and metadata (title, authors, catalogs), pdf text goes to a .{name}.txt sidecar (see pdf_text.py).
+# Plain functions of the path with no aios imports, so they run in the worker processes of DocumentIngestor.
+
+def parse_pdf_bookmarks(bookmarks, parent:list):
+    for item in bookmarks:
+        if isinstance(item,list):
+            parse_pdf_bookmarks(item,parent)
+        else:
+            if item.title:
+                new_item = {}
+                new_item["page"] = item.page.idnum
+                new_item["title"] = item.title
+                my_childs = []
+                if item.childs:
+                    if len(item.childs) > 0:
+                        parse_pdf_bookmarks(item.childs, my_childs)
+                        new_item["childs"] = my_childs
+                parent.append(new_item)
+            else:
+                logger.warning("parse pdf bookmarks failed: item.title is None!")
+
+    return
+
+def parse_pdf(doc_path:str) -> dict:
+    metadata = {}
+    with open(doc_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        try:
+            doc_info = reader.metadata
+            if doc_info:
+                if doc_info.title:
+                    metadata["title"] = doc_info.title
+                if doc_info.author:
+                    metadata["authors"] = doc_info.author
+        except Exception as e:
+            logger.warn("parse pdf metadata failed:%s",e)
+
+        # streamed to the sidecar page by page, nothing to do when it is up to date
+        PdfText(doc_path).extract(reader=reader)
+
+        try:
+            bookmarks = reader.outline
+            if bookmarks:
+                catalogs = []
+                parse_pdf_bookmarks(bookmarks,catalogs)
+                metadata["catalogs"] = json.dumps(catalogs,ensure_ascii=False)
+        except Exception as e:
+            logger.warn("parse pdf bookmarks failed:%s",e)
+
+    return metadata
+
+def parse_md(doc_path:str) -> dict:
+    metadata = {}
+    with open(doc_path,'rb') as f:
+        raw = f.read()
+    # most files are utf-8, chardet only when they aren't
+    try:
+        content = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        cur_encode = chardet.detect(raw[:1024])['encoding'] or "utf-8"
+        content = raw.decode(cur_encode, errors="replace")
+
+    match = re.search(r'^# (.*)', content, re.MULTILINE)
+    if match:
+        metadata['title'] = match.group(1).strip()
+    md = Markdown(extensions=['toc'])
+    html_str = md.convert(content)
+    toc = md.toc
+    if toc:
+        metadata['catalogs'] = toc
+
+    return metadata
+
+def parse_document(doc_path:str):
+    """ return (md5 of the file, metadata) """
+    hash_result = None
+    title = os.path.basename(doc_path)
+    meta_data = {}
+
+    with open(doc_path, "rb") as f:
+        hash_md5 = hashlib.md5()
+        for chunk in iter(lambda: f.read(1024*1024), b""):
+            hash_md5.update(chunk)
+        hash_result = hash_md5.hexdigest()
+    try:
+        if doc_path.endswith(".md"):
+            meta_data = parse_md(doc_path)
+        elif doc_path.endswith(".pdf"):
+            meta_data = parse_pdf(doc_path)
+    except Exception as e:
+        logger.error("parse document %s failed:%s",doc_path,e)
+        # traceback.print_exc()
+
+    if not "title" in meta_data:
+        meta_data["title"] = title
+    logger.info("parse document %s!",doc_path)
+    return hash_result, meta_data
+
+def parse_documents(doc_paths:list) -> list:
+    """ parse_document of each path, one pool task for a batch of small files. a failed file is (None, error) """
+    results = []
+    for doc_path in doc_paths:
+        try:
+            results.append(parse_document(doc_path))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
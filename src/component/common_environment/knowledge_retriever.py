@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import re
+from sqlite3 import Error
+from typing import List, Optional
+
+from aios import SQLiteDB, ComputeKernel, ComputeTaskPriority, VectorIndex
+
+logger = logging.getLogger(__name__)
+
+# Retrieval over the LocalKnowledgeBase documents: the knowledge table of kb.db and the extracted text.
+# Two rankings of the documents are fused by reciprocal rank fusion (RRF):
+#   bm25 of a fts5 inverted index (knowledge_fts) of title, summary, tags and the extracted text,
+#   cosine similarity of the query embedding to the chunk embeddings, kept in a VectorIndex next to kb.db.
+# Filters (tags, create_time range) are applied in sql. The vector side gets the matching docs as a filter
+# when there are few of them, otherwise it oversamples and drops the chunks of other docs.
+
+# each side returns limit * RETRIEVE_CANDIDATE_FACTOR candidates
+RETRIEVE_CANDIDATE_FACTOR = 4
+RRF_K = 60
+CHUNK_CHARS = 1024
+MAX_CHUNKS_PER_DOC = 64
+FILTER_DOCS_LIMIT = 4096
+# bm25 scores every doc matching a query term. terms are taken rarest first until they match this many docs,
+# the more common ones (the, of, ...) hardly change the ranking but would cost a score for most of the corpus
+FTS_MAX_MATCH_DOCS = 5000
+
+
+class KnowledgeRetriever:
+    def __init__(self, db_path: str, vector_dir: str, model_name: Optional[str] = None) -> None:
+        self.db_path = db_path
+        self.model_name = model_name
+        self.db : SQLiteDB = None
+        # shared by every LocalKnowledgeBase of the workspace, so documents indexed by the pipeline are found by the agents
+        self.vector_index = VectorIndex.open(vector_dir)
+        self._get_db()
+
+    def _get_db(self) -> SQLiteDB:
+        if self.db is None:
+            self.db = SQLiteDB.open(self.db_path)
+            self.db.init_schema("KnowledgeRetriever", KnowledgeRetriever._create_tables)
+        return self.db
+
+    @staticmethod
+    def _split_tags(tags: Optional[str]) -> List[str]:
+        return [tag.strip() for tag in (tags or "").split(",") if tag.strip()]
+
+    @staticmethod
+    def _create_tables(conn):
+        is_new = conn.execute("SELECT name FROM sqlite_master WHERE name = 'knowledge_fts'").fetchone() is None
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(doc_hash UNINDEXED, title, summary, tags, content)")
+        # title and tags weigh more than the body text
+        conn.execute("INSERT INTO knowledge_fts (knowledge_fts, rank) VALUES ('rank', 'bm25(0.0, 10.0, 5.0, 5.0, 1.0)')")
+        # doc frequency of each term
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts_vocab USING fts5vocab(knowledge_fts, 'row')")
+        # the knowledge table keeps tags comma separated, which no index can filter by
+        conn.execute("CREATE TABLE IF NOT EXISTS knowledge_tags (tag TEXT NOT NULL, doc_hash TEXT NOT NULL, PRIMARY KEY (tag, doc_hash))")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_tags_doc_hash ON knowledge_tags (doc_hash)")
+
+        has_knowledge = conn.execute("SELECT name FROM sqlite_master WHERE name = 'knowledge'").fetchone() is not None
+        if has_knowledge:
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_create_time ON knowledge (create_time)")
+        if is_new and has_knowledge:
+            # documents learned before the index existed, their text is added when they are indexed again
+            conn.execute("""
+                INSERT INTO knowledge_fts (doc_hash, title, summary, tags, content)
+                SELECT doc_hash, trim(coalesce(llm_title, '') || ' ' || coalesce(title, '')),
+                       trim(coalesce(llm_summary, '') || ' ' || coalesce(summary, '')), tags, ''
+                FROM knowledge
+            """)
+            conn.executemany("INSERT OR IGNORE INTO knowledge_tags (tag, doc_hash) VALUES (?, ?)",
+                             [(tag, doc_hash) for doc_hash, tags in conn.execute("SELECT doc_hash, tags FROM knowledge")
+                              for tag in KnowledgeRetriever._split_tags(tags)])
+        conn.commit()
+
+    def close(self):
+        self.vector_index.close()
+        if self.db is None:
+            return
+        self.db.close()
+        self.db = None
+
+    @staticmethod
+    def _filter_sql(tags: Optional[List[str]], create_after: Optional[str], create_before: Optional[str]):
+        # the doc must have every tag, times are "%Y-%m-%d %H:%M:%S" (or a prefix of it)
+        conditions = []
+        params = []
+        for tag in tags or []:
+            conditions.append("k.doc_hash IN (SELECT doc_hash FROM knowledge_tags WHERE tag = ?)")
+            params.append(tag.strip())
+        if create_after:
+            conditions.append("k.create_time >= ?")
+            params.append(create_after)
+        if create_before:
+            conditions.append("k.create_time < ?")
+            params.append(create_before)
+        return " AND ".join(conditions), params
+
+    @staticmethod
+    def _split_chunks(text: str) -> List[tuple]:
+        # (pos, text) chunks, cut at a line break near the chunk size when there is one
+        chunks = []
+        pos = 0
+        while pos < len(text) and len(chunks) < MAX_CHUNKS_PER_DOC:
+            end = min(pos + CHUNK_CHARS, len(text))
+            if end < len(text):
+                line_end = text.rfind("\n", pos + CHUNK_CHARS // 2, end)
+                if line_end > 0:
+                    end = line_end + 1
+            chunk = text[pos:end].strip()
+            if chunk:
+                chunks.append((pos, chunk))
+            pos = end
+        return chunks
+
+    async def index_document(self, doc_hash: str, content: str) -> bool:
+        """ (re)index a document of the knowledge table with its extracted text """
+        db = self._get_db()
+        row = await db.afetchone("SELECT title, summary, tags, llm_title, llm_summary FROM knowledge WHERE doc_hash = ?", (doc_hash,))
+        if row is None:
+            logger.warning(f"index document {doc_hash} failed: not in knowledge table")
+            return False
+        title, summary, tags, llm_title, llm_summary = [value or "" for value in row]
+        title = f"{llm_title} {title}".strip()
+        summary = f"{llm_summary} {summary}".strip()
+        content = content or ""
+
+        def write_fts(conn):
+            conn.execute("DELETE FROM knowledge_fts WHERE doc_hash = ?", (doc_hash,))
+            conn.execute("INSERT INTO knowledge_fts (doc_hash, title, summary, tags, content) VALUES (?, ?, ?, ?, ?)",
+                         (doc_hash, title, summary, tags, content))
+            conn.execute("DELETE FROM knowledge_tags WHERE doc_hash = ?", (doc_hash,))
+            conn.executemany("INSERT OR IGNORE INTO knowledge_tags (tag, doc_hash) VALUES (?, ?)",
+                             [(tag, doc_hash) for tag in KnowledgeRetriever._split_tags(tags)])
+            conn.commit()
+        try:
+            await db.run(write_fts)
+        except Error as e:
+            logger.warning(f"index document {doc_hash} text failed: {e}")
+            return False
+
+        chunks = KnowledgeRetriever._split_chunks(content)
+        if not chunks:
+            chunks = [(0, f"{title}\n{summary}")]
+        kernel = ComputeKernel.get_instance()
+        # the chunks go to the embedding batcher together
+        vectors = await asyncio.gather(*[kernel.do_text_embedding(f"{title}\n{chunk}", self.model_name, ComputeTaskPriority.BATCH_INGEST)
+                                         for pos, chunk in chunks], return_exceptions=True)
+        ids = []
+        embedded = []
+        metas = []
+        for (pos, chunk), vector in zip(chunks, vectors):
+            if isinstance(vector, BaseException) or not vector:
+                logger.warning(f"embedding of document {doc_hash} at {pos} failed: {vector}")
+                continue
+            ids.append(f"{doc_hash}:{len(ids)}")
+            embedded.append(vector)
+            metas.append({"doc_hash": doc_hash, "pos": pos})
+        self.remove_document_vectors(doc_hash)
+        if ids:
+            try:
+                self.vector_index.add(ids, embedded, metas)
+            except ValueError as e:
+                # a vector of another dimension than the index, a model change needs a new vector dir
+                logger.warning(f"index document {doc_hash} vectors failed: {e}")
+                return False
+        return True
+
+    def remove_document_vectors(self, doc_hash: str):
+        self.vector_index.delete([f"{doc_hash}:{i}" for i in range(MAX_CHUNKS_PER_DOC)])
+
+    async def remove_document(self, doc_hash: str):
+        def remove(conn):
+            conn.execute("DELETE FROM knowledge_fts WHERE doc_hash = ?", (doc_hash,))
+            conn.execute("DELETE FROM knowledge_tags WHERE doc_hash = ?", (doc_hash,))
+            conn.commit()
+        await self._get_db().run(remove)
+        self.remove_document_vectors(doc_hash)
+
+    @staticmethod
+    def _fts_query(conn, query: str) -> str:
+        # any of the selected words may match, quoted so the query can't inject fts5 syntax
+        words = list(dict.fromkeys(word.lower() for word in re.findall(r"\w+", query)))
+        if not words:
+            return ""
+        doc_counts = dict(conn.execute(f"SELECT term, doc FROM knowledge_fts_vocab WHERE term IN ({','.join('?' * len(words))})", words).fetchall())
+        selected = []
+        match_docs = 0
+        for word in sorted(doc_counts.keys(), key=lambda word: doc_counts[word]):
+            match_docs += doc_counts[word]
+            # the rarest term is kept however common it is, or a query of common words matches nothing
+            if match_docs > FTS_MAX_MATCH_DOCS and selected:
+                break
+            selected.append(word)
+        return " OR ".join(f'"{word}"' for word in selected)
+
+    async def _text_candidates(self, query: str, limit: int, filter_sql: str, filter_params: list) -> List[tuple]:
+        # [(doc_hash, snippet)], best bm25 first
+        def search(conn):
+            fts_query = KnowledgeRetriever._fts_query(conn, query)
+            if not fts_query:
+                return []
+            where = f"knowledge_fts MATCH ? AND {filter_sql}" if filter_sql else "knowledge_fts MATCH ?"
+            # snippets only for the top docs
+            return conn.execute(f"""
+                SELECT doc_hash, snippet(knowledge_fts, 4, '[', ']', '...', 16) FROM knowledge_fts
+                WHERE knowledge_fts MATCH ? AND rowid IN (
+                    SELECT knowledge_fts.rowid FROM knowledge_fts JOIN knowledge k ON k.doc_hash = knowledge_fts.doc_hash
+                    WHERE {where} ORDER BY rank LIMIT ?)
+                ORDER BY rank
+            """, [fts_query, fts_query] + filter_params + [limit]).fetchall()
+        try:
+            return await self._get_db().run(search)
+        except Error as e:
+            logger.warning(f"knowledge text search failed: {e}")
+            return []
+
+    async def _vector_candidates(self, query: str, limit: int, filter_sql: str, filter_params: list) -> List[tuple]:
+        # [(doc_hash, chunk pos)], most similar first
+        if len(self.vector_index) == 0:
+            return []
+        try:
+            query_vector = await ComputeKernel.get_instance().do_text_embedding(query, self.model_name)
+        except Exception as e:
+            logger.warning(f"knowledge query embedding failed: {e}")
+            return []
+        if not query_vector:
+            return []
+
+        db = self._get_db()
+        vector_filters = None
+        if filter_sql:
+            rows = await db.afetchall(f"SELECT k.doc_hash FROM knowledge k WHERE {filter_sql} LIMIT ?", filter_params + [FILTER_DOCS_LIMIT + 1])
+            if not rows:
+                return []
+            if len(rows) <= FILTER_DOCS_LIMIT:
+                vector_filters = {"doc_hash": [row[0] for row in rows]}
+
+        # a doc has several chunks, oversample so limit docs are left
+        chunk_limit = limit * RETRIEVE_CANDIDATE_FACTOR
+        # few allowed docs: scan their chunks exactly, the approximate cells would hold few of them
+        # the scan takes a while on a large index, off the event loop
+        try:
+            results = await asyncio.to_thread(self.vector_index.search, query_vector, chunk_limit, vector_filters,
+                                              True if vector_filters else None)
+        except ValueError as e:
+            logger.warning(f"knowledge vector search failed: {e}")
+            return []
+        candidates = {}
+        for result in results:
+            doc_hash = result.meta["doc_hash"]
+            if doc_hash not in candidates:
+                candidates[doc_hash] = result.meta["pos"]
+
+        if filter_sql and vector_filters is None and candidates:
+            doc_hashes = list(candidates.keys())
+            rows = await db.afetchall(f"SELECT k.doc_hash FROM knowledge k WHERE k.doc_hash IN ({','.join('?' * len(doc_hashes))}) AND {filter_sql}",
+                                      doc_hashes + filter_params)
+            matched = {row[0] for row in rows}
+            candidates = {doc_hash: pos for doc_hash, pos in candidates.items() if doc_hash in matched}
+        return list(candidates.items())[:limit]
+
+    async def retrieve(self, query: str, limit: int = 8, tags: Optional[List[str]] = None,
+                       create_after: Optional[str] = None, create_before: Optional[str] = None,
+                       mode: str = "hybrid") -> List[dict]:
+        """ the documents best matching query, mode is text, vector or hybrid.
+            every result is {"doc_hash","path","title","summary","tags","create_time","snippet","pos","score"},
+            pos is where the best matching chunk starts in the text """
+        filter_sql, filter_params = KnowledgeRetriever._filter_sql(tags, create_after, create_before)
+        candidate_limit = limit * RETRIEVE_CANDIDATE_FACTOR
+        text_candidates = []
+        vector_candidates = []
+        if mode in ("text", "hybrid"):
+            text_candidates = await self._text_candidates(query, candidate_limit, filter_sql, filter_params)
+        if mode in ("vector", "hybrid"):
+            vector_candidates = await self._vector_candidates(query, candidate_limit, filter_sql, filter_params)
+
+        scores = {}
+        snippets = {}
+        positions = {}
+        for rank, (doc_hash, snippet) in enumerate(text_candidates):
+            scores[doc_hash] = scores.get(doc_hash, 0.0) + 1.0 / (RRF_K + rank + 1)
+            snippets[doc_hash] = snippet
+        for rank, (doc_hash, pos) in enumerate(vector_candidates):
+            scores[doc_hash] = scores.get(doc_hash, 0.0) + 1.0 / (RRF_K + rank + 1)
+            positions[doc_hash] = pos
+        top = sorted(scores.keys(), key=lambda doc_hash: scores[doc_hash], reverse=True)[:limit]
+        if not top:
+            return []
+
+        rows = await self._get_db().afetchall(f"""
+            SELECT k.doc_hash, d.doc_path, k.title, k.llm_title, k.summary, k.llm_summary, k.tags, k.create_time
+            FROM knowledge k LEFT JOIN documents d ON d.doc_hash = k.doc_hash
+            WHERE k.doc_hash IN ({','.join('?' * len(top))})
+        """, top)
+        docs = {row[0]: row for row in rows}
+        result = []
+        for doc_hash in top:
+            row = docs.get(doc_hash)
+            if row is None:
+                continue
+            result.append({
+                "doc_hash": doc_hash,
+                "path": row[1],
+                "title": row[3] or row[2],
+                "summary": row[5] or row[4],
+                "tags": row[6],
+                "create_time": row[7],
+                "snippet": snippets.get(doc_hash, ""),
+                "pos": positions.get(doc_hash, 0),
+                "score": scores[doc_hash],
+            })
+        return result
+
+    def get_metrics(self) -> dict:
+        return self.vector_index.get_metrics()
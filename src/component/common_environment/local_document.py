@@ -1,49 +1,47 @@
 import os
+import asyncio
+import codecs
 import aiofiles
 import chardet
 import string
-import sqlite3
 import json
 import re
 import threading
 import logging
-import hashlib
-from markdown import Markdown
-import PyPDF2
 import datetime
 from typing import Optional, List
 from aios import *
 from aios.environment.workspace_env import TodoListEnvironment, TodoListType
 from .local_file_system import FilesystemEnvironment
+from .knowledge_retriever import KnowledgeRetriever
+from .document_ingest import DocumentIngestor, ScannedFile
+from . import document_parser
+from .pdf_text import PdfText
 
 logger = logging.getLogger(__name__)
 
+# the encoding of a text file is guessed from its head
+TEXT_ENCODING_DETECT_BYTES = 64 * 1024
+TEXT_ENCODING_CACHE_SIZE = 4096
+
 class MetaDatabase:
     def __init__(self,db_path:str):
         self.db_path = db_path
-        self._get_conn()
-
-    def _get_conn(self):
-        """ get db connection """
-        local = threading.local()
-        if not hasattr(local, 'conn'):
-            local.conn = self._create_connection(self.db_path)
-        return local.conn
-
-
-    def _create_connection(self, db_file):
-        """ create a database connection to a SQLite database """
-        conn = None
-        try:
-            conn = sqlite3.connect(db_file)
-        except Exception as e:
-            logger.error("Error occurred while connecting to database: %s", e)
-            return None
-
-        if conn:
-            self._create_tables(conn)
-
-        return conn
+        self.db : SQLiteDB = None
+        self._get_db()
+
+    def _get_db(self) -> SQLiteDB:
+        """ get the shared db of the file """
+        if self.db is None:
+            self.db = SQLiteDB.open(self.db_path)
+            self.db.init_schema("MetaDatabase", self._create_tables)
+        return self.db
+
+    def close(self):
+        if self.db is None:
+            return
+        self.db.close()
+        self.db = None
 
     def _create_tables(self,conn):
         cursor = conn.cursor()
@@ -83,53 +81,46 @@ class MetaDatabase:
         conn.commit()
 
     def add_doc(self, doc_path: str, length: int, last_modify: str, doc_hash: Optional[str] = None):
-        conn = self._get_conn()
-        cursor = conn.cursor()
+        db = self._get_db()
         create_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute('''
-            INSERT INTO documents (doc_path, length, last_modify, doc_hash,create_time) 
+        db.execute('''
+            INSERT OR REPLACE INTO documents (doc_path, length, last_modify, doc_hash,create_time) 
             VALUES (?, ?, ?, ?,?)
         ''', (doc_path, length, last_modify, doc_hash,create_time))
-        conn.commit()
 
     def is_doc_exist(self, doc_path: str) -> bool:
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
+        db = self._get_db()
+        rows = db.fetchall('''
             SELECT doc_path
             FROM documents
             WHERE doc_path = ?
         ''', (doc_path,))
-        return len(cursor.fetchall()) > 0
+        return len(rows) > 0
 
     def set_doc_hash(self, doc_path: str, doc_hash: str):
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
+        db = self._get_db()
+        db.execute('''
             UPDATE documents
             SET doc_hash = ?
             WHERE doc_path = ?
         ''', (doc_hash, doc_path))
-        conn.commit()
 
     def get_docs_without_hash(self,limit:int=1024) -> List[str]:
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
+        db = self._get_db()
+        rows = db.fetchall('''
             SELECT doc_path
             FROM documents
             WHERE doc_hash IS NULL OR doc_hash = ''
             ORDER BY create_time DESC
             LIMIT ?
         ''',(limit,))
-        return [row[0] for row in cursor.fetchall()]
+        return [row[0] for row in rows]
 
     #metadata["summary"]
     #metadata["catalogs"]
     #metadata["tags"]
     def add_knowledge(self, doc_hash: str, metadata: dict,content:str = None,):
-        conn = self._get_conn()
-        cursor = conn.cursor()
+        db = self._get_db()
 
         create_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         summary = metadata.get("summary", "")
@@ -137,64 +128,56 @@ class MetaDatabase:
         title = metadata.get("title","")
         tags = ','.join(metadata.get("tags", []))
 
-        cursor.execute('''
-            INSERT INTO knowledge (doc_hash, title , summary , catalogs , tags,create_time) 
+        db.execute('''
+            INSERT OR REPLACE INTO knowledge (doc_hash, title , summary , catalogs , tags,create_time) 
             VALUES (?, ?, ?, ?, ?,?)
         ''', (doc_hash, title, summary, catalogs, tags,create_time))
-        conn.commit()
 
     #llm_result["summary"]
     #llm_result["tags"]
     #llm_result["catalog"]
     def set_knowledge_llm_result(self, doc_hash: str, meta: dict):
-        conn = self._get_conn()
-        cursor = conn.cursor()
+        db = self._get_db()
 
         title = meta.get("title", "")
         summary = meta.get("summary", "")
         catalogs = json.dumps(meta.get("catalogs", {}),ensure_ascii=False)
         tags = ','.join(meta.get("tags", []))
 
-        cursor.execute('''
+        db.execute('''
             UPDATE knowledge
             SET llm_title = ?,llm_summary = ?, catalogs = ?, tags = ?
             WHERE doc_hash = ?
         ''', (title,summary, catalogs, tags, doc_hash))
-        conn.commit()
 
 
     def get_hash_by_doc_path(self, doc_path: str) -> Optional[str]:
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
+        db = self._get_db()
+        row = db.fetchone('''
             SELECT doc_hash
             FROM documents
             WHERE doc_path = ?
         ''', (doc_path,))
-        row = cursor.fetchone()
         if row is None:
             return None
         return row[0]
 
     def get_knowledge(self, doc_hash: str) -> Optional[dict]:
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
+        db = self._get_db()
+        row = db.fetchone('''
             SELECT title, summary, catalogs, tags, llm_title, llm_summary
             FROM knowledge
             WHERE doc_hash = ?
         ''', (doc_hash,))
-        row = cursor.fetchone()
         if row is None:
             return None
 
         # get doc path
-        cursor.execute('''
+        row2 = db.fetchone('''
             SELECT doc_path
             FROM documents
             WHERE doc_hash = ?
         ''', (doc_hash,))
-        row2 = cursor.fetchone()
         if row2 is None:
             return None
         doc_path = row2[0]
@@ -211,28 +194,26 @@ class MetaDatabase:
         }
 
     def get_knowledge_without_llm_title(self,limit:int=16) -> List[str]:
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
+        db = self._get_db()
+        rows = db.fetchall('''
             SELECT doc_hash
             FROM knowledge
             WHERE llm_title IS NULL OR llm_title = ''
             ORDER BY create_time DESC
             LIMIT ?
         ''',(limit,))
-        return [row[0] for row in cursor.fetchall()]
+        return [row[0] for row in rows]
 
     def query_docs_by_tag(self, tag: str) -> List[str]:
-        conn = self._get_conn()
-        cursor = conn.cursor()
+        db = self._get_db()
         tag_json = json.dumps(tag,ensure_ascii=False)  # 将标签转换为 JSON 字符串
-        cursor.execute('''
+        rows = db.fetchall('''
             SELECT documents.doc_path
             FROM documents
             JOIN knowledge ON documents.doc_hash = knowledge.doc_hash
             WHERE json_extract(knowledge.tags, '$') LIKE ?
         ''', (tag))
-        return [row[0] for row in cursor.fetchall()]
+        return [row[0] for row in rows]
 
 # singleton
 class LearningCache:
@@ -271,6 +252,9 @@ class LocalKnowledgeBase(CompositeEnvironment):
         if os.path.exists(self.root_path) is False:
             os.makedirs(self.root_path)
         self.meta_db = MetaDatabase(f"{self.root_path}/kb.db")
+        self.retriever = KnowledgeRetriever(f"{self.root_path}/kb.db", f"{self.root_path}/.vector")
+        # (path, size, mtime) -> encoding
+        self.text_encodings = {}
         self.learning_cache = LearningCache()
 
         async def learn(op:dict):
@@ -286,6 +270,31 @@ class LocalKnowledgeBase(CompositeEnvironment):
             func_handler=learn,
         ))
 
+        async def search(parameters):
+            tags = parameters.get("tags")
+            if isinstance(tags, str):
+                tags = [tag for tag in tags.split(",") if tag.strip()]
+            results = await self.retriever.retrieve(parameters["query"],
+                                                    int(parameters.get("limit") or 8),
+                                                    tags,
+                                                    parameters.get("create_after"),
+                                                    parameters.get("create_before"))
+            return json.dumps(results,ensure_ascii=False)
+
+        search_param = ParameterDefine.create_parameters({
+            "query": "keywords or a question",
+            "tags": "only documents with all these tags, comma separated",
+            "create_after": "only documents learned at or after this time, format %Y-%m-%d %H:%M:%S or a prefix like %Y-%m-%d",
+            "create_before": "only documents learned before this time",
+            "limit": "max number of documents, default 8",
+        })
+        for name in ["tags", "create_after", "create_before", "limit"]:
+            search_param[name].is_required = False
+        self.add_ai_function(SimpleAIFunction("knowledge.search",
+                                              "Find documents in the knowledge base by keywords and meaning. Returns the best matching documents with path, title, summary, a snippet and pos, the position of the best matching part, which load_knowledge_content can read from",
+                                              search,
+                                              search_param,read_only=True))
+
         self.fs = FilesystemEnvironment(self.root_path)
         self.add_env(self.fs)
 
@@ -340,23 +349,40 @@ class LocalKnowledgeBase(CompositeEnvironment):
 
         return "not found"
 
+    async def index_document(self,doc_hash:str,full_path:str) -> bool:
+        content = await self.load_knowledge_content(full_path)
+        return await self.retriever.index_document(doc_hash,content)
+
+    def _get_text_encoding(self, path:str) -> str:
+        # detected once per file version, from its first bytes
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime)
+        encoding = self.text_encodings.get(key)
+        if encoding is None:
+            with open(path, 'rb') as f:
+                head = f.read(TEXT_ENCODING_DETECT_BYTES)
+            try:
+                codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+                encoding = "utf-8"
+            except UnicodeDecodeError:
+                encoding = chardet.detect(head)['encoding'] or "utf-8"
+            if len(self.text_encodings) >= TEXT_ENCODING_CACHE_SIZE:
+                self.text_encodings.clear()
+            self.text_encodings[key] = encoding
+        return encoding
+
     async def load_knowledge_content(self,path:str,pos:int=0,length:int=None) -> str:
         if path.endswith("pdf"):
             logger.info("load_knowledge_content:pdf")
-            dir_path = os.path.dirname(path)
-            base_name = os.path.basename(path)
-            text_content_path = f"{dir_path}/.{base_name}.txt"
-            if os.path.exists(text_content_path) is False:
+            # pages are extracted on first read, a read only decodes the pages it covers
+            try:
+                pdf_text = PdfText.open(path)
+            except OSError:
                 return None
-            async with aiofiles.open(path, mode='r', encoding=cur_encode) as f:
-                await f.seek(pos)
-                content = await f.read(length)
-                return content
+            return await asyncio.to_thread(pdf_text.read, pos, length)
         else:
-            async with aiofiles.open(path,'rb') as f:
-                cur_encode = chardet.detect(await f.read())['encoding']
-
-            async with aiofiles.open(path, mode='r', encoding=cur_encode) as f:
+            cur_encode = await asyncio.to_thread(self._get_text_encoding, path)
+            async with aiofiles.open(path, mode='r', encoding=cur_encode, errors='replace') as f:
                 await f.seek(pos)
                 content = await f.read(length)
                 return content
@@ -369,6 +395,9 @@ class ScanLocalDocument:
         path = string.Template(config["path"]).substitute(myai_dir=AIStorage.get_instance().get_myai_dir())
         self.knowledge_base = LocalKnowledgeBase(workspace)
         self.path = path
+        # shared with ParseLocalDocument, which takes the documents parsed here
+        self.ingestor = DocumentIngestor.open(f"{self.knowledge_base.root_path}/kb.db",
+                                              max_workers=config.get("max_workers"), max_inflight=config.get("max_inflight"))
 
     def _support_file(self,file_name:str) -> bool:
         if file_name.startswith("."):
@@ -384,18 +413,20 @@ class ScanLocalDocument:
 
     async def next(self):
         while True:
-            for root, dirs, files in os.walk(self.path):
-                for file in files:
-                    if self._support_file(file):
-                        full_path = os.path.join(root, file)
-                        full_path = os.path.normpath(full_path)
-                        if self.knowledge_base.meta_db.is_doc_exist(full_path):
-                            continue
-                        yield(full_path, full_path)
-                    else:
-                        continue
+            # only new and changed files, already parsed in the ingestor's process pool
+            async for doc in self.ingestor.ingest(self.path, self._support_file):
+                yield(doc.path, doc.path)
             yield(None, None)
 
+    def get_metrics(self) -> dict:
+        return self.ingestor.get_metrics()
+
+    def close(self):
+        # the last handle of the ingestor shuts its process pool down
+        if self.ingestor is not None:
+            self.ingestor.close()
+            self.ingestor = None
+
 
 
 class ParseLocalDocument:
@@ -404,20 +435,46 @@ class ParseLocalDocument:
         workspace = string.Template(config["workspace"]).substitute(myai_dir=AIStorage.get_instance().get_myai_dir())
         self.todo_list = TodoListEnvironment(workspace, TodoListType.TO_LEARN)
         self.knowledge_base = LocalKnowledgeBase(workspace)
+        self.ingestor = DocumentIngestor.open(f"{self.knowledge_base.root_path}/kb.db",
+                                              max_workers=config.get("max_workers"), max_inflight=config.get("max_inflight"))
         self.token_limit = config.get("token_limit", 4000)
         self.assign_to = config.get("assign_to")
 
+    def close(self):
+        if self.ingestor is not None:
+            self.ingestor.close()
+            self.ingestor = None
 
     async def parse(self, full_path: str) -> str:
-        file_stat = os.stat(full_path)
-        if file_stat.st_size < 1:
+        doc = self.ingestor.take(full_path)
+        if doc is None:
+            file_stat = os.stat(full_path)
+            doc = await self.ingestor.parse_file(ScannedFile(full_path, file_stat.st_size, file_stat.st_mtime))
+            if doc is None:
+                return full_path
+        if doc.size < 1 or self.knowledge_base.meta_db.get_hash_by_doc_path(full_path) == doc.doc_hash:
+            # empty, or touched without changing the content
+            self.ingestor.commit(doc)
             return full_path
-        hash, parse_meta = self._parse_document(full_path)
+        hash, parse_meta = doc.doc_hash, doc.meta
         parse_meta["original_path"] = full_path
         llm_meta = await self._learn_by_agent(parse_meta)
-        self.knowledge_base.meta_db.add_doc(full_path,file_stat.st_size,file_stat.st_mtime,hash)
-        self.knowledge_base.meta_db.add_knowledge(hash,parse_meta)
-        self.knowledge_base.meta_db.set_knowledge_llm_result(hash,llm_meta)
+        meta_db = self.knowledge_base.meta_db
+        def learned(conn):
+            meta_db.add_doc(full_path,doc.size,doc.mtime,hash)
+            meta_db.add_knowledge(hash,parse_meta)
+            meta_db.set_knowledge_llm_result(hash,llm_meta)
+            # the journal is in kb.db too, the llm result and the commit are one transaction
+            self.ingestor.commit(doc)
+        await meta_db.db.abatch(learned)
+        try:
+            indexed = await self.knowledge_base.index_document(hash,full_path)
+        except Exception as e:
+            logger.warning(f"index document {full_path} error: {e}")
+            indexed = False
+        if not indexed:
+            # not parsed and sent to the llm again on every scan, it is indexed again when it changes
+            logger.warning(f"document {full_path} is learned but not indexed, the search won't find it")
         path_list = llm_meta.get("path")
         new_title = llm_meta.get("title")
         if path_list:
@@ -514,105 +571,14 @@ class ParseLocalDocument:
                     break
         return self.knowledge_base.learning_cache.remove(full_path)
 
-    def _parse_pdf_bookmarks(self,bookmarks, parent:list):
-        for item in bookmarks:
-            if isinstance(item,list):
-                self._parse_pdf_bookmarks(item,parent)
-            else:
-                if item.title:
-                    new_item = {}
-                    new_item["page"] = item.page.idnum
-                    new_item["title"] = item.title
-                    my_childs = []
-                    if item.childs:
-                        if len(item.childs) > 0:
-                            self._parse_pdf_bookmarks(item.childs, my_childs)
-                            new_item["childs"] = my_childs
-                    parent.append(new_item)
-                else:
-                    logger.warning("parse pdf bookmarks failed: item.title is None!")
-
-        return
-
     def _parse_pdf(self,doc_path:str):
-        metadata = {}
-        with open(doc_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            try:
-                doc_info = reader.metadata
-                if doc_info:
-                    if doc_info.title:
-                        metadata["title"] = doc_info.title
-                    if doc_info.author:
-                        metadata["authors"] = doc_info.author
-            except Exception as e:
-                logger.warn("parse pdf metadata failed:%s",e)
-
-            dir_path = os.path.dirname(doc_path)
-            base_name = os.path.basename(doc_path)
-            text_content_path = f"{dir_path}/.{base_name}.txt"
-            full_text = ""
-
-            for page in reader.pages:
-                text = page.extract_text()
-                full_text += text
-            with open(text_content_path, 'w', encoding='utf-8') as f:
-                f.write(full_text)
-
-            try:
-                bookmarks = reader.outline
-                if bookmarks:
-                    catalogs = []
-                    self._parse_pdf_bookmarks(bookmarks,catalogs)
-                    metadata["catalogs"] = json.dumps(catalogs,ensure_ascii=False)
-            except Exception as e:
-                logger.warn("parse pdf bookmarks failed:%s",e)
-
-        return metadata
+        return document_parser.parse_pdf(doc_path)
 
     def _parse_txt(self,doc_path:str):
         return {}
 
     def _parse_md(self,doc_path:str):
-        metadata = {}
-        cur_encode = "utf-8"
-        with open(doc_path,'rb') as f:
-            cur_encode = chardet.detect(f.read(1024))['encoding']
-
-        with open(doc_path, mode='r', encoding=cur_encode) as f:
-            content = f.read()
-            match = re.search(r'^# (.*)', content, re.MULTILINE)
-            if match:
-                metadata['title'] = match.group(1).strip()
-            md = Markdown(extensions=['toc'])
-            html_str = md.convert(content)
-            toc = md.toc
-            if toc:
-                metadata['catalogs'] = toc
-
-        return metadata
+        return document_parser.parse_md(doc_path)
 
     def _parse_document(self,doc_path:str):
-        hash_result = None
-        title = os.path.basename(doc_path)
-        meta_data = {}
-
-        with open(doc_path, "rb") as f:
-            hash_md5 = hashlib.md5()
-            for chunk in iter(lambda: f.read(1024*1024), b""):
-                hash_md5.update(chunk)
-            hash_result = hash_md5.hexdigest()
-        try:
-            if doc_path.endswith(".md"):
-                meta_data = self._parse_md(doc_path)
-            elif doc_path.endswith(".pdf"):
-                meta_data = self._parse_pdf(doc_path)
-        except Exception as e:
-            logger.error("parse document %s failed:%s",doc_path,e)
-            # traceback.print_exc()
-
-        if not "title" in meta_data:
-            meta_data["title"] = title
-        logger.info("parse document %s!",doc_path)
-        return hash_result, meta_data
-
+        return document_parser.parse_document(doc_path)
@@ -0,0 +1,152 @@
+import os
+import json
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import PyPDF2
+
+logger = logging.getLogger(__name__)
+
+# Text of a pdf, extracted page by page into the .{name}.txt sidecar (utf-8) with a page index next to it (.{name}.txt.idx):
+# the byte and char offset where each extracted page starts, and the size/mtime of the pdf it was extracted from.
+# Pages are extracted in order and only as far as a read needs them, an up to date sidecar is never extracted again.
+# A read of pos/length (in chars) finds the pages by bisect, seeks to the first one and decodes only those pages.
+
+PDF_INDEX_VERSION = 1
+# PdfText objects kept by open(), each holds the page index of one pdf
+PDF_TEXT_CACHE_SIZE = 64
+
+
+class PdfText:
+    _cache : OrderedDict = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, pdf_path: str) -> 'PdfText':
+        """ the shared PdfText of pdf_path, reloaded when the pdf changed """
+        pdf_key = os.path.abspath(pdf_path)
+        with cls._cache_lock:
+            pdf_text = cls._cache.get(pdf_key)
+            if pdf_text is not None and pdf_text.source == PdfText._source_stat(pdf_path):
+                cls._cache.move_to_end(pdf_key)
+                return pdf_text
+            pdf_text = PdfText(pdf_path)
+            cls._cache[pdf_key] = pdf_text
+            while len(cls._cache) > PDF_TEXT_CACHE_SIZE:
+                cls._cache.popitem(last=False)
+            return pdf_text
+
+    def __init__(self, pdf_path: str) -> None:
+        self.pdf_path = pdf_path
+        dir_path = os.path.dirname(pdf_path)
+        base_name = os.path.basename(pdf_path)
+        self.text_path = f"{dir_path}/.{base_name}.txt"
+        self.index_path = f"{self.text_path}.idx"
+        self.lock = threading.Lock()
+
+        self.source = PdfText._source_stat(pdf_path)
+        self.page_count : Optional[int] = None
+        self.page_bytes : List[int] = []
+        self.page_chars : List[int] = []
+        self.byte_size = 0
+        self.char_size = 0
+        self._load_index()
+
+    @staticmethod
+    def _source_stat(pdf_path: str) -> list:
+        stat = os.stat(pdf_path)
+        return [stat.st_size, stat.st_mtime]
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index["version"] == PDF_INDEX_VERSION and index["source"] == self.source \
+                    and os.path.getsize(self.text_path) == index["byte_size"]:
+                self.page_count = index["page_count"]
+                self.page_bytes = index["page_bytes"]
+                self.page_chars = index["page_chars"]
+                self.byte_size = index["byte_size"]
+                self.char_size = index["char_size"]
+                return
+            logger.info(f"pdf text of {self.pdf_path} is out of date, extract again")
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save_index(self):
+        index = {
+            "version": PDF_INDEX_VERSION,
+            "source": self.source,
+            "page_count": self.page_count,
+            "page_bytes": self.page_bytes,
+            "page_chars": self.page_chars,
+            "byte_size": self.byte_size,
+            "char_size": self.char_size,
+        }
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path)
+
+    def is_complete(self) -> bool:
+        return self.page_count is not None and len(self.page_bytes) == self.page_count
+
+    def extract(self, until_char: Optional[int] = None, reader: Optional[PyPDF2.PdfReader] = None):
+        """ extract the next pages until the text reaches until_char (all pages when None).
+            reader is an already open reader of the pdf """
+        with self.lock:
+            self._extract(until_char, reader)
+
+    def _extract(self, until_char: Optional[int], reader: Optional[PyPDF2.PdfReader]):
+        if self.is_complete() or (until_char is not None and self.char_size >= until_char):
+            return
+        pdf_file = None
+        if reader is None:
+            pdf_file = open(self.pdf_path, "rb")
+            reader = PyPDF2.PdfReader(pdf_file)
+        try:
+            self.page_count = len(reader.pages)
+            # a new extraction starts an empty sidecar, a resumed one appends to it
+            with open(self.text_path, "ab" if self.page_bytes else "wb") as text_file:
+                while len(self.page_bytes) < self.page_count:
+                    if until_char is not None and self.char_size >= until_char:
+                        break
+                    try:
+                        text = reader.pages[len(self.page_bytes)].extract_text() or ""
+                    except Exception as e:
+                        logger.warning(f"extract page {len(self.page_bytes)} of {self.pdf_path} failed: {e}")
+                        text = ""
+                    data = text.encode("utf-8")
+                    text_file.write(data)
+                    self.page_bytes.append(self.byte_size)
+                    self.page_chars.append(self.char_size)
+                    self.byte_size += len(data)
+                    self.char_size += len(text)
+            self._save_index()
+        finally:
+            if pdf_file is not None:
+                pdf_file.close()
+
+    def read(self, pos: int = 0, length: Optional[int] = None) -> str:
+        """ length chars of the text from pos (to the end when length is None) """
+        end = None if length is None else pos + length
+        with self.lock:
+            if not self.is_complete() and (end is None or end > self.char_size):
+                self._extract(end, None)
+            if end is None or end > self.char_size:
+                end = self.char_size
+            if pos >= end:
+                return ""
+
+            first_page = bisect.bisect_right(self.page_chars, pos) - 1
+            end_page = bisect.bisect_left(self.page_chars, end)
+            begin_byte = self.page_bytes[first_page]
+            end_byte = self.page_bytes[end_page] if end_page < len(self.page_bytes) else self.byte_size
+            with open(self.text_path, "rb") as f:
+                f.seek(begin_byte)
+                text = f.read(end_byte - begin_byte).decode("utf-8")
+        skip = pos - self.page_chars[first_page]
+        return text[skip:skip + end - pos]
@@ -10,7 +10,7 @@ from urllib.parse import urlparse
 from typing import Optional
 
 #from aios import KnowledgeStore, ObjectType
-from aios.frame.tunnel import AgentTunnel
+from aios.frame.tunnel import AgentTunnel, StreamingReply
 from aios.proto.agent_msg import AgentMsg, AgentMsgType
 import discord
 
@@ -154,10 +154,16 @@ class DiscordTunnel(AgentTunnel):
                 agent_msg.body = agent_msg.create_audio_body(audio_file, content)
                 agent_msg.body_mime = f"audio/{ext}"
 
-            resp_msg: AgentMsg = await self.ai_bus.send_message(agent_msg)
+            # the reply is shown while the agent generates it
+            reply = StreamingReply(message.channel.send, lambda sent,text: sent.edit(content=text), lambda sent: sent.delete())
+            resp_msg: AgentMsg = await self.ai_bus.send_message(agent_msg,on_stream=reply.on_stream)
             if resp_msg is None:
+                await reply.discard()
                 await message.channel.send(f"System Error: Timeout,{self.target_id}  no resopnse! Please check logs/aios.log for more details!")
+            elif resp_msg.is_text_msg() and await reply.finish(resp_msg.body):
+                return
             else:
+                await reply.discard()
                 if resp_msg.body_mime is None:
                     if resp_msg.body is None:
                         return
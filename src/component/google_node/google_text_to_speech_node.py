@@ -1,13 +1,12 @@
 
 import os
 import asyncio
-from asyncio import Queue
 import logging
 from typing import Optional
 
 from google.cloud import texttospeech
 
-from aios import AIStorage,ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType,ComputeNode
+from aios import AIStorage,ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType,ComputeNode,ComputeTaskQueue
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +29,7 @@ class GoogleTextToSpeechNode(ComputeNode):
     def __init__(self):
         super().__init__()
         self.node_id = "google_text_to_speech_node"
-        self.task_queue = Queue()
+        self.task_queue = ComputeTaskQueue()
         self.client: Optional[texttospeech.TextToSpeechClient] = None
 
         self.language_list = {
@@ -97,6 +96,8 @@ class GoogleTextToSpeechNode(ComputeNode):
         async def _run_task_loop():
             while True:
                 task = await self.task_queue.get()
+                if task.is_cancelled:
+                    continue
                 try:
                     result = self._run_task(task)
                     if result is not None:
@@ -154,9 +155,9 @@ class GoogleTextToSpeechNode(ComputeNode):
         result.result = response.audio_content
         return result
 
-    async def push_task(self, task: ComputeTask, proiority: int = 0):
+    async def push_task(self, task: ComputeTask, proiority: int = None):
         logger.info(f"google_text_to_speech_node push task: {task.display()}")
-        self.task_queue.put_nowait(task)
+        self.task_queue.push(task, proiority)
 
     async def remove_task(self, task_id: str):
         pass
@@ -167,9 +168,6 @@ class GoogleTextToSpeechNode(ComputeNode):
     def display(self) -> str:
         return f"GoogleTextToSpeechNode: {self.node_id}"
 
-    def get_capacity(self):
-        return 0
-
     def is_support(self, task: ComputeTask) -> bool:
         if task.task_type == ComputeTaskType.TEXT_2_VOICE:
             return True
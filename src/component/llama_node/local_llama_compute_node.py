@@ -1,8 +1,9 @@
 
+import json
 import logging
-import requests
+from typing import List, Union
 
-from aios import ComputeTask,Queue_ComputeNode, ComputeTaskResult, ComputeTaskResultCode, ComputeTaskState, ComputeTaskType,AIStorage,UserConfig
+from aios import ComputeTask,Queue_ComputeNode, ComputeTaskResult, ComputeTaskResultCode, ComputeTaskState, ComputeTaskType,AIStorage,UserConfig,AsyncHttpClient
 
 logger = logging.getLogger(__name__)
 
@@ -11,10 +12,13 @@ This is a custom implementation, it should be redesigned.
 """
 
 class LocalLlama_ComputeNode(Queue_ComputeNode):
-    def __init__(self, url: str, model_name: str):
-        super().__init__()
+    def __init__(self, url: str, model_name: str, max_workers: int = 1, timeout: float = 600):
+        super().__init__(max_workers)
         self.url = url
         self.model_name = model_name
+        self.timeout = timeout
+        # several llama servers can be registered to the compute kernel at the same time
+        self.node_id = f"local_llama:{model_name}@{url}"
 
     async def execute_task(self, task: ComputeTask)->ComputeTaskResult:
         result = ComputeTaskResult()
@@ -27,7 +31,7 @@ class LocalLlama_ComputeNode(Queue_ComputeNode):
                 input = task.params["input"]
                 logger.info(f"call local-llama ({self.url}, {self.model_name}) {model_name} input: {input}")
 
-                self.embedding(input, result)
+                await self.embedding(input, result)
                 
                 if result.result_code == ComputeTaskResultCode.OK:
                     task.state = ComputeTaskState.DONE
@@ -42,7 +46,7 @@ class LocalLlama_ComputeNode(Queue_ComputeNode):
                     
                 logger.info(f"local-llama({self.url}, {self.model_name}) prompts: {prompts}")
 
-                self.completion(task, result)
+                await self.completion(task, result)
 
                 if result.result_code == ComputeTaskResultCode.OK:
                     task.state = ComputeTaskState.DONE
@@ -65,29 +69,35 @@ class LocalLlama_ComputeNode(Queue_ComputeNode):
     def display(self) -> str:
         return f"local-llama: {self.node_id}"
 
-    def get_capacity(self):
-        pass
-
     def is_support(self, task: ComputeTask) -> bool:
         return (task.task_type == ComputeTaskType.TEXT_EMBEDDING or task.task_type == ComputeTaskType.LLM_COMPLETION) and (not task.params["model_name"] or task.params["model_name"] == self.model_name)
 
+    def is_support_batch(self, task: ComputeTask) -> bool:
+        return task.task_type == ComputeTaskType.TEXT_EMBEDDING
+
     def is_local(self) -> bool:
         return True
 
-    def embedding(self, input: str, result: ComputeTaskResult):
+    async def embedding(self, input: Union[str, List[str]], result: ComputeTaskResult):
         body = {
             "input": input
         }
         
         try:
-            response = requests.post(self.url + "/v1/embeddings", json = body, verify=False, headers={"Content-Type": "application/json"})
-            response.close()
+            response = await AsyncHttpClient.get_instance().post(self.url + "/v1/embeddings", json_body = body, verify_ssl=False,
+                                                                  headers={"Content-Type": "application/json"}, timeout=self.timeout)
 
             logger.info(f"local-llama({self.url}, {self.model_name}) task responsed, request: {body}, status-code: {response.status_code}, headers: {response.headers}, content: {response.content}")
 
             if response.status_code == 200:
                 resp = response.json()
-                result.result = resp["data"][0]["embedding"]
+                result.result_code = ComputeTaskResultCode.OK
+                if isinstance(input, list):
+                    # a batch request, one vector for each input in the order of inputs
+                    data = sorted(resp["data"], key=lambda item: item.get("index", 0))
+                    result.result["content"] = [item["embedding"] for item in data]
+                else:
+                    result.result["content"] = resp["data"][0]["embedding"]
             elif response.status_code == 422:
                 resp = response.json()
                 result.result_code = ComputeTaskResultCode.ERROR
@@ -101,7 +111,7 @@ class LocalLlama_ComputeNode(Queue_ComputeNode):
             result.error_str = str(e)
             return result
         
-    def completion(self, task: ComputeTask, result: ComputeTaskResult):
+    async def completion(self, task: ComputeTask, result: ComputeTaskResult):
         mode_name = task.params["model_name"]
         prompts = task.params["prompts"]
         max_token_size = task.params.get("max_token_size")
@@ -130,24 +140,33 @@ class LocalLlama_ComputeNode(Queue_ComputeNode):
                 })
 
         for prompt in prompts:
-            body["messages"].append({
+            message = {
                 "role": prompt["role"],
                 "content": prompt["content"]
-            })
+            }
+            # the calls of a turn and the results which refer to them
+            for key in ["name", "function_call", "tool_calls", "tool_call_id"]:
+                if prompt.get(key):
+                    message[key] = prompt[key]
+            body["messages"].append(message)
         
         try:
             logger.info(f"will post http request to {self.url}/v1/chat/completions, body: {body}")
 
-            response = requests.post(self.url + "/v1/chat/completions", json = body, verify=False, headers={"Content-Type": "application/json"})
-            response.close()
-
-            logger.info(f"local-llama({self.url}, {self.model_name}) task responsed, request: {body}, status-code: {response.status_code}, headers: {response.headers}, content: {response.content}")
+            if task.params.get("stream"):
+                body["stream"] = True
+                status_code, resp = await self._stream_completion(task, body)
+            else:
+                response = await AsyncHttpClient.get_instance().post(self.url + "/v1/chat/completions", json_body = body, verify_ssl=False,
+                                                                      headers={"Content-Type": "application/json"}, timeout=self.timeout)
 
-            if response.status_code == 200:
-                resp = response.json()
+                logger.info(f"local-llama({self.url}, {self.model_name}) task responsed, request: {body}, status-code: {response.status_code}, headers: {response.headers}, content: {response.content}")
+                status_code = response.status_code
+                resp = response.json() if status_code == 200 or status_code == 422 else None
 
+            if status_code == 200:
                 status_code = resp["choices"][0]["finish_reason"]
-                token_usage = resp["usage"]
+                token_usage = resp.get("usage")
 
                 match status_code:
                     case "tool_calls":
@@ -173,15 +192,60 @@ class LocalLlama_ComputeNode(Queue_ComputeNode):
                     result.result_refers["token_usage"] = token_usage
 
                 logger.info(f"local-llama({self.url}, {self.model_name}) success response: {result.result_str}")
-            elif response.status_code == 422:
-                resp = response.json()
+            elif status_code == 422:
                 result.result_code = ComputeTaskResultCode.ERROR
                 result.error_str = "http request failed: " + str(resp["detail"][0]["msg"])
             else:
                 result.result_code = ComputeTaskResultCode.ERROR
-                result.error_str = "http request failed: " + str(response.status_code)
+                result.error_str = "http request failed: " + str(status_code)
         except Exception as e:
             logger.error(f"call local-llama({self.url}, {self.model_name}) run LLM_COMPLETION task error: {e}")
             result.result_code = ComputeTaskResultCode.ERROR
             result.error_str = str(e)
-            return result
\ No newline at end of file
+            return result
+
+    async def _stream_completion(self, task: ComputeTask, body: dict):
+        # the content tokens go to the task as they arrive, returns the status code and a response as without streaming
+        async with AsyncHttpClient.get_instance().stream("POST", self.url + "/v1/chat/completions", json_body = body, verify_ssl=False,
+                                                         headers={"Content-Type": "application/json"}, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                content = (await response.read()).content
+                logger.info(f"local-llama({self.url}, {self.model_name}) stream task responsed, status-code: {response.status_code}, content: {content}")
+                return response.status_code, json.loads(content) if response.status_code == 422 else None
+
+            content = ""
+            function_call = None
+            tool_calls = {}
+            finish_reason = None
+            async for data in response.iter_sse_data():
+                chunk = json.loads(data)
+                if not chunk.get("choices"):
+                    continue
+                choice = chunk["choices"][0]
+                delta = choice.get("delta") or {}
+                if delta.get("content"):
+                    content += delta["content"]
+                    task.push_token(delta["content"])
+                delta_call = delta.get("function_call")
+                if delta_call:
+                    if function_call is None:
+                        function_call = {"name": "", "arguments": ""}
+                    function_call["name"] += delta_call.get("name") or ""
+                    function_call["arguments"] += delta_call.get("arguments") or ""
+                for delta_tool_call in delta.get("tool_calls") or []:
+                    tool_call = tool_calls.setdefault(delta_tool_call.get("index", 0), {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                    tool_call["id"] += delta_tool_call.get("id") or ""
+                    delta_func = delta_tool_call.get("function") or {}
+                    tool_call["function"]["name"] += delta_func.get("name") or ""
+                    tool_call["function"]["arguments"] += delta_func.get("arguments") or ""
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+
+        message = {"role": "assistant", "content": content if content else None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+            if function_call is None:
+                function_call = dict(message["tool_calls"][0]["function"])
+        if function_call is not None:
+            message["function_call"] = function_call
+        return 200, {"choices": [{"finish_reason": finish_reason, "message": message}], "usage": None}
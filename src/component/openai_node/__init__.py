@@ -1,4 +1,5 @@
 from .open_ai_node import *
 from .openai_tts_node import *
 from .whisper_node import *
-from .dall_e_compute_node import *
\ No newline at end of file
+from .dall_e_compute_node import *
+from .openai_client_pool import OpenAIClientPool
\ No newline at end of file
@@ -1,15 +1,13 @@
 import os
 import io
 import asyncio
-from asyncio import Queue
 import logging
 from pathlib import Path
-from openai import OpenAI
 import base64
 
 from PIL import Image
 
-from aios import ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType, ComputeTaskResultCode,ComputeNode, AIStorage, UserConfig
+from aios import ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType, ComputeTaskResultCode,ComputeNode, AIStorage, UserConfig,ComputeTaskQueue,AsyncHttpClient
 
 logger = logging.getLogger(__name__)
 
@@ -42,7 +40,7 @@ class DallEComputeNode(ComputeNode):
         self.openai_api_key = ""
         self.default_model = "dall-e-3"
 
-        self.task_queue = Queue()
+        self.task_queue = ComputeTaskQueue()
 
     async def initial(self):
         if os.getenv("OPENAI_API_KEY") is not None:
@@ -68,14 +66,19 @@ class DallEComputeNode(ComputeNode):
 
         return True
 
-    async def push_task(self, task: ComputeTask, proiority: int = 0):
+    async def push_task(self, task: ComputeTask, proiority: int = None):
         logger.info(f"DallE_node push task: {task.display()}")
-        self.task_queue.put_nowait(task)
+        self.task_queue.push(task, proiority)
 
     async def remove_task(self, task_id: str):
         pass
 
-    def _run_task(self, task: ComputeTask):
+    @staticmethod
+    def _save_image(image_base64: str, file_name: str):
+        image = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+        image.save(file_name)
+
+    async def _run_task(self, task: ComputeTask):
         task.state = ComputeTaskState.RUNNING
         result = ComputeTaskResult()
         result.result_code = ComputeTaskResultCode.ERROR
@@ -84,21 +87,22 @@ class DallEComputeNode(ComputeNode):
         try:
             prompt = task.params["prompt"]
             logging.info(f"Call DallE {self.default_model} prompts: {prompt}")
-            client = OpenAI(api_key=self.openai_api_key)
-
-            response = client.images.generate(
-                model=self.default_model,
-                prompt=prompt,
-                size="1024x1024",
-                quality="standard",
-                n=1,
-                response_format="b64_json",
-            )
-
-            binary_data = base64.b64decode(response.data[0].b64_json)
-            image = Image.open(io.BytesIO(binary_data))
+            body = {
+                "model": self.default_model,
+                "prompt": prompt,
+                "size": "1024x1024",
+                "quality": "standard",
+                "n": 1,
+                "response_format": "b64_json",
+            }
+            headers = {"Authorization": f"Bearer {self.openai_api_key}", "Content-Type": "application/json"}
+            response = await AsyncHttpClient.get_instance().post("https://api.openai.com/v1/images/generations",
+                                                                 json_body=body, headers=headers)
+            if response.status_code != 200:
+                raise Exception(f"{response.status_code}, {response.text}")
+
             file_name = os.path.join(self.output_dir, task.task_id + ".png")
-            image.save(file_name)
+            await asyncio.to_thread(self._save_image, response.json()["data"][0]["b64_json"], file_name)
             
             task.state = ComputeTaskState.DONE
             result.result_code = ComputeTaskResultCode.OK
@@ -123,8 +127,12 @@ class DallEComputeNode(ComputeNode):
             while True:
                 logger.info("Dall E node is waiting for task...")
                 task = await self.task_queue.get()
+                if task.is_cancelled:
+                    continue
                 logger.info(f"Dall E node get task: {task.display()}")
-                result = self._run_task(task)
+                result = await self.run_cancellable(task, self._run_task(task))
+                if result is not None:
+                    task.result = result
 
         asyncio.create_task(_run_task_loop())
 
@@ -134,9 +142,6 @@ class DallEComputeNode(ComputeNode):
     def get_task_state(self, task_id: str):
         pass
 
-    def get_capacity(self):
-        pass
-
     def is_support(self, task: ComputeTask) -> bool:
         return task.task_type == ComputeTaskType.TEXT_2_IMAGE
 
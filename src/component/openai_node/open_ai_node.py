@@ -3,16 +3,16 @@ import openai
 from openai import AsyncOpenAI
 import os
 import asyncio
-from asyncio import Queue
 import logging
 import json
 import aiohttp
 import base64
-import requests
 from openai._types import NOT_GIVEN
 
-from aios import ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType,ComputeTaskResultCode,ComputeNode,AIStorage,UserConfig
+from aios import ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType,ComputeTaskResultCode,ComputeNode,AIStorage,UserConfig,ComputeTaskQueue
 from aios import image_utils
+from aios import AsyncHttpClient
+from .openai_client_pool import OpenAIClientPool, get_openai_base_url
 
 logger = logging.getLogger(__name__)
 
@@ -27,9 +27,13 @@ class OpenAI_ComputeNode(ComputeNode):
 
     @classmethod
     def declare_user_config(cls):
+        user_config = AIStorage.get_instance().get_user_config()
         if os.getenv("OPENAI_API_KEY") is None:
-            user_config = AIStorage.get_instance().get_user_config()
             user_config.add_user_config("openai_api_key","openai api key",False,None)
+        if os.getenv("OPENAI_BASE_URL") is None:
+            user_config.add_user_config("openai_base_url","base url of openai api",True,"https://api.openai.com/v1")
+        user_config.add_user_config("openai_max_workers","max concurrent requests of openai node",True,8)
+        user_config.add_user_config("openai_model_max_workers","max concurrent requests of each openai model",True,{})
 
     def __init__(self) -> None:
         super().__init__()
@@ -38,8 +42,8 @@ class OpenAI_ComputeNode(ComputeNode):
         # openai.organization = "org-AoKrOtF2myemvfiFfnsSU8rF" #buckycloud
         self.openai_api_key = None
         self.node_id = "openai_node"
-        self.task_queue = Queue()
-
+        self.task_queue = ComputeTaskQueue()
+        self.client_pool = OpenAIClientPool()
 
     async def initial(self):
         if os.getenv("OPENAI_API_KEY") is not None:
@@ -52,12 +56,19 @@ class OpenAI_ComputeNode(ComputeNode):
             return False
 
         openai.api_key = self.openai_api_key
+        self.client_pool.configure(self.openai_api_key, get_openai_base_url())
+
+        user_config = AIStorage.get_instance().get_user_config()
+        max_workers = user_config.get_value("openai_max_workers")
+        if max_workers is not None:
+            self.set_parallelism(max_workers, user_config.get_value("openai_model_max_workers"))
+
         self.start()
         return True
 
-    async def push_task(self, task: ComputeTask, proiority: int = 0):
+    async def push_task(self, task: ComputeTask, proiority: int = None):
         logger.info(f"openai_node push task: {task.display()}")
-        self.task_queue.put_nowait(task)
+        self.task_queue.push(task, proiority)
 
     async def remove_task(self, task_id: str):
         pass
@@ -92,7 +103,50 @@ class OpenAI_ComputeNode(ComputeNode):
         # result["message"] = result_msg
         return result
 
-    def _image_2_text(self, task: ComputeTask):
+    async def _stream_chat_completion(self, task: ComputeTask, client: AsyncOpenAI, **kwargs):
+        # the content tokens go to the task as they arrive, returns the whole message and the finish reason
+        content = ""
+        function_call = None
+        # the parts of each tool call come with its index
+        tool_calls = {}
+        finish_reason = None
+        stream = await client.chat.completions.create(stream=True, **kwargs)
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if delta.content:
+                content += delta.content
+                task.push_token(delta.content)
+            if delta.function_call:
+                if function_call is None:
+                    function_call = {"name": "", "arguments": ""}
+                if delta.function_call.name:
+                    function_call["name"] += delta.function_call.name
+                if delta.function_call.arguments:
+                    function_call["arguments"] += delta.function_call.arguments
+            for delta_call in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(delta_call.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                if delta_call.id:
+                    tool_call["id"] += delta_call.id
+                if delta_call.function and delta_call.function.name:
+                    tool_call["function"]["name"] += delta_call.function.name
+                if delta_call.function and delta_call.function.arguments:
+                    tool_call["function"]["arguments"] += delta_call.function.arguments
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+
+        # the same fields as message_to_dict of a whole response
+        message = {
+            "role": "assistant",
+            "content": content if content else None,
+            "function_call": function_call,
+            "tool_calls": [tool_calls[index] for index in sorted(tool_calls)] if tool_calls else None,
+        }
+        return message, finish_reason
+
+    async def _image_2_text(self, task: ComputeTask):
         logger.info('openai image_2_text')
         # 本地图片处理
 
@@ -104,7 +158,7 @@ class OpenAI_ComputeNode(ComputeNode):
         image_path = task.params["image_path"]
 
         if image_utils.is_file(image_path):
-            url = image_utils.to_base64(image_path, (1024, 1024))
+            url = await asyncio.to_thread(image_utils.to_base64, image_path, (1024, 1024))
         else:
             url = image_path
 
@@ -131,7 +185,7 @@ class OpenAI_ComputeNode(ComputeNode):
         }
         logger.info('openai send image_2_text request ')
         # openai 的库的Vision只支持传图片的url地址。本地图片得用request
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        response = await AsyncHttpClient.get_instance().post(f"{self.client_pool.base_url}/chat/completions", headers=headers, json_body=payload)
         if response.status_code == 200:
             logger.info('openai image_2_text success')
             return response.json()
@@ -153,8 +207,8 @@ class OpenAI_ComputeNode(ComputeNode):
                 input = task.params["input"]
                 logger.info(f"call openai {model_name} input: {input}")
                 try:
-                    resp = openai.Embedding.create(model=model_name,
-                                                input=input)
+                    resp = await self.client_pool.get_client().embeddings.create(model=model_name,
+                                                                                input=input)
                 except Exception as e:
                     logger.error(f"openai run TEXT_EMBEDDING task error: {e}")
                     task.state = ComputeTaskState.ERROR
@@ -181,14 +235,15 @@ class OpenAI_ComputeNode(ComputeNode):
                 task.state = ComputeTaskState.DONE
                 result.result_code = ComputeTaskResultCode.OK
                 result.worker_id = self.node_id
-                result.result_str = resp["data"][0]["embedding"]
+                result.result_str = resp.data[0].embedding
+                result.result["content"] = resp.data[0].embedding
 
                 return result
             case ComputeTaskType.IMAGE_2_TEXT:
                 result.result_code = ComputeTaskResultCode.OK
                 result.worker_id = self.node_id
                 # result.result_str = resp["data"][0]["image_2_text"]
-                result.result["message"] = self._image_2_text(task)
+                result.result["message"] = await self._image_2_text(task)
                 return result
             case ComputeTaskType.LLM_COMPLETION:
                 mode_name = task.params["model_name"]
@@ -213,25 +268,45 @@ class OpenAI_ComputeNode(ComputeNode):
                 else:
                     result_token = NOT_GIVEN
 
-                client = AsyncOpenAI(api_key=self.openai_api_key)
+                client = self.client_pool.get_client()
+                # the vision model reports its finish reason differently, it isn't streamed
+                is_stream = task.params.get("stream") and mode_name != "gpt-4-vision-preview"
                 try:
                     if llm_inner_functions is None or len(llm_inner_functions) == 0:
                         if mode_name != "gpt-4-vision-preview":
                             logger.info(f"call openai {mode_name} prompts: {prompts}")
-                        resp = await client.chat.completions.create(model=mode_name,
-                                                        messages=prompts,
-                                                        response_format = response_format,
-                                                        max_tokens=result_token,
-                                                        )
+                        llm_tools = NOT_GIVEN
                     else:
                         if mode_name != "gpt-4-vision-preview":
                             logger.info(f"call openai {mode_name} prompts: \n\t {prompts} \nfunctions: \n\t{json.dumps(llm_inner_functions,ensure_ascii=False)}")
+                        # as tools the model can call several functions in one turn
+                        llm_tools = [{"type": "function", "function": func} for func in llm_inner_functions]
+
+                    if is_stream:
+                        result_message, status_code = await self._stream_chat_completion(task, client,
+                                                                                         model=mode_name,
+                                                                                         messages=prompts,
+                                                                                         response_format = response_format,
+                                                                                         tools=llm_tools,
+                                                                                         max_tokens=result_token)
+                        token_usage = None
+                    else:
                         resp = await client.chat.completions.create(model=mode_name,
                                                             messages=prompts,
                                                             response_format = response_format,
-                                                            functions=llm_inner_functions,
+                                                            tools=llm_tools,
                                                             max_tokens=result_token,
                                                             ) # TODO: add temperature to task params?
+                        #logger.info(f"openai response: {resp}")
+                        #TODO: gpt-4v api is image_2_text ?
+                        if mode_name == "gpt-4-vision-preview":
+                            status_code = resp.choices[0].finish_reason
+                            if status_code is None:
+                                status_code = resp.choices[0].finish_details['type']
+                        else:
+                            status_code = resp.choices[0].finish_reason
+                        token_usage = resp.usage
+                        result_message = self.message_to_dict(resp.choices[0].message)
                 except Exception as e:
                     logger.error(f"openai run LLM_COMPLETION task error: {e}")
                     task.state = ComputeTaskState.ERROR
@@ -239,18 +314,8 @@ class OpenAI_ComputeNode(ComputeNode):
                     result.error_str = str(e)
                     return result
 
-                #logger.info(f"openai response: {resp}")
-                #TODO: gpt-4v api is image_2_text ?
-                if mode_name == "gpt-4-vision-preview":
-                    status_code = resp.choices[0].finish_reason
-                    if status_code is None:
-                        status_code = resp.choices[0].finish_details['type']
-                else:
-                    status_code = resp.choices[0].finish_reason
-                token_usage = resp.usage
-
                 match status_code:
-                    case "function_call":
+                    case "function_call" | "tool_calls":
                         task.state = ComputeTaskState.DONE
                     case "stop":
                         task.state = ComputeTaskState.DONE
@@ -263,9 +328,9 @@ class OpenAI_ComputeNode(ComputeNode):
 
                 result.result_code = ComputeTaskResultCode.OK
                 result.worker_id = self.node_id
-                result.result_str = resp.choices[0].message.content
+                result.result_str = result_message.get("content")
 
-                result.result["message"] = self.message_to_dict(resp.choices[0].message)
+                result.result["message"] = result_message
 
                 if token_usage:
                     result.result_refers["token_usage"] = token_usage
@@ -286,13 +351,24 @@ class OpenAI_ComputeNode(ComputeNode):
         async def _run_task_loop():
             while True:
                 task = await self.task_queue.get()
+                if task.is_cancelled:
+                    continue
                 logger.info(f"openai_node get task: {task.display()}")
-                result = await self._run_task(task)
+                async with self.task_slot(task):
+                    if task.is_cancelled:
+                        continue
+                    result = await self.run_cancellable(task, self._run_task(task))
                 if result is not None:
                     task.result = result
                     task.state = ComputeTaskState.DONE
 
-        asyncio.create_task(_run_task_loop())
+        for _ in range(self.max_workers):
+            asyncio.create_task(_run_task_loop())
+
+    def get_capacity(self) -> dict:
+        capacity = super().get_capacity()
+        capacity["client_pool"] = self.client_pool.get_metrics()
+        return capacity
 
     def display(self) -> str:
         return f"OpenAI_ComputeNode: {self.node_id}"
@@ -300,9 +376,6 @@ class OpenAI_ComputeNode(ComputeNode):
     def get_task_state(self, task_id: str):
         pass
 
-    def get_capacity(self):
-        pass
-
 
     def is_support(self, task: ComputeTask) -> bool:
         if task.task_type == ComputeTaskType.LLM_COMPLETION:
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from aios import AIStorage
+
+logger = logging.getLogger(__name__)
+
+# One AsyncOpenAI client (and its httpx connection pool) per compute node, shared by all tasks of the node.
+# Creating a client for each task throws away the keep-alive connections, so every completion pays a new TCP+TLS handshake.
+
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+
+def get_openai_base_url() -> str:
+    # an openai compatible server (a local stub, a proxy) can be used instead of api.openai.com
+    if os.getenv("OPENAI_BASE_URL") is not None:
+        return os.getenv("OPENAI_BASE_URL")
+    base_url = AIStorage.get_instance().get_user_config().get_value("openai_base_url")
+    if base_url:
+        return base_url
+    return DEFAULT_OPENAI_BASE_URL
+
+
+class OpenAIPoolMetrics:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.clients_created = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connections_reused": self.connections_reused,
+            "clients_created": self.clients_created,
+        }
+
+
+class _MeteredTransport(httpx.AsyncHTTPTransport):
+    # httpcore reports a tcp connect through the trace extension, a request without it ran on a pooled connection
+    def __init__(self, metrics: OpenAIPoolMetrics, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        is_opened = False
+        origin_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict):
+            nonlocal is_opened
+            if event_name == "connection.connect_tcp.complete":
+                is_opened = True
+            if origin_trace is not None:
+                await origin_trace(event_name, info)
+
+        request.extensions = dict(request.extensions)
+        request.extensions["trace"] = trace
+
+        response = await super().handle_async_request(request)
+        self.metrics.requests += 1
+        if is_opened:
+            self.metrics.connections_opened += 1
+        else:
+            self.metrics.connections_reused += 1
+        return response
+
+
+class OpenAIClientPool:
+    def __init__(self, api_key: str = None, base_url: str = None,
+                 max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 60, timeout: float = 600) -> None:
+        self.api_key = api_key
+        self.base_url = base_url or DEFAULT_OPENAI_BASE_URL
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.metrics = OpenAIPoolMetrics()
+
+        self._client : AsyncOpenAI = None
+        self._client_loop = None
+
+    def configure(self, api_key: str, base_url: Optional[str] = None):
+        base_url = base_url or DEFAULT_OPENAI_BASE_URL
+        if api_key == self.api_key and base_url == self.base_url:
+            return
+        self.api_key = api_key
+        self.base_url = base_url
+        # the old client is dropped, in-flight requests keep their own reference to it
+        self._client = None
+        self._client_loop = None
+
+    def get_client(self) -> AsyncOpenAI:
+        # connections are bound to the event loop which opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            transport = _MeteredTransport(self.metrics,
+                                          limits=httpx.Limits(max_connections=self.max_connections,
+                                                              max_keepalive_connections=self.max_keepalive_connections,
+                                                              keepalive_expiry=self.keepalive_expiry))
+            http_client = httpx.AsyncClient(transport=transport, timeout=self.timeout)
+            self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client)
+            self._client_loop = loop
+            self.metrics.clients_created += 1
+            logger.info(f"create openai client for {self.base_url}")
+        return self._client
+
+    def get_metrics(self) -> dict:
+        return self.metrics.to_dict()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+        self._client = None
+        self._client_loop = None
@@ -2,9 +2,9 @@ import asyncio
 import io
 import logging
 import os
-from asyncio import Queue
 
-from aios import ComputeNode, ComputeTask, ComputeTaskState, ComputeTaskResult, ComputeTaskType, AIStorage
+from aios import ComputeNode, ComputeTask, ComputeTaskState, ComputeTaskResult, ComputeTaskType, AIStorage,ComputeTaskQueue
+from .openai_client_pool import OpenAIClientPool, get_openai_base_url
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +22,7 @@ class OpenAITTSComputeNode(ComputeNode):
         super().__init__()
         self.is_start = False
         self.node_id = "openai_tts_node"
-        self.task_queue = Queue()
+        self.task_queue = ComputeTaskQueue()
         self.voice_list = {
             "female": ["nova", "shimmer"],
             "man": ["alloy", "echo", "fable", "onyx"]
@@ -31,6 +31,7 @@ class OpenAITTSComputeNode(ComputeNode):
             self.openai_api_key = os.getenv("OPENAI_API_KEY")
         else:
             self.openai_api_key = AIStorage.get_instance().get_user_config().get_value("openai_api_key")
+        self.client_pool = OpenAIClientPool(self.openai_api_key, get_openai_base_url())
 
         self.start()
 
@@ -43,8 +44,10 @@ class OpenAITTSComputeNode(ComputeNode):
         async def _run_task_loop():
             while True:
                 task = await self.task_queue.get()
+                if task.is_cancelled:
+                    continue
                 try:
-                    result = await self._run_task(task)
+                    result = await self.run_cancellable(task, self._run_task(task))
                     if result is not None:
                         task.state = ComputeTaskState.DONE
                         task.result = result
@@ -75,7 +78,7 @@ class OpenAITTSComputeNode(ComputeNode):
         if model_name is None:
             model_name = 'tts-1'
 
-        client = AsyncOpenAI(api_key=self.openai_api_key)
+        client = self.client_pool.get_client()
 
         response = await client.audio.speech.create(model=model_name, voice=voice, input=text)
 
@@ -91,9 +94,9 @@ class OpenAITTSComputeNode(ComputeNode):
         result.result = cache.read()
         return result
 
-    async def push_task(self, task: ComputeTask, proiority: int = 0):
+    async def push_task(self, task: ComputeTask, proiority: int = None):
         logger.info(f"openai_tts_node push task: {task.display()}")
-        self.task_queue.put_nowait(task)
+        self.task_queue.push(task, proiority)
 
     async def remove_task(self, task_id: str):
         pass
@@ -101,12 +104,14 @@ class OpenAITTSComputeNode(ComputeNode):
     def get_task_state(self, task_id: str):
         pass
 
+    def get_capacity(self) -> dict:
+        capacity = super().get_capacity()
+        capacity["client_pool"] = self.client_pool.get_metrics()
+        return capacity
+
     def display(self) -> str:
         return f"OpenAITTSComputeNode: {self.node_id}"
 
-    def get_capacity(self):
-        return 0
-
     def is_support(self, task: ComputeTask) -> bool:
         if task.task_type == ComputeTaskType.TEXT_2_VOICE:
             if task.params['model_name'] is None or task.params['model_name'] == 'tts-1' or task.params['model_name'] == 'tts-1-hd':
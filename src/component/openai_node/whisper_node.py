@@ -1,6 +1,5 @@
 import io
 import json
-from asyncio import Queue
 import asyncio
 import openai
 import os
@@ -8,12 +7,12 @@ import logging
 import srt
 import webvtt
 
-from openai import AsyncOpenAI
 from openai.cli._progress import BufferReader
 from pydub import AudioSegment
 from datetime import timedelta
 
-from aios import AIStorage,ComputeNode,ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType
+from aios import AIStorage,ComputeNode,ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType,ComputeTaskQueue
+from .openai_client_pool import OpenAIClientPool, get_openai_base_url
 
 logger = logging.getLogger(__name__)
 
@@ -44,12 +43,13 @@ class WhisperComputeNode(ComputeNode):
         self.is_start = False
         self.node_id = "whisper_node"
         self.enable = True
-        self.task_queue = Queue()
+        self.task_queue = ComputeTaskQueue()
 
         if os.getenv("OPENAI_API_KEY") is not None:
             self.openai_api_key = os.getenv("OPENAI_API_KEY")
         else:
             self.openai_api_key = AIStorage.get_instance().get_user_config().get_value("openai_api_key")
+        self.client_pool = OpenAIClientPool(self.openai_api_key, get_openai_base_url())
 
         self.start()
 
@@ -61,8 +61,10 @@ class WhisperComputeNode(ComputeNode):
         async def _run_task_loop():
             while True:
                 task = await self.task_queue.get()
+                if task.is_cancelled:
+                    continue
                 try:
-                    result = await self._run_task(task)
+                    result = await self.run_cancellable(task, self._run_task(task))
                     if result is not None:
                         task.state = ComputeTaskState.DONE
                         task.result = result
@@ -91,7 +93,7 @@ class WhisperComputeNode(ComputeNode):
             language = task.params["language"]
         file = task.params["file"]
 
-        client = AsyncOpenAI(api_key=self.openai_api_key)
+        client = self.client_pool.get_client()
 
         if os.path.getsize(file) > 25 * 1024 * 1024:
             audio = AudioSegment.from_file(file)
@@ -200,9 +202,9 @@ class WhisperComputeNode(ComputeNode):
             result.result = resp
             return result
 
-    async def push_task(self, task: ComputeTask, proiority: int = 0):
+    async def push_task(self, task: ComputeTask, proiority: int = None):
         logger.info(f"whisper_node push task: {task.display()}")
-        self.task_queue.put_nowait(task)
+        self.task_queue.push(task, proiority)
 
     async def remove_task(self, task_id: str):
         pass
@@ -210,12 +212,14 @@ class WhisperComputeNode(ComputeNode):
     def get_task_state(self, task_id: str):
         pass
 
+    def get_capacity(self) -> dict:
+        capacity = super().get_capacity()
+        capacity["client_pool"] = self.client_pool.get_metrics()
+        return capacity
+
     def display(self) -> str:
         return f"WhisperComputeNode: {self.node_id}"
 
-    def get_capacity(self):
-        return 0
-
     def is_support(self, task: ComputeTask) -> bool:
         if task.task_type == ComputeTaskType.VOICE_2_TEXT:
             if task.params['model_name'] is None or task.params['model_name'] == 'openai-whisper':
@@ -1,15 +1,14 @@
 import os
 import io
 import asyncio
-from asyncio import Queue
 import logging
 import base64
 from PIL import Image
-import requests
 from typing import Tuple
 from pathlib import Path
 
-from aios import ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType,ComputeTaskResultCode,ComputeNode,AIStorage,UserConfig
+from aios import ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType,ComputeTaskResultCode,ComputeNode,AIStorage,UserConfig,ComputeTaskQueue
+from aios import AsyncHttpClient,HttpResponse
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +47,7 @@ class Local_Stability_ComputeNode(ComputeNode):
         self.default_model = None
         self.output_dir = None
 
-        self.task_queue = Queue()
+        self.task_queue = ComputeTaskQueue()
     
     async def initial(self):
         if os.getenv("LOCAL_STABILITY_URL") is not None:
@@ -86,16 +85,16 @@ class Local_Stability_ComputeNode(ComputeNode):
 
         return True
 
-    async def push_task(self, task: ComputeTask, proiority: int = 0):
+    async def push_task(self, task: ComputeTask, proiority: int = None):
         logger.info(f"stability_node push task: {task.display()}")
-        self.task_queue.put_nowait(task)
+        self.task_queue.push(task, proiority)
 
     async def remove_task(self, task_id: str):
         pass
 
-    def _make_post_request(self, url, json) -> Tuple[str, requests.Response]:
+    async def _make_post_request(self, url, json) -> Tuple[str, HttpResponse]:
         try:
-            response = requests.post(url, json=json)
+            response = await AsyncHttpClient.get_instance().post(url, json_body=json)
             if response.status_code != 200:
                 return f'{response.status_code}, {response.json()}', None
             return None, response
@@ -103,7 +102,12 @@ class Local_Stability_ComputeNode(ComputeNode):
             return f"{e}", None
 
 
-    def _run_task(self, task: ComputeTask):
+    @staticmethod
+    def _save_image(image_base64: str, file_name: str):
+        image = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+        image.save(file_name)
+
+    async def _run_task(self, task: ComputeTask):
         task.state = ComputeTaskState.RUNNING
         result = ComputeTaskResult()
         result.result_code = ComputeTaskResultCode.ERROR
@@ -123,7 +127,7 @@ class Local_Stability_ComputeNode(ComputeNode):
             payload = {
                 "sd_model_checkpoint": model_name,
             }
-            err, resp = self._make_post_request(f'{self.url}/sdapi/v1/options', payload)
+            err, resp = await self._make_post_request(f'{self.url}/sdapi/v1/options', payload)
 
             if err is not None:
                 task.state = ComputeTaskState.ERROR
@@ -141,7 +145,7 @@ class Local_Stability_ComputeNode(ComputeNode):
             "steps": 20
         }
 
-        err, resp = self._make_post_request(f'{self.url}/sdapi/v1/txt2img', payload)
+        err, resp = await self._make_post_request(f'{self.url}/sdapi/v1/txt2img', payload)
         if err is not None:
             task.state = ComputeTaskState.ERROR
             err_msg = f"Failed. err:{err}"
@@ -153,10 +157,9 @@ class Local_Stability_ComputeNode(ComputeNode):
         r = resp.json()
 
         for i in r['images']:
-            image = Image.open(io.BytesIO(
-                base64.b64decode(i.split(",", 1)[0])))
             file_name = os.path.join(self.output_dir, task.task_id + ".png")
-            image.save(file_name)
+            # decoding and encoding a png takes a while, keep it off the event loop
+            await asyncio.to_thread(self._save_image, i.split(",", 1)[0], file_name)
 
             task.state = ComputeTaskState.DONE
             result.result_code = ComputeTaskResultCode.OK
@@ -179,11 +182,12 @@ class Local_Stability_ComputeNode(ComputeNode):
             while True:
                 logger.info("local_stability_node is waiting for task...")
                 task = await self.task_queue.get()
+                if task.is_cancelled:
+                    continue
                 logger.info(f"stability_node get task: {task.display()}")
-                result = self._run_task(task)
-                # if result is not None:
-                #     task.state = ComputeTaskState.DONE
-                #     task.result = result
+                result = await self.run_cancellable(task, self._run_task(task))
+                if result is not None:
+                    task.result = result
 
         asyncio.create_task(_run_task_loop())
 
@@ -193,9 +197,6 @@ class Local_Stability_ComputeNode(ComputeNode):
     def get_task_state(self, task_id: str):
         pass
 
-    def get_capacity(self):
-        pass
-
     def is_support(self, task: ComputeTask) -> bool:
         return task.task_type == ComputeTaskType.TEXT_2_IMAGE
 
@@ -1,7 +1,6 @@
 import os
 import io
 import asyncio
-from asyncio import Queue
 import logging
 from pathlib import Path
 
@@ -9,7 +8,7 @@ from PIL import Image
 from stability_sdk import client
 import stability_sdk.interfaces.gooseai.generation.generation_pb2 as generation
 
-from aios import ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType,ComputeTaskResultCode,ComputeNode,AIStorage,UserConfig
+from aios import ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType,ComputeTaskResultCode,ComputeNode,AIStorage,UserConfig,ComputeTaskQueue
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +47,7 @@ class Stability_ComputeNode(ComputeNode):
         self.api_key = ""
         self.default_model = ""
 
-        self.task_queue = Queue()
+        self.task_queue = ComputeTaskQueue()
 
     async def initial(self):
         if os.getenv("STABILITY_API_KEY") is not None:
@@ -84,9 +83,9 @@ class Stability_ComputeNode(ComputeNode):
 
         return True
 
-    async def push_task(self, task: ComputeTask, proiority: int = 0):
+    async def push_task(self, task: ComputeTask, proiority: int = None):
         logger.info(f"stability_node push task: {task.display()}")
-        self.task_queue.put_nowait(task)
+        self.task_queue.push(task, proiority)
 
     async def remove_task(self, task_id: str):
         pass
@@ -175,6 +174,8 @@ class Stability_ComputeNode(ComputeNode):
             while True:
                 logger.info("stability_node is waiting for task...")
                 task = await self.task_queue.get()
+                if task.is_cancelled:
+                    continue
                 logger.info(f"stability_node get task: {task.display()}")
                 result = self._run_task(task)
                 # if result is not None:
@@ -189,9 +190,6 @@ class Stability_ComputeNode(ComputeNode):
     def get_task_state(self, task_id: str):
         pass
 
-    def get_capacity(self):
-        pass
-
     def is_support(self, task: ComputeTask) -> bool:
         return task.task_type == ComputeTaskType.TEXT_2_IMAGE
 
@@ -13,7 +13,7 @@ from slack_bolt.adapter.socket_mode.websockets import AsyncSocketModeHandler
 from slack_bolt.app.async_app import AsyncApp
 
 #from aios import KnowledgeStore, ObjectType
-from aios.frame.tunnel import AgentTunnel
+from aios.frame.tunnel import AgentTunnel, StreamingReply
 from aios.proto.agent_msg import AgentMsg, AgentMsgType
 from aios.storage.storage import AIStorage
 
@@ -178,10 +178,23 @@ class SlackTunnel(AgentTunnel):
                 agent_msg.body_mime = mime_type
 
 
-            resp_msg: AgentMsg = await self.ai_bus.send_message(agent_msg)
+            # the reply is shown while the agent generates it
+            async def send_reply(text):
+                return (await app.client.chat_postMessage(channel=event["channel"], text=text))["ts"]
+            async def edit_reply(ts, text):
+                await app.client.chat_update(channel=event["channel"], ts=ts, text=text)
+            async def delete_reply(ts):
+                await app.client.chat_delete(channel=event["channel"], ts=ts)
+            reply = StreamingReply(send_reply, edit_reply, delete_reply)
+
+            resp_msg: AgentMsg = await self.ai_bus.send_message(agent_msg,on_stream=reply.on_stream)
             if resp_msg is None:
+                await reply.discard()
                 await app.client.chat_postMessage(channel=event["channel"], text=f"System Error: Timeout,{self.target_id}  no resopnse! Please check logs/aios.log for more details!")
+            elif resp_msg.is_text_msg() and await reply.finish(resp_msg.body):
+                return
             else:
+                await reply.discard()
                 if resp_msg.body_mime is None:
                     if resp_msg.body is None:
                         return
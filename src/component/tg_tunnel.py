@@ -12,7 +12,7 @@ from telegram import Bot
 from telegram.ext import Updater
 from telegram.error import Forbidden, NetworkError
 
-from aios import AgentTunnel,AIStorage,ContactManager,Contact,AgentMsg,AgentMsgType
+from aios import AgentTunnel,StreamingReply,AIStorage,ContactManager,Contact,AgentMsg,AgentMsgType
 
 logger = logging.getLogger(__name__)
 
@@ -362,19 +362,25 @@ class TelegramTunnel(AgentTunnel):
 
         agent_msg.sender = reomte_user_name
         logger.info(f"process message {agent_msg.msg_id} from {agent_msg.sender} to {agent_msg.target}")
+        # the reply is shown while the agent generates it
+        reply = StreamingReply(update.message.reply_text, lambda message,text: message.edit_text(text), lambda message: message.delete())
         if agent_msg.msg_type == AgentMsgType.TYPE_GROUPMSG:
             self.ai_bus.register_message_handler(agent_msg.target, self._process_message)
-            resp_msg: AgentMsg = await self.ai_bus.send_message(agent_msg,self.target_id,agent_msg.target)
+            resp_msg: AgentMsg = await self.ai_bus.send_message(agent_msg,self.target_id,agent_msg.target,on_stream=reply.on_stream)
         else:
             #self.ai_bus.register_message_handler(reomte_user_name, self._process_message)
-            resp_msg: AgentMsg = await self.ai_bus.send_message(agent_msg)
+            resp_msg: AgentMsg = await self.ai_bus.send_message(agent_msg,on_stream=reply.on_stream)
         #await bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
 
 
 
         if resp_msg is None:
+            await reply.discard()
             await update.message.reply_text(f"System Error: Timeout,{self.target_id}  no resopnse! Please check logs/aios.log for more details!")
+        elif resp_msg.is_text_msg() and await reply.finish(resp_msg.body):
+            return
         else:
+            await reply.discard()
             await self.conver_agent_msg_to_tg_msg(resp_msg,update)
 
            
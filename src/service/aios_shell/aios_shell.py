@@ -82,6 +82,8 @@ class AIOS_Shell:
 
         user_config.add_user_config("feature.llama","enable Local-llama feature",True,"False")
         user_config.add_user_config("feature.aigc","enable AIGC feature",True,"False")
+        user_config.add_user_config("embedding_cache.max_mb","max size of the text embedding cache (MB)",True,256)
+        user_config.add_user_config("chatsession.tail_cache_mb","max size of the cached recent chat messages (MB)",True,32)
 
         openai_node = OpenAI_ComputeNode.get_instance()
         openai_node.declare_user_config()
@@ -227,6 +229,12 @@ class AIOS_Shell:
         #     ComputeKernel.get_instance().add_compute_node(local_st_image_compute_node)
 
 
+        embedding_cache_db = os.path.abspath(f"{AIStorage.get_instance().get_myai_dir()}/cache/embedding_cache.db")
+        embedding_cache_size = int(AIStorage.get_instance().get_user_config().get_value("embedding_cache.max_mb")) * 1024 * 1024
+        ComputeKernel.get_instance().set_embedding_cache(EmbeddingCache(embedding_cache_db, embedding_cache_size))
+        tail_cache_size = int(AIStorage.get_instance().get_user_config().get_value("chatsession.tail_cache_mb")) * 1024 * 1024
+        AIChatSession.set_tail_cache(max_size=tail_cache_size)
+
         await ComputeKernel.get_instance().start()
 
         AIBus().get_default_bus().register_unhandle_message_handler(self._handle_no_target_msg)
@@ -8,6 +8,7 @@ Configuration for nodes:
 |   └── 0
 |   |   └── url
 |   |   └── model_name
+|   |   └── max_workers (optional, default 1)
 |   └── 1
 |       └── url
 |       └── model_name
@@ -53,7 +54,7 @@ class ComputeNodeConfig:
             llama_nodes_cfg = self.config["llama"]
             if llama_nodes_cfg is not None:
                 for cfg in llama_nodes_cfg:
-                    node = LocalLlama_ComputeNode(url=cfg["url"], model_name=cfg["model_name"])
+                    node = LocalLlama_ComputeNode(url=cfg["url"], model_name=cfg["model_name"], max_workers=cfg.get("max_workers", 1))
                     nodes.append(node)
 
             return nodes
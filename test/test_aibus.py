@@ -0,0 +1,202 @@
+import sys
+import os
+import time
+import asyncio
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import AIBus, AgentMsg, AgentMsgStatus, AgentMsgType
+from aios.frame.bus import OVERFLOW_DROP
+
+# AIOS_BENCHMARK=1 runs the benchmarks, AIBUS_BENCHMARK_MESSAGES=2000 for a quicker run
+BENCHMARK = os.environ.get("AIOS_BENCHMARK")
+BENCHMARK_MESSAGES = int(os.environ.get("AIBUS_BENCHMARK_MESSAGES", 10000))
+
+
+def _create_msg(sender: str, target: str, body: str) -> AgentMsg:
+    msg = AgentMsg()
+    msg.set(sender, target, body)
+    return msg
+
+
+def _create_event(sender: str, target: str, event_name: str, args: str) -> AgentMsg:
+    msg = AgentMsg(AgentMsgType.TYPE_EVENT)
+    msg.set(sender, target, None)
+    msg.event_name = event_name
+    msg.event_args = args
+    return msg
+
+
+class TestAIBus(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.bus = AIBus()
+
+        async def echo(msg: AgentMsg) -> AgentMsg:
+            return msg.create_resp_msg(f"echo {msg.body}")
+
+        async def silent(msg: AgentMsg) -> AgentMsg:
+            return None
+
+        self.bus.register_message_handler("client", None)
+        self.bus.register_message_handler("echo", echo)
+        self.bus.register_message_handler("silent", silent)
+
+    async def asyncTearDown(self):
+        for handler in self.bus.handlers.values():
+            for task in handler.session_tasks:
+                task.cancel()
+
+    async def test_send_message(self):
+        msg = _create_msg("client", "echo", "hello")
+        resp = await self.bus.send_message(msg)
+        self.assertEqual(resp.body, "echo hello")
+        self.assertIs(msg.resp_msg, resp)
+        self.assertEqual(msg.status, AgentMsgStatus.RESPONSED)
+
+        # concurrent requests get their own resps
+        msgs = [_create_msg("client", "echo", str(i)) for i in range(100)]
+        resps = await asyncio.gather(*[self.bus.send_message(msg) for msg in msgs])
+        self.assertEqual([resp.body for resp in resps], [f"echo {i}" for i in range(100)])
+        self.assertEqual(self.bus.handlers["client"].pending_resps, {})
+
+        self.assertIsNone(await self.bus.send_message(_create_msg("client", "nobody", "hello")))
+        self.assertIsNone(await self.bus.send_message(_create_msg("unknown", "echo", "hello")))
+
+    async def test_timeout(self):
+        msg = _create_msg("client", "silent", "hello")
+        # times out on its own, doesn't wait for a resp that never comes
+        self.assertIsNone(await asyncio.wait_for(self.bus.send_message(msg, timeout=0.05), 5))
+        self.assertEqual(msg.status, AgentMsgStatus.ERROR)
+        self.assertEqual(self.bus.handlers["client"].pending_resps, {})
+
+        # a late resp is dropped
+        await self.bus.post_message(msg.create_resp_msg("too late"))
+        self.assertEqual(self.bus.orphan_resp_count, 1)
+        self.assertEqual(self.bus.handlers["client"].pending_resps, {})
+
+    async def test_session_concurrency(self):
+        release = asyncio.Event()
+        handled = []
+        running = []
+        max_running = 0
+
+        async def slow(msg: AgentMsg) -> AgentMsg:
+            nonlocal max_running
+            running.append(msg.body)
+            max_running = max(max_running, len(running))
+            if msg.sender == "blocked":
+                await release.wait()
+            await asyncio.sleep(0.001)
+            running.remove(msg.body)
+            handled.append(msg.body)
+            return msg.create_resp_msg(f"done {msg.body}")
+
+        self.bus.register_message_handler("agent", slow, max_concurrency=2)
+        self.bus.register_message_handler("blocked", None)
+        # a long turn in one session
+        await self.bus.post_message(_create_msg("blocked", "agent", "long"))
+        await asyncio.sleep(0.01)
+        # doesn't hold up the other sessions, which keep their order
+        resps = await asyncio.gather(*[self.bus.send_message(_create_msg("client", "agent", f"c{i}"), timeout=5) for i in range(5)])
+        self.assertEqual([resp.body for resp in resps], [f"done c{i}" for i in range(5)])
+        self.assertEqual(handled, [f"c{i}" for i in range(5)])
+        self.assertNotIn("long", handled)
+
+        # the msgs behind the long one wait, the cap holds
+        await self.bus.post_message(_create_msg("blocked", "agent", "after long"))
+        for i in range(4):
+            msg = _create_msg("client", "agent", f"s{i}")
+            msg.topic = f"topic{i}"
+            await self.bus.post_message(msg)
+        await asyncio.sleep(0.05)
+        self.assertNotIn("after long", handled)
+        metrics = self.bus.get_metrics()["agent"]
+        self.assertEqual(metrics["sessions"], 1)
+        self.assertEqual(metrics["waiting"], 1)
+        release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(handled[-2:], ["long", "after long"])
+        self.assertLessEqual(max_running, 2)
+
+        metrics = self.bus.get_metrics()["agent"]
+        self.assertEqual(metrics["handled"], 11)
+        self.assertEqual(metrics["waiting"], 0)
+        self.assertGreater(metrics["max_lag"], 0.05)
+
+    async def test_backpressure(self):
+        release = asyncio.Event()
+        handled = []
+
+        async def slow(msg: AgentMsg) -> AgentMsg:
+            await release.wait()
+            handled.append(msg.body or msg.event_args)
+            return None
+
+        self.bus.register_message_handler("agent", slow, max_concurrency=1, max_queue=3)
+        self.assertTrue(await self.bus.post_message(_create_msg("client", "agent", "running")))
+        await asyncio.sleep(0.01)
+        for i in range(3):
+            self.assertTrue(await self.bus.post_message(_create_msg("client", "agent", f"m{i}")))
+        self.assertEqual(self.bus.get_metrics()["agent"]["waiting"], 3)
+
+        # a full queue holds the sender back
+        blocked_post = asyncio.ensure_future(self.bus.post_message(_create_msg("client", "agent", "m3")))
+        await asyncio.sleep(0.05)
+        self.assertFalse(blocked_post.done())
+        self.assertFalse(await self.bus.post_message(_create_msg("client", "agent", "timeout"), timeout=0.01))
+
+        # newer events replace the waiting ones
+        self.bus.handlers["agent"].max_queue = 4
+        self.assertTrue(await self.bus.post_message(_create_event("client", "agent", "progress", "10%")))
+        self.assertTrue(await self.bus.post_message(_create_event("client", "agent", "progress", "20%")))
+        self.assertTrue(await self.bus.post_message(_create_event("client", "agent", "progress", "30%")))
+        self.assertFalse(blocked_post.done())
+        metrics = self.bus.get_metrics()["agent"]
+        self.assertEqual(metrics["waiting"], 4)
+        self.assertEqual(metrics["merged"], 2)
+        self.assertEqual(metrics["dropped"], 1)
+
+        release.set()
+        self.assertTrue(await blocked_post)
+        await asyncio.sleep(0.05)
+        self.assertEqual(handled, ["running", "m0", "m1", "m2", "30%", "m3"])
+        metrics = self.bus.get_metrics()["agent"]
+        self.assertEqual(metrics["waiting"], 0)
+        self.assertEqual(metrics["blocked"], 2)
+        self.assertGreater(metrics["max_block_time"], 0.05)
+
+    async def test_overflow_drop(self):
+        async def never(msg: AgentMsg) -> AgentMsg:
+            await asyncio.sleep(10)
+
+        self.bus.register_message_handler("agent", never, max_concurrency=1, max_queue=1,
+                                          overflow_policies={AgentMsgType.TYPE_EVENT: OVERFLOW_DROP})
+        self.assertTrue(await self.bus.post_message(_create_event("client", "agent", "tick", "1")))
+        await asyncio.sleep(0.01)
+        self.assertTrue(await self.bus.post_message(_create_event("client", "agent", "tick", "2")))
+        # dropped at once, the sender isn't held back
+        self.assertFalse(await asyncio.wait_for(self.bus.post_message(_create_event("client", "agent", "tick", "3")), 5))
+        self.assertEqual(self.bus.get_metrics()["agent"]["dropped"], 1)
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    async def test_benchmark(self):
+        latencies = []
+        begin = time.perf_counter()
+        for i in range(BENCHMARK_MESSAGES):
+            msg_begin = time.perf_counter()
+            resp = await self.bus.send_message(_create_msg("client", "echo", str(i)))
+            latencies.append(time.perf_counter() - msg_begin)
+            self.assertEqual(resp.body, f"echo {i}")
+        total_time = time.perf_counter() - begin
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        result = (f"{BENCHMARK_MESSAGES} request/response round trips in {total_time:.2f}s: "
+                  f"p50 {p50 * 1000:.3f}ms p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms")
+        # polling every 200ms made every round trip take at least 200ms
+        self.assertLess(p50, 0.01, result)
+
+
+if __name__ == "__main__":
+    unittest.main()
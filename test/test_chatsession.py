@@ -0,0 +1,368 @@
+import sys
+import os
+import time
+import sqlite3
+import tempfile
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import AIChatSession, AgentMsg
+from aios.agent.chatsession import ChatSessionDB
+from aios.agent.session_registry import SessionRegistry
+from aios.proto.agent_msg import AgentMsgType
+
+# AIOS_BENCHMARK=1 runs the benchmarks
+BENCHMARK = os.environ.get("AIOS_BENCHMARK")
+# number of messages in the benchmark db, building 1M takes about 20s
+BENCHMARK_MESSAGES = int(os.getenv("CHATSESSION_BENCHMARK_MESSAGES", "1000000"))
+
+LEGACY_SCHEMA = """
+    CREATE TABLE ChatSessions (SessionID TEXT PRIMARY KEY, SessionOwner TEXT, SessionTopic TEXT, StartTime TEXT,
+                               SummarizePos INTEGER, Summary TEXT, ThreadID TEXT);
+    CREATE TABLE Messages (MessageID TEXT PRIMARY KEY, SessionID TEXT, MsgType INTEGER, PrevMsgID TEXT, QuoteMsgID TEXT,
+                           RelyMsgID TEXT, SenderID TEXT, ReceiverID TEXT, Timestamp TEXT, Topic TEXT, Mentions TEXT,
+                           ContentMIME TEXT, Content TEXT, ActionName TEXT, ActionParams TEXT, ActionResult TEXT,
+                           DoneTime TEXT, Status INTEGER, Tags TEXT);
+"""
+
+
+def _create_msg(session_id: str, sender: str, target: str, body: str, create_time: float) -> AgentMsg:
+    msg = AgentMsg()
+    msg.session_id = session_id
+    msg.sender = sender
+    msg.target = target
+    msg.body = body
+    msg.create_time = create_time
+    return msg
+
+
+def _create_legacy_db(db_file: str, message_count: int, session_count: int = 1000):
+    # a memory.db written by the previous version: no index, no WAL
+    conn = sqlite3.connect(db_file)
+    conn.executescript(LEGACY_SCHEMA)
+    base_time = 1700000000.0
+    rows = ((f"msg#{i}", f"CS#{i % session_count}", 0, None, None, None, f"user{i % session_count}", f"agent{i % 10}",
+             base_time + i, None, None, "text/plain", f"message {i}", None, None, None, 0, 1, "")
+            for i in range(message_count))
+    conn.executemany("INSERT INTO Messages VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+    conn.executemany("INSERT INTO ChatSessions VALUES (?,?,?,?,0,'','')",
+                     ((f"CS#{i}", f"user{i}", "default", base_time) for i in range(session_count)))
+    conn.commit()
+    conn.close()
+
+
+def _measure_history_loads(db: ChatSessionDB, rounds: int = 20) -> float:
+    begin = time.perf_counter()
+    for i in range(rounds):
+        msgs = db.get_messages(f"CS#{i * 37 % 1000}", 20, 0)
+        assert len(msgs) == 20
+        db.load_message_by_agentid(f"user{i}", 20)
+    return (time.perf_counter() - begin) / rounds
+
+
+class LegacyChatSessionDB(ChatSessionDB):
+    # reads the db the way the previous version did, without indexes
+    def _migrate(self, conn):
+        pass
+
+
+class TestChatSessionDB(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, "memory.db")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_insert_with_inner_calls(self):
+        session = AIChatSession.get_session("user", "test_inner_calls", self.db_file)
+        msg = _create_msg(None, "user", "agent", "hello", time.time())
+        for i in range(3):
+            inner_call = AgentMsg.create_internal_call_msg(f"func_{i}", {"i": i}, msg.msg_id, "agent")
+            inner_call.session_id = session.session_id
+            msg.inner_call_chain.append(inner_call)
+        session.append(msg)
+
+        history = session.read_history(10, 0, "natural")
+        self.assertEqual(len(history), 4)
+        self.assertEqual(history[0].body, "hello")
+        self.assertEqual([m.func_name for m in history[1:]], ["func_0", "func_1", "func_2"])
+        self.assertEqual(history[1].msg_type, AgentMsgType.TYPE_INTERNAL_CALL)
+
+    def test_schema(self):
+        db = ChatSessionDB(self.db_file)
+        other_db = ChatSessionDB(self.db_file)
+        # stores of the same file share one connection
+        self.assertIs(db.db, other_db.db)
+        self.assertEqual(db.db.fetchone("PRAGMA journal_mode")[0], "wal")
+        self.assertEqual(db.db.fetchone("PRAGMA user_version")[0], ChatSessionDB.SCHEMA_VERSION)
+        plan = db.db.fetchall("EXPLAIN QUERY PLAN SELECT * FROM Messages WHERE SessionID = ? ORDER BY Timestamp DESC LIMIT 10",
+                              ("CS#1",))
+        self.assertIn("idx_messages_session_time", str(plan))
+        other_db.close()
+        db.close()
+
+    def test_load_message_by_agentid(self):
+        db = ChatSessionDB(self.db_file)
+        db.insert_messages([_create_msg("CS#1", "alice", "bob", "1", 1700000100),
+                            _create_msg("CS#1", "bob", "alice", "2", 1700000200),
+                            _create_msg("CS#2", "carol", "dave", "3", 1700000300),
+                            _create_msg("CS#3", "carol", "alice", "4", 1700000050)])
+        msgs = db.load_message_by_agentid("alice", 10, 1700000060)
+        self.assertEqual([msg[10] for msg in msgs], ["1", "2"])
+        db.close()
+
+    def test_group_commit(self):
+        db = ChatSessionDB(self.db_file)
+        message_count = 2000
+
+        def insert_group():
+            for i in range(message_count):
+                db.insert_message(_create_msg("CS#group", "user", "agent", f"message {i}", i))
+        db.group_commit(insert_group)
+        self.assertEqual(db.db.fetchone("SELECT COUNT(*) FROM Messages WHERE SessionID = ?", ("CS#group",))[0], message_count)
+
+        # a failed block rolls the whole batch back
+        def insert_failed():
+            db.insert_message(_create_msg("CS#rollback", "user", "agent", "lost", 0))
+            raise ValueError("failed")
+        with self.assertRaises(ValueError):
+            db.group_commit(insert_failed)
+        self.assertEqual(len(db.get_messages("CS#rollback", 10, 0)), 0)
+        self.assertEqual(len(db.get_messages("CS#group", 0, 0)), 1024)
+        db.close()
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    def test_migration_benchmark(self):
+        begin = time.perf_counter()
+        _create_legacy_db(self.db_file, BENCHMARK_MESSAGES)
+        create_time = time.perf_counter() - begin
+
+        legacy_db = LegacyChatSessionDB(self.db_file)
+        legacy_time = _measure_history_loads(legacy_db)
+        legacy_db.close()
+
+        begin = time.perf_counter()
+        db = ChatSessionDB(self.db_file)
+        migrate_time = time.perf_counter() - begin
+        indexed_time = _measure_history_loads(db)
+        result = (f"history load at {BENCHMARK_MESSAGES} messages (created in {create_time:.1f}s): full scan {legacy_time * 1000:.1f}ms, "
+                  f"indexed {indexed_time * 1000:.2f}ms, migration took {migrate_time:.1f}s")
+        self.assertEqual(db.db.fetchone("PRAGMA user_version")[0], ChatSessionDB.SCHEMA_VERSION)
+        self.assertLess(indexed_time * 10, legacy_time, result)
+        db.close()
+
+
+class CountingChatSessionDB(ChatSessionDB):
+    def __init__(self, db_file):
+        super().__init__(db_file)
+        self.page_reads = 0
+
+    def read_messages_by_key(self, *args, **kwargs):
+        self.page_reads += 1
+        return super().read_messages_by_key(*args, **kwargs)
+
+    def get_messages(self, *args, **kwargs):
+        self.page_reads += 1
+        return super().get_messages(*args, **kwargs)
+
+
+class TestChatSessionHistory(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db = CountingChatSessionDB(os.path.join(self.temp_dir.name, "memory.db"))
+        AIChatSession.set_tail_cache()
+        self.session = AIChatSession("user", "CS#history", self.db)
+
+    def tearDown(self):
+        self.db.close()
+        self.temp_dir.cleanup()
+
+    def _fill(self, count: int):
+        def append_all():
+            for i in range(count):
+                # three messages share each timestamp, they keep their insert order
+                self.session.append(_create_msg(None, "user", "agent", f"message {i}", 1700000000 + i // 3))
+        self.db.group_commit(append_all)
+
+    async def test_iter_history_order(self):
+        self._fill(100)
+        expected_ids = [row[0] for row in self.db.read_message("CS#history", 100, 0)]
+
+        natural = [msg.msg_id async for msg in self.session.iter_history("natural", page_size=7)]
+        self.assertEqual(natural, expected_ids)
+        revers = [msg.msg_id async for msg in self.session.iter_history(page_size=7)]
+        self.assertEqual(revers, list(reversed(expected_ids)))
+        skipped = [msg.msg_id async for msg in self.session.iter_history("natural", offset=40, page_size=7)]
+        self.assertEqual(skipped, expected_ids[40:])
+
+    async def test_budgeted_load(self):
+        self._fill(20000)
+
+        msgs = self.session.read_history()
+        self.assertEqual(len(msgs), 1024)
+
+        # a loader whose budget is used up after 20 messages
+        self.db.page_reads = 0
+        read_count = 0
+        async for msg in self.session.iter_history(page_size=16):
+            read_count += 1
+            if read_count >= 20:
+                break
+        # read_history loaded the tail, the 20 newest messages don't touch the db again
+        self.assertEqual(self.db.page_reads, 0)
+
+    async def test_tail_cache(self):
+        self._fill(100)
+        expected_ids = [row[0] for row in self.db.get_messages("CS#history", 100, 0)]
+
+        # cold start reads the tail once, the following prompt builds are served from memory
+        self.db.page_reads = 0
+        for i in range(10):
+            self.assertEqual([msg.msg_id for msg in self.session.read_history(10)], expected_ids[:10])
+            self.assertEqual([msg.msg_id for msg in self.session.read_history(8, 4)], expected_ids[4:12])
+            loaded = [msg.msg_id async for msg in self.session.iter_history(page_size=16)]
+            self.assertEqual(loaded, expected_ids)
+        # one cold load, then only the 36 messages older than the tail are paged from the db
+        self.assertEqual(self.db.page_reads, 1 + 10 * 3)
+
+        self.db.page_reads = 0
+        msg = _create_msg(None, "agent", "user", "newest", 1700000100)
+        self.session.append(msg)
+        self.assertEqual(self.session.read_history(2)[0].msg_id, msg.msg_id)
+        self.assertEqual(self.db.get_messages("CS#history", 1, 0)[0][0], msg.msg_id)
+        self.assertEqual(self.db.page_reads, 1)
+
+        # a range past the tail still comes from the db
+        self.assertEqual([msg.msg_id for msg in self.session.read_history(10, 80)], expected_ids[79:89])
+        metrics = AIChatSession.get_tail_cache_metrics()
+        self.assertEqual(metrics["miss"], 1)
+        self.assertEqual(metrics["hit"], 30)
+
+    async def test_tail_cache_short_session(self):
+        self._fill(5)
+        self.db.page_reads = 0
+        self.assertEqual(len(self.session.read_history()), 5)
+        self.session.append(_create_msg(None, "agent", "user", "reply", 1700000100))
+        self.assertEqual(len([msg async for msg in self.session.iter_history()]), 6)
+        self.assertEqual(len(self.session.read_history(10, 3)), 3)
+        self.assertEqual(self.db.page_reads, 1)
+
+    async def test_out_of_order_and_concurrent_append(self):
+        AIChatSession.set_tail_cache(tail_len=16)
+        self._fill(40)
+        self.session.read_history(1)
+        # a late message with an older timestamp goes inside the tail, in the order of the db
+        late = _create_msg(None, "agent", "user", "late", 1700000010)
+        self.session.append(late)
+        expected_ids = [row[0] for row in self.db.get_messages("CS#history", 100, 0)]
+        self.assertEqual([msg.msg_id for msg in self.session.read_history(16)], expected_ids[:16])
+        self.assertEqual([msg.msg_id async for msg in self.session.iter_history(page_size=5)], expected_ids)
+        self.assertEqual([msg.msg_id async for msg in self.session.iter_history(offset=20, page_size=5)], expected_ids[20:])
+
+        # messages appended while a reader pages through the history don't repeat or skip any message
+        loaded = []
+        async for msg in self.session.iter_history(page_size=5):
+            loaded.append(msg.msg_id)
+            if len(loaded) % 5 == 0:
+                self.session.append(_create_msg(None, "user", "agent", f"new {len(loaded)}", 1700000200 + len(loaded)))
+        self.assertEqual(loaded, expected_ids)
+
+    def test_tail_cache_bound(self):
+        AIChatSession.set_tail_cache(tail_len=16, max_size=64 * 1024)
+        body = "x" * 1000
+        sessions = [AIChatSession("user", f"CS#bound{i}", self.db) for i in range(20)]
+        def append_all():
+            for session in sessions:
+                for i in range(16):
+                    session.append(_create_msg(None, "user", "agent", body, 1700000000 + i))
+        self.db.group_commit(append_all)
+        for session in sessions:
+            self.assertEqual(len(session.read_history(16)), 16)
+
+        metrics = AIChatSession.get_tail_cache_metrics()
+        self.assertLessEqual(metrics["size"], 64 * 1024)
+        self.assertGreater(metrics["evicted"], 0)
+        self.assertLess(metrics["sessions"], 20)
+        # the most recently used session is still cached
+        self.db.page_reads = 0
+        sessions[-1].read_history(4)
+        self.assertEqual(self.db.page_reads, 0)
+
+
+class TestSessionRegistry(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.now = 1000.0
+        self.origin_registry = AIChatSession._registry
+        AIChatSession._registry = SessionRegistry(max_sessions=100, idle_timeout=600,
+                                                  on_evict=self.origin_registry.on_evict, clock=lambda: self.now)
+        AIChatSession.set_tail_cache()
+
+    def tearDown(self):
+        for db_entry in AIChatSession._registry._dbs.values():
+            db_entry[0].close()
+        AIChatSession._registry = self.origin_registry
+        self.temp_dir.cleanup()
+
+    def test_lookup(self):
+        db_path = os.path.join(self.temp_dir.name, "memory.db")
+        AIChatSession.set_session_registry(max_sessions=5000)
+        sessions = [AIChatSession.get_session(f"agent{i % 10}", f"user{i}#default", db_path) for i in range(2000)]
+
+        for i in range(2000):
+            self.assertIs(AIChatSession.get_session(f"agent{i % 10}", f"user{i}#default", db_path), sessions[i])
+            self.assertIs(AIChatSession.get_session_by_id(sessions[i].session_id, db_path), sessions[i])
+
+        metrics = AIChatSession.get_registry_metrics()
+        self.assertEqual(metrics["sessions"], 2000)
+        self.assertEqual(metrics["hit"], 4000)
+        # the same owner and topic in another db is another session
+        other_db_path = os.path.join(self.temp_dir.name, "other.db")
+        self.assertIsNot(AIChatSession.get_session("agent0", "user0#default", other_db_path), sessions[0])
+
+    def test_lru_eviction(self):
+        db_path = os.path.join(self.temp_dir.name, "memory.db")
+        sessions = [AIChatSession.get_session("agent", f"user{i}#default", db_path) for i in range(100)]
+        sessions[0].append(_create_msg(None, "user", "agent", "hello", 1700000000))
+        self.assertEqual(len(sessions[0].read_history(4)), 1)
+        AIChatSession.get_session("agent", "user0#default", db_path)
+
+        AIChatSession.get_session("agent", "user100#default", db_path)
+        metrics = AIChatSession.get_registry_metrics()
+        self.assertEqual(metrics["sessions"], 100)
+        self.assertEqual(metrics["evicted_sessions"], 1)
+        # user1 was the least recently used one, user0 was used again
+        self.assertIs(AIChatSession.get_session("agent", "user0#default", db_path), sessions[0])
+        reloaded = AIChatSession.get_session("agent", "user1#default", db_path)
+        self.assertIsNot(reloaded, sessions[1])
+        self.assertEqual(reloaded.session_id, sessions[1].session_id)
+
+    def test_idle_eviction(self):
+        db_path = os.path.join(self.temp_dir.name, "memory.db")
+        session = AIChatSession.get_session("agent", "user#default", db_path)
+        session.append(_create_msg(None, "user", "agent", "hello", 1700000000))
+        self.assertEqual(len(session.read_history(4)), 1)
+        self.assertEqual(AIChatSession.get_tail_cache_metrics()["sessions"], 1)
+
+        self.now += 601
+        other_db_path = os.path.join(self.temp_dir.name, "other.db")
+        AIChatSession.get_session("agent", "user#default", other_db_path)
+        metrics = AIChatSession.get_registry_metrics()
+        self.assertEqual(metrics["sessions"], 1)
+        self.assertEqual(metrics["dbs"], 1)
+        self.assertEqual(metrics["evicted_sessions"], 1)
+        self.assertEqual(metrics["evicted_dbs"], 1)
+        self.assertEqual(AIChatSession.get_tail_cache_metrics()["sessions"], 0)
+
+        # a caller which still holds the evicted session keeps working
+        self.assertEqual(len(session.read_history(4)), 1)
+        reloaded = AIChatSession.get_session("agent", "user#default", db_path)
+        self.assertEqual(reloaded.session_id, session.session_id)
+        self.assertEqual(len(reloaded.read_history(4)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
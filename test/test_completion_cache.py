@@ -0,0 +1,110 @@
+import sys
+import os
+import time
+import asyncio
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import ComputeKernel, ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType, Queue_ComputeNode
+from aios import CompletionCache, LLMPrompt
+from aios.proto.compute_task import ComputeTaskResultCode
+
+
+class StubLLMNode(Queue_ComputeNode):
+    def __init__(self, delay: float = 0.05):
+        super().__init__(max_workers=4)
+        self.node_id = "stub_llm_node"
+        self.delay = delay
+        self.task_count = 0
+
+    async def execute_task(self, task: ComputeTask) -> ComputeTaskResult:
+        self.task_count += 1
+        await asyncio.sleep(self.delay)
+        prompts = task.params["prompts"]
+        result = ComputeTaskResult()
+        result.set_from_task(task)
+        result.worker_id = self.node_id
+        result.result_code = ComputeTaskResultCode.OK
+        result.result_str = f"reply to {prompts[-1]['content']}"
+        result.result["message"] = {"role": "assistant", "content": result.result_str}
+        task.state = ComputeTaskState.DONE
+        return result
+
+    def display(self) -> str:
+        return f"StubLLMNode: {self.node_id}"
+
+    def is_support(self, task: ComputeTask) -> bool:
+        return task.task_type == ComputeTaskType.LLM_COMPLETION
+
+    def is_local(self) -> bool:
+        return True
+
+
+def _prompt(content: str) -> LLMPrompt:
+    prompt = LLMPrompt()
+    prompt.append_system_message("You are a triage bot.")
+    prompt.append_user_message(content)
+    return prompt
+
+
+class TestCompletionCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.node = StubLLMNode()
+        self.kernel = ComputeKernel()
+        self.kernel.add_compute_node(self.node)
+        self.node.start()
+        await self.kernel.start()
+
+    async def test_key(self):
+        key = CompletionCache.make_key(_prompt("a"), "text", "gpt-4", 100, None)
+        self.assertEqual(key, CompletionCache.make_key(_prompt("a"), "text", "gpt-4", 100, []))
+        self.assertNotEqual(key, CompletionCache.make_key(_prompt("b"), "text", "gpt-4", 100, None))
+        self.assertNotEqual(key, CompletionCache.make_key(_prompt("a"), "json", "gpt-4", 100, None))
+        self.assertNotEqual(key, CompletionCache.make_key(_prompt("a"), "text", "gpt-3.5-turbo", 100, None))
+        self.assertNotEqual(key, CompletionCache.make_key(_prompt("a"), "text", "gpt-4", 200, None))
+        functions = [{"name": "search", "parameters": {"type": "object", "properties": {}}}]
+        self.assertNotEqual(key, CompletionCache.make_key(_prompt("a"), "text", "gpt-4", 100, functions))
+
+    async def test_opt_in(self):
+        await self.kernel.do_llm_completion(_prompt("hello"), "text", "stub", 100)
+        await self.kernel.do_llm_completion(_prompt("hello"), "text", "stub", 100)
+        self.assertEqual(self.node.task_count, 2)
+        self.assertEqual(self.kernel.completion_cache.get_metrics()["entries"], 0)
+
+    async def test_replay_workload(self):
+        # 100 triage prompts over 10 distinct messages, replayed one after another like an agent does
+        workload = [f"email {i % 10}" for i in range(100)]
+        for content in workload:
+            result = await self.kernel.do_llm_completion(_prompt(content), "text", "stub", 100, use_cache=True)
+            self.assertEqual(result.result_str, f"reply to {content}")
+
+        metrics = self.kernel.completion_cache.get_metrics()
+        self.assertEqual(self.node.task_count, 10)
+        self.assertAlmostEqual(metrics["hit_rate"], 0.9)
+        self.assertGreater(metrics["saved_time"], 90 * self.node.delay)
+
+    async def test_cached_result_is_a_copy(self):
+        await self.kernel.do_llm_completion(_prompt("hello"), "text", "stub", 100, use_cache=True)
+        result = await self.kernel.do_llm_completion(_prompt("hello"), "text", "stub", 100, use_cache=True)
+        result.result["message"]["content"] = "changed"
+        result = await self.kernel.do_llm_completion(_prompt("hello"), "text", "stub", 100, use_cache=True)
+        self.assertEqual(result.result["message"]["content"], "reply to hello")
+
+    def test_ttl_and_size(self):
+        cache = CompletionCache(max_entries=2, ttl=0.05)
+        result = ComputeTaskResult()
+        cache.put("a", result, 1)
+        cache.put("b", result, 1)
+        cache.get("a")
+        cache.put("c", result, 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get_metrics()["entries"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
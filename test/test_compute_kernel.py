@@ -0,0 +1,255 @@
+import sys
+import os
+import time
+import asyncio
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import ComputeKernel, ComputeTask, ComputeTaskResult, ComputeTaskState, ComputeTaskType, Queue_ComputeNode
+from aios import LeastOutstandingPolicy, EWMALatencyPolicy, ComputeTaskQueue, ComputeTaskPriority
+from aios.proto.compute_task import ComputeTaskResultCode
+
+# AIOS_BENCHMARK=1 runs the benchmarks
+BENCHMARK = os.environ.get("AIOS_BENCHMARK")
+
+
+class StubEmbeddingNode(Queue_ComputeNode):
+    def __init__(self, delay: float = 0, max_workers: int = 1, model_max_workers: dict = None, node_id: str = "stub_embedding_node"):
+        super().__init__(max_workers, model_max_workers)
+        self.node_id = node_id
+        self.delay = delay
+        self.task_count = 0
+
+    async def execute_task(self, task: ComputeTask) -> ComputeTaskResult:
+        self.task_count += 1
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        result = ComputeTaskResult()
+        result.set_from_task(task)
+        result.worker_id = self.node_id
+        result.result_code = ComputeTaskResultCode.OK
+        result.result = {"content": [0.1, 0.2, 0.3]}
+        return result
+
+    def display(self) -> str:
+        return f"StubEmbeddingNode: {self.node_id}"
+
+    def is_support(self, task: ComputeTask) -> bool:
+        return task.task_type == ComputeTaskType.TEXT_EMBEDDING
+
+    def is_local(self) -> bool:
+        return True
+
+
+class BatchStubEmbeddingNode(StubEmbeddingNode):
+    async def execute_task(self, task: ComputeTask) -> ComputeTaskResult:
+        result = await super().execute_task(task)
+        input = task.params["input"]
+        if isinstance(input, list):
+            result.result = {"content": [[float(len(item))] for item in input]}
+        else:
+            result.result = {"content": [float(len(input))]}
+        return result
+
+    def is_support_batch(self, task: ComputeTask) -> bool:
+        return True
+
+
+async def _polling_wait_task(task_req: ComputeTask, timeout=60):
+    # the 0.5s polling waiter ComputeKernel used before tasks carried a done future
+    check_times = 0
+    while True:
+        if task_req.state == ComputeTaskState.DONE or task_req.state == ComputeTaskState.ERROR:
+            break
+        if timeout is not None and check_times >= timeout * 2:
+            break
+        await asyncio.sleep(0.5)
+        check_times += 1
+    return task_req.result
+
+
+def _create_kernel(node: Queue_ComputeNode) -> ComputeKernel:
+    kernel = ComputeKernel()
+    kernel.add_compute_node(node)
+    node.start()
+    return kernel
+
+
+async def _measure(kernel: ComputeKernel, task_count: int, waiter, concurrency: int = 100) -> float:
+    # each client sends its share of the tasks one after another and waits for each of them
+    async def one_client(client_id):
+        latencies = []
+        for i in range(task_count // concurrency):
+            begin = time.perf_counter()
+            task_req = kernel.text_embedding(f"text {client_id}-{i}")
+            await waiter(task_req)
+            latencies.append(time.perf_counter() - begin)
+        return latencies
+
+    results = await asyncio.gather(*[one_client(i) for i in range(concurrency)])
+    latencies = [latency for client_latencies in results for latency in client_latencies]
+    return sum(latencies) / len(latencies)
+
+
+class TestComputeKernel(unittest.IsolatedAsyncioTestCase):
+    async def test_do_text_embedding(self):
+        kernel = _create_kernel(StubEmbeddingNode())
+        await kernel.start()
+        vector = await kernel.do_text_embedding("hello")
+        self.assertEqual(vector, [0.1, 0.2, 0.3])
+
+    async def test_timeout_cancels_task(self):
+        kernel = _create_kernel(StubEmbeddingNode(delay=10))
+        await kernel.start()
+        task_req = kernel.text_embedding("slow")
+        # returns at the timeout, doesn't wait for the node
+        result = await asyncio.wait_for(kernel._wait_task(task_req, timeout=0.2), 5)
+        self.assertEqual(result.result_code, ComputeTaskResultCode.TIMEOUT)
+        self.assertTrue(task_req.is_cancelled)
+        self.assertEqual(task_req.state, ComputeTaskState.ERROR)
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    async def test_latency_benchmark(self):
+        task_count = 1000
+        kernel = _create_kernel(StubEmbeddingNode())
+        await kernel.start()
+
+        polling_latency = await _measure(kernel, task_count, _polling_wait_task)
+        future_latency = await _measure(kernel, task_count, kernel._wait_task)
+        result = f"{task_count} tasks, mean latency: polling {polling_latency * 1000:.2f}ms, done future {future_latency * 1000:.2f}ms"
+        self.assertLess(future_latency, polling_latency, result)
+
+    async def test_model_max_workers(self):
+        node = StubEmbeddingNode(delay=0.05, max_workers=8, model_max_workers={"slow-model": 2})
+        kernel = _create_kernel(node)
+        await kernel.start()
+
+        tasks = [kernel.text_embedding(f"text {i}", "slow-model") for i in range(6)]
+        await asyncio.sleep(0.02)
+        capacity = node.get_capacity()
+        self.assertEqual(capacity["max_workers"], 8)
+        self.assertEqual(capacity["in_flight"], 2)
+        self.assertEqual(capacity["models"], {"slow-model": 2})
+
+        await asyncio.gather(*[kernel._wait_task(task) for task in tasks])
+        self.assertEqual(node.get_capacity()["in_flight"], 0)
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    async def test_throughput_benchmark(self):
+        task_count = 200
+        throughputs = {}
+        for max_workers in [1, 4, 16]:
+            kernel = _create_kernel(StubEmbeddingNode(delay=0.05, max_workers=max_workers))
+            await kernel.start()
+
+            begin = time.perf_counter()
+            await asyncio.gather(*[kernel.do_text_embedding(f"text {i}") for i in range(task_count)])
+            throughputs[max_workers] = task_count / (time.perf_counter() - begin)
+
+        result = ", ".join(f"{max_workers} workers: {throughput:.1f} tasks/s" for max_workers, throughput in throughputs.items())
+        self.assertGreater(throughputs[4], throughputs[1] * 1.5, result)
+        self.assertGreater(throughputs[16], throughputs[4] * 1.5, result)
+
+    async def test_ewma_latency_policy(self):
+        fast_node = StubEmbeddingNode(delay=0.01, max_workers=2, node_id="fast_node")
+        slow_node = StubEmbeddingNode(delay=0.2, max_workers=2, node_id="slow_node")
+        kernel = _create_kernel(fast_node)
+        kernel.add_compute_node(slow_node)
+        slow_node.start()
+        kernel.set_schedule_policy(EWMALatencyPolicy())
+        await kernel.start()
+
+        for _ in range(10):
+            await asyncio.gather(*[kernel.do_text_embedding(f"text {i}") for i in range(4)])
+        self.assertGreater(fast_node.task_count, slow_node.task_count * 3)
+
+    async def test_least_outstanding_policy(self):
+        busy_node = StubEmbeddingNode(delay=0.05, node_id="busy_node")
+        idle_node = StubEmbeddingNode(delay=0.05, node_id="idle_node")
+        kernel = _create_kernel(busy_node)
+        kernel.add_compute_node(idle_node)
+        idle_node.start()
+        kernel.set_schedule_policy(LeastOutstandingPolicy())
+        await kernel.start()
+
+        for i in range(5):
+            task = ComputeTask()
+            task.set_text_embedding_params(f"direct {i}")
+            await busy_node.push_task(task)
+        await asyncio.gather(*[kernel.do_text_embedding(f"text {i}") for i in range(4)])
+        self.assertEqual(idle_node.task_count, 4)
+
+    async def test_support_nodes_index(self):
+        kernel = _create_kernel(StubEmbeddingNode(node_id="node_a"))
+        task = ComputeTask()
+        task.set_text_embedding_params("hello")
+        self.assertEqual(len(kernel._get_support_nodes(task)), 1)
+
+        kernel.add_compute_node(StubEmbeddingNode(node_id="node_b"))
+        self.assertEqual(len(kernel._get_support_nodes(task)), 2)
+        kernel.disable_compute_node("node_a")
+        self.assertEqual([node.node_id for node in kernel._get_support_nodes(task)], ["node_b"])
+
+    async def test_priority_queue(self):
+        queue = ComputeTaskQueue(max_wait={ComputeTaskPriority.BATCH_INGEST: 0.1})
+        for priority in [ComputeTaskPriority.BATCH_INGEST, ComputeTaskPriority.AGENT_BACKGROUND, ComputeTaskPriority.INTERACTIVE]:
+            task = ComputeTask()
+            task.set_text_embedding_params(priority.name)
+            queue.push(task, priority.value)
+
+        self.assertEqual(queue.qsize(), 3)
+        self.assertEqual((await queue.get()).priority, ComputeTaskPriority.INTERACTIVE)
+        self.assertEqual(queue.get_depths()["batch_ingest"]["depth"], 1)
+
+        # the batch task has waited longer than its max wait, it goes before the background task
+        await asyncio.sleep(0.15)
+        self.assertEqual((await queue.get()).priority, ComputeTaskPriority.BATCH_INGEST)
+        self.assertEqual(queue.get_depths()["batch_ingest"]["promoted"], 1)
+        self.assertEqual((await queue.get()).priority, ComputeTaskPriority.AGENT_BACKGROUND)
+        self.assertTrue(queue.empty())
+
+    async def test_interactive_latency_under_background_load(self):
+        node = StubEmbeddingNode(delay=0.01, max_workers=2)
+        kernel = _create_kernel(node)
+        await kernel.start()
+
+        background = [kernel.text_embedding(f"doc {i}", priority=ComputeTaskPriority.BATCH_INGEST) for i in range(200)]
+        await asyncio.sleep(0.05)
+        await kernel.do_text_embedding("user question")
+        # the interactive task went ahead of the batch tasks still queued
+        self.assertGreater(node.get_capacity()["queue_depths"]["batch_ingest"]["depth"], 0)
+
+        await asyncio.gather(*[kernel._wait_task(task) for task in background])
+
+    async def test_embedding_batch(self):
+        node = BatchStubEmbeddingNode(delay=0.01)
+        kernel = _create_kernel(node)
+        kernel.set_embedding_batch(0.01, 32)
+        await kernel.start()
+
+        inputs = ["x" * (i % 50) for i in range(100)]
+        vectors = await asyncio.gather(*[kernel.do_text_embedding(input) for input in inputs])
+        self.assertEqual(vectors, [[float(len(input))] for input in inputs])
+        # 50 distinct inputs, at most 32 of them in one task
+        self.assertEqual(node.task_count, 2)
+        metrics = kernel.embedding_batcher.get_metrics()
+        self.assertEqual(metrics["deduped"], 50)
+        self.assertEqual(metrics["batched_inputs"], 50)
+        self.assertEqual(metrics["in_flight"], 0)
+
+    async def test_embedding_batch_fallback(self):
+        # the node takes one input for each task, the batcher still dedups identical inputs
+        node = StubEmbeddingNode(max_workers=4)
+        kernel = _create_kernel(node)
+        await kernel.start()
+
+        vectors = await asyncio.gather(*[kernel.do_text_embedding(f"text {i % 5}") for i in range(20)])
+        self.assertEqual(vectors, [[0.1, 0.2, 0.3]] * 20)
+        self.assertEqual(node.task_count, 5)
+        self.assertEqual(kernel.embedding_batcher.get_metrics()["batches"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
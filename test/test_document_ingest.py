@@ -0,0 +1,132 @@
+import sys
+import os
+import time
+import asyncio
+import tempfile
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from component.common_environment.document_ingest import DocumentIngestor
+from component.common_environment import document_parser
+
+# AIOS_BENCHMARK=1 runs the benchmarks, INGEST_BENCHMARK_FILES=5000 for a quicker run
+BENCHMARK = os.environ.get("AIOS_BENCHMARK")
+BENCHMARK_FILES = int(os.environ.get("INGEST_BENCHMARK_FILES", 50000))
+
+
+def support_file(file_name: str) -> bool:
+    return not file_name.startswith(".") and file_name.endswith((".pdf", ".md", ".txt"))
+
+
+def write_file(path: str, content: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+async def ingest_all(ingestor: DocumentIngestor, root: str) -> list:
+    docs = []
+    async for doc in ingestor.ingest(root, support_file):
+        docs.append(doc)
+        ingestor.commit(ingestor.take(doc.path))
+    return docs
+
+
+class TestDocumentIngest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "kb.db")
+        self.root = os.path.join(self.temp_dir.name, "docs")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    async def test_incremental_ingest(self):
+        write_file(f"{self.root}/a.md", "# Title A\n\n## Part 1\ntext\n")
+        write_file(f"{self.root}/sub/b.txt", "plain text")
+        write_file(f"{self.root}/sub/deep/c.txt", "more text")
+        write_file(f"{self.root}/sub/.hidden.txt", "hidden")
+        write_file(f"{self.root}/sub/d.doc", "not supported")
+        write_file(f"{self.root}/empty.txt", "")
+
+        ingestor = DocumentIngestor.open(self.db_path, max_workers=2)
+        self.assertIs(DocumentIngestor.open(self.db_path), ingestor)
+        ingestor.close()
+        docs = await ingest_all(ingestor, self.root)
+        by_name = {os.path.basename(doc.path): doc for doc in docs}
+        self.assertEqual(sorted(by_name.keys()), ["a.md", "b.txt", "c.txt", "empty.txt"])
+        self.assertEqual(by_name["a.md"].meta["title"], "Title A")
+        self.assertIn("Part 1", by_name["a.md"].meta["catalogs"])
+        self.assertEqual(by_name["b.txt"].doc_hash, document_parser.parse_document(by_name["b.txt"].path)[0])
+        # empty files aren't parsed
+        self.assertIsNone(by_name["empty.txt"].doc_hash)
+        self.assertIsNone(ingestor.take(by_name["a.md"].path))
+
+        # nothing changed
+        self.assertEqual(await ingest_all(ingestor, self.root), [])
+        metrics = ingestor.get_metrics()
+        self.assertEqual(metrics["parsed"], 3)
+        self.assertEqual(metrics["skipped"], 4)
+
+        # a changed, a new and a touched file
+        write_file(f"{self.root}/sub/b.txt", "plain text, edited")
+        write_file(f"{self.root}/new.md", "# New")
+        os.utime(f"{self.root}/sub/deep/c.txt", (time.time() + 10, time.time() + 10))
+        docs = await ingest_all(ingestor, self.root)
+        self.assertEqual(sorted(os.path.basename(doc.path) for doc in docs), ["b.txt", "c.txt", "new.md"])
+        ingestor.close()
+
+        # the journal is persistent
+        ingestor = DocumentIngestor.open(self.db_path)
+        self.assertEqual(len(ingestor.journal), 5)
+        self.assertEqual(await ingest_all(ingestor, self.root), [])
+        ingestor.close()
+
+    async def test_bounded_inflight(self):
+        for i in range(20):
+            write_file(f"{self.root}/{i}.txt", f"text {i}")
+        ingestor = DocumentIngestor.open(self.db_path, max_workers=2, max_inflight=3, batch_files=1)
+        max_inflight = 0
+        async for doc in ingestor.ingest(self.root, support_file):
+            max_inflight = max(max_inflight, ingestor.get_metrics()["inflight"])
+            # a slow consumer doesn't let parsed documents pile up
+            await asyncio.sleep(0.01)
+            self.assertLessEqual(ingestor.get_metrics()["waiting"], 3)
+            ingestor.commit(ingestor.take(doc.path))
+        self.assertLessEqual(max_inflight, 3)
+        self.assertEqual(ingestor.get_metrics()["parsed"], 20)
+        ingestor.close()
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    async def test_benchmark(self):
+        # mostly text files with some markdown, 100 per folder
+        begin = time.perf_counter()
+        for i in range(BENCHMARK_FILES):
+            if i % 10 == 0:
+                content = f"# Document {i}\n\n## Intro\n{'some words ' * 40}\n## Details\n{'more words ' * 40}\n"
+                write_file(f"{self.root}/d{i // 100}/{i}.md", content)
+            else:
+                write_file(f"{self.root}/d{i // 100}/{i}.txt", f"document {i} " * 50)
+        create_time = time.perf_counter() - begin
+
+        ingestor = DocumentIngestor.open(self.db_path)
+        begin = time.perf_counter()
+        docs = await ingest_all(ingestor, self.root)
+        ingest_time = time.perf_counter() - begin
+        self.assertEqual(len(docs), BENCHMARK_FILES)
+        metrics = ingestor.get_metrics()
+
+        begin = time.perf_counter()
+        self.assertEqual(await ingest_all(ingestor, self.root), [])
+        rescan_time = time.perf_counter() - begin
+        result = (f"{BENCHMARK_FILES} files (created in {create_time:.1f}s) on {ingestor.max_workers} workers: "
+                  f"ingest {ingest_time:.1f}s ({metrics['files_per_sec']:.0f} files/s, {metrics['bytes_per_sec'] / 1024 / 1024:.1f}MB/s), "
+                  f"rescan {rescan_time:.2f}s")
+        self.assertLess(rescan_time, 5, result)
+        ingestor.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import sys
+import os
+import asyncio
+import tempfile
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import EmbeddingCache, ChunkID, HashValue
+from test_compute_kernel import BatchStubEmbeddingNode, _create_kernel
+
+
+class TestEmbeddingCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, "cache", "embedding_cache.db")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    async def test_put_get(self):
+        cache = EmbeddingCache(self.db_file)
+        self.assertIsNone(await cache.get("model-a", "hello"))
+        await cache.put("model-a", "hello", [0.5, -1.25, 3.0])
+        self.assertEqual(await cache.get("model-a", "hello"), [0.5, -1.25, 3.0])
+        self.assertIsNone(await cache.get("model-b", "hello"))
+        self.assertEqual(cache.get_metrics()["hit"], 1)
+        self.assertEqual(cache.get_metrics()["miss"], 2)
+        # float32 storage: 3 floats in 12 bytes
+        self.assertEqual(cache.get_metrics()["size"], 12)
+        cache.close()
+
+        # the cache survives a restart
+        cache = EmbeddingCache(self.db_file)
+        self.assertEqual(await cache.get("model-a", "hello"), [0.5, -1.25, 3.0])
+        self.assertEqual(cache.get_metrics()["size"], 12)
+        cache.close()
+
+    async def test_hits_dont_write(self):
+        cache = EmbeddingCache(self.db_file)
+        await cache.put("model", "hello", [1.0])
+        last_access = cache.db.fetchone("SELECT last_access FROM embeddings")[0]
+        queries = cache.db.get_metrics()["queries"]
+        for _ in range(10):
+            await cache.get("model", "hello")
+        # one read for each hit, the touch waits in memory
+        self.assertEqual(cache.db.get_metrics()["queries"], queries + 10)
+        self.assertEqual(cache.db.fetchone("SELECT last_access FROM embeddings")[0], last_access)
+        cache.close()
+
+        cache = EmbeddingCache(self.db_file)
+        self.assertGreater(cache.db.fetchone("SELECT last_access FROM embeddings")[0], last_access)
+        cache.close()
+
+    def test_content_hash_matches_chunk_id(self):
+        text = "a chunk of some document"
+        chunk_id = ChunkID.hash_data(text.encode("utf-8"))
+        # a chunk id is the sha256 of the chunk with the object type in the first byte
+        self.assertEqual(HashValue.from_base58(EmbeddingCache.content_hash(text)).value[1:], chunk_id.value[1:])
+
+    async def test_lru_eviction(self):
+        cache = EmbeddingCache(self.db_file, max_size=40)
+        for i in range(10):
+            await cache.put("model", f"text {i}", [float(i)])
+        # text 0 was read recently, it survives the eviction
+        await cache.get("model", "text 0")
+        await cache.put("model", "text 10", [10.0])
+
+        metrics = cache.get_metrics()
+        self.assertLessEqual(metrics["size"], 40)
+        self.assertGreater(metrics["evicted"], 0)
+        self.assertEqual(await cache.get("model", "text 0"), [0.0])
+        self.assertIsNone(await cache.get("model", "text 1"))
+        self.assertEqual(await cache.get("model", "text 10"), [10.0])
+        cache.close()
+
+    async def test_reingest_without_embedding_calls(self):
+        node = BatchStubEmbeddingNode()
+        kernel = _create_kernel(node)
+        kernel.set_embedding_cache(EmbeddingCache(self.db_file))
+        await kernel.start()
+
+        chunks = [f"chunk {i} " * (i % 7) for i in range(200)]
+        first = await asyncio.gather(*[kernel.do_text_embedding(chunk) for chunk in chunks])
+        task_count = node.task_count
+        self.assertGreater(task_count, 0)
+
+        second = await asyncio.gather(*[kernel.do_text_embedding(chunk) for chunk in chunks])
+        self.assertEqual(first, second)
+        self.assertEqual(node.task_count, task_count)
+        self.assertEqual(kernel.embedding_cache.get_metrics()["hit"], 200)
+        kernel.embedding_cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import sys
+import os
+import asyncio
+import json
+import unittest
+
+from aiohttp import web
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import ComputeKernel, AsyncHttpClient, LLMPrompt
+from component.llama_node import LocalLlama_ComputeNode
+
+
+class TestAsyncHttpClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # a stub of the llama-cpp-python server which takes 0.5s for each embedding
+        self.request_count = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.chunks_sent = 0
+        async def embeddings(request: web.Request):
+            self.request_count += 1
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+            body = await request.json()
+            await asyncio.sleep(0.5)
+            self.inflight -= 1
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            data = [{"index": i, "embedding": [0.1, 0.2, len(input)]} for i, input in enumerate(inputs)]
+            # the server may return the vectors in any order
+            return web.json_response({"data": list(reversed(data))})
+
+        # and streams a completion token by token as server sent events
+        async def chat_completions(request: web.Request):
+            body = await request.json()
+            self.assertTrue(body["stream"])
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for i in range(10):
+                await asyncio.sleep(0.05)
+                chunk = {"choices": [{"index": 0, "delta": {"content": f"t{i} "}, "finish_reason": None}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.chunks_sent += 1
+            chunk = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode())
+            return response
+
+        app = web.Application()
+        app.router.add_post("/v1/embeddings", embeddings)
+        app.router.add_post("/v1/chat/completions", chat_completions)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def asyncTearDown(self):
+        await AsyncHttpClient.get_instance().close()
+        await self.runner.cleanup()
+
+    async def test_post(self):
+        response = await AsyncHttpClient.get_instance().post(self.url + "/v1/embeddings", json_body={"input": "abc"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"][0]["embedding"], [0.1, 0.2, 3])
+
+    async def test_event_loop_responsive(self):
+        node = LocalLlama_ComputeNode(self.url, "stub-model", max_workers=10)
+        kernel = ComputeKernel()
+        kernel.set_embedding_batch(0, 1)
+        kernel.add_compute_node(node)
+        node.start()
+        await kernel.start()
+
+        vectors = await asyncio.gather(*[kernel.do_text_embedding("x" * i, "stub-model") for i in range(10)])
+        self.assertEqual([vector[2] for vector in vectors], list(range(10)))
+        # the stub server runs on the same loop, it only sees the calls overlap if none of them blocks the loop
+        self.assertEqual(self.max_inflight, 10)
+
+    async def test_batch_embedding(self):
+        node = LocalLlama_ComputeNode(self.url, "stub-model")
+        kernel = ComputeKernel()
+        kernel.add_compute_node(node)
+        node.start()
+        await kernel.start()
+
+        inputs = ["x" * (i % 20) for i in range(100)]
+        vectors = await asyncio.gather(*[kernel.do_text_embedding(input, "stub-model") for input in inputs])
+        self.assertEqual([vector[2] for vector in vectors], [len(input) for input in inputs])
+        # 20 distinct inputs in one multi-input request
+        self.assertEqual(self.request_count, 1)
+        self.assertEqual(kernel.embedding_batcher.get_metrics()["deduped"], 80)
+
+    async def test_stream_completion(self):
+        node = LocalLlama_ComputeNode(self.url, "stub-model")
+        kernel = ComputeKernel()
+        kernel.add_compute_node(node)
+        node.start()
+        await kernel.start()
+
+        stream = kernel.llm_completion_stream(LLMPrompt("hello"), mode_name="stub-model", timeout=10)
+        tokens = []
+        async for token in stream:
+            # the first token arrives before the server has sent the rest
+            if not tokens:
+                self.assertLess(self.chunks_sent, 10)
+            tokens.append(token)
+        result = await stream.result()
+        self.assertEqual(tokens, [f"t{i} " for i in range(10)])
+        self.assertEqual(result.result_str, "".join(tokens))
+        self.assertEqual(result.result["message"]["content"], "".join(tokens))
+
+
+if __name__ == "__main__":
+    unittest.main()
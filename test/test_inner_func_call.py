@@ -0,0 +1,225 @@
+import sys
+import os
+import json
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import ComputeKernel, ComputeTask, ComputeTaskResult, ComputeTaskState
+from aios import AgentMsg, SimpleAIFunction, ParameterDefine, InnerFuncCall, LLMPrompt, Workflow
+from aios.proto.compute_task import ComputeTaskResultCode
+from aios.agent.inner_func_call import execute_inner_func_calls
+from test_completion_cache import StubLLMNode
+from test_tokenizer import _is_encoding_available
+from test_llm_stream import ReplyProcess
+
+CALL_TIME = 0.2
+
+
+def _tool_calls_message(calls: list) -> dict:
+    return {
+        "role": "assistant",
+        "content": None,
+        "function_call": None,
+        "tool_calls": [{"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+                       for i, (name, args) in enumerate(calls)],
+    }
+
+
+def _create_funcs(events: list) -> dict:
+    # the calls log (name, "begin"/"end") to events
+    def create_func(name: str, read_only: bool, timeout: float = None) -> SimpleAIFunction:
+        async def handler(parameters):
+            events.append((name, "begin"))
+            await asyncio.sleep(parameters.get("seconds", CALL_TIME))
+            events.append((name, "end"))
+            return f"{name} of {parameters.get('query')}"
+        return SimpleAIFunction(name, name, handler, ParameterDefine.create_parameters({"query": "query"}),
+                                read_only=read_only, timeout=timeout)
+
+    return {
+        "knowledge.search": create_func("knowledge.search", True),
+        "system.now": create_func("system.now", True),
+        "agent.workspace.write_file": create_func("agent.workspace.write_file", False),
+        "slow.search": create_func("slow.search", True, timeout=0.05),
+    }
+
+
+class TestInnerFuncCall(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.events = []
+        self.funcs = _create_funcs(self.events)
+
+    def _create_calls(self, message: dict) -> list:
+        calls = InnerFuncCall.from_message(message)
+        for call in calls:
+            call.func_node = self.funcs.get(call.name)
+        return calls
+
+    async def _run(self, call: InnerFuncCall, arguments: dict) -> str:
+        return await call.func_node.execute(arguments)
+
+    def test_from_message(self):
+        message = _tool_calls_message([("knowledge.search", {"query": "a"}), ("system.now", {})])
+        calls = InnerFuncCall.from_message(message)
+        self.assertEqual([(call.name, call.call_id) for call in calls], [("knowledge.search", "call_0"), ("system.now", "call_1")])
+        call_message = InnerFuncCall.get_call_message(message)
+        self.assertNotIn("function_call", call_message)
+        self.assertIsNone(call_message["content"])
+        self.assertEqual(len(call_message["tool_calls"]), 2)
+
+        message = {"role": "assistant", "content": None, "function_call": {"name": "system.now", "arguments": "{}"}, "tool_calls": None}
+        calls = InnerFuncCall.from_message(message)
+        self.assertEqual([(call.name, call.call_id) for call in calls], [("system.now", None)])
+        self.assertNotIn("tool_calls", InnerFuncCall.get_call_message(message))
+        calls[0].result_str = "now"
+        self.assertEqual(calls[0].to_result_message(), {"role": "function", "content": "now", "name": "system.now"})
+        self.assertEqual(InnerFuncCall.from_message({"role": "assistant", "content": "hi"}), [])
+
+    async def test_parallel(self):
+        queries = [f"q{i}" for i in range(4)]
+        calls = self._create_calls(_tool_calls_message([("knowledge.search", {"query": query}) for query in queries]))
+        await execute_inner_func_calls(calls, self._run)
+        # all of them run at once instead of one after another
+        self.assertEqual([event for name, event in self.events], ["begin"] * 4 + ["end"] * 4)
+        self.assertEqual([call.to_result_message() for call in calls],
+                         [{"role": "tool", "tool_call_id": f"call_{i}", "content": f"knowledge.search of {query}"} for i, query in enumerate(queries)])
+
+    async def test_writes_run_alone(self):
+        calls = self._create_calls(_tool_calls_message([
+            ("knowledge.search", {"query": "a"}),
+            ("system.now", {"seconds": CALL_TIME / 2}),
+            ("agent.workspace.write_file", {"query": "b"}),
+            ("knowledge.search", {"query": "c"}),
+        ]))
+        await execute_inner_func_calls(calls, self._run)
+        # the reads before the write run together, the write waits for them and the read after it waits for the write
+        self.assertEqual(self.events, [("knowledge.search", "begin"), ("system.now", "begin"), ("system.now", "end"), ("knowledge.search", "end"),
+                                       ("agent.workspace.write_file", "begin"), ("agent.workspace.write_file", "end"),
+                                       ("knowledge.search", "begin"), ("knowledge.search", "end")])
+        self.assertEqual([call.result_str for call in calls],
+                         ["knowledge.search of a", "system.now of None", "agent.workspace.write_file of b", "knowledge.search of c"])
+
+    async def test_errors(self):
+        message = _tool_calls_message([("slow.search", {"seconds": 1}), ("unknown", {}), ("knowledge.search", {"query": "a"})])
+        message["tool_calls"][2]["function"]["arguments"] = "{not json"
+        message["tool_calls"].append({"id": "call_3", "type": "function", "function": {"name": "system.now", "arguments": "{}"}})
+        calls = self._create_calls(message)
+        await execute_inner_func_calls(calls, self._run)
+        # the timed out function is cancelled, it doesn't hold the others up
+        self.assertNotIn(("slow.search", "end"), self.events)
+        self.assertEqual(calls[0].result_str, "execute slow.search error:timeout after 0.05s")
+        self.assertEqual(calls[1].result_str, "execute unknown error,function not found")
+        self.assertTrue(calls[2].result_str.startswith("execute knowledge.search error:"))
+        self.assertEqual(calls[3].result_str, "system.now of None")
+
+        calls = self._create_calls(_tool_calls_message([("knowledge.search", {"seconds": 1})]))
+        await execute_inner_func_calls(calls, self._run, timeout=0.05)
+        self.assertEqual(calls[0].result_str, "execute knowledge.search error:timeout after 0.05s")
+
+
+class ToolStubLLMNode(StubLLMNode):
+    # asks for 4 knowledge lookups, then replies with what they returned
+    async def execute_task(self, task: ComputeTask) -> ComputeTaskResult:
+        self.task_count += 1
+        result = ComputeTaskResult()
+        result.set_from_task(task)
+        result.worker_id = self.node_id
+        prompts = task.params["prompts"]
+        results = [prompt["content"] for prompt in prompts if prompt["role"] == "tool"]
+        if results:
+            message = {"role": "assistant", "content": "|".join(results)}
+        else:
+            message = _tool_calls_message([("knowledge.search", {"query": f"q{i}"}) for i in range(4)])
+        result.result_code = ComputeTaskResultCode.OK
+        result.result_str = message["content"]
+        result.result["message"] = message
+        task.state = ComputeTaskState.DONE
+        return result
+
+
+class StubWorkflowEnvironment:
+    def __init__(self, funcs: dict) -> None:
+        self.funcs = funcs
+
+    def get_ai_function(self, func_name: str):
+        return self.funcs.get(func_name)
+
+    def get_all_ai_functions(self):
+        return None
+
+
+class TestWorkflowToolCalls(unittest.IsolatedAsyncioTestCase):
+    async def test_role_execute_func(self):
+        origin_kernel = ComputeKernel._instance
+        kernel = ComputeKernel()
+        node = ToolStubLLMNode()
+        kernel.add_compute_node(node)
+        node.start()
+        await kernel.start()
+        ComputeKernel._instance = kernel
+        try:
+            workflow = Workflow()
+            workflow.workflow_env = StubWorkflowEnvironment(_create_funcs([]))
+            workflow.inner_func_timeout = 0.5
+            role = SimpleNamespace(agent=SimpleNamespace(llm_model_name=None, max_token_size=4000))
+            msg = AgentMsg()
+            msg.set("user", "workflow.role", "what do I know?")
+
+            message = _tool_calls_message([("knowledge.search", {"query": "a"}), ("knowledge.search", {"query": "b", "seconds": 1}),
+                                           ("unknown", {}), ("system.now", {})])
+            message["tool_calls"][3]["function"]["arguments"] = "{not json"
+            calls = InnerFuncCall.from_message(message)
+            prompt = LLMPrompt("what do I know?")
+            prompt.messages.append(InnerFuncCall.get_call_message(message))
+            result_str, error_code = await workflow._role_execute_func(role, calls, prompt, msg)
+            self.assertEqual(error_code, 0)
+
+            # a record of each call with its own result, the calls which didn't run too
+            records = msg.inner_call_chain
+            self.assertEqual([record.func_name for record in records], ["knowledge.search", "knowledge.search", "unknown", "system.now"])
+            self.assertEqual(records[0].result_str, "knowledge.search of a")
+            self.assertEqual(records[0].args, {"query": "a"})
+            # the workflow's timeout
+            self.assertEqual(records[1].result_str, "execute knowledge.search error:timeout after 0.5s")
+            self.assertEqual(records[2].result_str, "execute unknown error,function not found")
+            self.assertTrue(records[3].result_str.startswith("execute system.now error:"))
+            self.assertEqual(records[3].args, "{not json")
+            self.assertEqual(result_str, "|".join(record.result_str for record in records))
+        finally:
+            ComputeKernel._instance = origin_kernel
+
+
+@unittest.skipUnless(_is_encoding_available(), "tiktoken encoding files are not available")
+class TestLLMProcessToolCalls(unittest.IsolatedAsyncioTestCase):
+    async def test_process(self):
+        events = []
+        funcs = _create_funcs(events)
+        origin_kernel = ComputeKernel._instance
+        kernel = ComputeKernel()
+        node = ToolStubLLMNode()
+        kernel.add_compute_node(node)
+        node.start()
+        await kernel.start()
+        ComputeKernel._instance = kernel
+        try:
+            process = ReplyProcess()
+            async def get_inner_function_for_exec(func_name):
+                return funcs.get(func_name)
+            process.get_inner_function_for_exec = get_inner_function_for_exec
+
+            msg = AgentMsg()
+            msg.set("user", "agent", "what do I know?")
+            llm_result = await process.process({"msg": msg})
+            self.assertEqual([event for name, event in events], ["begin"] * 4 + ["end"] * 4)
+            self.assertEqual(llm_result.resp.strip(), "|".join(f"knowledge.search of q{i}" for i in range(4)))
+            self.assertEqual(node.task_count, 2)
+        finally:
+            ComputeKernel._instance = origin_kernel
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+import sys
+import os
+import time
+import tempfile
+import unittest
+
+import numpy as np
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import ComputeKernel, ComputeTask, ComputeTaskResult, SQLiteDB
+from component.common_environment.knowledge_retriever import KnowledgeRetriever, FTS_MAX_MATCH_DOCS
+from test_compute_kernel import StubEmbeddingNode, _create_kernel
+
+# AIOS_BENCHMARK=1 runs the benchmarks, KNOWLEDGE_BENCHMARK_DOCS=20000 for a quicker run
+BENCHMARK = os.environ.get("AIOS_BENCHMARK")
+BENCHMARK_DOCS = int(os.environ.get("KNOWLEDGE_BENCHMARK_DOCS", 100000))
+BENCHMARK_DIM = 64
+
+# the tables of MetaDatabase (local_document.py)
+KNOWLEDGE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS documents (doc_path TEXT PRIMARY KEY, length INTEGER, last_modify TEXT, doc_hash TEXT, create_time TEXT);
+    CREATE TABLE IF NOT EXISTS knowledge (doc_hash TEXT PRIMARY KEY, title TEXT, summary TEXT, content TEXT, catalogs TEXT,
+                                          tags TEXT, llm_title TEXT, llm_summary TEXT, create_time TEXT);
+    CREATE INDEX IF NOT EXISTS idx_documents_doc_hash ON documents (doc_hash);
+"""
+
+TOPIC_WORDS = [["cat", "kitten", "feline"], ["dog", "puppy", "canine"], ["car", "engine", "vehicle"]]
+
+
+class TopicEmbeddingNode(StubEmbeddingNode):
+    # a three dimension "model": how much a text is about cats, dogs and cars, whatever words it uses for them
+    def __init__(self, vectors: dict = None):
+        super().__init__()
+        self.vectors = vectors or {}
+
+    async def execute_task(self, task: ComputeTask) -> ComputeTaskResult:
+        result = await super().execute_task(task)
+        text = task.params["input"]
+        vector = self.vectors.get(text)
+        if vector is None:
+            words = text.lower().split()
+            vector = [float(sum(words.count(word) for word in topic)) + 0.01 for topic in TOPIC_WORDS]
+        result.result = {"content": vector}
+        return result
+
+
+def _create_knowledge_db(db_path: str) -> SQLiteDB:
+    db = SQLiteDB.open(db_path)
+    db.call(lambda conn: conn.executescript(KNOWLEDGE_SCHEMA))
+    return db
+
+
+def _add_doc(db: SQLiteDB, doc_hash: str, title: str, tags: str, create_time: str):
+    db.execute("INSERT INTO documents (doc_path, doc_hash, create_time) VALUES (?, ?, ?)", (f"/docs/{doc_hash}.md", doc_hash, create_time))
+    db.execute("INSERT INTO knowledge (doc_hash, title, tags, create_time) VALUES (?, ?, ?, ?)", (doc_hash, title, tags, create_time))
+
+
+class TestKnowledgeRetrieval(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, "kb.db")
+        self.vector_dir = os.path.join(self.temp_dir.name, ".vector")
+        self.origin_kernel = ComputeKernel._instance
+
+    async def asyncTearDown(self):
+        ComputeKernel._instance = self.origin_kernel
+        self.temp_dir.cleanup()
+
+    async def _start_kernel(self, node: TopicEmbeddingNode):
+        kernel = _create_kernel(node)
+        await kernel.start()
+        ComputeKernel._instance = kernel
+
+    async def test_hybrid_retrieve(self):
+        node = TopicEmbeddingNode()
+        await self._start_kernel(node)
+        db = _create_knowledge_db(self.db_path)
+        _add_doc(db, "d1", "Kitten care", "pets,cats", "2023-01-10 08:00:00")
+        _add_doc(db, "d2", "Puppy training", "pets,dogs", "2023-06-01 08:00:00")
+        _add_doc(db, "d3", "Engine repair", "cars", "2024-02-01 08:00:00")
+        retriever = KnowledgeRetriever(self.db_path, self.vector_dir)
+        await retriever.index_document("d1", "How to feed a kitten.\nA young cat needs food four times a day.")
+        await retriever.index_document("d2", "Teach your dog to sit before the puppy gets older.")
+        await retriever.index_document("d3", "Fix the car engine when the vehicle won't start.")
+        # indexing again replaces the document
+        await retriever.index_document("d3", "Fix the car engine when the vehicle won't start.")
+        self.assertEqual(len(retriever.vector_index), 3)
+
+        results = await retriever.retrieve("engine", mode="text")
+        self.assertEqual([result["doc_hash"] for result in results], ["d3"])
+        self.assertIn("[engine]", results[0]["snippet"])
+        self.assertEqual(results[0]["path"], "/docs/d3.md")
+        self.assertEqual(results[0]["title"], "Engine repair")
+
+        # no document has the word, the embeddings know what it means
+        self.assertEqual(await retriever.retrieve("feline", mode="text"), [])
+        results = await retriever.retrieve("feline")
+        self.assertEqual(results[0]["doc_hash"], "d1")
+
+        # found by both rankings first
+        results = await retriever.retrieve("puppy dog")
+        self.assertEqual(results[0]["doc_hash"], "d2")
+
+        # filters
+        results = await retriever.retrieve("dog", tags=["cats"])
+        self.assertEqual([result["doc_hash"] for result in results], ["d1"])
+        results = await retriever.retrieve("pets", tags=["pets"], mode="text")
+        self.assertEqual(sorted(result["doc_hash"] for result in results), ["d1", "d2"])
+        results = await retriever.retrieve("dog kitten engine", create_after="2024")
+        self.assertEqual([result["doc_hash"] for result in results], ["d3"])
+        results = await retriever.retrieve("dog kitten engine", create_before="2023-06")
+        self.assertEqual([result["doc_hash"] for result in results], ["d1"])
+
+        await retriever.remove_document("d2")
+        self.assertNotIn("d2", [result["doc_hash"] for result in await retriever.retrieve("puppy dog")])
+
+        # vectors of another model don't fit the index, the document fails and the index is unchanged
+        _add_doc(db, "d4", "Other model", "", "2024-03-01 08:00:00")
+        node.vectors["Other model\ncat"] = [1.0, 0.0]
+        self.assertFalse(await retriever.index_document("d4", "cat"))
+        self.assertEqual(len(retriever.vector_index), 2)
+        node.vectors["wrong"] = [1.0, 0.0]
+        self.assertEqual(await retriever.retrieve("wrong", mode="vector"), [])
+        retriever.close()
+        db.close()
+
+    async def test_common_terms(self):
+        # every word of the query is in more docs than FTS_MAX_MATCH_DOCS
+        await self._start_kernel(TopicEmbeddingNode())
+        db = _create_knowledge_db(self.db_path)
+        retriever = KnowledgeRetriever(self.db_path, self.vector_dir)
+        doc_count = FTS_MAX_MATCH_DOCS + 1000
+        rows = [(f"doc{i}", f"python guide {i}", "", "2023-01-01 08:00:00") for i in range(doc_count)]
+        def insert_rows(conn):
+            conn.executemany("INSERT INTO knowledge (doc_hash, title, tags, create_time) VALUES (?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO documents (doc_path, doc_hash, create_time) VALUES (?, ?, ?)", [(f"/docs/{row[0]}", row[0], row[3]) for row in rows])
+            conn.executemany("INSERT INTO knowledge_fts (doc_hash, title, summary, tags, content) VALUES (?, ?, '', '', '')",
+                             [(row[0], row[1]) for row in rows])
+        db.batch(insert_rows)
+        _add_doc(db, "rare", "python tips", "", "2023-01-01 08:00:00")
+        db.execute("INSERT INTO knowledge_fts (doc_hash, title, summary, tags, content) VALUES ('rare', 'python tips', '', '', '')")
+
+        results = await retriever.retrieve("python", mode="text")
+        self.assertEqual(len(results), 8)
+        # the rarer word is used, the common one is dropped once the cap is reached
+        results = await retriever.retrieve("python tips", mode="text")
+        self.assertEqual(results[0]["doc_hash"], "rare")
+        retriever.close()
+        db.close()
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    async def test_benchmark(self):
+        rng = np.random.default_rng(0)
+        vocabulary = [f"w{i}" for i in range(5000)]
+        # zipf like word frequencies, as in real text
+        word_p = 1.0 / np.arange(1, len(vocabulary) + 1)
+        word_p /= word_p.sum()
+        topics = rng.normal(size=(BENCHMARK_DOCS // 100, BENCHMARK_DIM)).astype(np.float32)
+        doc_topics = rng.integers(0, len(topics), BENCHMARK_DOCS)
+
+        db = _create_knowledge_db(self.db_path)
+        retriever = KnowledgeRetriever(self.db_path, self.vector_dir)
+        begin = time.perf_counter()
+        words = rng.choice(len(vocabulary), size=(BENCHMARK_DOCS, 80), p=word_p)
+        rows = []
+        for i in range(BENCHMARK_DOCS):
+            create_time = f"2023-{i % 12 + 1:02d}-{i % 28 + 1:02d} 08:00:00"
+            rows.append((f"doc{i}", f"title {vocabulary[words[i][0]]} {vocabulary[words[i][1]]}", f"tag{i % 50}", create_time,
+                         " ".join(vocabulary[w] for w in words[i])))
+        def insert_rows(conn):
+            conn.executemany("INSERT INTO knowledge (doc_hash, title, tags, create_time) VALUES (?, ?, ?, ?)", [row[:4] for row in rows])
+            conn.executemany("INSERT INTO documents (doc_path, doc_hash, create_time) VALUES (?, ?, ?)", [(f"/docs/{row[0]}", row[0], row[3]) for row in rows])
+            conn.executemany("INSERT INTO knowledge_fts (doc_hash, title, summary, tags, content) VALUES (?, ?, '', ?, ?)",
+                             [(row[0], row[1], row[2], row[4]) for row in rows])
+            conn.executemany("INSERT INTO knowledge_tags (tag, doc_hash) VALUES (?, ?)", [(row[2], row[0]) for row in rows])
+        db.batch(insert_rows)
+        vectors = topics[doc_topics] + rng.normal(scale=0.5, size=(BENCHMARK_DOCS, BENCHMARK_DIM)).astype(np.float32)
+        retriever.vector_index.add([f"doc{i}:0" for i in range(BENCHMARK_DOCS)], vectors,
+                                   [{"doc_hash": f"doc{i}", "pos": 0} for i in range(BENCHMARK_DOCS)])
+        load_time = time.perf_counter() - begin
+
+        queries = []
+        query_vectors = {}
+        for i in range(50):
+            query = " ".join(vocabulary[w] for w in rng.choice(len(vocabulary), 3, p=word_p))
+            queries.append(query)
+            query_vectors[query] = (topics[rng.integers(0, len(topics))] + rng.normal(scale=0.5, size=BENCHMARK_DIM)).tolist()
+        await self._start_kernel(TopicEmbeddingNode(query_vectors))
+        # measure the retrieval, not the wait for more embedding requests to batch with
+        ComputeKernel.get_instance().set_embedding_batch(0, 1)
+
+        # the first query trains the approximate vector index
+        await retriever.retrieve(queries[0])
+        latencies = []
+        filtered_latencies = []
+        for query in queries:
+            begin = time.perf_counter()
+            results = await retriever.retrieve(query)
+            latencies.append(time.perf_counter() - begin)
+            self.assertEqual(len(results), 8)
+            begin = time.perf_counter()
+            results = await retriever.retrieve(query, tags=["tag7"], create_after="2023-06")
+            filtered_latencies.append(time.perf_counter() - begin)
+            self.assertTrue(all(result["tags"] == "tag7" and result["create_time"] >= "2023-06" for result in results))
+
+        latencies.sort()
+        filtered_latencies.sort()
+        result = (f"{BENCHMARK_DOCS} docs (loaded in {load_time:.1f}s): hybrid retrieve p50 {latencies[len(latencies) // 2] * 1000:.1f}ms "
+                  f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms, filtered p50 {filtered_latencies[len(filtered_latencies) // 2] * 1000:.1f}ms "
+                  f"p95 {filtered_latencies[int(len(filtered_latencies) * 0.95)] * 1000:.1f}ms")
+        self.assertLess(latencies[len(latencies) // 2], 0.1, result)
+        self.assertLess(filtered_latencies[len(filtered_latencies) // 2], 0.1, result)
+        retriever.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
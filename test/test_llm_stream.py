@@ -0,0 +1,229 @@
+import sys
+import os
+import asyncio
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import ComputeKernel, ComputeTask, ComputeTaskResult, ComputeTaskState, Queue_ComputeNode
+from aios import AIBus, AgentMsg, LLMPrompt, StreamingReply
+from aios.proto.compute_task import ComputeTaskResultCode
+from aios.agent.llm_process import BaseLLMProcess
+from test_completion_cache import StubLLMNode
+from test_tokenizer import _is_encoding_available
+
+TOKEN_COUNT = 20
+TOKEN_DELAY = 0.02
+
+
+class StreamingStubLLMNode(StubLLMNode):
+    # generates a token every TOKEN_DELAY, like a model does
+    generated = 0
+
+    async def execute_task(self, task: ComputeTask) -> ComputeTaskResult:
+        self.task_count += 1
+        self.generated = 0
+        result = ComputeTaskResult()
+        result.set_from_task(task)
+        result.worker_id = self.node_id
+        text = ""
+        for i in range(TOKEN_COUNT):
+            await asyncio.sleep(TOKEN_DELAY)
+            token = f"t{i} "
+            text += token
+            self.generated += 1
+            if task.params.get("stream"):
+                task.push_token(token)
+        result.result_code = ComputeTaskResultCode.OK
+        result.result_str = text
+        result.result["message"] = {"role": "assistant", "content": text}
+        task.state = ComputeTaskState.DONE
+        return result
+
+
+class ReplyProcess(BaseLLMProcess):
+    async def prepare_prompt(self, input: dict) -> LLMPrompt:
+        return LLMPrompt(input["msg"].body)
+
+    async def get_inner_function_for_exec(self, func_name: str):
+        return None
+
+    def prepare_inner_function_context_for_exec(self, inner_func_name: str, parameters: dict):
+        return
+
+    async def post_llm_process(self, actions, input: dict, llm_result) -> bool:
+        return True
+
+    async def load_from_config(self, config: dict) -> bool:
+        return True
+
+    async def initial(self, params: dict = None) -> bool:
+        return True
+
+
+class TestLLMStream(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.origin_kernel = ComputeKernel._instance
+
+    async def asyncTearDown(self):
+        ComputeKernel._instance = self.origin_kernel
+
+    async def _start_kernel(self, node: Queue_ComputeNode) -> ComputeKernel:
+        kernel = ComputeKernel()
+        kernel.add_compute_node(node)
+        node.start()
+        await kernel.start()
+        ComputeKernel._instance = kernel
+        return kernel
+
+    async def test_stream(self):
+        node = StreamingStubLLMNode()
+        kernel = await self._start_kernel(node)
+        stream = kernel.llm_completion_stream(LLMPrompt("hello"), timeout=10)
+        tokens = []
+        async for token in stream:
+            # the first token arrives while the node is still generating the rest
+            if not tokens:
+                self.assertLess(node.generated, TOKEN_COUNT)
+            tokens.append(token)
+        result = await stream.result()
+        self.assertEqual(len(tokens), TOKEN_COUNT)
+        self.assertEqual("".join(tokens), result.result_str)
+        self.assertIsNotNone(stream.first_token_time)
+
+        # the same result with a callback
+        tokens = []
+        async def on_token(token):
+            tokens.append(token)
+        result = await kernel.do_llm_completion(LLMPrompt("hello"), on_token=on_token)
+        self.assertEqual("".join(tokens), result.result_str)
+
+    async def test_not_streaming_node(self):
+        kernel = await self._start_kernel(StubLLMNode())
+        stream = kernel.llm_completion_stream(LLMPrompt("hello"), timeout=10)
+        tokens = [token async for token in stream]
+        self.assertEqual(tokens, ["reply to hello"])
+        self.assertEqual((await stream.result()).result_str, "reply to hello")
+
+    async def test_stream_timeout(self):
+        kernel = await self._start_kernel(StreamingStubLLMNode())
+        stream = kernel.llm_completion_stream(LLMPrompt("hello"), timeout=TOKEN_DELAY * 5)
+        tokens = [token async for token in stream]
+        self.assertLess(len(tokens), TOKEN_COUNT)
+        self.assertEqual((await stream.result()).result_code, ComputeTaskResultCode.TIMEOUT)
+
+    async def _send_to_tunnel(self, bus: AIBus, node: StreamingStubLLMNode, edit_interval: float):
+        bus.register_message_handler("tunnel", None)
+        # a chat app message which is sent, then edited
+        shown = []
+        async def send(text):
+            shown.append((node.generated, text))
+            return len(shown)
+        async def edit(handle, text):
+            shown.append((node.generated, text))
+
+        reply = StreamingReply(send, edit, edit_interval=edit_interval)
+        msg = AgentMsg()
+        msg.set("tunnel", "agent", "hello")
+        resp = await bus.send_message(msg, timeout=10, on_stream=reply.on_stream)
+        self.assertTrue(await reply.finish(resp.body))
+        self.assertEqual(bus.stream_listeners, {})
+
+        # the first token is shown while the rest of the reply is still generated
+        first_generated, first_text = shown[0]
+        self.assertEqual(first_text, "t0 ")
+        self.assertLess(first_generated, TOKEN_COUNT)
+        # throttled, not an edit for every token
+        self.assertLess(len(shown), TOKEN_COUNT)
+        self.assertEqual(shown[-1][1].strip(), resp.body.strip())
+
+        # without a listener the reply is only sent at the end
+        reply = StreamingReply(send, edit)
+        msg = AgentMsg()
+        msg.set("tunnel", "agent", "hello")
+        resp = await bus.send_message(msg, timeout=10)
+        self.assertEqual(resp.body, "".join(f"t{i} " for i in range(TOKEN_COUNT)))
+        self.assertFalse(await reply.finish(resp.body))
+
+    async def test_reply_to_tunnel(self):
+        node = StreamingStubLLMNode()
+        kernel = await self._start_kernel(node)
+        bus = AIBus()
+
+        # not the default bus, the agent finds the listener on the bus which delivered the msg
+        async def agent(msg: AgentMsg) -> AgentMsg:
+            self.assertIs(AIBus.get_current_bus(), bus)
+            result = await kernel.do_llm_completion(LLMPrompt(msg.body), on_token=AIBus.get_current_bus().get_stream_listener(msg.msg_id))
+            return msg.create_resp_msg(result.result_str)
+
+        bus.register_message_handler("agent", agent)
+        await self._send_to_tunnel(bus, node, TOKEN_DELAY * 4)
+
+    async def test_reply_starts_over(self):
+        shown = []
+        async def send(text):
+            shown.append(text)
+            return 1
+        async def edit(handle, text):
+            shown.append(text)
+
+        # the text of a completion which ended in tool calls is dropped, the final reply edits the same message
+        reply = StreamingReply(send, edit, edit_interval=0)
+        await reply.on_stream("let me look ")
+        await reply.on_stream("that up")
+        await reply.on_stream(None)
+        await reply.on_stream("it is ")
+        await reply.on_stream("sunny")
+        self.assertTrue(await reply.finish(""))
+        self.assertEqual(shown, ["let me look ", "let me look that up", "it is ", "it is sunny"])
+        # outside of a handler it's the default bus
+        self.assertIs(AIBus.get_current_bus(), AIBus.get_default_bus())
+
+    async def test_reply_fallback(self):
+        messages = {}
+        async def send(text):
+            messages[len(messages) + 1] = text
+            return len(messages)
+        async def edit(handle, text):
+            # like telegram, which rejects a message over 4096 characters
+            if len(text) > 4096:
+                raise ValueError("message is too long")
+            messages[handle] = text
+        async def delete(handle):
+            del messages[handle]
+
+        # the final text can't be shown, the streamed message is removed before the tunnel sends the reply itself
+        reply = StreamingReply(send, edit, delete, edit_interval=0)
+        await reply.on_stream("a long ")
+        await reply.on_stream("reply")
+        self.assertEqual(messages, {1: "a long reply"})
+        self.assertFalse(await reply.finish("x" * 5000))
+        self.assertEqual(messages, {})
+
+        # a reply which isn't text replaces the streamed one
+        reply = StreamingReply(send, edit, delete, edit_interval=0)
+        await reply.on_stream("let me draw it")
+        self.assertEqual(len(messages), 1)
+        await reply.discard()
+        await reply.discard()
+        self.assertEqual(messages, {})
+        self.assertFalse(await reply.finish("too late"))
+
+    @unittest.skipUnless(_is_encoding_available(), "tiktoken encoding files are not available")
+    async def test_llm_process_reply(self):
+        node = StreamingStubLLMNode()
+        await self._start_kernel(node)
+        bus = AIBus()
+        process = ReplyProcess()
+
+        # how Agent.llm_process_msg passes the listener on
+        async def agent(msg: AgentMsg) -> AgentMsg:
+            llm_result = await process.process({"msg": msg, "on_token": AIBus.get_current_bus().get_stream_listener(msg.msg_id)})
+            return msg.create_resp_msg(llm_result.resp)
+
+        bus.register_message_handler("agent", agent)
+        await self._send_to_tunnel(bus, node, TOKEN_DELAY * 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import sys
+import os
+import sqlite3
+import tempfile
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import ComputeKernel, ComputeTask, ComputeTaskResult, ObjFS
+from aios.knowledge.knowledge_base import ObjFSKnowledgeGrpah
+from test_compute_kernel import StubEmbeddingNode, _create_kernel
+
+
+class PetEmbeddingNode(StubEmbeddingNode):
+    # a two dimension "model": how much a text is about kittens and about dogs, the query "pet" means a kitten to it
+    inflight = 0
+    max_inflight = 0
+
+    async def execute_task(self, task: ComputeTask) -> ComputeTaskResult:
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        result = await super().execute_task(task)
+        self.inflight -= 1
+        text = task.params["input"]
+        result.result = {"content": [float(text.count("kitten") + (text == "pet")), float(text.count("dog"))]}
+        return result
+
+
+class TestObjFSSearch(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, "memory.db")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_full_text_search(self):
+        objfs = ObjFS(self.db_file)
+        self.assertTrue(objfs.fts_enabled)
+        objfs.add_obj("alice", "Alice", "Alice lives in Paris and works as a pianist", ["/contacts/alice", "/music/alice"])
+        objfs.add_obj("bob", "Bob", "Bob is a carpenter in Berlin", ["/contacts/bob"])
+        objfs.add_obj("trip", "Trip", "Trip to Paris with Alice in May", ["/events/trip"])
+
+        results = objfs.search("who lives in Paris?")
+        # any word may match, the objects matching more words come first
+        self.assertEqual([result["obj_id"] for result in results], ["alice", "trip", "bob"])
+        alice = results[0]
+        self.assertEqual(sorted(alice["paths"]), ["/contacts/alice", "/music/alice"])
+        self.assertIn("[Paris]", alice["snippet"])
+        self.assertEqual(objfs.search("pianist")[0]["obj_id"], "alice")
+        # fts5 syntax in the query is taken as text
+        self.assertEqual(objfs.search('carpenter" OR NEAR(')[0]["obj_id"], "bob")
+        self.assertEqual(objfs.search("!!!"), [])
+
+        # the index follows updates and removes
+        objfs.update_obj("bob", "Bob moved to Paris")
+        self.assertEqual(objfs.search("carpenter"), [])
+        self.assertIn("bob", [result["obj_id"] for result in objfs.search("Paris")])
+        objfs.remove_obj("alice")
+        self.assertEqual(objfs.search("pianist"), [])
+        objfs.close()
+
+    def test_index_existing_objects(self):
+        # objects written before the full text index existed
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("CREATE TABLE objects (id TEXT PRIMARY KEY, name TEXT, content TEXT, created_at REAL, modified_at REAL, size INTEGER)")
+        conn.execute("CREATE TABLE paths (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE, obj_id TEXT)")
+        conn.execute("INSERT INTO objects VALUES ('old', 'Old', 'written by an older version', 0, 0, 0)")
+        conn.execute("INSERT INTO paths (path, obj_id) VALUES ('/old', 'old')")
+        conn.commit()
+        conn.close()
+
+        objfs = ObjFS(self.db_file)
+        results = objfs.search("older version")
+        self.assertEqual(results[0]["obj_id"], "old")
+        self.assertEqual(results[0]["paths"], ["/old"])
+        objfs.close()
+
+    async def test_hybrid_search(self):
+        kernel = _create_kernel(PetEmbeddingNode())
+        await kernel.start()
+        origin_kernel = ComputeKernel._instance
+        ComputeKernel._instance = kernel
+        try:
+            kb = ObjFSKnowledgeGrpah("test.memory", self.db_file)
+            await kb.add_obj("a", "a", "pet pet pet pet dog dog", ["/pets/a"])
+            await kb.add_obj("b", "b", "pet pet kitten kitten kitten kitten dog", ["/pets/b"])
+            await kb.add_obj("c", "c", "pet kitten dog dog dog dog dog", ["/pets/c"])
+
+            text_results = await kb.serach("pet", "text")
+            self.assertEqual([result["obj_id"] for result in text_results], ["a", "b", "c"])
+            # b is second by text and first by meaning
+            hybrid_results = await kb.serach("pet", "hybrid", 2)
+            self.assertEqual([result["obj_id"] for result in hybrid_results], ["b", "a"])
+            kb.obj_storage.close()
+        finally:
+            ComputeKernel._instance = origin_kernel
+
+    async def test_hybrid_search_embeds_at_once(self):
+        node = PetEmbeddingNode(delay=0.1, max_workers=8)
+        kernel = _create_kernel(node)
+        await kernel.start()
+        origin_kernel = ComputeKernel._instance
+        ComputeKernel._instance = kernel
+        try:
+            kb = ObjFSKnowledgeGrpah("test.memory", self.db_file)
+            for i in range(7):
+                await kb.add_obj(f"o{i}", f"o{i}", f"pet {'kitten ' * i}", [f"/pets/o{i}"])
+            node.max_inflight = 0
+            results = await kb.serach("pet", "hybrid", 2)
+            # the query and 7 candidates are embedded at once, not one after another
+            self.assertEqual(node.max_inflight, 8)
+            self.assertEqual(len(results), 2)
+            kb.obj_storage.close()
+        finally:
+            ComputeKernel._instance = origin_kernel
+
+
+if __name__ == "__main__":
+    unittest.main()
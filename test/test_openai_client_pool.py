@@ -0,0 +1,76 @@
+import sys
+import os
+import asyncio
+import unittest
+
+from aiohttp import web
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import ComputeTask, ComputeTaskState, LLMPrompt
+from component.openai_node import OpenAI_ComputeNode, OpenAIClientPool
+
+
+class TestOpenAIClientPool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # a stub of an openai compatible server
+        async def chat_completions(request: web.Request):
+            body = await request.json()
+            return web.json_response({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": body["messages"][-1]["content"]}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", chat_completions)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    async def test_connection_reused(self):
+        pool = OpenAIClientPool("sk-stub", self.base_url)
+        for i in range(5):
+            resp = await pool.get_client().chat.completions.create(model="gpt-stub",
+                                                                   messages=[{"role": "user", "content": f"hello {i}"}])
+            self.assertEqual(resp.choices[0].message.content, f"hello {i}")
+
+        metrics = pool.get_metrics()
+        self.assertEqual(metrics["requests"], 5)
+        self.assertEqual(metrics["clients_created"], 1)
+        self.assertEqual(metrics["connections_opened"], 1)
+        self.assertEqual(metrics["connections_reused"], 4)
+        await pool.close()
+
+    async def test_node_shares_client(self):
+        node = OpenAI_ComputeNode()
+        node.client_pool.configure("sk-stub", self.base_url)
+        for i in range(3):
+            prompt = LLMPrompt()
+            prompt.append_user_message(f"task {i}")
+            task = ComputeTask()
+            task.set_llm_params(prompt, None, "gpt-stub", 100)
+            result = await node._run_task(task)
+            self.assertEqual(task.state, ComputeTaskState.DONE)
+            self.assertEqual(result.result_str, f"task {i}")
+
+        pool_metrics = node.get_capacity()["client_pool"]
+        self.assertEqual(pool_metrics["clients_created"], 1)
+        self.assertEqual(pool_metrics["connections_opened"], 1)
+        self.assertEqual(pool_metrics["connections_reused"], 2)
+        await node.client_pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import sys
+import os
+import time
+import random
+import tempfile
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from component.common_environment.pdf_text import PdfText
+from component.common_environment import document_parser
+
+# AIOS_BENCHMARK=1 runs the benchmarks, PDF_BENCHMARK_PAGES=300 for a quicker run
+BENCHMARK = os.environ.get("AIOS_BENCHMARK")
+BENCHMARK_PAGES = int(os.environ.get("PDF_BENCHMARK_PAGES", 1200))
+
+
+def write_pdf(path: str, pages: list):
+    # the smallest valid pdf: a catalog, the page tree, one Helvetica font and a text line per page
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream.decode('latin-1')}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(data))
+        data += f"{i + 1} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref_pos = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        data += f"{offset:010d} 00000 n \n".encode("latin-1")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_pos}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class TestPdfText(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.temp_dir.name, "book.pdf")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_lazy_read(self):
+        pages = [f"page {i} of the book" for i in range(10)]
+        write_pdf(self.pdf_path, pages)
+        pdf_text = PdfText(self.pdf_path)
+        # only the pages the read covers are extracted
+        self.assertEqual(pdf_text.read(0, 10), pages[0][:10])
+        self.assertFalse(pdf_text.is_complete())
+        self.assertEqual(len(pdf_text.page_bytes), 1)
+
+        # the index is reused and the extraction resumes where it stopped
+        pdf_text = PdfText(self.pdf_path)
+        self.assertEqual(len(pdf_text.page_bytes), 1)
+        full_text = pdf_text.read()
+        self.assertTrue(pdf_text.is_complete())
+        for i in range(10):
+            self.assertIn(pages[i], full_text)
+        with open(pdf_text.text_path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), full_text)
+
+        pdf_text = PdfText(self.pdf_path)
+        self.assertTrue(pdf_text.is_complete())
+        self.assertEqual(pdf_text.read(25, 40), full_text[25:65])
+        self.assertEqual(pdf_text.read(len(full_text) - 5), full_text[-5:])
+        self.assertEqual(pdf_text.read(len(full_text) + 10, 10), "")
+
+    def test_parse_and_stale(self):
+        write_pdf(self.pdf_path, ["first version"])
+        document_parser.parse_document(self.pdf_path)
+        pdf_text = PdfText.open(self.pdf_path)
+        self.assertIs(PdfText.open(self.pdf_path), pdf_text)
+        self.assertIn("first version", pdf_text.read())
+        # an up to date sidecar isn't extracted again
+        text_mtime = os.stat(pdf_text.text_path).st_mtime_ns
+        time.sleep(0.01)
+        document_parser.parse_document(self.pdf_path)
+        self.assertEqual(os.stat(pdf_text.text_path).st_mtime_ns, text_mtime)
+
+        # a changed pdf invalidates the text
+        write_pdf(self.pdf_path, ["second version", "with two pages"])
+        os.utime(self.pdf_path, (time.time() + 10, time.time() + 10))
+        pdf_text = PdfText.open(self.pdf_path)
+        text = pdf_text.read()
+        self.assertNotIn("first version", text)
+        self.assertIn("with two pages", text)
+        self.assertEqual(pdf_text.page_count, 2)
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    def test_benchmark(self):
+        pages = [f"chapter {i // 20} page {i} " + " ".join(f"word{(i * 7 + j) % 997}" for j in range(150)) for i in range(BENCHMARK_PAGES)]
+        write_pdf(self.pdf_path, pages)
+        begin = time.perf_counter()
+        document_parser.parse_document(self.pdf_path)
+        parse_time = time.perf_counter() - begin
+
+        pdf_text = PdfText.open(self.pdf_path)
+        self.assertEqual(pdf_text.page_count, BENCHMARK_PAGES)
+        with open(pdf_text.text_path, encoding="utf-8") as f:
+            full_text = f.read()
+        rng = random.Random(0)
+        latencies = []
+        for _ in range(200):
+            page = rng.randrange(BENCHMARK_PAGES)
+            pos = pdf_text.page_chars[page] + rng.randrange(500)
+            begin = time.perf_counter()
+            text = PdfText.open(self.pdf_path).read(pos, 2000)
+            latencies.append(time.perf_counter() - begin)
+            self.assertEqual(text, full_text[pos:pos + 2000])
+        latencies.sort()
+        result = (f"{BENCHMARK_PAGES} pages ({pdf_text.byte_size / 1024 / 1024:.1f}MB text) parsed in {parse_time:.1f}s, "
+                  f"random read p50 {latencies[len(latencies) // 2] * 1000:.2f}ms p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f}ms")
+        self.assertLess(latencies[len(latencies) // 2], 0.01, result)
+
+
+if __name__ == "__main__":
+    unittest.main()
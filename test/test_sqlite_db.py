@@ -0,0 +1,150 @@
+import sys
+import os
+import time
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios.storage.sqlite_db import SQLiteDB
+from aios.storage.objfs import ObjFS
+from aios.environment.simple_kb_db import SimpleKnowledgeDB
+
+# AIOS_BENCHMARK=1 runs the benchmarks
+BENCHMARK = os.environ.get("AIOS_BENCHMARK")
+
+
+class LegacyKnowledgeDB(SimpleKnowledgeDB):
+    # the previous _get_conn: a new threading.local() each call, so every query connects and creates the tables again
+    def _get_db(self):
+        return self
+
+    def _connect(self):
+        local = threading.local()
+        if not hasattr(local, 'conn'):
+            local.conn = sqlite3.connect(self.db_path)
+            self._create_tables(local.conn)
+        return local.conn
+
+    def fetchone(self, sql, params=()):
+        return self._connect().execute(sql, params).fetchone()
+
+    def execute(self, sql, params=()):
+        conn = self._connect()
+        conn.execute(sql, params)
+        conn.commit()
+
+
+class TestSQLiteDB(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, "memory.db")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    async def test_shared_connection(self):
+        db = SQLiteDB.open(self.db_file)
+        self.assertIs(SQLiteDB.open(self.db_file), db)
+        create_count = 0
+
+        def create_table(conn):
+            nonlocal create_count
+            create_count += 1
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v TEXT)")
+        db.init_schema("kv", create_table)
+        db.init_schema("kv", create_table)
+        self.assertEqual(create_count, 1)
+
+        db.execute("INSERT INTO kv VALUES (?, ?)", ("a", "1"))
+        self.assertEqual(await db.afetchone("SELECT v FROM kv WHERE k = ?", ("a",)), ("1",))
+        await db.aexecutemany("INSERT INTO kv VALUES (?, ?)", [("b", "2"), ("c", "3")])
+
+        # any thread can use the db, the statements all run on the db thread
+        rows = await asyncio.to_thread(db.fetchall, "SELECT k FROM kv ORDER BY k")
+        self.assertEqual(rows, [("a",), ("b",), ("c",)])
+
+        def insert_failed(conn):
+            db.execute("INSERT INTO kv VALUES (?, ?)", ("d", "4"))
+            raise ValueError("failed")
+        with self.assertRaises(ValueError):
+            db.batch(insert_failed)
+        self.assertIsNone(db.fetchone("SELECT v FROM kv WHERE k = ?", ("d",)))
+
+        # a write of another coroutine waits for a batch, it isn't rolled back with it
+        def slow_failed(conn):
+            conn.execute("INSERT INTO kv VALUES (?, ?)", ("e", "5"))
+            time.sleep(0.05)
+            raise ValueError("failed")
+        results = await asyncio.gather(db.abatch(slow_failed), db.aexecute("INSERT INTO kv VALUES (?, ?)", ("f", "6")),
+                                       return_exceptions=True)
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual(db.fetchall("SELECT k FROM kv WHERE k IN ('e', 'f')"), [("f",)])
+        self.assertEqual(db.batch(lambda conn: db.fetchone("SELECT v FROM kv WHERE k = ?", ("f",))), ("6",))
+
+        db.close()
+        self.assertIs(SQLiteDB.open(self.db_file), db)
+        db.close()
+        db.close()
+        self.assertIsNot(SQLiteDB.open(self.db_file), db)
+        SQLiteDB.open(self.db_file).close()
+
+    def test_stores(self):
+        objfs = ObjFS(self.db_file)
+        self.assertTrue(objfs.add_obj("obj1", "name", "content", ["/a/b", "/a/c"]))
+        self.assertEqual(objfs.get_obj_by_path("/a/c"), "content")
+        self.assertTrue(objfs.add_path("obj1", "/a/d"))
+        self.assertEqual(objfs.get_obj_by_path("/a/d"), "content")
+        self.assertTrue(objfs.remove_obj("obj1"))
+        self.assertIsNone(objfs.get_obj_by_id("obj1"))
+
+        kb_db = SimpleKnowledgeDB(self.db_file)
+        self.assertIs(kb_db.db, objfs.db)
+        kb_db.add_doc("/doc.txt", 10, "2024-01-01 00:00:00", "hash1")
+        self.assertTrue(kb_db.is_doc_exist("/doc.txt"))
+        self.assertEqual(kb_db.get_hash_by_doc_path("/doc.txt"), "hash1")
+        kb_db.close()
+        objfs.close()
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    def test_query_latency(self):
+        kb_db = SimpleKnowledgeDB(self.db_file)
+        kb_db.add_doc("/doc.txt", 10, "2024-01-01 00:00:00", "hash1")
+        legacy_db = LegacyKnowledgeDB(self.db_file)
+        query_count = 500
+
+        begin = time.perf_counter()
+        for i in range(query_count):
+            self.assertEqual(legacy_db.get_hash_by_doc_path("/doc.txt"), "hash1")
+        legacy_time = (time.perf_counter() - begin) / query_count
+
+        begin = time.perf_counter()
+        for i in range(query_count):
+            self.assertEqual(kb_db.get_hash_by_doc_path("/doc.txt"), "hash1")
+        shared_time = (time.perf_counter() - begin) / query_count
+        result = f"per query latency: connection per call {legacy_time * 1000000:.0f}us, shared db {shared_time * 1000000:.0f}us"
+        self.assertLess(shared_time * 3, legacy_time, result)
+        kb_db.close()
+
+    async def test_event_loop_blocking(self):
+        db = SQLiteDB.open(self.db_file)
+        release = threading.Event()
+
+        def wait_release(conn):
+            return release.wait(5)
+
+        # the db thread waits for the event loop, which only gets to release it if the query doesn't block the loop
+        query = asyncio.ensure_future(db.run(wait_release))
+        await asyncio.sleep(0)
+        release.set()
+        self.assertTrue(await query)
+        self.assertEqual(await db.afetchone("SELECT 1"), (1,))
+        self.assertEqual(db.get_metrics()["async_queries"], 2)
+        db.close()
+
+if __name__ == "__main__":
+    unittest.main()
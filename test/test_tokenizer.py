@@ -0,0 +1,195 @@
+import sys
+import os
+import time
+import copy
+import unittest
+from unittest import mock
+
+import tiktoken
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios import ComputeKernel, LLMPrompt
+from aios.proto.tokenizer import get_encoding, num_tokens_from_text
+
+# AIOS_BENCHMARK=1 runs the benchmarks
+BENCHMARK = os.environ.get("AIOS_BENCHMARK")
+
+
+def _uncached_num_tokens(prompt: LLMPrompt, model: str) -> int:
+    # how ComputeKernel.llm_num_tokens counted before: look the encoder up and encode the whole prompt
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(prompt.as_str()))
+
+
+def _build_prompt(message_count: int) -> LLMPrompt:
+    prompt = LLMPrompt()
+    prompt.append_system_message("You are a helpful assistant. " * 20)
+    for i in range(message_count):
+        role = "user" if i % 2 == 0 else "assistant"
+        prompt.messages.append({"role": role, "content": f"message {i}: " + "the quick brown fox jumps over the lazy dog " * 50})
+    return prompt
+
+
+def _is_encoding_available() -> bool:
+    # tiktoken downloads the bpe files on first use
+    try:
+        get_encoding("gpt-4")
+        return True
+    except Exception:
+        return False
+
+
+class FakeEncoding:
+    # one token per word, counts the encode calls
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.encode_count = 0
+
+    def encode(self, text: str) -> list:
+        self.encode_count += 1
+        return text.split()
+
+
+class TestTokenizerCache(unittest.TestCase):
+    # the caching with a fake encoder, the real encoding files need a download
+    def setUp(self):
+        self.created = []
+        def encoding_for_model(model_name):
+            if model_name.startswith("gpt-"):
+                return self._create_encoding("cl100k_base")
+            if model_name.startswith("text-"):
+                return self._create_encoding("p50k_base")
+            raise KeyError(model_name)
+
+        get_encoding.cache_clear()
+        self.patches = [mock.patch.object(tiktoken, "encoding_for_model", encoding_for_model),
+                        mock.patch.object(tiktoken, "get_encoding", self._create_encoding)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        get_encoding.cache_clear()
+
+    def _create_encoding(self, name: str) -> FakeEncoding:
+        encoding = FakeEncoding(name)
+        self.created.append(encoding)
+        return encoding
+
+    def test_encoding_memoised(self):
+        self.assertIs(get_encoding("gpt-4"), get_encoding("gpt-4"))
+        self.assertIs(get_encoding(None), get_encoding(None))
+        self.assertIs(get_encoding("unknown-model"), get_encoding("unknown-model"))
+        self.assertEqual(get_encoding("unknown-model").name, "cl100k_base")
+        # one lookup for each model name
+        self.assertEqual(len(self.created), 3)
+        self.assertEqual(num_tokens_from_text("hello big world", "gpt-4"), 3)
+        self.assertEqual(len(self.created), 3)
+
+    def test_count_cache(self):
+        encoding = get_encoding("gpt-4")
+        prompt = _build_prompt(10)
+        count = prompt.get_token_count("gpt-4")
+        self.assertEqual(encoding.encode_count, 11)
+
+        # counted again, nothing is encoded
+        self.assertEqual(prompt.get_token_count("gpt-4"), count)
+        self.assertEqual(encoding.encode_count, 11)
+
+        # an appended message is the only one encoded
+        prompt.messages.append({"role": "function", "name": "search", "content": "result of the function"})
+        new_count = prompt.get_token_count("gpt-4")
+        self.assertEqual(encoding.encode_count, 12)
+        self.assertEqual(new_count - count, len(encoding.encode(
+            '{"role": "function", "name": "search", "content": "result of the function"}')))
+        encode_count = encoding.encode_count
+
+        # a message changed in place is encoded again
+        prompt.messages[-1]["content"] = ""
+        self.assertLess(prompt.get_token_count("gpt-4"), new_count)
+        self.assertEqual(encoding.encode_count, encode_count + 1)
+
+        # a removed message drops out of the cache, it's encoded again when it's back
+        removed = prompt.messages.pop()
+        self.assertEqual(prompt.get_token_count("gpt-4"), count)
+        self.assertEqual(len(prompt._token_counts), 11)
+        prompt.messages.append(removed)
+        prompt.get_token_count("gpt-4")
+        self.assertEqual(encoding.encode_count, encode_count + 2)
+
+        # the fallback is the same encoding, its counts are reused
+        prompt.get_token_count("unknown-model")
+        self.assertEqual(get_encoding("unknown-model").encode_count, 0)
+
+        # another encoding doesn't use the counts of this one
+        other = get_encoding("text-davinci-003")
+        prompt.get_token_count("text-davinci-003")
+        self.assertEqual(other.encode_count, 12)
+
+        # the counts are copied with the prompt
+        copied = copy.deepcopy(prompt)
+        copied.get_token_count("text-davinci-003")
+        self.assertEqual(other.encode_count, 12)
+
+
+@unittest.skipUnless(_is_encoding_available(), "tiktoken encoding files are not available")
+class TestTokenizer(unittest.TestCase):
+    def test_encoding_memoised(self):
+        self.assertIs(get_encoding("gpt-4"), get_encoding("gpt-4"))
+        self.assertIs(get_encoding("unknown-model"), get_encoding("unknown-model"))
+        self.assertEqual(get_encoding("unknown-model").name, "cl100k_base")
+        self.assertEqual(num_tokens_from_text("hello world"), ComputeKernel.llm_num_tokens_from_text("hello world"))
+
+    def test_incremental_count(self):
+        prompt = _build_prompt(10)
+        count = prompt.get_token_count("gpt-4")
+        # the sum over messages is within a few tokens of encoding the whole prompt at once
+        self.assertAlmostEqual(count, _uncached_num_tokens(prompt, "gpt-4"), delta=len(prompt.messages) * 2 + 2)
+
+        prompt.messages.append({"role": "function", "name": "search", "content": "result of the function"})
+        new_count = prompt.get_token_count("gpt-4")
+        self.assertEqual(new_count - count, len(get_encoding("gpt-4").encode(
+            '{"role": "function", "name": "search", "content": "result of the function"}')))
+
+        # messages changed in place are counted again
+        prompt.messages[-1]["content"] = ""
+        self.assertLess(prompt.get_token_count("gpt-4"), new_count)
+        prompt.messages.pop()
+        self.assertEqual(prompt.get_token_count("gpt-4"), count)
+
+        copied = copy.deepcopy(prompt)
+        self.assertEqual(copied.get_token_count("gpt-4"), count)
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    def test_benchmark(self):
+        # about 100k tokens, then 20 function results are appended and the prompt is counted after each one,
+        # as _execute_inner_func does
+        prompt = _build_prompt(200)
+        uncached_prompt = copy.deepcopy(prompt)
+
+        begin = time.perf_counter()
+        for i in range(20):
+            uncached_prompt.messages.append({"role": "function", "name": "f", "content": f"function result {i}"})
+            uncached_count = _uncached_num_tokens(uncached_prompt, "gpt-4")
+        uncached_time = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        for i in range(20):
+            prompt.messages.append({"role": "function", "name": "f", "content": f"function result {i}"})
+            count = ComputeKernel.llm_num_tokens(prompt, "gpt-4")
+        cached_time = time.perf_counter() - begin
+
+        result = f"{count} tokens prompt, 20 counts: uncached {uncached_time * 1000:.1f}ms, incremental {cached_time * 1000:.1f}ms"
+        self.assertGreater(count, 100000)
+        self.assertAlmostEqual(count, uncached_count, delta=len(prompt.messages) * 2 + 2)
+        self.assertLess(cached_time * 3, uncached_time, result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import sys
+import os
+import time
+import tempfile
+import unittest
+
+import numpy as np
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("{}/../src/".format(dir_path))
+
+from aios.knowledge import VectorIndex, ObjectID
+
+# AIOS_BENCHMARK=1 runs the benchmarks, VECTOR_BENCHMARK_SIZE=100000 for a quicker run
+BENCHMARK = os.environ.get("AIOS_BENCHMARK")
+BENCHMARK_SIZE = int(os.environ.get("VECTOR_BENCHMARK_SIZE", 1000000))
+BENCHMARK_DIM = 64
+
+
+class TestVectorIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root_dir = os.path.join(self.temp_dir.name, "vector")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_add_search_delete(self):
+        index = VectorIndex(self.root_dir)
+        object_id = ObjectID.hash_data(b"object")
+        index.add([object_id, "b", "c"],
+                  [[1, 0, 0], [0.8, 0.6, 0], [0, 0, 1]],
+                  [{"type": "doc", "owner": "alice"}, {"type": "image"}, {"type": "doc"}])
+        self.assertEqual(len(index), 3)
+
+        results = index.search([1, 0.1, 0], k=2)
+        self.assertEqual([result.id for result in results], [str(object_id), "b"])
+        # cosine similarity
+        self.assertAlmostEqual(results[1].score, 0.86 / np.linalg.norm([1, 0.1, 0]), places=5)
+        self.assertEqual(results[0].meta["owner"], "alice")
+
+        # filters: every key must match, a list matches any of its values
+        self.assertEqual([result.id for result in index.search([1, 0, 0], filters={"type": "image"})], ["b"])
+        self.assertEqual([result.id for result in index.search([1, 0, 0], filters={"type": "doc", "owner": "alice"})], [str(object_id)])
+        self.assertEqual(len(index.search([1, 0, 0], filters={"type": ["doc", "image"]})), 3)
+        self.assertEqual(index.search([1, 0, 0], filters={"type": "video"}), [])
+
+        # replace and delete
+        index.add(["b"], [[0, 1, 0]], [{"type": "doc"}])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.search([0, 1, 0], k=1)[0].id, "b")
+        self.assertEqual(len(index.search([1, 0, 0], filters={"type": "image"})), 0)
+        self.assertEqual(index.delete([object_id, "missing"]), 1)
+        self.assertIsNone(index.get(object_id))
+        self.assertNotIn(str(object_id), [result.id for result in index.search([1, 0, 0])])
+
+        with self.assertRaises(ValueError):
+            index.add(["d"], [[1, 0]])
+        index.close()
+
+    def test_persistence_and_compact(self):
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(size=(3000, 16)).astype(np.float32)
+        ids = [f"chunk{i}" for i in range(len(vectors))]
+        index = VectorIndex(self.root_dir)
+        # added in batches, so the files grow a few times
+        for begin in range(0, len(vectors), 500):
+            index.add(ids[begin:begin + 500], vectors[begin:begin + 500], [{"part": i % 3} for i in range(begin, begin + 500)])
+        index.delete(ids[:1000])
+        index.build_index(nlist=16)
+        index.close()
+
+        index = VectorIndex(self.root_dir)
+        self.assertEqual(len(index), 2000)
+        self.assertEqual(index.get_metrics()["cells"], 16)
+        self.assertEqual(index.get_meta("chunk1500"), {"part": 0})
+        np.testing.assert_allclose(index.get("chunk1500"), vectors[1500] / np.linalg.norm(vectors[1500]), rtol=1e-5)
+        self.assertEqual(index.search(vectors[1500], k=1, exact=True)[0].id, "chunk1500")
+        self.assertEqual(index.search(vectors[1500], k=1, exact=False, nprobe=16)[0].id, "chunk1500")
+        self.assertNotEqual(index.search(vectors[10], k=1, exact=False, nprobe=16)[0].id, "chunk10")
+
+        # vectors added after training are searched until the next build
+        index.add(["new"], [vectors[10]])
+        self.assertEqual(index.get_metrics()["pending"], 1)
+        self.assertEqual(index.search(vectors[10], k=1, exact=False, nprobe=16)[0].id, "new")
+
+        index.compact()
+        self.assertEqual(index.get_metrics()["deleted"], 0)
+        results = index.search(vectors[2999], k=3, filters={"part": 2999 % 3}, exact=False, nprobe=16)
+        self.assertEqual(results[0].id, "chunk2999")
+        self.assertTrue(all(result.meta["part"] == 2999 % 3 for result in results))
+        index.close()
+
+        index = VectorIndex(self.root_dir)
+        self.assertEqual(len(index), 2001)
+        self.assertEqual(index.search(vectors[10], k=1)[0].id, "new")
+        index.close()
+
+    def test_background_training(self):
+        rng = np.random.default_rng(2)
+        vectors = rng.normal(size=(4000, 16)).astype(np.float32)
+        index = VectorIndex(self.root_dir, ivf_threshold=2000)
+        index.add([f"chunk{i}" for i in range(1000)], vectors[:1000])
+        self.assertIsNone(index._train_thread)
+
+        # the write which makes the index large enough starts the training, it doesn't wait for it
+        index.add([f"chunk{i}" for i in range(1000, 3000)], vectors[1000:3000])
+        self.assertIsNotNone(index._train_thread)
+        # queries are exact until the training is done
+        self.assertEqual(index.search(vectors[5], k=1)[0].id, "chunk5")
+        # rows written while it trains get cells of the new centroids
+        index.add([f"chunk{i}" for i in range(3000, 4000)], vectors[3000:4000])
+        index.add(["chunk7"], [vectors[3999]])
+        index._train_thread.join()
+
+        self.assertGreater(index.get_metrics()["cells"], 0)
+        for i in (5, 2500, 3500):
+            self.assertEqual(index.search(vectors[i], k=1, exact=False, nprobe=1)[0].id, f"chunk{i}")
+        self.assertEqual({result.id for result in index.search(vectors[3999], k=2, exact=False, nprobe=1)}, {"chunk7", "chunk3999"})
+        index.close()
+
+    @unittest.skipUnless(BENCHMARK, "set AIOS_BENCHMARK=1 to run the benchmarks")
+    def test_benchmark(self):
+        # clustered data, like embeddings of documents about a few thousand topics
+        rng = np.random.default_rng(0)
+        topics = rng.normal(size=(BENCHMARK_SIZE // 200, BENCHMARK_DIM)).astype(np.float32)
+        index = VectorIndex(self.root_dir, ivf_threshold=50000)
+        batch_size = 100000
+        begin = time.perf_counter()
+        for batch_begin in range(0, BENCHMARK_SIZE, batch_size):
+            count = min(batch_size, BENCHMARK_SIZE - batch_begin)
+            vectors = topics[rng.integers(0, len(topics), count)] + rng.normal(scale=0.5, size=(count, BENCHMARK_DIM)).astype(np.float32)
+            index.add([f"chunk{i}" for i in range(batch_begin, batch_begin + count)], vectors)
+        add_time = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        index.build_index()
+        build_time = time.perf_counter() - begin
+
+        queries = topics[rng.integers(0, len(topics), 50)] + rng.normal(scale=0.5, size=(50, BENCHMARK_DIM)).astype(np.float32)
+        exact_time = 0.0
+        ivf_time = 0.0
+        hits = 0
+        for query in queries:
+            begin = time.perf_counter()
+            exact_ids = {result.id for result in index.search(query, k=10, exact=True)}
+            exact_time += time.perf_counter() - begin
+            begin = time.perf_counter()
+            ivf_ids = {result.id for result in index.search(query, k=10, exact=False)}
+            ivf_time += time.perf_counter() - begin
+            hits += len(exact_ids & ivf_ids)
+        recall = hits / (len(queries) * 10)
+        result = (f"{BENCHMARK_SIZE} vectors dim {BENCHMARK_DIM}: add {add_time:.1f}s, build {build_time:.1f}s, "
+                  f"exact {exact_time / len(queries) * 1000:.1f}ms, ivf {ivf_time / len(queries) * 1000:.1f}ms, recall@10 {recall:.3f}")
+        self.assertGreater(recall, 0.9, result)
+        self.assertLess(ivf_time * 2, exact_time, result)
+        index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()